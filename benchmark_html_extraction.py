@@ -0,0 +1,172 @@
+""" Benchmark of the HTML extraction of get_url_content
+
+Compares the previous extraction, which parsed each page with html.parser once per
+output (text, links, visible HTML), with the single-pass HTMLExtraction.
+
+Usage:
+    python benchmark_html_extraction.py [folder with saved pages] [--repeat N]
+
+The pages downloaded by get_url_content are saved in the web cache (bodies folder),
+which is the default corpus. Generated pages are used if no page is found.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+from bs4 import BeautifulSoup
+from bs4.element import Comment
+
+from gat_llm.tools.html_extraction import HTMLExtraction, DEFAULT_PARSER
+from gat_llm.tools.web_cache import WEB_CACHE
+
+
+# previous implementation, as the baseline
+def legacy_tag_visible(element):
+    if element.parent.name in ["a", "p"]:
+        return True
+    if element.parent.name in ["style", "script", "head", "title", "meta"]:
+        return False
+    if isinstance(element, Comment):
+        return False
+    return True
+
+
+def legacy_text_from_html(body):
+    soup = BeautifulSoup(body, "html.parser")
+    texts = soup.findAll(string=True)
+    visible_texts = filter(legacy_tag_visible, texts)
+    url_list = []
+    for link in soup.find_all("a"):
+        url_list.append(f"[ {link.get('href')} ] {link.text}")
+    return " ".join(t.strip() for t in visible_texts), "\n".join(url_list)
+
+
+def legacy_extract_links(html_text):
+    soup = BeautifulSoup(html_text, "html.parser")
+    return [a_tag["href"].strip() for a_tag in soup.find_all("a", href=True)]
+
+
+def legacy_extract_visible_html(html):
+    soup = BeautifulSoup(html, "html.parser")
+    for hidden in soup(["script", "style", "meta", "head", "link"]):
+        hidden.decompose()
+    for element in soup.find_all(True):
+        style = element.get("style", "")
+        if (
+            "display: none" in style
+            or "visibility: hidden" in style
+            or "opacity: 0" in style
+        ):
+            element.decompose()
+    for comment in soup.findAll(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    for element in soup.find_all(True):
+        if not element.get_text(strip=True):
+            element.decompose()
+    return soup.prettify()
+
+
+def load_corpus(folder):
+    pages = []
+    if folder is not None and os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path) and not name.endswith((".json", ".tmp")):
+                with open(path, "rb") as f:
+                    data = f.read()
+                if b"<html" in data[:4096].lower():
+                    pages.append(data)
+    return pages
+
+
+def generated_corpus(n_pages=20, n_articles=300):
+    """News front pages with nested markup, scripts, comments and hidden elements"""
+    pages = []
+    for k in range(n_pages):
+        articles = "".join(
+            f"""<article class="story"><div class="wrap"><div class="media">
+<img src="/img/{j}.jpg"><!-- ad slot {j} --></div><h2><a href="/news/{k}/{j}">Headline {j}
+of page {k}</a></h2><p>Summary of the story {j}, with <b>bold</b> and <i>italic</i> text
+and a <a href="/topic/{j % 7}">topic link</a>.</p><div style="display: none">Hidden {j}</div>
+<script>track({j});</script><span aria-hidden="true"></span></div></article>"""
+            for j in range(n_articles)
+        )
+        pages.append(
+            f"""<!DOCTYPE html><html><head><title>Page {k}</title>
+<style>.story {{margin: 0}}</style><script>var page = {k};</script></head>
+<body><nav><ul>{"".join(f'<li><a href="/section/{j}">Section {j}</a></li>' for j in range(30))}</ul></nav>
+<main>{articles}</main><footer><p>Footer</p></footer></body></html>""".encode(
+                "utf-8"
+            )
+        )
+    return pages
+
+
+def timed(fn, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for page in pages:
+            fn(page)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    arg_parser.add_argument(
+        "corpus", nargs="?", default=os.path.join(WEB_CACHE.cache_dir, "bodies")
+    )
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    pages = load_corpus(args.corpus)
+    if len(pages) == 0:
+        print(f"No saved pages in {args.corpus}. Using generated pages")
+        pages = generated_corpus()
+    mb = sum(len(x) for x in pages) / 1024 / 1024
+    print(f"{len(pages)} pages, {mb:.1f} MB. Best of {args.repeat} runs\n")
+
+    # what get_url_content computes for a page when it follows its links
+    cases = {
+        "text + links": (
+            lambda x: (legacy_text_from_html(x), legacy_extract_links(x)),
+            lambda x: HTMLExtraction(x).links(),
+            lambda x: HTMLExtraction(x, "html.parser").links(),
+        ),
+        "visible HTML + links": (
+            lambda x: (legacy_extract_visible_html(x), legacy_extract_links(x)),
+            lambda x: HTMLExtraction(x).visible_html(),
+            lambda x: HTMLExtraction(x, "html.parser").visible_html(),
+        ),
+    }
+    print(
+        f"{'case':<22}{'previous':>10}{DEFAULT_PARSER:>14}{'html.parser':>14}{'speedup':>10}"
+    )
+    for name, (legacy_fn, fast_fn, default_fn) in cases.items():
+        legacy = timed(legacy_fn, pages, args.repeat)
+        fast = timed(fast_fn, pages, args.repeat)
+        default = timed(default_fn, pages, args.repeat)
+        print(
+            f"{name:<22}{legacy:>9.2f}s{fast:>13.2f}s{default:>13.2f}s{legacy / fast:>9.1f}x"
+        )
+
+    # the text is the same, apart from whitespace and the doctype and comments, which
+    # the previous extraction returned as text
+    differences = 0
+    for page in pages:
+        legacy_text = legacy_text_from_html(page)[0]
+        if page.lstrip()[:15].lower() == b"<!doctype html>":
+            legacy_text = legacy_text.replace("html", "", 1)
+        legacy_text = re.sub(r"\s+", " ", legacy_text).strip()
+        text = re.sub(r"\s+", " ", HTMLExtraction(page, "html.parser").text())
+        if legacy_text != text:
+            differences += 1
+    print(f"\nPages whose text differs from the previous extraction: {differences}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+""" Background compaction of long chat histories
+
+Every message sends the whole history, so the latency and input cost of a turn grow
+with the length of the chat. Once a history passes a token threshold, HistoryCompactor
+asks a small LLM (e.g. Claude Haiku or a local Qwen 3) to summarize its older turns in
+a background thread, while the user reads the answer. The summary replaces those turns
+when the next message arrives, marked with [|[PAST_FORGOTTEN]|] like the summaries
+written by ToolSummarizePast, so the main LLM never waits for it.
+"""
+import re
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .llm_providers.context_manager import estimate_tokens, is_tool_result
+
+
+PAST_FORGOTTEN = "[|[PAST_FORGOTTEN]|]"
+
+SUMMARY_SYSTEM_PROMPT = """You summarize conversations between a user and an AI assistant.
+The summary replaces the conversation in the memory of the assistant, so keep everything
+needed to continue it: topics discussed, decisions, results of tools, files and paths
+mentioned, user preferences and details, and questions still open. Be concise.
+Answer only with the summary."""
+
+
+def _is_turn_start(x):
+    """Turns start with a [user msg, answer] pair or a user message that is not a tool result"""
+    if isinstance(x, dict):
+        return x.get("role") == "user" and not is_tool_result(x)
+    return True
+
+
+def _content_text(content, max_chars):
+    """Readable text of a message content, for the summarizer"""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content[:max_chars]
+    if isinstance(content, list):
+        return "\n".join(_content_text(x, max_chars) for x in content)
+    if not isinstance(content, dict):
+        return str(content)[:max_chars]
+    if content.get("type") in ["image", "image_url", "image_ref"] or "image" in content:
+        return "[image]"
+    if "text" in content:
+        return content["text"][:max_chars]
+    if content.get("type") == "tool_use":
+        return f"[called {content['name']}: {json.dumps(content['input'])[:max_chars]}]"
+    if "toolUse" in content:
+        tool_use = content["toolUse"]
+        return (
+            f"[called {tool_use['name']}: {json.dumps(tool_use['input'])[:max_chars]}]"
+        )
+    if content.get("type") == "tool_result":
+        return f"[tool result: {_content_text(content.get('content'), max_chars)}]"
+    if "toolResult" in content:
+        return f"[tool result: {_content_text(content['toolResult'].get('content'), max_chars)}]"
+    return json.dumps(content, default=str)[:max_chars]
+
+
+def summary_messages(summary):
+    """History entries that replace the summarized turns"""
+    return [
+        {
+            "role": "user",
+            "content": f"""Summary of the past conversation:
+
+<past_conversation_summary>{summary}</past_conversation_summary>
+
+{PAST_FORGOTTEN}""",
+        },
+        {
+            "role": "assistant",
+            "content": "Understood. I will continue the conversation from this summary.",
+        },
+    ]
+
+
+class HistoryCompactor:
+    def __init__(
+        self,
+        llm,
+        threshold_tokens=32000,
+        keep_recent_tokens=8000,
+        max_tool_result_chars=2000,
+        max_workers=2,
+        max_pending=1000,
+    ):
+        """Summarizes the older turns of long chats in the background.
+
+        Arguments:
+            llm: small LLM that writes the summaries, from LLM_Provider.get_llm
+            threshold_tokens: histories estimated above this size are compacted
+            keep_recent_tokens: the most recent turns up to this size are kept as they are.
+                The last turn is always kept
+            max_tool_result_chars: characters of each message part sent to the summarizer,
+                so long tool results don't fill the context of the small LLM
+            max_workers: summaries written at the same time
+            max_pending: summaries kept until their chat sends a new message
+        """
+        self.llm = llm
+        self.threshold_tokens = threshold_tokens
+        self.keep_recent_tokens = keep_recent_tokens
+        self.max_tool_result_chars = max_tool_result_chars
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # chat id -> (summarized entries, future with the summary)
+        self.pending = OrderedDict()
+        self.metrics = {"submitted": 0, "compacted": 0, "failed": 0, "stale": 0}
+        self.lock = threading.Lock()
+
+    def submit(self, chat_id, history):
+        """Starts summarizing the older turns if the history is over the threshold.
+        Returns True if a summary was started
+        """
+        # entries before the last reset are not sent to the LLM anymore
+        start = 0
+        for k, x in enumerate(history):
+            if PAST_FORGOTTEN in str(x):
+                start = k
+        tokens = [estimate_tokens(x) for x in history]
+        if sum(tokens[start:]) <= self.threshold_tokens:
+            return False
+
+        # keep the most recent turns that fit keep_recent_tokens, and the last one
+        turn_starts = [
+            k for k in range(start + 1, len(history)) if _is_turn_start(history[k])
+        ]
+        split = None
+        for k in reversed(turn_starts):
+            if split is not None and sum(tokens[k:]) > self.keep_recent_tokens:
+                break
+            split = k
+        if split is None:
+            return False
+
+        with self.lock:
+            if chat_id in self.pending and not self.pending[chat_id][1].done():
+                return False
+            summarized = history[:split]
+            future = self.executor.submit(self._summarize, history[start:split])
+            self.pending[chat_id] = (summarized, future)
+            self.pending.move_to_end(chat_id)
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+            self.metrics["submitted"] += 1
+        return True
+
+    def apply(self, chat_id, history):
+        """Returns the history with the older turns replaced by their summary, if it is
+        ready. Doesn't wait for summaries being written
+        """
+        with self.lock:
+            if chat_id not in self.pending or not self.pending[chat_id][1].done():
+                return history
+            summarized, future = self.pending.pop(chat_id)
+            if future.exception() is not None:
+                print(f"Could not compact chat {chat_id}: {future.exception()}")
+                self.metrics["failed"] += 1
+                return history
+            # the history changed since the summary started, e.g. another app worker
+            if history[: len(summarized)] != summarized:
+                self.metrics["stale"] += 1
+                return history
+            self.metrics["compacted"] += 1
+        return summary_messages(future.result()) + history[len(summarized) :]
+
+    def wait(self, chat_id, timeout=None):
+        """Waits for the summary of the chat, if one is being written"""
+        with self.lock:
+            entry = self.pending.get(chat_id)
+        if entry is not None:
+            entry[1].exception(timeout=timeout)
+
+    def stats(self):
+        with self.lock:
+            return {"pending": len(self.pending), **self.metrics}
+
+    def _summarize(self, messages):
+        conversation = []
+        for x in messages:
+            if isinstance(x, dict):
+                text = _content_text(x.get("content"), self.max_tool_result_chars)
+                if x.get("tool_calls"):
+                    text += _content_text(
+                        json.dumps(x["tool_calls"]), self.max_tool_result_chars
+                    )
+                conversation.append(f"{x.get('role')}: {text}")
+            else:
+                conversation.append(f"user: {x[0]}\nassistant: {x[1]}")
+        conversation = "\n\n".join(conversation)
+
+        ans = ""
+        for ans in self.llm(
+            f"<conversation>\n{conversation}\n</conversation>\n\nSummarize this conversation.",
+            system_prompt=SUMMARY_SYSTEM_PROMPT,
+            max_retries=2,
+            cur_fail_sleep=5,
+        ):
+            pass
+        # reasoning models think before answering
+        ans = re.sub(r"<think>[\S\s]*?</think>\s*", "", ans).strip()
+        if ans == "" or ans == "Could not invoke the AI model.":
+            raise RuntimeError(f"{self.llm.llm_description} did not write a summary")
+        return ans
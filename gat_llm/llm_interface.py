@@ -3,11 +3,17 @@ import re
 import json
 import time
 import uuid
-import base64
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from PIL import Image
+
+from .llm_providers.call_session import CallSession
+from .llm_providers.image_preprocessing import IMAGE_PREPROCESSOR, max_image_edge
+from .session_store import InMemorySessionStore
+
+
+# runs manual tool calls while the LLMs finish generating </function_calls>
+MANUAL_TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tools")
 
 
 def _adjust_msg_for_gradio_ui(x, show_scratchpad=False, show_calls=False):
@@ -42,6 +48,214 @@ def _adjust_msg_for_gradio_ui(x, show_scratchpad=False, show_calls=False):
     return x
 
 
+# tags that _adjust_msg_for_gradio_ui replaces or removes
+_UI_TAGS = [
+    f"<{close}{tag}>"
+    for tag in ["scratchpad", "think", "function_calls", "function_results", "answer"]
+    for close in ["", "/"]
+]
+_MEDIA_TAGS = ["path_to_image", "path_to_audio", "path_to_file"]
+
+
+class UIMessageFormatter:
+    def __init__(self, show_scratchpad=False, show_calls=False):
+        """Formats the streamed answer of one turn for the UI, processing only new text.
+
+        Each chunk is the whole answer so far. The beginning of the answer is formatted
+        once it can't change anymore, ie. when it has no open block and doesn't end in a
+        partial tag, so each chunk only formats the text after it. Media paths and the
+        position of the last scratchpad and function call are found in the new text only.
+        If a chunk doesn't extend the previous one, the formatter starts over.
+
+        Arguments:
+            show_scratchpad, show_calls: as in _adjust_msg_for_gradio_ui
+        """
+        self.show_scratchpad = show_scratchpad
+        self.show_calls = show_calls
+        # blocks removed by _adjust_msg_for_gradio_ui, in order
+        self.removed_blocks = []
+        if not show_scratchpad:
+            self.removed_blocks += ["scratchpad", "think"]
+        if not show_calls:
+            self.removed_blocks.append("function_calls")
+        self.removed_blocks.append("function_results")
+        # os.path.isfile of the media paths seen in this turn
+        self.is_file = {}
+        self.reset()
+
+    def reset(self):
+        self.text = ""
+        # text[:done_len] is formatted for good as done
+        self.done_len = 0
+        self.done = ""
+        # text before scan_pos was searched for tags
+        self.scan_pos = 0
+        # tag -> position of its last opening
+        self.last_open = {}
+        # media tag -> (existing paths, where the next path may start)
+        self.media = {tag: ([], 0) for tag in _MEDIA_TAGS}
+
+    def update(self, x):
+        """Processes the answer so far and returns it adjusted for the UI"""
+        if not x.startswith(self.text):
+            self.reset()
+        self.text = x
+        self._scan_new_text()
+
+        tail = x[self.done_len :]
+        ans = self.done + _adjust_msg_for_gradio_ui(
+            tail, self.show_scratchpad, self.show_calls
+        )
+
+        # move the formatted beginning forward: at the end of the text or, when a
+        # block or tag is still open, right before its opening
+        for end in [len(tail), tail.rfind("<")]:
+            end = len(tail[: max(end, 0)].rstrip())
+            if end > 0 and self._is_final(tail[:end]):
+                self.done += _adjust_msg_for_gradio_ui(
+                    tail[:end], self.show_scratchpad, self.show_calls
+                )
+                self.done_len += end
+                break
+        return ans
+
+    def media_paths(self, tag):
+        """Existing files in <tag>...</tag> of the answer, in order and without repetitions"""
+        paths, start = self.media[tag]
+        ans = list(paths)
+        # a path still being generated runs until the end of the answer
+        candidate = self._next_media_path(tag, start)
+        if candidate is not None and candidate[0] not in ans:
+            if os.path.isfile(candidate[0]):
+                ans.append(candidate[0])
+        return ans
+
+    def last_block(self, tag):
+        """Content of the last <tag> block of the answer (possibly unfinished) or None"""
+        start = self.last_open.get(tag)
+        if start is None:
+            return None
+        start += len(f"<{tag}>")
+        end = self.text.find(f"</{tag}>", start)
+        return self.text[start:] if end == -1 else self.text[start:end]
+
+    def _scan_new_text(self):
+        # a tag may have started at the end of the previous chunk
+        start = max(0, self.scan_pos - max(len(x) for x in _UI_TAGS))
+        for tag in ["scratchpad", "think", "function_calls"]:
+            pos = self.text.rfind(f"<{tag}>", start)
+            if pos != -1:
+                self.last_open[tag] = pos
+        self.scan_pos = len(self.text)
+
+        for tag in _MEDIA_TAGS:
+            paths, pos = self.media[tag]
+            candidate = self._next_media_path(tag, pos)
+            # only finished paths are looked up once and for all
+            while candidate is not None and candidate[1] is not None:
+                path, pos = candidate
+                if path not in self.is_file:
+                    self.is_file[path] = os.path.isfile(path)
+                if self.is_file[path] and path not in paths:
+                    paths.append(path)
+                candidate = self._next_media_path(tag, pos)
+            if candidate is None:
+                # the next path can only start in the text to come
+                pos = max(pos, len(self.text) - len(f"<{tag}>") + 1)
+            else:
+                pos = self.text.find(f"<{tag}>", pos)
+            self.media[tag] = (paths, pos)
+
+    def _next_media_path(self, tag, pos):
+        """(path, position after it) of the next <tag> from pos, as split by _format_msg.
+        The position is None if the path may still grow
+        """
+        start = self.text.find(f"<{tag}>", pos)
+        if start == -1:
+            return None
+        start += len(f"<{tag}>")
+        end = self.text.find(f"</{tag}>", start)
+        next_start = self.text.find(f"<{tag}>", start)
+        if next_start != -1 and (end == -1 or next_start < end):
+            return self.text[start:next_start], next_start
+        if end == -1:
+            return self.text[start:], None
+        return self.text[start:end], end + len(f"</{tag}>")
+
+    def _is_final(self, x):
+        """True if _adjust_msg_for_gradio_ui(x + y) == _adjust_msg_for_gradio_ui(x) + _adjust_msg_for_gradio_ui(y)
+        for any y. x ends in a character other than whitespace and '>', so the
+        character stays last when blocks are removed and stops the trailing whitespace
+        of removed blocks
+        """
+        if x[-1] == ">" or not self._ends_outside_tag(x):
+            return False
+        for tag in self.removed_blocks:
+            x = re.sub(rf"<{tag}>[\S\s]*?</{tag}>\s*", "", x)
+            # a block left after its pass has no closing tag yet
+            if f"<{tag}>" in x or not self._ends_outside_tag(x):
+                return False
+        return True
+
+    @staticmethod
+    def _ends_outside_tag(x):
+        start = x.rfind("<")
+        return start == -1 or not any(tag.startswith(x[start:]) for tag in _UI_TAGS)
+
+
+class UIFrameThrottle:
+    def __init__(self, min_interval_ms=50, min_new_chars=None):
+        """Decides which streamed chunks are sent to the UI as frames.
+
+        Each frame holds the whole answer so far, so a chunk that is not sent is only
+        shown later, with the next frame. A chunk is sent when min_interval_ms passed
+        since the last frame or min_new_chars characters arrived since then.
+
+        Arguments:
+            min_interval_ms: minimum time between frames. None or 0 sends every chunk
+            min_new_chars: also send a frame after this many new characters. None to only use the time
+        """
+        self.min_interval_ms = min_interval_ms
+        self.min_new_chars = min_new_chars
+        self.last_time = None
+        self.last_len = 0
+        # a chunk arrived after the last frame
+        self.pending = False
+        self.frames = 0
+        self.chunks = 0
+
+    def due(self, x, force=False):
+        """True if the chunk x has to be sent. force at tool boundaries"""
+        self.chunks += 1
+        now = time.monotonic()
+        if (
+            force
+            or not self.min_interval_ms
+            or self.last_time is None
+            or (now - self.last_time) * 1000 >= self.min_interval_ms
+            or (
+                self.min_new_chars is not None
+                and len(x) - self.last_len >= self.min_new_chars
+            )
+        ):
+            self.last_time = now
+            self.last_len = len(x)
+            self.pending = False
+            self.frames += 1
+            return True
+        self.pending = True
+        return False
+
+    def flush(self):
+        """True if the last chunk was not sent, ie. at the end of a LLM call it has to be"""
+        if not self.pending:
+            return False
+        self.pending = False
+        self.last_time = time.monotonic()
+        self.frames += 1
+        return True
+
+
 class LLMInterface:
     def __init__(
         self,
@@ -52,6 +266,10 @@ class LLMInterface:
         output_mode="chat_bot",
         chat_log_folder="chat_logs",
         show_extra_info=True,
+        ui_frame_interval_ms=50,
+        ui_frame_chars=None,
+        session_store=None,
+        compactor=None,
     ):
         """Constructor
 
@@ -64,6 +282,12 @@ class LLMInterface:
             receive the whole history. Otherwise uses gradio chatinterface
         chat_log_folder: folder to save chat to. If None, does not save chat
         show_extra_info: show extra info like tools used and scratchpad in the UI?
+        ui_frame_interval_ms: minimum time between streamed UI updates. 0 to send every chunk.
+            Tool boundaries and the final answer are always sent
+        ui_frame_chars: also send an UI update after this many new characters. None to only use the time
+        session_store: SessionStore with the histories of the chats. If None, they are kept in memory
+        compactor: HistoryCompactor that summarizes the older turns of long chats with a small
+            LLM between messages. Shared by the LLMInterface instances, like session_store
         """
         self.system_prompt = system_prompt
         self.llm = llm
@@ -71,10 +295,15 @@ class LLMInterface:
         self.rpg = rpg
         self.chat_log_folder = chat_log_folder
         self.show_extra_info = show_extra_info
+        self.ui_frame_interval_ms = ui_frame_interval_ms
+        self.ui_frame_chars = ui_frame_chars
 
-        # keep a hash of histories so we can send to the UI
+        # keep the histories by chat id so we can send to the UI
         # something different than what has been generated
-        self.history_log = {}
+        self.history_log = (
+            session_store if session_store is not None else InMemorySessionStore()
+        )
+        self.compactor = compactor
 
         valid_output_modes = ["chat_interface", "chat_bot"]
         assert (
@@ -88,126 +317,105 @@ class LLMInterface:
 
         # handle native tool use
         if self.rpg is not None and self.rpg.use_native_tools:
-            self.native_tools = [x.tool_description for x in self.lt.tools]
+            self.native_tools = self.lt.get_native_tools()
             self.tool_invoker_fn = self.lt.invoke_tool
             self.extra_stop_sequences = []
         else:
             self.native_tools = None
             self.tool_invoker_fn = None
             self.extra_stop_sequences = ["</function_calls>"]
+        # shared by the LLMInterfaces of the process
+        self.tool_executor = MANUAL_TOOL_EXECUTOR
 
     def _format_msg(
-        self, x, message, chat_history, show_ans_only=False, extra_info=None
+        self,
+        x,
+        message,
+        chat_history,
+        show_ans_only=False,
+        extra_info=None,
+        formatter=None,
     ):
+        """Formats the answer so far for the UI.
+
+        formatter: UIMessageFormatter of the turn, which keeps what was already processed
+            from one chunk to the next. If None, the answer is processed from scratch
+        """
+        if formatter is None:
+            formatter = UIMessageFormatter()
         # the "<path_to_" substring from native tools has to be appended to the final answer for file display
         if self.output_mode == "chat_interface":
-            return _adjust_msg_for_gradio_ui(x)
+            return formatter.update(x)
         elif self.output_mode == "chat_bot":
-            cur_history = chat_history.copy()
-            cur_ans = _adjust_msg_for_gradio_ui(x)
-
-            ans_only = cur_ans.split("<answer>")
-            if len(ans_only) > 1 and show_ans_only:
-                cur_ans = ans_only[-1]
-            elif show_ans_only:
-                cur_ans = ""
-
-            info_msg = None
-            if extra_info is None or not self.show_extra_info:
-                cur_history += [
-                    {"role": "user", "content": message},
-                    {"role": "assistant", "content": cur_ans},
-                ]
-            else:
-                info_msg = {
-                    "role": "assistant",
-                    "content": extra_info.get("content", ""),
-                    "metadata": extra_info["metadata"],
-                }
-                cur_history += [
-                    {"role": "user", "content": message},
-                    info_msg,
-                    {"role": "assistant", "content": cur_ans},
-                ]
-
-            # find out if we should be showing an image
-            image_candidates = x.split("<path_to_image>")
-            shown_images = {}
-            for k in range(1, len(image_candidates)):
-                image_candidate = image_candidates[k].split("</path_to_image>")[0]
-
-                if os.path.isfile(image_candidate) and not shown_images.get(
-                    image_candidate, False
-                ):
-                    cur_history.append(
-                        {
-                            "role": "assistant",
-                            "content": {"path": image_candidate, "alt_text": "media"},
-                        }
-                    )
-                    shown_images[image_candidate] = True
+            cur_ans = formatter.update(x)
 
-            # find out if we should be showing an audio
-            audio_candidates = x.split("<path_to_audio>")
-            shown_audios = {}
-            for k in range(1, len(audio_candidates)):
-                audio_candidate = audio_candidates[k].split("</path_to_audio>")[0]
+            if show_ans_only:
+                ans_start = cur_ans.rfind("<answer>")
+                cur_ans = (
+                    cur_ans[ans_start + len("<answer>") :] if ans_start != -1 else ""
+                )
 
-                if os.path.isfile(audio_candidate) and not shown_audios.get(
-                    audio_candidate, False
-                ):
-                    cur_history.append(
-                        {
-                            "role": "assistant",
-                            "content": {"path": audio_candidate, "alt_text": "media"},
-                        }
-                    )
-                    shown_audios[audio_candidate] = True
-
-            # find out if we should add a downloadable file
-            file_candidates = x.split("<path_to_file>")
-            shown_files = {}
-            for k in range(1, len(file_candidates)):
-                file_candidate = file_candidates[k].split("</path_to_file>")[0]
-                if os.path.isfile(file_candidate) and not shown_files.get(
-                    file_candidate, False
-                ):
+            # figure out what should go into the scratchpad
+            scratchpad_info = formatter.last_block("scratchpad")
+            if scratchpad_info is None:
+                scratchpad_info = formatter.last_block("think") or ""
+
+            # only the messages of this turn are new
+            cur_history = chat_history + [{"role": "user", "content": message}]
+            if extra_info is not None and self.show_extra_info:
+                cur_history.append(
+                    {
+                        "role": "assistant",
+                        "content": extra_info.get("content", "")
+                        + "\n"
+                        + scratchpad_info,
+                        "metadata": extra_info["metadata"],
+                    }
+                )
+            cur_history.append({"role": "assistant", "content": cur_ans})
+
+            # show the images, audios and downloadable files
+            for tag in ["path_to_image", "path_to_audio", "path_to_file"]:
+                for path in formatter.media_paths(tag):
                     cur_history.append(
                         {
                             "role": "assistant",
-                            "content": {"path": file_candidate, "alt_text": "media"},
+                            "content": {"path": path, "alt_text": "media"},
                         }
                     )
-                    shown_files[file_candidate] = True
-
-            # figure out what should go into the scratchpad
-            scratchpad_info = ""
-            if "<scratchpad>" in x:
-                scratchpad_info = x.split("<scratchpad>")
-                if len(scratchpad_info) > 1:
-                    scratchpad_info = scratchpad_info[-1].split("</scratchpad>")[0]
-            elif "<think>" in x:
-                scratchpad_info = x.split("<think>")
-                if len(scratchpad_info) > 1:
-                    scratchpad_info = scratchpad_info[-1].split("</think>")[0]
-
-            if info_msg is not None:
-                info_msg["content"] = (
-                    extra_info.get("content", "") + "\n" + scratchpad_info
-                )
 
             # also put function calls in there
-            func_call_info = x.split("<function_calls>")
-            if len(func_call_info) > 1:
+            func_call_info = formatter.last_block("function_calls")
+            if func_call_info is not None:
                 scratchpad_info = (
-                    scratchpad_info
-                    + "\n\nFunction call:\n\n"
-                    + func_call_info[-1].split("</function_calls>")[0]
+                    scratchpad_info + "\n\nFunction call:\n\n" + func_call_info
                 )
 
             # make sure to send ChatBot history last
             return "", scratchpad_info, None, cur_history
 
+    def _dispatch_manual_tool_early(self, answer, username, early_calls):
+        """Starts a manual tool call as soon as its </invoke> has been generated,
+        so the tool runs while the LLM finishes the <function_calls> block.
+        Only tools without side effects are started early: the answer may still be
+        cancelled or call more tools. early_calls maps the dispatched commands to their futures
+        """
+        if self.lt is None or self.rpg is None or self.rpg.use_native_tools:
+            return
+        last_call = answer.split("<function_calls>")
+        # results are appended right after a call, so a call with results is an old one
+        if (
+            len(last_call) < 2
+            or "</invoke>" not in last_call[-1]
+            or "<function_results>" in last_call[-1]
+        ):
+            return
+        xml_cmd = last_call[-1].split("</invoke>")[0] + "</invoke>"
+        if xml_cmd.strip() not in early_calls and self.lt.can_run_early(xml_cmd):
+            early_calls[xml_cmd.strip()] = self.tool_executor.submit(
+                self.lt.invoke_from_cmd, xml_cmd, username=username
+            )
+
     def _rem_none(self, history):
         """Returns a copy of history but with None messages from users removed"""
         return str([x for x in history if x[0] is not None])
@@ -221,27 +429,58 @@ class LLMInterface:
             ui_history: history in the user interface. The first is used to recover the state in memory
             username: user name of the user logged in the UI
         """
-        image_strings = None
+        # the history is stored when the answer is complete, or when the UI stops
+        # reading it (eg. cancel), with the answer so far
+        turn = {}
+        try:
+            yield from self._chat_turn(msg, images, ui_history, username, turn)
+        finally:
+            # early calls that were not used, e.g. the answer called more tools
+            for future in turn.get("early_calls", {}).values():
+                future.cancel()
+            if turn.get("answer") is not None:
+                self._save_history(
+                    turn["chat_id"],
+                    turn["history"]
+                    + [
+                        turn["session"].last_message,
+                        {"role": "assistant", "content": turn["answer"]},
+                    ],
+                )
+
+    def _save_history(self, chat_id, history):
+        self.history_log[chat_id] = history
+        # the older turns are summarized while the user reads the answer
+        if self.compactor is not None:
+            self.compactor.submit(chat_id, history)
+
+    def _chat_turn(self, msg, images, ui_history, username, turn):
+        """Body of chat_with_function_caller. Keeps the answer so far in turn"""
+        # the images are resized for the LLM and the history keeps references to them
+        image_refs = None
         if images is not None:
-            image_strings = []
+            image_refs = []
             if not isinstance(images, list):
                 images = [images]
             for image in images:
                 if image is None:
-                    image_strings.append(None)
+                    image_refs.append(None)
                 else:
                     npimg = np.array(image, dtype=np.uint8)
-                    pil_img = Image.fromarray(npimg)
-                    buff = BytesIO()
-                    pil_img.save(buff, format="JPEG")
-                    image_string = base64.b64encode(buff.getvalue()).decode("utf-8")
-                    image_strings.append(image_string)
+                    image_refs.append(
+                        IMAGE_PREPROCESSOR.prepare(npimg, max_image_edge(self.llm))
+                    )
 
         t0 = time.time()
 
         if len(ui_history) > 0:
             chat_id = ui_history[0]["content"][0]["text"]
-            history = self.history_log[chat_id]
+            history = self.history_log.get(chat_id)
+            if history is None:
+                print(f"Chat {chat_id} not found in the session store. Starting over")
+                history = []
+            elif self.compactor is not None:
+                history = self.compactor.apply(chat_id, history)
             # with open('ui_debug.txt', 'w') as f:
             #    f.write(str([msg, history]))
         else:
@@ -251,9 +490,11 @@ class LLMInterface:
             ]
             history = []
 
+        # state of the calls to the LLM, which can be shared by other chats
+        session = CallSession()
         ans2 = self.llm(
             msg,
-            b64images=image_strings,
+            b64images=image_refs,
             system_prompt=self.system_prompt,
             chat_history=history,
             postpend=self.rpg.post_anti_hallucination
@@ -262,29 +503,42 @@ class LLMInterface:
             extra_stop_sequences=self.extra_stop_sequences,
             tools=self.native_tools,
             tool_invoker_fn=self.lt.invoke_tool if self.lt is not None else None,
+            session=session,
         )
+        turn.update({"chat_id": chat_id, "history": history, "session": session})
 
         extra_info = {
             "metadata": {"title": "🧠", "status": "pending"},
         }
+        # manual tool calls that were started before the answer finished
+        early_calls = {}
+        turn["early_calls"] = early_calls
+        # formats only the new part of each chunk for the UI
+        formatter = UIMessageFormatter()
+        # coalesces the chunks into UI frames
+        throttle = UIFrameThrottle(self.ui_frame_interval_ms, self.ui_frame_chars)
         x = ""
         for x in ans2:
-            if self.lt is not None and (
-                hasattr(self.llm, "cur_tool_spec")
-                or hasattr(self.llm, "cur_tool_specs")
-            ):
+            self._dispatch_manual_tool_early(x, username, early_calls)
+            tool_boundary = False
+            if self.lt is not None and session.tool_use_added_msgs is not None:
+                tools_used = ", ".join([x["tool_name"] for x in self.lt.invoke_log])
+                # a native tool was called: show it right away
+                tool_boundary = tools_used != extra_info.get("content")
                 extra_info = {
                     "metadata": {"title": "🛠️", "status": "pending"},
-                    "content": ", ".join([x["tool_name"] for x in self.lt.invoke_log]),
+                    "content": tools_used,
                 }
-            self.history_log[chat_id] = history + [
-                self.llm.last_message,
-                {"role": "assistant", "content": x},
-            ]
-            yield self._format_msg(x, msg, ui_history, extra_info=extra_info)
+            turn["answer"] = x
+            if throttle.due(x, force=tool_boundary):
+                yield self._format_msg(
+                    x, msg, ui_history, extra_info=extra_info, formatter=formatter
+                )
         # initial_ans = self._format_msg(x, msg, ui_history)
         # yield initial_ans
 
+        # extra info shown with the last chunk
+        ui_extra_info = extra_info
         cur_answer = x
 
         cur_answer_split = cur_answer.split("<function_calls>")
@@ -295,9 +549,19 @@ class LLMInterface:
         ):
             # this loop means that manual tool usage is needed
             cur_func_log = {}
+            if throttle.flush():
+                # show the tool call before it runs
+                yield self._format_msg(
+                    x, msg, ui_history, extra_info=ui_extra_info, formatter=formatter
+                )
+            ui_extra_info = None
 
             xml_to_parse = cur_answer_split[-1].split("</function_calls>")[0]
-            post_prompt = self.lt.invoke_from_cmd(xml_to_parse, username=username)
+            early_call = early_calls.pop(xml_to_parse.strip(), None)
+            if early_call is not None:
+                post_prompt = early_call.result()
+            else:
+                post_prompt = self.lt.invoke_from_cmd(xml_to_parse, username=username)
 
             cur_func_log["Parse and exec query"] = {
                 "exec_time": time.time() - t0,
@@ -316,21 +580,20 @@ class LLMInterface:
                 chat_history=history,
                 postpend=cur_postpend if not self.rpg.use_native_tools else "",
                 extra_stop_sequences=self.extra_stop_sequences,
+                session=session,
             )
 
             for x in ans2:
-                # pass
-                self.history_log[chat_id] = history + [
-                    self.llm.last_message,
-                    {"role": "assistant", "content": x},
-                ]
-                yield self._format_msg(x, msg, ui_history)
+                self._dispatch_manual_tool_early(x, username, early_calls)
+                turn["answer"] = x
+                if throttle.due(x):
+                    yield self._format_msg(x, msg, ui_history, formatter=formatter)
             # yield self._format_msg(x, msg, ui_history)
 
-            log_dict = self.llm.word_counts[-1].copy()
+            log_dict = self.llm.usage_log[-1].copy()
             cur_func_log["Analyze query with LLM"] = {
                 "exec_time": time.time() - t0,
-                "word_count": log_dict,
+                "usage": log_dict,
             }
             t0 = time.time()
             cur_answer = x
@@ -339,10 +602,10 @@ class LLMInterface:
 
         history_to_append = []
         tool_results = []
-        if hasattr(self.llm, "tool_use_added_msgs"):
-            history_to_append.append(self.llm.last_message)
+        if session.tool_use_added_msgs is not None:
+            history_to_append.append(session.last_message)
             tool_results.append("\n")
-            for x in self.llm.tool_use_added_msgs:
+            for x in session.tool_use_added_msgs:
                 history_to_append.append(x)
 
                 # enable media display in the Gradio UI - amazon Nova
@@ -370,7 +633,8 @@ class LLMInterface:
             history_to_append.append([msg, cur_answer])
 
         tool_results = "\n".join(tool_results)
-        self.history_log[chat_id] = history + history_to_append
+        self._save_history(chat_id, history + history_to_append)
+        turn["answer"] = None
 
         try:
             chat_log_dir = self.chat_log_folder
@@ -385,7 +649,7 @@ class LLMInterface:
                     "w",
                     encoding="utf-8",
                 ) as f:
-                    f.write(json.dumps(self.history_log[chat_id]))
+                    f.write(json.dumps(history + history_to_append))
         except Exception as ex:
             print(
                 f"Could not log chat to folder `{self.chat_log_folder}`. Reason: {str(ex)}"
@@ -393,7 +657,11 @@ class LLMInterface:
 
         extra_info["metadata"]["status"] = "done"
         final_response_ui = self._format_msg(
-            cur_answer + tool_results, msg, ui_history, extra_info=extra_info
+            cur_answer + tool_results,
+            msg,
+            ui_history,
+            extra_info=extra_info,
+            formatter=formatter,
         )
         if self.lt is not None:
             self.lt.invoke_log = []
@@ -1,13 +1,14 @@
-import re
 import json
-import time
-import types
 
-import anthropic
 from .base_service import LLM_Service
+from .client_registry import CLIENT_REGISTRY
+from .stream_events import StreamStop, TextDelta, ToolCallDelta
+from .usage import ANTHROPIC_USAGE_FIELDS, UsageLog, update_usage
 
 
 class LLM_Claude_Anthropic(LLM_Service):
+    supports_stream_deltas = True
+
     def __init__(self, model_size, use_caching=True):
         """Constructor
         Arguments:
@@ -15,64 +16,10 @@ class LLM_Claude_Anthropic(LLM_Service):
                 to use when making calls to bedrock models
         """
         self.use_caching = use_caching
-        self.anthropic_client = anthropic.Anthropic()
-        if model_size == "Opus 4 Anthropic":
-            self.model_id = "claude-opus-4-20250514"
-            self.llm_description = (
-                "Anthropic Claude 4 Opus (Large-size LLM) - directly from Anthropic"
-            )
-            self.price_per_M_input_tokens = 15
-            self.price_per_M_output_tokens = 75
-        elif model_size == "Sonnet 4.5 Anthropic":
-            self.model_id = "claude-sonnet-4-5-20250929"
-            self.llm_description = "Anthropic Claude 4.5 Sonnet (Medium-size LLM) - directly from Anthropic"
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Haiku 4.5 Anthropic":
-            self.model_id = "claude-haiku-4-5-20251001"
-            self.llm_description = (
-                "Anthropic Claude 4.5 Haiku (Small-size LLM) - directly from Anthropic"
-            )
-            self.price_per_M_input_tokens = 1
-            self.price_per_M_output_tokens = 5
-        elif model_size == "Sonnet 4 Anthropic":
-            self.model_id = "claude-sonnet-4-20250514"
-            self.llm_description = (
-                "Anthropic Claude 4 Sonnet (Medium-size LLM) - directly from Anthropic"
-            )
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Sonnet 3.7 Anthropic":
-            self.model_id = "claude-3-7-sonnet-20250219"
-            self.llm_description = "Anthropic Claude 3.7 Sonnet (Medium-size LLM) - directly from Anthropic"
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Sonnet 3.5 Anthropic":
-            self.model_id = "claude-3-5-sonnet-20241022"
-            self.llm_description = "Anthropic Claude 3.5 Sonnet (Medium-size LLM) - directly from Anthropic"
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Haiku 3.5 Anthropic":
-            self.model_id = "claude-3-5-haiku-20241022"
-            self.llm_description = (
-                "Anthropic Claude 3.5 Haiku (Small-size LLM) - directly from Anthropic"
-            )
-            self.price_per_M_input_tokens = 1
-            self.price_per_M_output_tokens = 5
-        elif model_size == "Opus 3 Anthropic":
-            self.model_id = "claude-3-opus-20240229"
-            self.llm_description = (
-                "Anthropic Claude 3 Opus (Large-size LLM) - directly from Anthropic"
-            )
-            self.price_per_M_input_tokens = 15
-            self.price_per_M_output_tokens = 75
-        elif model_size == "Haiku 3 Anthropic":
-            self.model_id = "claude-3-haiku-20240307"
-            self.llm_description = (
-                "Anthropic Claude 3 Haiku (Small-size LLM) - directly from Anthropic"
-            )
-            self.price_per_M_input_tokens = 0.25
-            self.price_per_M_output_tokens = 1.25
+        self.anthropic_client = CLIENT_REGISTRY.anthropic_client()
+        # None for the client of the event loop of each call, from CLIENT_REGISTRY
+        self.anthropic_async_client = None
+        self._load_model_spec(model_size)
 
         self.config = {
             # "messages": prompt,
@@ -85,8 +32,10 @@ class LLM_Claude_Anthropic(LLM_Service):
             "stop_sequences": [],  # the regular is already implemented
             "model": self.model_id,
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -110,6 +59,8 @@ class LLM_Claude_Anthropic(LLM_Service):
         tool_invoker_fn=None,
         max_retries=5,
         cur_fail_sleep=6,
+        stream_deltas=False,
+        session=None,
     ):
         """
         Invokes the Claude 3 model to run an inference
@@ -126,18 +77,58 @@ class LLM_Claude_Anthropic(LLM_Service):
                 kwargs - arguments to the tool that will be called
         max_retries: how many attempts to call the model
         cur_fail_sleep: how long to wait between model calls (this gets incremented)
+        stream_deltas: if True, yields the events in stream_events instead of the
+            cumulative answer
+        session: CallSession that receives the state of the call
         :return: Inference response from the model.
         """
-        # Messages that had to be added because of function use
-        self.tool_use_added_msgs = []
+        body = self._prepare_body(
+            prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+        )
+        yield from self._run_tool_loop(
+            session,
+            body,
+            postpend,
+            tool_invoker_fn,
+            max_retries,
+            cur_fail_sleep,
+            stream_deltas=stream_deltas,
+        )
 
-        # try:
-        # The different model providers have individual request and response formats.
-        # For the format, ranges, and default values for Meta Llama 2 Chat, refer to:
-        # https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-meta.html
+    async def ainvoke_streaming(
+        self,
+        prompt,
+        b64image=None,
+        postpend="",
+        extra_stop_sequences=[],
+        tools=None,
+        tool_invoker_fn=None,
+        max_retries=5,
+        cur_fail_sleep=6,
+        stream_deltas=False,
+        session=None,
+    ):
+        """Async counterpart of invoke_streaming, using anthropic.AsyncAnthropic.
+        Yields the same chunks.
+        """
+        body = self._prepare_body(
+            prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+        )
+        async for x in self._arun_tool_loop(
+            session,
+            body,
+            postpend,
+            tool_invoker_fn,
+            max_retries,
+            cur_fail_sleep,
+            stream_deltas=stream_deltas,
+        ):
+            yield x
 
-        # start time
-        t0 = time.time()
+    def _prepare_body(
+        self, prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+    ):
+        """Builds the request body sent to the Anthropic API"""
         body = self.config.copy()
         body["stop_sequences"] = body["stop_sequences"] + extra_stop_sequences
 
@@ -155,140 +146,141 @@ class LLM_Claude_Anthropic(LLM_Service):
                     }
                 ]
             elif isinstance(body["system"], list):
-                body["system"][-1]["cache_control"] = {"type": "ephemeral"}
+                body["system"] = body["system"][:-1] + [
+                    {**body["system"][-1], "cache_control": {"type": "ephemeral"}}
+                ]
 
         if tools is None:
             body["messages"].append({"role": "assistant", "content": postpend})
         else:
             if self.use_caching:
-                # if caching, append the caching structure to the last tool
-                tools[-1]["cache_control"] = {"type": "ephemeral"}
+                # if caching, append the caching structure to the last tool.
+                # Tool descriptions are shared (see ToolCatalog): don't change them
+                tools = tools[:-1] + [
+                    {**tools[-1], "cache_control": {"type": "ephemeral"}}
+                ]
             body["tools"] = tools
 
             assert postpend == "", "When using tools, postpend is not supported"
             assert (
                 tool_invoker_fn is not None
             ), "When using tools, a tool invoker must be provided"
+        return body
+
+    def _invoke_model(self, body):
+        return self.anthropic_client.messages.create(**body)
 
-        for k in range(max_retries):
-            try:
-                self.debug_body = body
-                llm_body_changed = True
-                while llm_body_changed:
-                    llm_body_changed = False
-                    response = self.anthropic_client.messages.create(**body)
+    async def _ainvoke_model(self, body):
+        client = self.anthropic_async_client
+        if client is None:
+            # the async client is tied to the event loop of the call
+            client = CLIENT_REGISTRY.async_anthropic_client()
+        return await client.messages.create(**body)
 
-                    word_count = len(re.findall(r"\w+", str(body["messages"])))
-                    print(f"Invoking {self.llm_description}. Word count: {word_count}")
+    def _get_tool_calls(self, session):
+        # tool use has been required. Let's do it
+        return [
+            (cur_tool_spec["name"], cur_tool_spec["input"])
+            for cur_tool_spec in session.cur_tool_specs
+        ]
 
-                    # stream responses
-                    partial_ans = self._response_gen(response, postpend)
-                    x = ""
-                    for x in partial_ans:
-                        yield x
-                    cur_ans = x
+    def _append_tool_turn(self, session, body, cur_ans, tool_answers):
+        # append assistant responses
+        assistant_msg = {"role": "assistant", "content": []}
+        if cur_ans is not None and cur_ans.strip() != "":
+            assistant_msg["content"].append(
+                {
+                    "type": "text",
+                    "text": cur_ans,
+                },
+            )
+        # all tool calls go in the same message and the results in the same order
+        assistant_msg["content"].extend(session.cur_tool_specs)
 
-                    if self.cur_tool_spec is not None:
-                        # tool use has been required. Let's do it
-                        # TODO: update upstream to reflect the inclusion of a response
-                        # TODO: probably rework gradio UI to re-instantiate things every chat, or keep an instance per chat ID
-                        tool_ans = tool_invoker_fn(
-                            self.cur_tool_spec["name"],
-                            return_results_only=True,
-                            **self.cur_tool_spec["input"],
-                        )
-                        if isinstance(tool_ans, types.GeneratorType):
-                            for partial_ans in tool_ans:
-                                yield partial_ans
-                            tool_ans = partial_ans
+        next_user_msg = {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": cur_tool_spec["id"],
+                    "content": tool_ans,
+                }
+                for cur_tool_spec, tool_ans in zip(session.cur_tool_specs, tool_answers)
+            ],
+        }
+        body["messages"].append(assistant_msg)
+        body["messages"].append(next_user_msg)
 
-                        # append assistant responses
-                        assistant_msg = {"role": "assistant", "content": []}
-                        if cur_ans is not None and cur_ans.strip() != "":
-                            assistant_msg["content"].append(
-                                {
-                                    "type": "text",
-                                    "text": cur_ans,
-                                },
-                            )
-                        assistant_msg["content"].append(self.cur_tool_spec)
+        # keep a log of messages that had to be appended due to tool use
+        session.tool_use_added_msgs.append(assistant_msg)
+        session.tool_use_added_msgs.append(next_user_msg)
 
-                        next_user_msg = {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "tool_result",
-                                    "tool_use_id": self.cur_tool_spec["id"],
-                                    "content": tool_ans,
-                                }
-                            ],
-                        }
-                        body["messages"].append(assistant_msg)
-                        body["messages"].append(next_user_msg)
+    def _process_stream_chunk(self, state, x):
+        txt = ""
+        if hasattr(x, "type") and x.type == "message_start":
+            print(x)
+            state["usage"] = update_usage(
+                state["usage"], x.message.usage, ANTHROPIC_USAGE_FIELDS
+            )
+        if hasattr(x, "type") and x.type == "message_delta":
+            # has the output token count
+            state["usage"] = update_usage(
+                state["usage"], x.usage, ANTHROPIC_USAGE_FIELDS
+            )
+        if hasattr(x, "content_block"):
+            if x.content_block.type == "text":
+                txt = x.content_block.text
+            elif x.content_block.type == "tool_use":
+                state["cur_tool_spec"] = x.content_block.__dict__.copy()
+                state["cur_tool_spec"]["input"] = ""
+                state["cur_tool_specs"].append(state["cur_tool_spec"])
+                yield ToolCallDelta(
+                    state["cur_tool_spec"]["id"], state["cur_tool_spec"]["name"]
+                )
 
-                        # keep a log of messages that had to be appended due to tool use
-                        self.tool_use_added_msgs.append(assistant_msg)
-                        self.tool_use_added_msgs.append(next_user_msg)
-                        llm_body_changed = True
+        elif hasattr(x, "delta"):
+            txt = x.delta.text if hasattr(x.delta, "text") else ""
+            partial_json = (
+                x.delta.partial_json if hasattr(x.delta, "partial_json") else ""
+            )
+            if state["cur_tool_spec"] is not None and partial_json != "":
+                state["cur_tool_spec"]["input"] += partial_json
+                yield ToolCallDelta(
+                    state["cur_tool_spec"]["id"],
+                    state["cur_tool_spec"]["name"],
+                    partial_json,
+                )
 
-                    # TODO: Include proper token count and pricing
-                    ans_word_count = len(
-                        re.findall(r"\w+", postpend + cur_ans + str(self.stop_reason))
-                    )
-                    self.word_counts.append(
-                        {
-                            "request_word_count": word_count,
-                            "answer_word_count": ans_word_count,
-                            "price_estimate": 0.001
-                            * (0.003 * word_count + 0.015 * ans_word_count),
-                            "exec_time_in_s": time.time() - t0,
-                        }
-                    )
-                return
-            except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
-        yield "Could not invoke the AI model."
+        if txt != "":
+            yield TextDelta(txt)
 
-    def _response_gen(self, response_body, postpend=""):
-        cur_ans = ""
-        cur_tool_spec = None
-        for x in response_body:
-            txt = ""
-            if hasattr(x, "type") and x.type == "message_start":
-                print(x)
-            if hasattr(x, "content_block"):
-                if x.content_block.type == "text":
-                    txt = x.content_block.text
-                elif x.content_block.type == "tool_use":
-                    cur_tool_spec = x.content_block.__dict__.copy()
-                    cur_tool_spec["input"] = ""
+        # the tool input is complete: parse it so the tool can start right away
+        if hasattr(x, "type") and x.type == "content_block_stop":
+            cur_tool_spec = state["cur_tool_spec"]
+            if cur_tool_spec is not None and isinstance(cur_tool_spec["input"], str):
+                self._parse_tool_input(cur_tool_spec)
+                state["ready_tool_calls"].append(
+                    (cur_tool_spec["name"], cur_tool_spec["input"])
+                )
 
-            elif hasattr(x, "delta"):
-                txt = x.delta.text if hasattr(x.delta, "text") else ""
-                if cur_tool_spec is not None:
-                    cur_tool_spec["input"] += (
-                        x.delta.partial_json if hasattr(x.delta, "partial_json") else ""
-                    )
+        stop_reason = (
+            x.delta.stop_reason
+            if hasattr(x, "delta") and hasattr(x.delta, "stop_reason")
+            else None
+        )
+        state["stop_reason"] = stop_reason
+        if stop_reason is not None and stop_reason == "stop_sequence":
+            stop_txt = x.delta.stop_sequence
+            yield StreamStop(stop_reason, stop_txt)
+            state["finished"] = True
 
-            if txt != "":
-                cur_ans += txt
-                yield postpend + cur_ans
+    def _parse_tool_input(self, cur_tool_spec):
+        if cur_tool_spec["input"].strip() == "":
+            cur_tool_spec["input"] = {}
+        else:
+            cur_tool_spec["input"] = json.loads(cur_tool_spec["input"])
 
-            stop_reason = (
-                x.delta.stop_reason
-                if hasattr(x, "delta") and hasattr(x.delta, "stop_reason")
-                else None
-            )
-            if stop_reason is not None and stop_reason == "stop_sequence":
-                stop_txt = x.delta.stop_sequence
-                yield postpend + cur_ans + stop_txt
-                break
-        if cur_tool_spec is not None:
-            if cur_tool_spec["input"].strip() == "":
-                cur_tool_spec["input"] = {}
-            else:
-                cur_tool_spec["input"] = json.loads(cur_tool_spec["input"])
-        self.cur_tool_spec = cur_tool_spec
-        self.stop_reason = stop_reason
+    def _finish_stream(self, state):
+        for cur_tool_spec in state["cur_tool_specs"]:
+            if isinstance(cur_tool_spec["input"], str):
+                self._parse_tool_input(cur_tool_spec)
@@ -1,13 +1,22 @@
 import re
 import json
 import time
-import types
+import asyncio
 
 from typing import Dict, List
-from .base_service import LLM_Service
+from .base_service import LLM_Service, _aiter_in_thread
+from .stream_events import StreamStop, TextDelta, ToolCallDelta
+from .usage import (
+    ANTHROPIC_USAGE_FIELDS,
+    UsageLog,
+    bedrock_invocation_usage,
+    update_usage,
+)
 
 
 class LLM_Claude_Bedrock(LLM_Service):
+    supports_stream_deltas = True
+
     def __init__(self, bedrock_client, model_size, use_caching=True):
         """Constructor
         Arguments:
@@ -18,76 +27,7 @@ class LLM_Claude_Bedrock(LLM_Service):
         """
         self.use_caching = use_caching
 
-        if model_size == "Sonnet 4":
-            self.model_id = "us.anthropic.claude-sonnet-4-20250514-v1:0"
-            self.llm_description = (
-                "Anthropic Claude 4 Sonnet from AWS Bedrock (Medium-size LLM)"
-            )
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Sonnet 4.5":
-            self.model_id = "us.anthropic.claude-sonnet-4-5-20250929-v1:0"
-            self.llm_description = (
-                "Anthropic Claude 4.5 Sonnet from AWS Bedrock (Medium-size LLM)"
-            )
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Haiku 4.5":
-            self.model_id = "us.anthropic.claude-haiku-4-5-20251001-v1:0"
-            self.llm_description = (
-                "Anthropic Claude 4.5 Haiku from AWS Bedrock (Small-size LLM)"
-            )
-            self.price_per_M_input_tokens = 1
-            self.price_per_M_output_tokens = 5
-        elif model_size == "Opus 4":
-            self.model_id = "us.anthropic.claude-opus-4-20250514-v1:0"
-            self.llm_description = (
-                "Anthropic Claude 4 Opus from AWS Bedrock (Large-size LLM)"
-            )
-            self.price_per_M_input_tokens = 15
-            self.price_per_M_output_tokens = 75
-        elif model_size == "Opus":
-            self.model_id = "anthropic.claude-3-opus-20240229-v1:0"
-            self.llm_description = (
-                "Anthropic Claude 3.0 Opus from AWS Bedrock (Large LLM)"
-            )
-            self.price_per_M_input_tokens = 15
-            self.price_per_M_output_tokens = 75
-        elif model_size == "Sonnet":
-            self.model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
-            self.llm_description = (
-                "Anthropic Claude 3.0 Sonnet from AWS Bedrock (Medium-size LLM)"
-            )
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Sonnet 3.5":
-            self.model_id = "anthropic.claude-3-5-sonnet-20241022-v2:0"
-            self.llm_description = (
-                "Anthropic Claude 3.5 Sonnet from AWS Bedrock (Medium-size LLM)"
-            )
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Sonnet 3.7":
-            self.model_id = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
-            self.llm_description = (
-                "Anthropic Claude 3.7 Sonnet from AWS Bedrock (Medium-size LLM)"
-            )
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Haiku 3.5":
-            self.model_id = "anthropic.claude-3-5-haiku-20241022-v1:0"
-            self.llm_description = (
-                "Anthropic Claude 3.5 Haiku from AWS Bedrock (Small-size LLM)"
-            )
-            self.price_per_M_input_tokens = 1
-            self.price_per_M_output_tokens = 5
-        elif model_size == "Haiku":
-            self.model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-            self.llm_description = (
-                "Anthropic Claude 3.0 Haiku from AWS Bedrock (Small-size LLM)"
-            )
-            self.price_per_M_input_tokens = 0.25
-            self.price_per_M_output_tokens = 1.25
+        self._load_model_spec(model_size)
 
         self.bedrock_client = bedrock_client
         self.config = {
@@ -100,8 +40,10 @@ class LLM_Claude_Bedrock(LLM_Service):
             "stop_sequences": [],  # the regular is already implemented
             "anthropic_version": "bedrock-2023-05-31",
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -125,6 +67,8 @@ class LLM_Claude_Bedrock(LLM_Service):
         tool_invoker_fn=None,
         max_retries=25,
         cur_fail_sleep=60,
+        stream_deltas=False,
+        session=None,
     ):
         """
         Invokes the Claude 3 model to run an inference
@@ -139,18 +83,58 @@ class LLM_Claude_Bedrock(LLM_Service):
                 function name - function to call
                 return_results_only - we set to True because we already use Claude format
                 kwargs - arguments to the tool that will be called
+        stream_deltas: if True, yields the events in stream_events instead of the
+            cumulative answer
+        session: CallSession that receives the state of the call
         :return: Inference response from the model.
         """
-        # Messages that had to be added because of function use
-        self.tool_use_added_msgs = []
-
-        # try:
-        # The different model providers have individual request and response formats.
-        # For the format, ranges, and default values for Meta Llama 2 Chat, refer to:
-        # https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-meta.html
+        body = self._prepare_body(
+            prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+        )
+        yield from self._run_tool_loop(
+            session,
+            body,
+            postpend,
+            tool_invoker_fn,
+            max_retries,
+            cur_fail_sleep,
+            stream_deltas=stream_deltas,
+        )
 
-        # start time
-        t0 = time.time()
+    async def ainvoke_streaming(
+        self,
+        prompt,
+        b64image=None,
+        postpend="",
+        extra_stop_sequences=[],
+        tools=None,
+        tool_invoker_fn=None,
+        max_retries=25,
+        cur_fail_sleep=60,
+        stream_deltas=False,
+        session=None,
+    ):
+        """Async counterpart of invoke_streaming. Yields the same chunks.
+        boto3 has no async client, so the request and each chunk read run in worker threads
+        """
+        body = self._prepare_body(
+            prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+        )
+        async for x in self._arun_tool_loop(
+            session,
+            body,
+            postpend,
+            tool_invoker_fn,
+            max_retries,
+            cur_fail_sleep,
+            stream_deltas=stream_deltas,
+        ):
+            yield x
+
+    def _prepare_body(
+        self, prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+    ):
+        """Builds the request body sent to Bedrock"""
         body = self.config.copy()
         body["stop_sequences"] = body["stop_sequences"] + extra_stop_sequences
 
@@ -168,136 +152,143 @@ class LLM_Claude_Bedrock(LLM_Service):
                     }
                 ]
             elif isinstance(body["system"], list):
-                body["system"][-1]["cache_control"] = {"type": "ephemeral"}
+                body["system"] = body["system"][:-1] + [
+                    {**body["system"][-1], "cache_control": {"type": "ephemeral"}}
+                ]
 
         if tools is None:
             body["messages"].append({"role": "assistant", "content": postpend})
         else:
             if self.use_caching:
-                # if caching, append the caching structure to the last tool
-                tools[-1]["cache_control"] = {"type": "ephemeral"}
+                # if caching, append the caching structure to the last tool.
+                # Tool descriptions are shared (see ToolCatalog): don't change them
+                tools = tools[:-1] + [
+                    {**tools[-1], "cache_control": {"type": "ephemeral"}}
+                ]
             body["tools"] = tools
             assert postpend == "", "When using tools, postpend is not supported"
             assert (
                 tool_invoker_fn is not None
             ), "When using tools, a tool invoker must be provided"
+        return body
 
-        for k in range(max_retries):
-            try:
-                llm_body_changed = True
-                while llm_body_changed:
-                    llm_body_changed = False
-                    response = self.bedrock_client.invoke_model_with_response_stream(
-                        modelId=self.model_id,
-                        body=json.dumps(body),
-                    )
-                    word_count = len(re.findall(r"\w+", str(body["messages"])))
-                    print(f"Invoking {self.llm_description}. Word count: {word_count}")
-
-                    # stream responses
-                    partial_ans = self._response_gen(response["body"], postpend)
-                    x = ""
-                    for x in partial_ans:
-                        yield x
-                    cur_ans = x
-
-                    if self.cur_tool_spec is not None:
-                        tool_ans = tool_invoker_fn(
-                            self.cur_tool_spec["name"],
-                            return_results_only=True,
-                            **self.cur_tool_spec["input"],
-                        )
-                        if isinstance(tool_ans, types.GeneratorType):
-                            for partial_ans in tool_ans:
-                                yield partial_ans
-                            tool_ans = partial_ans
-
-                        # append assistant responses
-                        assistant_msg = {"role": "assistant", "content": []}
-                        if cur_ans is not None and cur_ans.strip() != "":
-                            assistant_msg["content"].append(
-                                {
-                                    "type": "text",
-                                    "text": cur_ans,
-                                },
-                            )
-                        assistant_msg["content"].append(self.cur_tool_spec)
-
-                        next_user_msg = {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "tool_result",
-                                    "tool_use_id": self.cur_tool_spec["id"],
-                                    "content": tool_ans,
-                                }
-                            ],
-                        }
-                        body["messages"].append(assistant_msg)
-                        body["messages"].append(next_user_msg)
-
-                        # keep a log of messages that had to be appended due to tool use
-                        self.tool_use_added_msgs.append(assistant_msg)
-                        self.tool_use_added_msgs.append(next_user_msg)
-                        llm_body_changed = True
-
-                    # TODO: Include proper token count and pricing
-                    ans_word_count = len(
-                        re.findall(r"\w+", postpend + cur_ans + str(self.stop_reason))
-                    )
-                    self.word_counts.append(
-                        {
-                            "request_word_count": word_count,
-                            "answer_word_count": ans_word_count,
-                            "price_estimate": 0.001
-                            * (0.003 * word_count + 0.015 * ans_word_count),
-                            "exec_time_in_s": time.time() - t0,
-                        }
-                    )
-                return
-            except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
-        yield "Could not invoke the AI model."
+    def _invoke_model(self, body):
+        response = self.bedrock_client.invoke_model_with_response_stream(
+            modelId=self.model_id,
+            body=json.dumps(body),
+        )
+        return response["body"]
 
-    def _response_gen(self, response_body, postpend=""):
-        cur_ans = ""
-        cur_tool_spec = None
-        for x in response_body:
-            out_dict = json.loads(x["chunk"]["bytes"])
-            if "type" in out_dict.keys() and out_dict["type"] == "message_start":
-                print(x)
-
-            txt = ""
-            if "content_block" in out_dict.keys():
-                if out_dict["content_block"]["type"] == "text":
-                    txt = out_dict["content_block"]["text"]
-                elif out_dict["content_block"]["type"] == "tool_use":
-                    cur_tool_spec = out_dict["content_block"].copy()
-                    cur_tool_spec["input"] = ""
-
-            elif "delta" in out_dict.keys():
-                txt = out_dict["delta"].get("text", "")
-                if cur_tool_spec is not None:
-                    cur_tool_spec["input"] += out_dict["delta"].get("partial_json", "")
-
-            if txt != "":
-                cur_ans += txt
-                yield postpend + cur_ans
-            stop_reason = (
-                out_dict["delta"].get("stop_reason", None)
-                if "delta" in out_dict.keys()
-                else None
+    async def _ainvoke_model(self, body):
+        response = await asyncio.to_thread(
+            self.bedrock_client.invoke_model_with_response_stream,
+            modelId=self.model_id,
+            body=json.dumps(body),
+        )
+        return _aiter_in_thread(response["body"])
+
+    def _get_tool_calls(self, session):
+        return [
+            (cur_tool_spec["name"], cur_tool_spec["input"])
+            for cur_tool_spec in session.cur_tool_specs
+        ]
+
+    def _append_tool_turn(self, session, body, cur_ans, tool_answers):
+        # append assistant responses
+        assistant_msg = {"role": "assistant", "content": []}
+        if cur_ans is not None and cur_ans.strip() != "":
+            assistant_msg["content"].append(
+                {
+                    "type": "text",
+                    "text": cur_ans,
+                },
+            )
+        # all tool calls go in the same message and the results in the same order
+        assistant_msg["content"].extend(session.cur_tool_specs)
+
+        next_user_msg = {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": cur_tool_spec["id"],
+                    "content": tool_ans,
+                }
+                for cur_tool_spec, tool_ans in zip(session.cur_tool_specs, tool_answers)
+            ],
+        }
+        body["messages"].append(assistant_msg)
+        body["messages"].append(next_user_msg)
+
+        # keep a log of messages that had to be appended due to tool use
+        session.tool_use_added_msgs.append(assistant_msg)
+        session.tool_use_added_msgs.append(next_user_msg)
+
+    def _process_stream_chunk(self, state, x):
+        out_dict = json.loads(x["chunk"]["bytes"])
+        if "type" in out_dict.keys() and out_dict["type"] == "message_start":
+            print(x)
+            state["usage"] = update_usage(
+                state["usage"],
+                out_dict.get("message", {}).get("usage", {}),
+                ANTHROPIC_USAGE_FIELDS,
+            )
+        if "usage" in out_dict.keys():
+            # message_delta has the output token count
+            state["usage"] = update_usage(
+                state["usage"], out_dict["usage"], ANTHROPIC_USAGE_FIELDS
             )
-            if stop_reason is not None and stop_reason == "stop_sequence":
-                stop_txt = out_dict["delta"]["stop_sequence"]
-                yield postpend + cur_ans + stop_txt
-                break
-        if cur_tool_spec is not None:
-            cur_tool_spec["input"] = json.loads(cur_tool_spec["input"])
-        self.cur_tool_spec = cur_tool_spec
-        self.stop_reason = stop_reason
+
+        txt = ""
+        if "content_block" in out_dict.keys():
+            if out_dict["content_block"]["type"] == "text":
+                txt = out_dict["content_block"]["text"]
+            elif out_dict["content_block"]["type"] == "tool_use":
+                state["cur_tool_spec"] = out_dict["content_block"].copy()
+                state["cur_tool_spec"]["input"] = ""
+                state["cur_tool_specs"].append(state["cur_tool_spec"])
+                yield ToolCallDelta(
+                    state["cur_tool_spec"]["id"], state["cur_tool_spec"]["name"]
+                )
+
+        elif "delta" in out_dict.keys():
+            txt = out_dict["delta"].get("text", "")
+            partial_json = out_dict["delta"].get("partial_json", "")
+            if state["cur_tool_spec"] is not None and partial_json != "":
+                state["cur_tool_spec"]["input"] += partial_json
+                yield ToolCallDelta(
+                    state["cur_tool_spec"]["id"],
+                    state["cur_tool_spec"]["name"],
+                    partial_json,
+                )
+
+        if txt != "":
+            yield TextDelta(txt)
+
+        # the tool input is complete: parse it so the tool can start right away
+        if out_dict.get("type") == "content_block_stop":
+            cur_tool_spec = state["cur_tool_spec"]
+            if cur_tool_spec is not None and isinstance(cur_tool_spec["input"], str):
+                cur_tool_spec["input"] = json.loads(cur_tool_spec["input"])
+                state["ready_tool_calls"].append(
+                    (cur_tool_spec["name"], cur_tool_spec["input"])
+                )
+
+        stop_reason = (
+            out_dict["delta"].get("stop_reason", None)
+            if "delta" in out_dict.keys()
+            else None
+        )
+        state["stop_reason"] = stop_reason
+        if stop_reason is not None and stop_reason == "stop_sequence":
+            stop_txt = out_dict["delta"]["stop_sequence"]
+            yield StreamStop(stop_reason, stop_txt)
+            state["finished"] = True
+
+    def _finish_stream(self, state):
+        for cur_tool_spec in state["cur_tool_specs"]:
+            if isinstance(cur_tool_spec["input"], str):
+                cur_tool_spec["input"] = json.loads(cur_tool_spec["input"])
 
 
 class LLM_Mistral_Bedrock(LLM_Service):
@@ -310,16 +301,7 @@ class LLM_Mistral_Bedrock(LLM_Service):
         """
 
         self.bedrock_client = bedrock_client
-        if model_size == "Mixtral 8x7B v0:1":
-            self.model_id = "mistral.mixtral-8x7b-instruct-v0:1"
-            self.llm_description = "Mistral Mixtral 8x7B LLM from Bedrock"
-            self.price_per_M_input_tokens = 0.45
-            self.price_per_M_output_tokens = 0.7
-        elif model_size == "Mistral Large v1":
-            self.model_id = "mistral.mistral-large-2402-v1:0"
-            self.llm_description = "Mistral Large LLM from Bedrock"
-            self.price_per_M_input_tokens = 4
-            self.price_per_M_output_tokens = 12
+        self._load_model_spec(model_size)
 
         self.config = {
             # "prompt": prompt,
@@ -328,8 +310,10 @@ class LLM_Mistral_Bedrock(LLM_Service):
             "top_k": 50,
             "top_p": 0.9,
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -346,6 +330,7 @@ class LLM_Mistral_Bedrock(LLM_Service):
         tools=None,
         tool_invoker_fn=None,
         cur_fail_sleep=6,
+        session=None,
     ):
         """
         Invokes the Llama2 large-language model to run an inference
@@ -368,6 +353,9 @@ class LLM_Mistral_Bedrock(LLM_Service):
         body["prompt"] = prompt + postpend
 
         for k in range(max_retries):
+            if not self.retry_policy.allow_request(self._retry_key()):
+                yield "The AI service is temporarily unavailable."
+                break
             try:
                 response = self.bedrock_client.invoke_model_with_response_stream(
                     modelId=self.model_id, body=json.dumps(body)
@@ -376,8 +364,12 @@ class LLM_Mistral_Bedrock(LLM_Service):
                 print(f"Invoking {self.llm_description}. Word count: {word_count}")
 
                 cur_ans = ""
+                usage = None
                 for x in response["body"]:
-                    partial = json.loads(x["chunk"]["bytes"])["outputs"][0]["text"]
+                    out_dict = json.loads(x["chunk"]["bytes"])
+                    # Bedrock adds the token counts to the last chunk
+                    usage = bedrock_invocation_usage(out_dict) or usage
+                    partial = out_dict["outputs"][0]["text"]
                     cur_ans += partial
 
                     # we include those again so there's no need to leave these in the answer
@@ -398,21 +390,18 @@ class LLM_Mistral_Bedrock(LLM_Service):
                         break
                     # stop_reason = json.loads(x['chunk']['bytes'])['stop_reason']
 
-                ans_word_count = len(re.findall(r"\w+", postpend + cur_ans))
-                self.word_counts.append(
-                    {
-                        "request_word_count": word_count,
-                        "answer_word_count": ans_word_count,
-                        "price_estimate": 0.001
-                        * (0.00195 * word_count + 0.00256 * ans_word_count),
-                        "exec_time_in_s": time.time() - t0,
-                    }
-                )
+                self._add_usage(usage, t0, body["prompt"], postpend + cur_ans)
+                self.retry_policy.record_success(self._retry_key())
                 return
             except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
+                retry_delay = self.retry_policy.on_failure(
+                    self._retry_key(), e, k, max_retries, cur_fail_sleep
+                )
+                if retry_delay is None:
+                    yield f"Error {str(e)}."
+                    break
+                yield f"Error {str(e)}. Waiting {int(retry_delay)} s. Retrying {k+1}/{max_retries}..."
+                time.sleep(retry_delay)
         yield "Could not invoke the AI model."
 
 
@@ -425,9 +414,7 @@ class LLM_Claude2_1_Bedrock(LLM_Service):
         """
 
         self.bedrock_client = bedrock_client
-        self.llm_description = "Anthropic Claude 2.1 LLM"
-        self.price_per_M_input_tokens = 8
-        self.price_per_M_output_tokens = 24
+        self._load_model_spec()
 
         self.config = {
             # "prompt": prompt,
@@ -438,8 +425,10 @@ class LLM_Claude2_1_Bedrock(LLM_Service):
             "stop_sequences": ["\n\nHuman:"],
             "anthropic_version": "bedrock-2023-05-31",
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -454,6 +443,7 @@ class LLM_Claude2_1_Bedrock(LLM_Service):
         extra_stop_sequences=[],
         max_retries=25,
         cur_fail_sleep=6,
+        session=None,
     ):
         """
         Invokes the Claude large-language model to run an inference
@@ -476,42 +466,44 @@ class LLM_Claude2_1_Bedrock(LLM_Service):
         body["prompt"] = prompt + postpend
 
         for k in range(max_retries):
+            if not self.retry_policy.allow_request(self._retry_key()):
+                yield "The AI service is temporarily unavailable."
+                break
             try:
                 response = self.bedrock_client.invoke_model_with_response_stream(
-                    modelId="anthropic.claude-v2:1", body=json.dumps(body)
+                    modelId=self.model_id, body=json.dumps(body)
                 )
                 word_count = len(re.findall(r"\w+", body["prompt"]))
                 print(f"Invoking Claude. Word count: {word_count}")
 
                 cur_ans = ""
+                usage = None
                 for x in response["body"]:
-                    partial = json.loads(x["chunk"]["bytes"])["completion"]
+                    out_dict = json.loads(x["chunk"]["bytes"])
+                    # Bedrock adds the token counts to the last chunk
+                    usage = bedrock_invocation_usage(out_dict) or usage
+                    partial = out_dict["completion"]
                     cur_ans += partial
                     yield postpend + cur_ans
-                    stop_reason = json.loads(x["chunk"]["bytes"])["stop"]
+                    stop_reason = out_dict["stop"]
                     if (
                         stop_reason is not None
                         and stop_reason != body["stop_sequences"][0]
                     ):
                         yield postpend + cur_ans + stop_reason
 
-                ans_word_count = len(
-                    re.findall(r"\w+", postpend + cur_ans + stop_reason)
-                )
-                self.word_counts.append(
-                    {
-                        "request_word_count": word_count,
-                        "answer_word_count": ans_word_count,
-                        "price_estimate": 0.001
-                        * (0.008 * word_count + 0.024 * ans_word_count),
-                        "exec_time_in_s": time.time() - t0,
-                    }
-                )
+                self._add_usage(usage, t0, body["prompt"], postpend + cur_ans)
+                self.retry_policy.record_success(self._retry_key())
                 return
             except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
+                retry_delay = self.retry_policy.on_failure(
+                    self._retry_key(), e, k, max_retries, cur_fail_sleep
+                )
+                if retry_delay is None:
+                    yield f"Error {str(e)}."
+                    break
+                yield f"Error {str(e)}. Waiting {int(retry_delay)} s. Retrying {k+1}/{max_retries}..."
+                time.sleep(retry_delay)
         yield "Could not invoke the AI model."
 
 
@@ -524,9 +516,7 @@ class LLM_Claude_Instant_1_2_Bedrock(LLM_Service):
         """
 
         self.bedrock_client = bedrock_client
-        self.llm_description = "Anthropic Claude Instant 1.0 LLM"
-        self.price_per_M_input_tokens = 0.8
-        self.price_per_M_output_tokens = 2.4
+        self._load_model_spec()
         self.config = {
             # "prompt": prompt,
             "max_tokens_to_sample": 600,
@@ -536,8 +526,10 @@ class LLM_Claude_Instant_1_2_Bedrock(LLM_Service):
             "stop_sequences": ["\n\nHuman:"],
             "anthropic_version": "bedrock-2023-05-31",
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -552,6 +544,7 @@ class LLM_Claude_Instant_1_2_Bedrock(LLM_Service):
         extra_stop_sequences=[],
         max_retries=25,
         cur_fail_sleep=1,
+        session=None,
     ):
         """
         Invokes the Claude large-language model to run an inference
@@ -574,42 +567,44 @@ class LLM_Claude_Instant_1_2_Bedrock(LLM_Service):
         body["prompt"] = prompt + postpend
 
         for k in range(max_retries):
+            if not self.retry_policy.allow_request(self._retry_key()):
+                yield "The AI service is temporarily unavailable."
+                break
             try:
                 response = self.bedrock_client.invoke_model_with_response_stream(
-                    modelId="anthropic.claude-instant-v1", body=json.dumps(body)
+                    modelId=self.model_id, body=json.dumps(body)
                 )
                 word_count = len(re.findall(r"\w+", body["prompt"]))
                 print(f"Invoking Claude Instant. Word count: {word_count}")
 
                 cur_ans = ""
+                usage = None
                 for x in response["body"]:
-                    partial = json.loads(x["chunk"]["bytes"])["completion"]
+                    out_dict = json.loads(x["chunk"]["bytes"])
+                    # Bedrock adds the token counts to the last chunk
+                    usage = bedrock_invocation_usage(out_dict) or usage
+                    partial = out_dict["completion"]
                     cur_ans += partial
                     yield postpend + cur_ans
-                    stop_reason = json.loads(x["chunk"]["bytes"])["stop"]
+                    stop_reason = out_dict["stop"]
                     if (
                         stop_reason is not None
                         and stop_reason != body["stop_sequences"][0]
                     ):
                         yield postpend + cur_ans + stop_reason
 
-                ans_word_count = len(
-                    re.findall(r"\w+", postpend + cur_ans + stop_reason)
-                )
-                self.word_counts.append(
-                    {
-                        "request_word_count": word_count,
-                        "answer_word_count": ans_word_count,
-                        "price_estimate": 0.001
-                        * (0.0008 * word_count + 0.0024 * ans_word_count),
-                        "exec_time_in_s": time.time() - t0,
-                    }
-                )
+                self._add_usage(usage, t0, body["prompt"], postpend + cur_ans)
+                self.retry_policy.record_success(self._retry_key())
                 return
             except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
+                retry_delay = self.retry_policy.on_failure(
+                    self._retry_key(), e, k, max_retries, cur_fail_sleep
+                )
+                if retry_delay is None:
+                    yield f"Error {str(e)}."
+                    break
+                yield f"Error {str(e)}. Waiting {int(retry_delay)} s. Retrying {k+1}/{max_retries}..."
+                time.sleep(retry_delay)
         yield "Could not invoke the AI model."
 
 
@@ -624,9 +619,7 @@ class LLM_Llama13b(LLM_Service):
         """
 
         self.bedrock_client = bedrock_client
-        self.llm_description = "Llama2 13b v1 LLM"
-        self.price_per_M_input_tokens = 0.75
-        self.price_per_M_output_tokens = 1
+        self._load_model_spec()
 
         self.config = {
             "max_gen_len": 1024,
@@ -634,8 +627,10 @@ class LLM_Llama13b(LLM_Service):
             "temperature": 0.6,
         }
 
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -650,6 +645,7 @@ class LLM_Llama13b(LLM_Service):
         extra_stop_sequences=[],
         max_retries=25,
         cur_fail_sleep=1,
+        session=None,
     ):
         """
         Invokes the Llama2 large-language model to run an inference
@@ -672,16 +668,23 @@ class LLM_Llama13b(LLM_Service):
         body["prompt"] = prompt + postpend
 
         for k in range(max_retries):
+            if not self.retry_policy.allow_request(self._retry_key()):
+                yield "The AI service is temporarily unavailable."
+                break
             try:
                 response = self.bedrock_client.invoke_model_with_response_stream(
-                    modelId="meta.llama2-13b-chat-v1", body=json.dumps(body)
+                    modelId=self.model_id, body=json.dumps(body)
                 )
                 word_count = len(re.findall(r"\w+", body["prompt"]))
                 print(f"Invoking Llama 2 chat 13b. Word count: {word_count}")
 
                 cur_ans = ""
+                usage = None
                 for x in response["body"]:
-                    partial = json.loads(x["chunk"]["bytes"])["generation"]
+                    out_dict = json.loads(x["chunk"]["bytes"])
+                    # Bedrock adds the token counts to the last chunk
+                    usage = bedrock_invocation_usage(out_dict) or usage
+                    partial = out_dict["generation"]
                     cur_ans += partial
 
                     # we include those again so there's no need to leave these in the answer
@@ -702,21 +705,18 @@ class LLM_Llama13b(LLM_Service):
                         break
                     # stop_reason = json.loads(x['chunk']['bytes'])['stop_reason']
 
-                ans_word_count = len(re.findall(r"\w+", postpend + cur_ans))
-                self.word_counts.append(
-                    {
-                        "request_word_count": word_count,
-                        "answer_word_count": ans_word_count,
-                        "price_estimate": 0.001
-                        * (0.00075 * word_count + 0.001 * ans_word_count),
-                        "exec_time_in_s": time.time() - t0,
-                    }
-                )
+                self._add_usage(usage, t0, body["prompt"], postpend + cur_ans)
+                self.retry_policy.record_success(self._retry_key())
                 return
             except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
+                retry_delay = self.retry_policy.on_failure(
+                    self._retry_key(), e, k, max_retries, cur_fail_sleep
+                )
+                if retry_delay is None:
+                    yield f"Error {str(e)}."
+                    break
+                yield f"Error {str(e)}. Waiting {int(retry_delay)} s. Retrying {k+1}/{max_retries}..."
+                time.sleep(retry_delay)
         yield "Could not invoke the AI model."
 
 
@@ -730,9 +730,7 @@ class LLM_Llama70b(LLM_Service):
                 to use when making calls to bedrock models
         """
         self.bedrock_client = bedrock_client
-        self.llm_description = "Llama2 70b v1 LLM"
-        self.price_per_M_input_tokens = 1.95
-        self.price_per_M_output_tokens = 2.56
+        self._load_model_spec()
 
         self.config = {
             "max_gen_len": 1024,
@@ -740,8 +738,10 @@ class LLM_Llama70b(LLM_Service):
             "temperature": 0.6,
         }
 
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -756,6 +756,7 @@ class LLM_Llama70b(LLM_Service):
         extra_stop_sequences=[],
         max_retries=25,
         cur_fail_sleep=1,
+        session=None,
     ):
         """
         Invokes the Llama2 large-language model to run an inference
@@ -778,16 +779,23 @@ class LLM_Llama70b(LLM_Service):
         body["prompt"] = prompt + postpend
 
         for k in range(max_retries):
+            if not self.retry_policy.allow_request(self._retry_key()):
+                yield "The AI service is temporarily unavailable."
+                break
             try:
                 response = self.bedrock_client.invoke_model_with_response_stream(
-                    modelId="meta.llama2-70b-chat-v1", body=json.dumps(body)
+                    modelId=self.model_id, body=json.dumps(body)
                 )
                 word_count = len(re.findall(r"\w+", body["prompt"]))
                 print(f"Invoking Llama 2 chat 70b. Word count: {word_count}")
 
                 cur_ans = ""
+                usage = None
                 for x in response["body"]:
-                    partial = json.loads(x["chunk"]["bytes"])["generation"]
+                    out_dict = json.loads(x["chunk"]["bytes"])
+                    # Bedrock adds the token counts to the last chunk
+                    usage = bedrock_invocation_usage(out_dict) or usage
+                    partial = out_dict["generation"]
                     cur_ans += partial
 
                     # we include those again so there's no need to leave these in the answer
@@ -808,21 +816,18 @@ class LLM_Llama70b(LLM_Service):
                         break
                     # stop_reason = json.loads(x['chunk']['bytes'])['stop_reason']
 
-                ans_word_count = len(re.findall(r"\w+", postpend + cur_ans))
-                self.word_counts.append(
-                    {
-                        "request_word_count": word_count,
-                        "answer_word_count": ans_word_count,
-                        "price_estimate": 0.001
-                        * (0.00195 * word_count + 0.00256 * ans_word_count),
-                        "exec_time_in_s": time.time() - t0,
-                    }
-                )
+                self._add_usage(usage, t0, body["prompt"], postpend + cur_ans)
+                self.retry_policy.record_success(self._retry_key())
                 return
             except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
+                retry_delay = self.retry_policy.on_failure(
+                    self._retry_key(), e, k, max_retries, cur_fail_sleep
+                )
+                if retry_delay is None:
+                    yield f"Error {str(e)}."
+                    break
+                yield f"Error {str(e)}. Waiting {int(retry_delay)} s. Retrying {k+1}/{max_retries}..."
+                time.sleep(retry_delay)
         yield "Could not invoke the AI model."
 
 
@@ -834,31 +839,7 @@ class LLM_Llama3(LLM_Service):
                 to use when making calls to bedrock models
         """
         self.bedrock_client = bedrock_client
-        if model == "Llama3 8B Instruct - Bedrock":
-            self.model_id = "meta.llama3-8b-instruct-v1:0"
-            self.llm_description = "Llama3 8B Instruct LLM from Bedrock"
-            self.price_per_M_input_tokens = 0.3
-            self.price_per_M_output_tokens = 0.6
-        elif model == "Llama3 70B Instruct - Bedrock":
-            self.model_id = "meta.llama3-70b-instruct-v1:0"
-            self.llm_description = "Llama3 70B Instruct LLM from Bedrock"
-            self.price_per_M_input_tokens = 2.65
-            self.price_per_M_output_tokens = 3.5
-        elif model == "Llama3_1 70B Instruct - Bedrock":
-            self.model_id = "meta.llama3-1-70b-instruct-v1:0"
-            self.llm_description = "Llama3.1 70B Instruct LLM from Bedrock"
-            self.price_per_M_input_tokens = 2.65
-            self.price_per_M_output_tokens = 3.5
-        elif model == "Llama3_1 8B Instruct - Bedrock":
-            self.model_id = "meta.llama3-1-8b-instruct-v1:0"
-            self.llm_description = "Llama3.1 8B Instruct LLM from Bedrock"
-            self.price_per_M_input_tokens = 0.3
-            self.price_per_M_output_tokens = 0.6
-        elif model == "Llama3_1 405B Instruct - Bedrock":
-            self.model_id = "meta.llama3-1-405b-instruct-v1:0"
-            self.llm_description = "Llama3.1 405B Instruct LLM from Bedrock"
-            self.price_per_M_input_tokens = 5.32
-            self.price_per_M_output_tokens = 16.0
+        self._load_model_spec(model)
 
         self.config = {
             "max_gen_len": 1024,
@@ -866,8 +847,10 @@ class LLM_Llama3(LLM_Service):
             "temperature": 0.6,
         }
 
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, messages):
         """Receives a list of dictionaries containing keys
@@ -904,6 +887,7 @@ class LLM_Llama3(LLM_Service):
         tools=None,
         tool_invoker_fn=None,
         cur_fail_sleep=1,
+        session=None,
     ):
         """
         Invokes the Llama3 large-language model to run an inference
@@ -929,6 +913,9 @@ class LLM_Llama3(LLM_Service):
         body["prompt"] = prompt + postpend
 
         for k in range(max_retries):
+            if not self.retry_policy.allow_request(self._retry_key()):
+                yield "The AI service is temporarily unavailable."
+                break
             try:
                 response = self.bedrock_client.invoke_model_with_response_stream(
                     modelId=self.model_id, body=json.dumps(body)
@@ -937,8 +924,12 @@ class LLM_Llama3(LLM_Service):
                 print(f"Invoking {self.llm_description}. Word count: {word_count}")
 
                 cur_ans = ""
+                usage = None
                 for x in response["body"]:
-                    partial = json.loads(x["chunk"]["bytes"])["generation"]
+                    out_dict = json.loads(x["chunk"]["bytes"])
+                    # Bedrock adds the token counts to the last chunk
+                    usage = bedrock_invocation_usage(out_dict) or usage
+                    partial = out_dict["generation"]
                     cur_ans += partial
 
                     # we have to manually check for stopword generation
@@ -956,21 +947,18 @@ class LLM_Llama3(LLM_Service):
                         break
                     # stop_reason = json.loads(x['chunk']['bytes'])['stop_reason']
 
-                ans_word_count = len(re.findall(r"\w+", postpend + cur_ans))
-                self.word_counts.append(
-                    {
-                        "request_word_count": word_count,
-                        "answer_word_count": ans_word_count,
-                        "price_estimate": 0.001
-                        * (0.00195 * word_count + 0.00256 * ans_word_count),
-                        "exec_time_in_s": time.time() - t0,
-                    }
-                )
+                self._add_usage(usage, t0, body["prompt"], postpend + cur_ans)
+                self.retry_policy.record_success(self._retry_key())
                 return
             except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
+                retry_delay = self.retry_policy.on_failure(
+                    self._retry_key(), e, k, max_retries, cur_fail_sleep
+                )
+                if retry_delay is None:
+                    yield f"Error {str(e)}."
+                    break
+                yield f"Error {str(e)}. Waiting {int(retry_delay)} s. Retrying {k+1}/{max_retries}..."
+                time.sleep(retry_delay)
         yield "Could not invoke the AI model."
 
 
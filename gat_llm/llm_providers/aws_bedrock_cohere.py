@@ -5,6 +5,8 @@ import time
 import types
 
 from .base_service import LLM_Service
+from .call_session import CallSession
+from .usage import UsageLog, bedrock_invocation_usage
 
 
 class LLM_Command_Cohere(LLM_Service):
@@ -17,20 +19,7 @@ class LLM_Command_Cohere(LLM_Service):
         """
         self.bedrock_client = bedrock_client
 
-        if model_size == "Command R Cohere 1":
-            self.model_id = "cohere.command-r-v1:0"
-            self.llm_description = (
-                "Cohere Command R 1.0 (Medium-size LLM) - from Bedrock"
-            )
-            self.price_per_M_input_tokens = 0.5
-            self.price_per_M_output_tokens = 1.5
-        elif model_size == "Command RPlus Cohere 1":
-            self.model_id = "cohere.command-r-plus-v1:0"
-            self.llm_description = (
-                "Cohere Command R+ 1.0 (Large-size LLM) - from Bedrock"
-            )
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
+        self._load_model_spec(model_size)
 
         self.config = {
             # "messages": prompt,
@@ -42,8 +31,10 @@ class LLM_Command_Cohere(LLM_Service):
             # "top_p": 1,
             "stop_sequences": [],  # the regular is already implemented
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -80,6 +71,7 @@ class LLM_Command_Cohere(LLM_Service):
         tool_invoker_fn=None,
         max_retries=25,
         cur_fail_sleep=60,
+        session=None,
     ):
         """
         Invokes the Cohere model to run an inference
@@ -94,11 +86,14 @@ class LLM_Command_Cohere(LLM_Service):
                 function name - function to call
                 return_results_only - we set to True because we already use Claude format
                 kwargs - arguments to the tool that will be called
+        session: CallSession that receives the state of the call
         :return: Inference response from the model.
         """
+        if session is None:
+            session = CallSession()
         # Messages that had to be added because of function use
-        self.tool_use_added_msgs = []
-        self.tool_results = []
+        session.tool_use_added_msgs = []
+        tool_results = []
 
         # try:
         # The different model providers have individual request and response formats.
@@ -157,8 +152,11 @@ class LLM_Command_Cohere(LLM_Service):
             ), "When using tools, a tool invoker must be provided"
 
         for k in range(max_retries):
+            if not self.retry_policy.allow_request(self._retry_key()):
+                yield "The AI service is temporarily unavailable."
+                break
             try:
-                self.debug_body = body
+                session.debug_body = body
                 llm_body_changed = True
                 while llm_body_changed:
                     llm_body_changed = False
@@ -171,38 +169,42 @@ class LLM_Command_Cohere(LLM_Service):
                     print(f"Invoking {self.llm_description}. Word count: {word_count}")
 
                     # stream responses
-                    partial_ans = self._response_gen(response["body"], postpend)
+                    prompt = [body["message"], body["chat_history"]]
+                    session.last_usage = None
+                    partial_ans = self._response_gen(
+                        response["body"], postpend, session=session
+                    )
                     x = ""
                     for x in partial_ans:
                         yield x
                     cur_ans = x
 
-                    if self.cur_tool_spec is not None:
+                    if session.cur_tool_spec is not None:
                         # tool use has been required. Let's do it
                         # TODO: update upstream to reflect the inclusion of a response
                         # TODO: probably rework gradio UI to re-instantiate things every chat, or keep an instance per chat ID
                         tool_ans = tool_invoker_fn(
-                            self.cur_tool_spec["tool_name"],
+                            session.cur_tool_spec["tool_name"],
                             return_results_only=True,
-                            **self.cur_tool_spec["input"],
+                            **session.cur_tool_spec["input"],
                         )
                         if isinstance(tool_ans, types.GeneratorType):
                             for partial_ans in tool_ans:
                                 yield partial_ans
                             tool_ans = partial_ans
 
-                        print(self.cur_tool_spec)
+                        print(session.cur_tool_spec)
                         last_call = {
-                            "name": self.cur_tool_spec["tool_name"],
-                            "parameters": self.cur_tool_spec["input"],
-                            # "generation_id": self.cur_tool_spec["generation_id"],
+                            "name": session.cur_tool_spec["tool_name"],
+                            "parameters": session.cur_tool_spec["input"],
+                            # "generation_id": session.cur_tool_spec["generation_id"],
                         }
-                        self.tool_results.append(
+                        tool_results.append(
                             {
                                 "call": last_call,
                                 "outputs": [
                                     {
-                                        self.cur_tool_spec["tool_name"]
+                                        session.cur_tool_spec["tool_name"]
                                         + "_output": tool_ans
                                     }
                                 ],
@@ -217,7 +219,7 @@ class LLM_Command_Cohere(LLM_Service):
                                     "type": "text",
                                     "text": cur_ans,
                                 },
-                                self.cur_tool_spec,
+                                session.cur_tool_spec,
                             ],
                         }
 
@@ -226,47 +228,44 @@ class LLM_Command_Cohere(LLM_Service):
                             "content": [
                                 {
                                     "type": "tool_result",
-                                    # "generation_id": self.cur_tool_spec["generation_id"],
+                                    # "generation_id": session.cur_tool_spec["generation_id"],
                                     "content": tool_ans,
                                 }
                             ],
                         }
                         # body["chat_history"].append(assistant_msg)
                         # body["chat_history"].append(next_user_msg)
-                        body["tool_results"] = self.tool_results
-                        body["chat_history"] = self.cur_tool_spec["chat_history"]
+                        body["tool_results"] = tool_results
+                        body["chat_history"] = session.cur_tool_spec["chat_history"]
                         body["message"] = ""
 
                         # keep a log of messages that had to be appended due to tool use
-                        self.tool_use_added_msgs.append(assistant_msg)
-                        self.tool_use_added_msgs.append(next_user_msg)
+                        session.tool_use_added_msgs.append(assistant_msg)
+                        session.tool_use_added_msgs.append(next_user_msg)
                         llm_body_changed = True
 
-                    # TODO: Include proper token count and pricing
-                    ans_word_count = len(
-                        re.findall(r"\w+", postpend + cur_ans + str(self.stop_reason))
-                    )
-                    self.word_counts.append(
-                        {
-                            "request_word_count": word_count,
-                            "answer_word_count": ans_word_count,
-                            "price_estimate": 0.001
-                            * (0.003 * word_count + 0.015 * ans_word_count),
-                            "exec_time_in_s": time.time() - t0,
-                        }
-                    )
+                    self._add_usage(session.last_usage, t0, prompt, postpend + cur_ans)
+                self.retry_policy.record_success(self._retry_key())
                 return
             except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
+                retry_delay = self.retry_policy.on_failure(
+                    self._retry_key(), e, k, max_retries, cur_fail_sleep
+                )
+                if retry_delay is None:
+                    yield f"Error {str(e)}."
+                    break
+                yield f"Error {str(e)}. Waiting {int(retry_delay)} s. Retrying {k+1}/{max_retries}..."
+                time.sleep(retry_delay)
         yield "Could not invoke the AI model."
 
-    def _response_gen(self, response_body, postpend=""):
+    def _response_gen(self, response_body, postpend="", session=None):
         cur_ans = ""
         cur_tool_spec = None
+        usage = None
         for x in response_body:
             out_dict = json.loads(x["chunk"]["bytes"])
+            # Bedrock adds the token counts to the last chunk
+            usage = bedrock_invocation_usage(out_dict) or usage
             txt = ""
             if "event_type" in out_dict.keys():
                 # if out_dict["event_type"] == "text-generation":
@@ -293,5 +292,7 @@ class LLM_Command_Cohere(LLM_Service):
 
         yield postpend + cur_ans
         # TODO: Make tool call work
-        self.cur_tool_spec = cur_tool_spec
-        self.stop_reason = stop_reason
+        if session is not None:
+            session.cur_tool_spec = cur_tool_spec
+            session.stop_reason = stop_reason
+            session.last_usage = usage
@@ -1,35 +1,23 @@
 # https://docs.aws.amazon.com/nova/latest/userguide/complete-request-schema.html
 # https://docs.aws.amazon.com/nova/latest/userguide/tool-use-results.html
-import re
 import json
-import time
-import types
+import asyncio
 
-from .base_service import LLM_Service
+from .base_service import LLM_Service, _aiter_in_thread
+from .stream_events import TextDelta, ToolCallDelta
+from .usage import NOVA_USAGE_FIELDS, UsageLog, update_usage
 
 
 class LLM_Nova_Bedrock(LLM_Service):
+    supports_stream_deltas = True
+
     def __init__(self, bedrock_client, model_size):
         """Constructor
         Arguments:
             bedrock_client - Instance of boto3.client(service_name='bedrock-runtime')
                 to use when making calls to bedrock models
         """
-        if model_size == "Nova_Micro":
-            self.model_id = "us.amazon.nova-micro-v1:0"
-            self.llm_description = "Amazon Nova Micro v1.0 from AWS Bedrock (Tiny LLM)"
-            self.price_per_M_input_tokens = 0.035
-            self.price_per_M_output_tokens = 0.14
-        elif model_size == "Nova_Lite":
-            self.model_id = "us.amazon.nova-lite-v1:0"
-            self.llm_description = "Amazon Nova Lite v1.0 from AWS Bedrock (Small LLM)"
-            self.price_per_M_input_tokens = 0.06
-            self.price_per_M_output_tokens = 0.24
-        elif model_size == "Nova_Pro":
-            self.model_id = "us.amazon.nova-pro-v1:0"
-            self.llm_description = "Amazon Nova Pro v1.0 from AWS Bedrock (Large LLM)"
-            self.price_per_M_input_tokens = 0.8
-            self.price_per_M_output_tokens = 3.2
+        self._load_model_spec(model_size)
 
         self.bedrock_client = bedrock_client
         self.config = {
@@ -41,8 +29,10 @@ class LLM_Nova_Bedrock(LLM_Service):
                 "stopSequences": [],
             },
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -61,11 +51,12 @@ class LLM_Nova_Bedrock(LLM_Service):
                         adj_msg = {"text": msg["content"][k]["text"]}
                         msg["content"][k] = adj_msg
                     elif msg["content"][k].get("type") == "image":
+                        source = msg["content"][k]["source"]
                         adj_msg = {
                             "image": {
-                                "format": "jpeg",
+                                "format": source["media_type"].split("/")[-1],
                                 "source": {
-                                    "bytes": msg["content"][k]["source"]["data"],
+                                    "bytes": source["data"],
                                 },
                             }
                         }
@@ -83,6 +74,8 @@ class LLM_Nova_Bedrock(LLM_Service):
         tool_invoker_fn=None,
         max_retries=25,
         cur_fail_sleep=6,
+        stream_deltas=False,
+        session=None,
     ):
         """
         Invokes the Nova model to run an inference
@@ -97,22 +90,65 @@ class LLM_Nova_Bedrock(LLM_Service):
                 function name - function to call
                 return_results_only - we set to True because we already use Claude format
                 kwargs - arguments to the tool that will be called
+        stream_deltas: if True, yields the events in stream_events instead of the
+            cumulative answer
+        session: CallSession that receives the state of the call
         :return: Inference response from the model.
         """
-        # Messages that had to be added because of function use
-        self.tool_use_added_msgs = []
+        body = self._prepare_body(
+            prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+        )
+        yield from self._run_tool_loop(
+            session,
+            body,
+            postpend,
+            tool_invoker_fn,
+            max_retries,
+            cur_fail_sleep,
+            stream_deltas=stream_deltas,
+        )
 
-        # try:
-        # The different model providers have individual request and response formats.
-        # For the format, ranges, and default values for Meta Llama 2 Chat, refer to:
-        # https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-meta.html
+    async def ainvoke_streaming(
+        self,
+        prompt,
+        b64image=None,
+        postpend="",
+        extra_stop_sequences=[],
+        tools=None,
+        tool_invoker_fn=None,
+        max_retries=25,
+        cur_fail_sleep=6,
+        stream_deltas=False,
+        session=None,
+    ):
+        """Async counterpart of invoke_streaming. Yields the same chunks.
+        boto3 has no async client, so the request and each chunk read run in worker threads
+        """
+        body = self._prepare_body(
+            prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+        )
+        async for x in self._arun_tool_loop(
+            session,
+            body,
+            postpend,
+            tool_invoker_fn,
+            max_retries,
+            cur_fail_sleep,
+            stream_deltas=stream_deltas,
+        ):
+            yield x
 
-        # start time
-        t0 = time.time()
+    def _prepare_body(
+        self, prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+    ):
+        """Builds the request body sent to Bedrock"""
         body = self.config.copy()
-        body["inferenceConfig"]["stopSequences"] = (
-            body["inferenceConfig"]["stopSequences"] + extra_stop_sequences
-        )
+        # the config is shared by the calls of the LLM: nested values are not changed
+        body["inferenceConfig"] = {
+            **self.config["inferenceConfig"],
+            "stopSequences": self.config["inferenceConfig"]["stopSequences"]
+            + extra_stop_sequences,
+        }
 
         body["messages"] = prompt["messages"].copy()
 
@@ -132,136 +168,122 @@ class LLM_Nova_Bedrock(LLM_Service):
             assert (
                 tool_invoker_fn is not None
             ), "When using tools, a tool invoker must be provided"
+        return body
 
-        for k in range(max_retries):
-            try:
-                llm_body_changed = True
-                while llm_body_changed:
-                    llm_body_changed = False
-                    response = self.bedrock_client.invoke_model_with_response_stream(
-                        modelId=self.model_id, body=json.dumps(body)
-                    )
-                    word_count = len(re.findall(r"\w+", str(body["messages"])))
-                    print(f"Invoking {self.llm_description}. Word count: {word_count}")
+    def _invoke_model(self, body):
+        response = self.bedrock_client.invoke_model_with_response_stream(
+            modelId=self.model_id, body=json.dumps(body)
+        )
+        return response["body"]
 
-                    # stream responses
-                    # return response
-                    partial_ans = self._response_gen(response["body"], postpend)
-                    for x in partial_ans:
-                        yield x
-                    cur_ans = x
+    async def _ainvoke_model(self, body):
+        response = await asyncio.to_thread(
+            self.bedrock_client.invoke_model_with_response_stream,
+            modelId=self.model_id,
+            body=json.dumps(body),
+        )
+        return _aiter_in_thread(response["body"])
 
-                    if self.cur_tool_spec is not None:
-                        # tool use has been required. Let's do it
-                        # TODO: update upstream to reflect the inclusion of a response
-                        # TODO: probably rework gradio UI to re-instantiate things every chat, or keep an instance per chat ID
-                        tool_ans = tool_invoker_fn(
-                            self.cur_tool_spec["toolUse"]["name"],
-                            return_results_only=True,
-                            **self.cur_tool_spec["toolUse"]["input"],
-                        )
-                        if isinstance(tool_ans, types.GeneratorType):
-                            for partial_ans in tool_ans:
-                                yield partial_ans
-                            tool_ans = partial_ans
+    def _get_tool_calls(self, session):
+        # tool use has been required. Let's do it
+        return [
+            (
+                cur_tool_spec["toolUse"]["name"],
+                cur_tool_spec["toolUse"]["input"],
+            )
+            for cur_tool_spec in session.cur_tool_specs
+        ]
 
-                        # append assistant responses
-                        assistant_msg = {
-                            "role": "assistant",
-                            "content": [
-                                {
-                                    "text": cur_ans,
-                                },
-                            ],
-                        }
-                        assistant_msg2 = {
-                            "role": "assistant",
-                            "content": [
-                                {
-                                    "toolUse": self.cur_tool_spec["toolUse"],
-                                },
-                            ],
-                        }
+    def _append_tool_turn(self, session, body, cur_ans, tool_answers):
+        # append assistant responses
+        assistant_msg = {
+            "role": "assistant",
+            "content": [
+                {
+                    "text": cur_ans,
+                },
+            ],
+        }
+        assistant_msg2 = {
+            "role": "assistant",
+            "content": [
+                {
+                    "toolUse": cur_tool_spec["toolUse"],
+                }
+                for cur_tool_spec in session.cur_tool_specs
+            ],
+        }
 
-                        next_user_msg = {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "toolResult": {
-                                        # "type": "tool_result",
-                                        "toolUseId": self.cur_tool_spec["toolUse"][
-                                            "toolUseId"
-                                        ],
-                                        "content": [{"text": tool_ans}],
-                                    }
-                                }
-                            ],
-                        }
+        next_user_msg = {
+            "role": "user",
+            "content": [
+                {
+                    "toolResult": {
+                        # "type": "tool_result",
+                        "toolUseId": cur_tool_spec["toolUse"]["toolUseId"],
+                        "content": [{"text": tool_ans}],
+                    }
+                }
+                for cur_tool_spec, tool_ans in zip(session.cur_tool_specs, tool_answers)
+            ],
+        }
 
-                        body["messages"].append(assistant_msg)
-                        body["messages"].append(assistant_msg2)
-                        body["messages"].append(next_user_msg)
+        body["messages"].append(assistant_msg)
+        body["messages"].append(assistant_msg2)
+        body["messages"].append(next_user_msg)
 
-                        # keep a log of messages that had to be appended due to tool use
-                        self.tool_use_added_msgs.append(assistant_msg)
-                        self.tool_use_added_msgs.append(assistant_msg2)
-                        self.tool_use_added_msgs.append(next_user_msg)
-                        llm_body_changed = True
+        # keep a log of messages that had to be appended due to tool use
+        session.tool_use_added_msgs.append(assistant_msg)
+        session.tool_use_added_msgs.append(assistant_msg2)
+        session.tool_use_added_msgs.append(next_user_msg)
 
-                    # TODO: Include proper token count and pricing
-                    ans_word_count = len(
-                        re.findall(r"\w+", postpend + cur_ans + str(self.stop_reason))
-                    )
-                    self.word_counts.append(
-                        {
-                            "request_word_count": word_count,
-                            "answer_word_count": ans_word_count,
-                            "price_estimate": 0.001
-                            * (0.003 * word_count + 0.015 * ans_word_count),
-                            "exec_time_in_s": time.time() - t0,
-                        }
-                    )
-                    # """
-                return
-            except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
-        yield "Could not invoke the AI model."
+    def _process_stream_chunk(self, state, x):
+        out_dict = json.loads(x["chunk"]["bytes"])
+        txt = ""
+        if "contentBlockDelta" in out_dict.keys():
+            if (
+                out_dict["contentBlockDelta"]["delta"].get("text")
+                and state["cur_tool_spec"] is None
+            ):
+                txt = out_dict["contentBlockDelta"]["delta"]["text"]
+            elif out_dict["contentBlockDelta"]["delta"].get("toolUse"):
+                tool_use = state["cur_tool_spec"]["toolUse"]
+                tool_use["input"] = out_dict["contentBlockDelta"]["delta"]["toolUse"][
+                    "input"
+                ]
+                yield ToolCallDelta(
+                    tool_use["toolUseId"], tool_use["name"], tool_use["input"]
+                )
 
-    def _response_gen(self, response_body, postpend=""):
-        cur_ans = ""
-        cur_tool_spec = None
-        for x in response_body:
-            out_dict = json.loads(x["chunk"]["bytes"])
-            txt = ""
-            if "contentBlockDelta" in out_dict.keys():
-                if (
-                    out_dict["contentBlockDelta"]["delta"].get("text")
-                    and cur_tool_spec is None
-                ):
-                    txt = out_dict["contentBlockDelta"]["delta"]["text"]
-                elif out_dict["contentBlockDelta"]["delta"].get("toolUse"):
-                    cur_tool_spec["toolUse"]["input"] = out_dict["contentBlockDelta"][
-                        "delta"
-                    ]["toolUse"]["input"]
+        if "contentBlockStart" in out_dict.keys():
+            if out_dict["contentBlockStart"]["start"].get("toolUse"):
+                state["cur_tool_spec"] = out_dict["contentBlockStart"]["start"].copy()
+                state["cur_tool_specs"].append(state["cur_tool_spec"])
+                tool_use = state["cur_tool_spec"]["toolUse"]
+                yield ToolCallDelta(tool_use["toolUseId"], tool_use["name"])
 
-            if "contentBlockStart" in out_dict.keys():
-                if out_dict["contentBlockStart"]["start"].get("toolUse"):
-                    cur_tool_spec = out_dict["contentBlockStart"]["start"].copy()
+        if state["cur_tool_spec"] is None and txt != "":
+            yield TextDelta(txt)
 
-            if cur_tool_spec is None:
-                cur_ans += txt
-                yield postpend + cur_ans
+        # the tool input is complete: parse it so the tool can start right away
+        if "contentBlockStop" in out_dict.keys() and state["cur_tool_spec"] is not None:
+            tool_use = state["cur_tool_spec"]["toolUse"]
+            if isinstance(tool_use["input"], str):
+                tool_use["input"] = json.loads(tool_use["input"])
+                state["ready_tool_calls"].append((tool_use["name"], tool_use["input"]))
 
-            stop_reason = None
-            if out_dict.get("messageStop"):
-                stop_reason = out_dict["messageStop"].get("stopReason", None)
-            if stop_reason is not None:
-                break
-        if cur_tool_spec is not None:
-            cur_tool_spec["toolUse"]["input"] = json.loads(
-                cur_tool_spec["toolUse"]["input"]
+        if out_dict.get("messageStop"):
+            state["stop_reason"] = out_dict["messageStop"].get("stopReason", None)
+
+        # sent after messageStop, so the stream is read until the end
+        if out_dict.get("metadata"):
+            state["usage"] = update_usage(
+                state["usage"], out_dict["metadata"].get("usage", {}), NOVA_USAGE_FIELDS
             )
-        self.cur_tool_spec = cur_tool_spec
-        self.stop_reason = stop_reason
+
+    def _finish_stream(self, state):
+        for cur_tool_spec in state["cur_tool_specs"]:
+            if isinstance(cur_tool_spec["toolUse"]["input"], str):
+                cur_tool_spec["toolUse"]["input"] = json.loads(
+                    cur_tool_spec["toolUse"]["input"]
+                )
@@ -1,7 +1,8 @@
 import os
 
-from openai import OpenAI
+from .client_registry import CLIENT_REGISTRY
 from .openai import LLM_GPT_OpenAI
+from .usage import UsageLog
 
 
 class LLM_Bedrock_OpenAI(LLM_GPT_OpenAI):
@@ -11,21 +12,10 @@ class LLM_Bedrock_OpenAI(LLM_GPT_OpenAI):
             model_size - Bedrock model to use to make LLM calls
         """
 
-        if model_size == "GPT OSS 20b Bedrock":
-            self.model_id = "openai.gpt-oss-20b-1:0"
-            self.llm_description = (
-                "GPT OSS 20b (small-sized LLM) - directly from Bedrock using OpenAI API"
-            )
-            self.price_per_M_input_tokens = 0.07
-            self.price_per_M_output_tokens = 0.3
-        if model_size == "GPT OSS 120b Bedrock":
-            self.model_id = "openai.gpt-oss-120b-1:0"
-            self.llm_description = "GPT OSS 120b (medium-sized LLM) - directly from Bedrock using OpenAI API"
-            self.price_per_M_input_tokens = 0.15
-            self.price_per_M_output_tokens = 0.6
+        self._load_model_spec(model_size)
 
         try:
-            self.openai_client = OpenAI(
+            self.openai_client = CLIENT_REGISTRY.openai_client(
                 api_key=os.environ.get("AWS_BEDROCK_API_KEY"),
                 base_url="https://bedrock-runtime.us-west-2.amazonaws.com/openai/v1",
             )
@@ -43,5 +33,7 @@ class LLM_Bedrock_OpenAI(LLM_GPT_OpenAI):
             "stop": None,  # the regular is already implemented
             "model": self.model_id,
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
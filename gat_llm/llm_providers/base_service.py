@@ -1,14 +1,183 @@
 """ Set of available and useful LLMs (mostly posted on AWS Bedrock)
 """
+import json
+import time
+import queue
+import types
+import asyncio
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .stream_events import CumulativeAnswer, StatusMessage, StreamStop, ToolResult
+from .usage import new_usage
+from .call_session import CallSession
+from .retry_policy import DEFAULT_RETRY_POLICY
+from .model_catalog import provider_spec
+from .image_store import IMAGE_STORE, is_image_ref
+from .context_manager import ContextManager, estimate_tokens
+from .response_cache import (
+    CachedResponse,
+    RecordingResponse,
+    ReplayedChunk,
+    cache_key,
+)
+
+
+async def _aiter_in_thread(iterable):
+    """Iterates a blocking iterable from async code.
+    Each `next` call runs in a worker thread so the event loop is never blocked
+    """
+    iterator = iter(iterable)
+    sentinel = object()
+    while True:
+        x = await asyncio.to_thread(next, iterator, sentinel)
+        if x is sentinel:
+            break
+        yield x
+
+
+class ToolJournal:
+    def __init__(self):
+        """Results of the tools run while answering one user message.
+
+        If a model or tool step fails, the retry starts from the conversation as it was
+        after the last tool turn. The model will usually request the same calls again:
+        results that were computed but not added to the conversation yet are reused,
+        so expensive tools don't run twice
+        """
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(tool_name, tool_input):
+        # tool call ids change when the model answers again: use the name and the arguments
+        return json.dumps([tool_name, tool_input], sort_keys=True, default=str)
+
+    def get(self, tool_name, tool_input):
+        """Returns (found, tool answer)"""
+        key = self.key(tool_name, tool_input)
+        with self.lock:
+            if key in self.pending:
+                return True, self.pending[key]
+        return False, None
+
+    def record(self, tool_name, tool_input, tool_ans):
+        with self.lock:
+            self.pending[self.key(tool_name, tool_input)] = tool_ans
+
+    def commit(self, tool_calls):
+        """The results of tool_calls are now in the conversation and won't be reused"""
+        with self.lock:
+            for tool_name, tool_input in tool_calls:
+                self.pending.pop(self.key(tool_name, tool_input), None)
+
+
+class ToolCallRunner:
+    def __init__(self, tool_invoker_fn, max_parallel_tools, journal=None):
+        """Runs the tool calls of one model answer in worker threads.
+        Calls can be submitted while the answer is still streaming
+
+        Arguments:
+            tool_invoker_fn: function that invokes the tools
+            max_parallel_tools: maximum number of tools running at the same time
+            journal: ToolJournal with the results of previous attempts, if any
+        """
+        self.tool_invoker_fn = tool_invoker_fn
+        self.journal = journal
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_parallel_tools))
+        # partial results are passed from the worker threads through this queue
+        self.outputs = queue.Queue()
+        self.futures = []
+        self.n_finished = 0
+
+    def submit(self, tool_name, tool_input):
+        if self.journal is not None:
+            found, tool_ans = self.journal.get(tool_name, tool_input)
+            if found:
+                print(f"Reusing the result of {tool_name} from a previous attempt")
+                future = Future()
+                future.set_result(tool_ans)
+                self.futures.append(future)
+                self.outputs.put((tool_name, None, True))
+                return
+        self.futures.append(self.executor.submit(self._run_tool, tool_name, tool_input))
+
+    def submit_remaining(self, tool_calls):
+        """Submits the calls of the answer that were not dispatched early.
+        Early calls are always the first ones, in the same order
+        """
+        for tool_name, tool_input in tool_calls[len(self.futures) :]:
+            self.submit(tool_name, tool_input)
+
+    def partial_results(self):
+        """Yields (tool name, partial answer) of generator tools until all calls finish"""
+        while self.n_finished < len(self.futures):
+            tool_name, partial_ans, finished = self.outputs.get()
+            if finished:
+                self.n_finished += 1
+            else:
+                yield tool_name, partial_ans
+
+    def answers(self):
+        """Tool answers in the order of the calls. Raises the tool errors, if any"""
+        return [future.result() for future in self.futures]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run_tool(self, tool_name, tool_input):
+        try:
+            tool_ans = self.tool_invoker_fn(
+                tool_name,
+                return_results_only=True,
+                **tool_input,
+            )
+            if isinstance(tool_ans, types.GeneratorType):
+                partial_ans = ""
+                for partial_ans in tool_ans:
+                    self.outputs.put((tool_name, partial_ans, False))
+                tool_ans = partial_ans
+            if self.journal is not None:
+                self.journal.record(tool_name, tool_input, tool_ans)
+            return tool_ans
+        finally:
+            self.outputs.put((tool_name, None, True))
 
 
 class LLM_Service:
+    # providers that implement the stream hooks can yield typed delta events
+    supports_stream_deltas = False
+    # how many tool calls of the same model turn can run at the same time
+    max_parallel_tools = 4
+    # session of the last call, for interactive use. Concurrent callers pass their own
+    last_session = None
+    # backoff and circuit breaking of failed calls, see retry_policy.py
+    retry_policy = DEFAULT_RETRY_POLICY
+    # optional ResponseCache that replays identical model calls, see response_cache.py
+    response_cache = None
+    # fits the history in the context window, see context_manager.py.
+    # None to drop the oldest turns when needed
+    context_manager = None
+
     def __str__(self):
         return self.llm_description
 
     def __repr__(self):
         return self.llm_description
 
+    def _load_model_spec(self, model_size=None):
+        """Sets the model id, description, prices and capabilities from model_catalog.py
+        model_size: key of the model in this provider. None for providers with a single model
+        """
+        self.model_spec = provider_spec(type(self), model_size)
+        self.model_id = self.model_spec["model_id"]
+        self.llm_description = self.model_spec["llm_description"]
+        self.price_per_M_input_tokens = self.model_spec["price_per_M_input_tokens"]
+        self.price_per_M_output_tokens = self.model_spec["price_per_M_output_tokens"]
+        self.context_window = self.model_spec["context_window"]
+        self.max_image_edge = self.model_spec["max_image_edge"]
+
     def __call__(
         self,
         msg,
@@ -21,42 +190,586 @@ class LLM_Service:
         tool_invoker_fn=None,
         max_retries=3,
         cur_fail_sleep=60,
+        stream_deltas=False,
+        session=None,
     ):
         """Calls the LLM in streaming mode
         Arguments:
         system_prompt: prompt that should persist across questions, using specialist attention
         msg: next user message
+        b64images: images of the message, as base64 jpeg strings or IMAGE_STORE references
         chat_history: list of lists. Each inner element should contain [<user msg>, <assistant msg>]
+        stream_deltas: if True, yields typed incremental events (see stream_events)
+            instead of the whole answer generated so far
+        session: CallSession that receives the state of this call, e.g. the messages added
+            by tool use. Needed to read that state when the LLM is shared by concurrent calls
+        """
+        session = self._new_session(session)
+        prompt = self._prepare_invocation(
+            session,
+            msg,
+            b64images,
+            system_prompt,
+            chat_history,
+            postpend,
+            extra_stop_sequences,
+            tools,
+        )
+        kwargs = {}
+        if tools is not None:
+            kwargs["tools"] = tools
+            kwargs["tool_invoker_fn"] = tool_invoker_fn
+        if stream_deltas:
+            assert (
+                self.supports_stream_deltas
+            ), f"Delta streaming is not supported by {self.llm_description}"
+            kwargs["stream_deltas"] = True
+        return self.invoke_streaming(
+            prompt,
+            postpend=postpend,
+            extra_stop_sequences=extra_stop_sequences,
+            max_retries=max_retries,
+            cur_fail_sleep=cur_fail_sleep,
+            session=session,
+            **kwargs,
+        )
+
+    def acall(
+        self,
+        msg,
+        b64images=None,
+        system_prompt="You are a helpful assistant. Do not use emojis in the answers.",
+        chat_history=[],
+        postpend="",
+        extra_stop_sequences=[],
+        tools=None,
+        tool_invoker_fn=None,
+        max_retries=3,
+        cur_fail_sleep=60,
+        stream_deltas=False,
+        session=None,
+    ):
+        """Calls the LLM in streaming mode from async code.
+        Same arguments as __call__. Returns an async generator that yields the same chunks
         """
+        session = self._new_session(session)
+        prompt = self._prepare_invocation(
+            session,
+            msg,
+            b64images,
+            system_prompt,
+            chat_history,
+            postpend,
+            extra_stop_sequences,
+            tools,
+        )
+        kwargs = {}
+        if tools is not None:
+            kwargs["tools"] = tools
+            kwargs["tool_invoker_fn"] = tool_invoker_fn
+        if stream_deltas:
+            assert (
+                self.supports_stream_deltas
+            ), f"Delta streaming is not supported by {self.llm_description}"
+            kwargs["stream_deltas"] = True
+        return self.ainvoke_streaming(
+            prompt,
+            postpend=postpend,
+            extra_stop_sequences=extra_stop_sequences,
+            max_retries=max_retries,
+            cur_fail_sleep=cur_fail_sleep,
+            session=session,
+            **kwargs,
+        )
+
+    def _new_session(self, session=None):
+        if session is None:
+            session = CallSession()
+        self.last_session = session
+        return session
+
+    def _prepare_invocation(
+        self,
+        session,
+        msg,
+        b64images,
+        system_prompt,
+        chat_history,
+        postpend,
+        extra_stop_sequences,
+        tools=None,
+    ):
+        """Builds the provider prompt from the chat history and the next user message"""
         assert isinstance(
             extra_stop_sequences, list
         ), "extra_stop_sequences should be a list of strings"
         call_list = self._prepare_call_list_from_history(
             system_prompt, msg, b64images, chat_history
         )
-        # keep last user message parsed, potentially with images
-        self.last_message = call_list[-1]
-
-        prompt = self._prepare_prompt_from_list(call_list)
-        self.last_prompt = str(prompt) + postpend
-        if tools is None:
-            return self.invoke_streaming(
-                prompt,
-                postpend=postpend,
-                extra_stop_sequences=extra_stop_sequences,
-                max_retries=max_retries,
-                cur_fail_sleep=cur_fail_sleep,
+        # keep last user message parsed, potentially with images (as references)
+        session.last_message = call_list[-1]
+        context_manager = self._get_context_manager()
+        if context_manager is not None:
+            call_list = context_manager.fit(
+                call_list, estimate_tokens(tools) if tools is not None else 0
             )
+
+        prompt = self._prepare_prompt_from_list(self._materialize_images(call_list))
+        session.last_prompt = str(prompt) + postpend
+        return prompt
+
+    def _get_context_manager(self):
+        if self.context_manager is None and hasattr(self, "context_window"):
+            self.context_manager = ContextManager(self.context_window)
+        return self.context_manager
+
+    def _check_context(self, body):
+        """Fails before sending a request larger than the context window"""
+        context_manager = self._get_context_manager()
+        if context_manager is not None:
+            context_manager.check(body)
+
+    def _image_ref(self, b64img):
+        """Reference to an image of the user message, stored in IMAGE_STORE"""
+        if is_image_ref(b64img):
+            return b64img
+        return IMAGE_STORE.put_b64(b64img)
+
+    def _image_block(self, b64img, media_type):
+        """Content block of an image in the request. This format is suited for Anthropic's Claude"""
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": media_type,
+                "data": b64img,
+            },
+        }
+
+    def _materialize_images(self, call_list):
+        """Returns call_list with the image references replaced by the images.
+        Only the messages with references are copied
+        """
+        ans = []
+        for x in call_list:
+            if isinstance(x, dict) and isinstance(x.get("content"), list):
+                if any(is_image_ref(y) for y in x["content"]):
+                    x = {
+                        **x,
+                        "content": [self._materialize_image(y) for y in x["content"]],
+                    }
+            ans.append(x)
+        return ans
+
+    def _materialize_image(self, x):
+        if not is_image_ref(x):
+            return x
+        try:
+            return self._image_block(IMAGE_STORE.get_b64(x), x["media_type"])
+        except FileNotFoundError:
+            print(f"Image {x['sha256']} is no longer in the image store")
+            return {"type": "text", "text": "[image no longer available]"}
+
+    async def ainvoke_streaming(self, prompt, **kwargs):
+        """Async counterpart of invoke_streaming.
+        Providers without a native async client run the blocking generator in a
+        worker thread, one chunk at a time.
+        """
+        async for x in _aiter_in_thread(self.invoke_streaming(prompt, **kwargs)):
+            yield x
+
+    def _run_tool_loop(
+        self,
+        session,
+        body,
+        postpend,
+        tool_invoker_fn,
+        max_retries,
+        cur_fail_sleep,
+        stream_deltas=False,
+    ):
+        """Streams the answer of the model, invoking tools and calling the model again
+        while it requests them. Used by providers that implement the stream hooks:
+            _invoke_model(body) - returns the raw response stream
+            _new_stream_state(), _process_stream_chunk(state, chunk), _finish_stream(state)
+                _process_stream_chunk yields the events defined in stream_events
+                when a tool call is complete, _process_stream_chunk can add (tool name, tool input)
+                to state["ready_tool_calls"] so that the tool starts before the stream ends
+            _get_tool_calls(session) - list of (tool name, tool input) requested in the last answer
+            _append_tool_turn(session, body, cur_ans, tool_answers) - adds tool calls and results
+                to body and session.tool_use_added_msgs, tool_answers being in the same order
+                as _get_tool_calls(session)
+        All the state of the call is kept in session (see call_session.py)
+        """
+        if session is None:
+            session = CallSession()
+        # Messages that had to be added because of function use
+        session.tool_use_added_msgs = []
+
+        # tool results of this user message, reused by the retries
+        tool_journal = ToolJournal()
+
+        # start time
+        t0 = time.time()
+        for k in range(max_retries):
+            if not self.retry_policy.allow_request(self._retry_key()):
+                yield self._status(
+                    "The AI service is temporarily unavailable.", stream_deltas
+                )
+                break
+            try:
+                session.debug_body = body
+                llm_body_changed = True
+                while llm_body_changed:
+                    llm_body_changed = False
+                    print(
+                        f"Invoking {self.llm_description}. Messages: {len(body['messages'])}"
+                    )
+                    self._check_context(body)
+                    # filled by the stream hooks if the provider reports usage
+                    session.last_usage = None
+                    response = self._invoke_model_cached(body, postpend)
+
+                    # tools requested in this answer start running as soon as
+                    # their call has been streamed completely
+                    tool_runner = self._start_tool_runner(
+                        session, tool_invoker_fn, tool_journal
+                    )
+                    try:
+                        # stream responses
+                        if stream_deltas:
+                            answer = CumulativeAnswer(postpend)
+                            for event in self._response_gen(
+                                response, postpend, stream_deltas=True, session=session
+                            ):
+                                answer.add(event)
+                                yield event
+                            cur_ans = answer.text()
+                        else:
+                            partial_ans = self._response_gen(
+                                response, postpend, session=session
+                            )
+                            x = ""
+                            for x in partial_ans:
+                                yield x
+                            cur_ans = x
+
+                        tool_answers = []
+                        if tool_runner is not None:
+                            tool_calls = self._get_tool_calls(session)
+                            tool_runner.submit_remaining(tool_calls)
+                            for tool_name, partial_ans in tool_runner.partial_results():
+                                yield self._tool_output(
+                                    tool_name, partial_ans, stream_deltas
+                                )
+                            tool_answers = tool_runner.answers()
+                    finally:
+                        self._stop_tool_runner(session, tool_runner)
+
+                    if len(tool_answers) > 0:
+                        self._append_tool_turn(session, body, cur_ans, tool_answers)
+                        tool_journal.commit(tool_calls)
+                        llm_body_changed = True
+
+                    self._log_usage(session, t0, body, cur_ans)
+                self.retry_policy.record_success(self._retry_key())
+                return
+            except Exception as e:
+                retry_delay = self.retry_policy.on_failure(
+                    self._retry_key(), e, k, max_retries, cur_fail_sleep
+                )
+                if retry_delay is None:
+                    yield self._status(f"Error {str(e)}.", stream_deltas)
+                    break
+                yield self._status(
+                    f"Error {str(e)}. Waiting {int(retry_delay)} s. Retrying {k+1}/{max_retries}...",
+                    stream_deltas,
+                )
+                time.sleep(retry_delay)
+        yield self._status("Could not invoke the AI model.", stream_deltas)
+
+    async def _arun_tool_loop(
+        self,
+        session,
+        body,
+        postpend,
+        tool_invoker_fn,
+        max_retries,
+        cur_fail_sleep,
+        stream_deltas=False,
+    ):
+        """Async counterpart of _run_tool_loop. Uses _ainvoke_model(body) to start the stream.
+        Tools are blocking, so they run in worker threads
+        """
+        if session is None:
+            session = CallSession()
+        # Messages that had to be added because of function use
+        session.tool_use_added_msgs = []
+
+        # tool results of this user message, reused by the retries
+        tool_journal = ToolJournal()
+
+        # start time
+        t0 = time.time()
+        for k in range(max_retries):
+            if not self.retry_policy.allow_request(self._retry_key()):
+                yield self._status(
+                    "The AI service is temporarily unavailable.", stream_deltas
+                )
+                break
+            try:
+                session.debug_body = body
+                llm_body_changed = True
+                while llm_body_changed:
+                    llm_body_changed = False
+                    print(
+                        f"Invoking {self.llm_description}. Messages: {len(body['messages'])}"
+                    )
+                    self._check_context(body)
+                    # filled by the stream hooks if the provider reports usage
+                    session.last_usage = None
+                    response = await self._ainvoke_model_cached(body, postpend)
+
+                    # tools requested in this answer start running as soon as
+                    # their call has been streamed completely
+                    tool_runner = self._start_tool_runner(
+                        session, tool_invoker_fn, tool_journal
+                    )
+                    try:
+                        # stream responses
+                        if stream_deltas:
+                            answer = CumulativeAnswer(postpend)
+                            async for event in self._aresponse_gen(
+                                response, postpend, stream_deltas=True, session=session
+                            ):
+                                answer.add(event)
+                                yield event
+                            cur_ans = answer.text()
+                        else:
+                            x = ""
+                            async for x in self._aresponse_gen(
+                                response, postpend, session=session
+                            ):
+                                yield x
+                            cur_ans = x
+
+                        tool_answers = []
+                        if tool_runner is not None:
+                            tool_calls = self._get_tool_calls(session)
+                            tool_runner.submit_remaining(tool_calls)
+                            async for tool_name, partial_ans in _aiter_in_thread(
+                                tool_runner.partial_results()
+                            ):
+                                yield self._tool_output(
+                                    tool_name, partial_ans, stream_deltas
+                                )
+                            tool_answers = tool_runner.answers()
+                    finally:
+                        self._stop_tool_runner(session, tool_runner)
+
+                    if len(tool_answers) > 0:
+                        self._append_tool_turn(session, body, cur_ans, tool_answers)
+                        tool_journal.commit(tool_calls)
+                        llm_body_changed = True
+
+                    self._log_usage(session, t0, body, cur_ans)
+                self.retry_policy.record_success(self._retry_key())
+                return
+            except Exception as e:
+                retry_delay = self.retry_policy.on_failure(
+                    self._retry_key(), e, k, max_retries, cur_fail_sleep
+                )
+                if retry_delay is None:
+                    yield self._status(f"Error {str(e)}.", stream_deltas)
+                    break
+                yield self._status(
+                    f"Error {str(e)}. Waiting {int(retry_delay)} s. Retrying {k+1}/{max_retries}...",
+                    stream_deltas,
+                )
+                await asyncio.sleep(retry_delay)
+        yield self._status("Could not invoke the AI model.", stream_deltas)
+
+    def _retry_key(self):
+        """Calls to the same provider share a circuit breaker"""
+        return type(self).__name__
+
+    def _response_cache_key(self, body, postpend):
+        """None if this call can't be served from the cache"""
+        if self.response_cache is None or body.get("stream") is False:
+            return None
+        return cache_key(
+            getattr(self, "model_id", self.llm_description), body, postpend
+        )
+
+    def _invoke_model_cached(self, body, postpend):
+        """_invoke_model, replaying the response from the cache when possible"""
+        key = self._response_cache_key(body, postpend)
+        if key is None:
+            return self._invoke_model(body)
+        entry = self.response_cache.get(key)
+        if entry is not None:
+            return CachedResponse(entry)
+        return RecordingResponse(self._invoke_model(body), self.response_cache, key)
+
+    async def _ainvoke_model_cached(self, body, postpend):
+        key = self._response_cache_key(body, postpend)
+        if key is None:
+            return await self._ainvoke_model(body)
+        entry = self.response_cache.get(key)
+        if entry is not None:
+            return CachedResponse(entry)
+        return RecordingResponse(
+            await self._ainvoke_model(body), self.response_cache, key
+        )
+
+    def _start_tool_runner(self, session, tool_invoker_fn, tool_journal=None):
+        """Creates the runner that receives the tool calls of the next answer.
+        Calls completed while the answer is still streaming are dispatched to it right away
+        """
+        if tool_invoker_fn is None:
+            session.tool_runner = None
         else:
-            return self.invoke_streaming(
-                prompt,
-                postpend=postpend,
-                extra_stop_sequences=extra_stop_sequences,
-                tools=tools,
-                tool_invoker_fn=tool_invoker_fn,
-                max_retries=max_retries,
-                cur_fail_sleep=cur_fail_sleep,
+            session.tool_runner = ToolCallRunner(
+                tool_invoker_fn, self.max_parallel_tools, tool_journal
             )
+        return session.tool_runner
+
+    def _stop_tool_runner(self, session, tool_runner):
+        if tool_runner is not None:
+            tool_runner.shutdown()
+        if session.tool_runner is tool_runner:
+            session.tool_runner = None
+
+    def _response_gen(
+        self, response_body, postpend="", stream_deltas=False, session=None
+    ):
+        """Yields the answer from a response stream, using the stream hooks.
+        Cumulative mode yields the whole answer generated so far; delta mode yields
+        the stream events, always ending with a StreamStop.
+        The tool calls, stop reason and usage of the answer are stored in session
+        """
+        state = self._new_stream_state(session)
+        if isinstance(response_body, RecordingResponse):
+            state["recorder"] = response_body
+        answer = CumulativeAnswer(postpend)
+        for x in response_body:
+            yield from self._chunk_outputs(state, x, answer, stream_deltas)
+            if state["finished"]:
+                break
+        self._end_stream(state, response_body)
+        if stream_deltas and not state["stop_sent"]:
+            yield StreamStop(state["stop_reason"])
+
+    async def _aresponse_gen(
+        self, response_body, postpend="", stream_deltas=False, session=None
+    ):
+        """Async counterpart of _response_gen"""
+        state = self._new_stream_state(session)
+        if isinstance(response_body, RecordingResponse):
+            state["recorder"] = response_body
+        answer = CumulativeAnswer(postpend)
+        async for x in response_body:
+            for partial_ans in self._chunk_outputs(state, x, answer, stream_deltas):
+                yield partial_ans
+            if state["finished"]:
+                break
+        self._end_stream(state, response_body)
+        if stream_deltas and not state["stop_sent"]:
+            yield StreamStop(state["stop_reason"])
+
+    def _end_stream(self, state, response_body):
+        if isinstance(response_body, CachedResponse):
+            state.update(response_body.final_state())
+            # no tokens were used
+            state["usage"] = new_usage()
+        elif isinstance(response_body, RecordingResponse):
+            response_body.save(state)
+        self._finish_stream(state)
+        session = state["session"]
+        session.cur_tool_specs = state["cur_tool_specs"]
+        session.cur_tool_spec = state["cur_tool_spec"]
+        session.stop_reason = state["stop_reason"]
+        session.last_usage = state["usage"]
+
+    def _chunk_outputs(self, state, x, answer, stream_deltas):
+        """Parses one chunk of the stream into the outputs of the selected mode"""
+        if isinstance(x, ReplayedChunk):
+            events = x.events
+        else:
+            events = list(self._process_stream_chunk(state, x))
+        if state["recorder"] is not None:
+            state["recorder"].add_chunk(events)
+        # early dispatch of the tool calls that have been fully streamed
+        tool_runner = state["session"].tool_runner
+        if tool_runner is not None:
+            for tool_name, tool_input in state["ready_tool_calls"]:
+                tool_runner.submit(tool_name, tool_input)
+        state["ready_tool_calls"] = []
+        if any(isinstance(event, StreamStop) for event in events):
+            state["stop_sent"] = True
+        if stream_deltas:
+            return events
+
+        # cumulative mode: only yield when the answer text changed
+        for event in events:
+            answer.add(event)
+        if any(event.kind in ["text", "reasoning", "stop"] for event in events):
+            return [answer.value()]
+        return []
+
+    def _tool_output(self, tool_name, partial_ans, stream_deltas):
+        return ToolResult(tool_name, partial_ans) if stream_deltas else partial_ans
+
+    def _status(self, msg, stream_deltas):
+        return StatusMessage(msg) if stream_deltas else msg
+
+    def _new_stream_state(self, session=None):
+        """State kept while parsing one response stream.
+        _finish_stream leaves the final tool calls and stop reason in it
+        """
+        return {
+            # receives the results of the stream
+            "session": session if session is not None else CallSession(),
+            "cur_tool_spec": None,
+            "cur_tool_specs": [],
+            # (tool name, tool input) of the calls that can already be executed
+            "ready_tool_calls": [],
+            # token counts, see usage.py. None if not reported by the provider
+            "usage": None,
+            "stop_reason": None,
+            "finished": False,
+            "stop_sent": False,
+            # RecordingResponse that stores the stream in the response cache, if any
+            "recorder": None,
+        }
+
+    def _log_usage(self, session, t0, body, answer):
+        """Records the token usage of the last model call in self.usage_log"""
+        prompt = [
+            body.get("system", ""),
+            body.get("messages", []),
+            body.get("tools", []),
+        ]
+        self._add_usage(session.last_usage, t0, prompt, answer)
+
+    def _add_usage(self, usage, t0, prompt, answer):
+        """Adds the usage of a model call to self.usage_log.
+
+        Arguments:
+            usage: usage reported by the provider. If None, it is estimated from
+                the characters of prompt and answer and the record is marked as not reported
+            t0: start time of the call
+            prompt: text or messages sent to the model. Images count as IMAGE_TOKENS
+            answer: text of the answer
+        """
+        if usage is None:
+            usage = {
+                "input_tokens": estimate_tokens(prompt),
+                "output_tokens": estimate_tokens(answer),
+            }
+            self.usage_log.add(usage, time.time() - t0, reported=False)
+        else:
+            self.usage_log.add(usage, time.time() - t0)
 
     def _prepare_call_list_from_history(
         self,
@@ -79,7 +792,9 @@ class LLM_Service:
                     history_list[0],
                     {
                         "role": "user",
-                        "content": str(x),
+                        "content": x["content"]
+                        if isinstance(x, dict) and isinstance(x.get("content"), str)
+                        else str(x),
                     },
                 ]
             elif isinstance(x, dict):
@@ -93,19 +808,11 @@ class LLM_Service:
         else:
             if not isinstance(b64images, list):
                 b64images = [b64images]
+            # the images are kept in the history as references
             cur_content = []
             for b64img in b64images:
                 if b64img is not None:
-                    cur_content.append(
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": b64img,
-                            },
-                        },
-                    )
+                    cur_content.append(self._image_ref(b64img))
             cur_content.append({"type": "text", "text": msg})
             history_list.append({"role": "user", "content": cur_content})
         return history_list
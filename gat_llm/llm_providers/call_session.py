@@ -0,0 +1,28 @@
+""" State of one call to an LLM, kept apart from the provider instance
+
+A provider instance (and its HTTP client) can then serve many calls at the same time.
+"""
+
+
+class CallSession:
+    def __init__(self):
+        """Per-call state, filled by the provider while the answer is streamed.
+        Pass one to __call__/acall (session=...) to read it once the stream ends
+        """
+        # last user message parsed, potentially with images
+        self.last_message = None
+        # prompt sent to the model, for debugging
+        self.last_prompt = None
+        # last request body sent to the model, for debugging
+        self.debug_body = None
+        # messages that had to be added because of function use.
+        # None for models that are not called with messages (history kept as [msg, answer] pairs)
+        self.tool_use_added_msgs = None
+        # tool calls requested in the last answer of the model
+        self.cur_tool_spec = None
+        self.cur_tool_specs = []
+        self.stop_reason = None
+        # token usage of the last model call, see usage.py
+        self.last_usage = None
+        # receives the tool calls of the answer being streamed
+        self.tool_runner = None
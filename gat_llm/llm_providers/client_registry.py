@@ -0,0 +1,232 @@
+""" Process-wide registry of SDK clients and LLM instances
+
+Creating a client per message means new TLS handshakes and credential resolution
+on every turn. The registry creates each client once, with a tuned connection pool
+and keep-alive, and hands out the same client (and the same LLM instances) afterwards.
+
+The connections of async clients belong to the event loop that opened them, so async
+clients are shared by the calls running in the same loop, and dropped once it closes.
+"""
+import asyncio
+import hashlib
+import threading
+
+
+def _import_httpx():
+    """httpx is imported with the first client, not with the registry"""
+    try:
+        import httpx
+    except ImportError:
+        # the SDKs still pool connections, with their default limits
+        httpx = None
+    return httpx
+
+
+def _key_hash(api_key):
+    """Identifies an API key in the keys and stats of the clients, without storing it"""
+    if api_key is None:
+        return None
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class ClientRegistry:
+    def __init__(self, max_pool_connections=50, keepalive_expiry=120):
+        """Memoises SDK clients and LLM instances.
+
+        Arguments:
+            max_pool_connections: maximum connections kept by each client
+            keepalive_expiry: seconds an idle connection is kept open (OpenAI-compatible
+                and Anthropic clients)
+        """
+        self.max_pool_connections = max_pool_connections
+        self.keepalive_expiry = keepalive_expiry
+        # key -> client
+        self.clients = {}
+        # event loop -> {key -> async client}
+        self.async_clients = {}
+        # key -> {"kind", "handed_out", "requests"}
+        self.client_stats = {}
+        # (llm name, bedrock client) -> LLM_Service
+        self.llms = {}
+        self.llm_stats = {"hits": 0, "misses": 0}
+        self.lock = threading.RLock()
+
+    def bedrock_client(
+        self, region_name="us-west-2", connect_timeout=9000, read_timeout=9000
+    ):
+        """boto3 bedrock-runtime client, shared by all the Bedrock LLMs of a region"""
+        key = ("bedrock-runtime", region_name, connect_timeout, read_timeout)
+
+        def create():
+            import boto3
+            import botocore
+
+            config = botocore.client.Config(
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                region_name=region_name,
+                max_pool_connections=self.max_pool_connections,
+                tcp_keepalive=True,
+            )
+            client = boto3.client(service_name="bedrock-runtime", config=config)
+            client.meta.events.register(
+                "before-send.bedrock-runtime", lambda **kwargs: self._count_request(key)
+            )
+            return client
+
+        return self._get_client(key, "bedrock", create)
+
+    def openai_client(self, base_url=None, api_key=None):
+        """OpenAI client. Also used for the OpenAI-compatible APIs (Ollama, vLLM, Grok, etc)"""
+        key = ("openai", base_url, _key_hash(api_key))
+
+        def create():
+            from openai import OpenAI, DefaultHttpxClient
+
+            kwargs = {}
+            if base_url is not None:
+                kwargs["base_url"] = base_url
+            if api_key is not None:
+                kwargs["api_key"] = api_key
+            if _import_httpx() is not None:
+                kwargs["http_client"] = DefaultHttpxClient(**self._httpx_kwargs(key))
+            return OpenAI(**kwargs)
+
+        return self._get_client(key, "openai", create)
+
+    def async_openai_client(self, base_url=None, api_key=None):
+        """AsyncOpenAI client of the running event loop"""
+        key = ("openai-async", base_url, _key_hash(api_key))
+
+        def create():
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+            kwargs = {}
+            if base_url is not None:
+                kwargs["base_url"] = base_url
+            if api_key is not None:
+                kwargs["api_key"] = api_key
+            if _import_httpx() is not None:
+                kwargs["http_client"] = DefaultAsyncHttpxClient(
+                    **self._httpx_kwargs(key, use_async=True)
+                )
+            return AsyncOpenAI(**kwargs)
+
+        return self._get_async_client(key, "openai", create)
+
+    def anthropic_client(self):
+        key = ("anthropic",)
+
+        def create():
+            import anthropic
+
+            kwargs = {}
+            if _import_httpx() is not None:
+                kwargs["http_client"] = anthropic.DefaultHttpxClient(
+                    **self._httpx_kwargs(key)
+                )
+            return anthropic.Anthropic(**kwargs)
+
+        return self._get_client(key, "anthropic", create)
+
+    def async_anthropic_client(self):
+        """AsyncAnthropic client of the running event loop"""
+        key = ("anthropic-async",)
+
+        def create():
+            import anthropic
+
+            kwargs = {}
+            if _import_httpx() is not None:
+                kwargs["http_client"] = anthropic.DefaultAsyncHttpxClient(
+                    **self._httpx_kwargs(key, use_async=True)
+                )
+            return anthropic.AsyncAnthropic(**kwargs)
+
+        return self._get_async_client(key, "anthropic", create)
+
+    def get_llm(self, llm, bedrock_client, create_fn):
+        """Returns the LLM instance for (llm, bedrock_client), created with create_fn if needed.
+        LLM instances keep no per-call state, so one can serve concurrent chats
+        """
+        key = (llm, bedrock_client)
+        with self.lock:
+            if key in self.llms:
+                self.llm_stats["hits"] += 1
+                return self.llms[key]
+            self.llm_stats["misses"] += 1
+            self.llms[key] = create_fn()
+            return self.llms[key]
+
+    def stats(self):
+        """Pool sizes, how many times each client was handed out and how many requests it sent"""
+        with self.lock:
+            return {
+                "max_pool_connections": self.max_pool_connections,
+                "clients": {
+                    " ".join(str(x) for x in key if x is not None): dict(cur_stats)
+                    for key, cur_stats in self.client_stats.items()
+                },
+                "llms": {"cached": len(self.llms), **self.llm_stats},
+            }
+
+    def clear(self):
+        with self.lock:
+            self.clients.clear()
+            self.async_clients.clear()
+            self.client_stats.clear()
+            self.llms.clear()
+            self.llm_stats = {"hits": 0, "misses": 0}
+
+    def _get_client(self, key, kind, create_fn):
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = create_fn()
+                self.client_stats[key] = {"kind": kind, "handed_out": 0, "requests": 0}
+            self.client_stats[key]["handed_out"] += 1
+            return self.clients[key]
+
+    def _get_async_client(self, key, kind, create_fn):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            # the clients of closed loops can't be used anymore
+            for x in [x for x in self.async_clients if x.is_closed()]:
+                del self.async_clients[x]
+            clients = self.async_clients.setdefault(loop, {})
+            if key not in clients:
+                clients[key] = create_fn()
+                self.client_stats.setdefault(
+                    key, {"kind": kind, "handed_out": 0, "requests": 0}
+                )
+            self.client_stats[key]["handed_out"] += 1
+            return clients[key]
+
+    def _count_request(self, key):
+        with self.lock:
+            if key in self.client_stats:
+                self.client_stats[key]["requests"] += 1
+
+    def _httpx_kwargs(self, key, use_async=False):
+        httpx = _import_httpx()
+        if use_async:
+
+            async def count_request(request):
+                self._count_request(key)
+
+        else:
+
+            def count_request(request):
+                self._count_request(key)
+
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_pool_connections,
+                max_keepalive_connections=self.max_pool_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "event_hooks": {"request": [count_request]},
+        }
+
+
+# shared by all the providers in the process
+CLIENT_REGISTRY = ClientRegistry()
@@ -0,0 +1,228 @@
+""" Keeps the prompt within the context window of the model
+
+The history is sent with every message, so long chats end up larger than the context
+window and are rejected by the API. The ContextManager estimates the tokens of each
+message and, when the prompt doesn't fit, shortens the history with a policy.
+The request body is checked again before it is sent, so oversized requests fail
+without leaving the process.
+"""
+import threading
+from collections import OrderedDict
+
+
+# policies applied when the history does not fit
+DROP_OLDEST = "drop_oldest"
+ELIDE_TOOL_RESULTS = "elide_tool_results"
+SUMMARIZE = "summarize"
+
+# rough estimate for text, which is also used for json (tool calls)
+CHARS_PER_TOKEN = 4
+# tokens of an image resized to the maximum edge of the model
+IMAGE_TOKENS = 1600
+# role and formatting of each message
+MESSAGE_OVERHEAD_TOKENS = 4
+ELIDED_TOOL_RESULT = "[Tool result removed to save context]"
+
+
+class ContextWindowExceeded(ValueError):
+    """The request does not fit the context window even after shortening the history"""
+
+
+def _is_image(x):
+    return x.get("type") in ["image", "image_url", "image_ref"] or "image" in x
+
+
+def _chars(x):
+    """Characters of the text in a message, images excluded"""
+    if isinstance(x, str):
+        return len(x)
+    if isinstance(x, dict):
+        if _is_image(x):
+            return IMAGE_TOKENS * CHARS_PER_TOKEN
+        return sum(_chars(v) for v in x.values())
+    if isinstance(x, (list, tuple)):
+        return sum(_chars(v) for v in x)
+    if x is None:
+        return 0
+    return len(str(x))
+
+
+def _content_key(x):
+    """Hashable copy of a message. Python caches the hash of each string, so hashing
+    the text of a message again is cheap"""
+    if isinstance(x, dict):
+        return tuple((k, _content_key(v)) for k, v in x.items())
+    if isinstance(x, (list, tuple)):
+        return tuple(_content_key(v) for v in x)
+    if isinstance(x, (str, int, float, bool)) or x is None:
+        return x
+    return str(x)
+
+
+def is_tool_result(msg):
+    """True for the messages with tool results: OpenAI, Anthropic and Bedrock Converse formats"""
+    if not isinstance(msg, dict):
+        return False
+    if msg.get("role") == "tool":
+        return True
+    content = msg.get("content")
+    return (
+        msg.get("role") == "user"
+        and isinstance(content, list)
+        and len(content) > 0
+        and isinstance(content[0], dict)
+        and ("toolResult" in content[0] or content[0].get("type") == "tool_result")
+    )
+
+
+def _elide_tool_result(msg):
+    """Copy of a tool result message without the results"""
+    if msg.get("role") == "tool":
+        return {**msg, "content": ELIDED_TOOL_RESULT}
+    content = []
+    for x in msg["content"]:
+        if "toolResult" in x:
+            x = {
+                "toolResult": {
+                    **x["toolResult"],
+                    "content": [{"text": ELIDED_TOOL_RESULT}],
+                }
+            }
+        elif x.get("type") == "tool_result":
+            x = {**x, "content": ELIDED_TOOL_RESULT}
+        content.append(x)
+    return {**msg, "content": content}
+
+
+def _prepend_text(msg, text):
+    """Copy of a user message with text before its content"""
+    if isinstance(msg["content"], str):
+        return {**msg, "content": f"{text}\n\n{msg['content']}"}
+    return {**msg, "content": [{"type": "text", "text": text}] + msg["content"]}
+
+
+class ContextManager:
+    def __init__(
+        self,
+        context_window,
+        policy=DROP_OLDEST,
+        reserved_output_tokens=8192,
+        summarizer=None,
+        max_cached=4096,
+    ):
+        """Fits the history of a call in the context window.
+
+        Arguments:
+            context_window: tokens of prompt plus answer accepted by the model
+            policy: DROP_OLDEST drops the oldest turns. ELIDE_TOOL_RESULTS first removes
+                the results of old tool calls. SUMMARIZE replaces the oldest turns with
+                their summary. The last two drop the oldest turns if that is not enough
+            reserved_output_tokens: kept free for the answer. At most a quarter of the window
+            summarizer: function that receives the messages to drop and returns their
+                summary (str). Required by SUMMARIZE
+            max_cached: estimates remembered, by the content of the message
+        """
+        assert policy in [DROP_OLDEST, ELIDE_TOOL_RESULTS, SUMMARIZE]
+        assert (
+            policy != SUMMARIZE or summarizer is not None
+        ), "SUMMARIZE needs a summarizer"
+        self.context_window = context_window
+        self.policy = policy
+        self.budget = context_window - min(reserved_output_tokens, context_window // 4)
+        self.summarizer = summarizer
+        self.max_cached = max_cached
+        # hash of the message content -> tokens. Only the hash is kept, not the message
+        self.token_cache = OrderedDict()
+        self.metrics = {"fitted": 0, "dropped_messages": 0, "elided_results": 0}
+        self.lock = threading.Lock()
+
+    def estimate_tokens(self, msg):
+        """Estimated tokens of a message, cached by its content"""
+        key = hash(_content_key(msg))
+        with self.lock:
+            if key in self.token_cache:
+                self.token_cache.move_to_end(key)
+                return self.token_cache[key]
+        tokens = _chars(msg) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+        with self.lock:
+            self.token_cache[key] = tokens
+            while len(self.token_cache) > self.max_cached:
+                self.token_cache.popitem(last=False)
+        return tokens
+
+    def fit(self, call_list, extra_tokens=0):
+        """Returns call_list ([system prompt, history..., next user message]) shortened
+        to fit the budget. extra_tokens: tokens sent besides the messages, e.g. tools
+        """
+        tokens = [self.estimate_tokens(x) for x in call_list]
+        if sum(tokens) + extra_tokens <= self.budget:
+            return call_list
+
+        with self.lock:
+            self.metrics["fitted"] += 1
+        system, history = call_list[:1], list(call_list[1:])
+        history_tokens = tokens[1:]
+        available = self.budget - extra_tokens - tokens[0]
+        # turns start with a user message that is not a tool result
+        turn_starts = [
+            k
+            for k, x in enumerate(history)
+            if isinstance(x, dict) and x.get("role") == "user" and not is_tool_result(x)
+        ]
+        last_turn = turn_starts[-1] if len(turn_starts) > 0 else len(history) - 1
+
+        if self.policy == ELIDE_TOOL_RESULTS:
+            for k in range(last_turn):
+                if sum(history_tokens) <= available:
+                    break
+                if is_tool_result(history[k]):
+                    history[k] = _elide_tool_result(history[k])
+                    history_tokens[k] = self.estimate_tokens(history[k])
+                    with self.lock:
+                        self.metrics["elided_results"] += 1
+
+        # drop the oldest turns. The last one is always kept
+        n_dropped = 0
+        for start in turn_starts:
+            if sum(history_tokens[n_dropped:]) <= available:
+                break
+            n_dropped = start
+        if n_dropped == 0:
+            return system + history
+
+        dropped, history = history[:n_dropped], history[n_dropped:]
+        with self.lock:
+            self.metrics["dropped_messages"] += len(dropped)
+        if self.policy == SUMMARIZE:
+            summary = self.summarizer(dropped)
+            history[0] = _prepend_text(
+                history[0],
+                f"[|[PAST_FORGOTTEN]|]\n<past_conversation_summary>\n{summary}\n</past_conversation_summary>",
+            )
+        return system + history
+
+    def check(self, body):
+        """Raises ContextWindowExceeded if the request body doesn't fit the context window.
+        The body has the images inlined, so its messages are estimated without the cache
+        """
+        messages = body.get("messages", [])
+        tokens = sum(
+            _chars(x) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS for x in messages
+        )
+        rest = {k: v for k, v in body.items() if k != "messages"}
+        tokens += _chars(rest) // CHARS_PER_TOKEN
+        if tokens > self.budget:
+            raise ContextWindowExceeded(
+                f"The request has about {tokens} tokens and the limit is {self.budget} "
+                f"(context window of {self.context_window} tokens)"
+            )
+        return tokens
+
+    def stats(self):
+        with self.lock:
+            return {"budget": self.budget, **self.metrics}
+
+
+def estimate_tokens(x):
+    """Estimated tokens of any json-like value, eg. the tools of a request"""
+    return _chars(x) // CHARS_PER_TOKEN
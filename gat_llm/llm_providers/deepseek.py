@@ -1,7 +1,8 @@
 import os
 
-from openai import OpenAI
+from .client_registry import CLIENT_REGISTRY
 from .openai import LLM_GPT_OpenAI
+from .usage import UsageLog
 
 
 class LLM_Deepseek(LLM_GPT_OpenAI):
@@ -11,16 +12,10 @@ class LLM_Deepseek(LLM_GPT_OpenAI):
             bedrock_client - Instance of boto3.client(service_name='bedrock-runtime')
                 to use when making calls to bedrock models
         """
-        if model_size == "Deepseek Chat":
-            self.model_id = "deepseek-chat"
-            self.llm_description = (
-                "Deepseek V3 (medium-sized LLM) - directly from DeepSeek"
-            )
-            self.price_per_M_input_tokens = 0.27
-            self.price_per_M_output_tokens = 1.1
+        self._load_model_spec(model_size)
 
         try:
-            self.openai_client = OpenAI(
+            self.openai_client = CLIENT_REGISTRY.openai_client(
                 api_key=os.environ.get("DEEPSEEK_API_KEY"),
                 base_url="https://api.deepseek.com",
             )
@@ -38,5 +33,7 @@ class LLM_Deepseek(LLM_GPT_OpenAI):
             "stop": None,  # the regular is already implemented
             "model": self.model_id,
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
@@ -1,7 +1,8 @@
 import os
 
-from openai import OpenAI
+from .client_registry import CLIENT_REGISTRY
 from .openai import LLM_GPT_OpenAI
+from .usage import UsageLog
 
 
 class LLM_Grok(LLM_GPT_OpenAI):
@@ -10,33 +11,10 @@ class LLM_Grok(LLM_GPT_OpenAI):
         Arguments:
             model_size - Grok model to use
         """
-        if model_size == "Grok2Vision xAI":
-            self.model_id = "grok-2-vision-1212"
-            self.llm_description = "Grok 2 (medium-sized LLM) - directly from xAI"
-            self.price_per_M_input_tokens = 2
-            self.price_per_M_output_tokens = 10
-        elif model_size == "Grok4":
-            self.model_id = "grok-4-0709"
-            self.llm_description = "Grok 4 (large-sized LLM) - directly from xAI"
-            self.price_per_M_input_tokens = 3
-            self.price_per_M_output_tokens = 15
-        elif model_size == "Grok4-fast-reasoning":
-            self.model_id = "grok-4-fast-reasoning"
-            self.llm_description = (
-                "Grok 4 Fast reasoning (small-sized LLM) - directly from xAI"
-            )
-            self.price_per_M_input_tokens = 0.2
-            self.price_per_M_output_tokens = 0.5
-        elif model_size == "Grok4-fast-non-reasoning":
-            self.model_id = "grok-4-fast-non-reasoning"
-            self.llm_description = (
-                "Grok 4 Fast reasoning (small-sized LLM) - directly from xAI"
-            )
-            self.price_per_M_input_tokens = 0.2
-            self.price_per_M_output_tokens = 0.5
+        self._load_model_spec(model_size)
 
         try:
-            self.openai_client = OpenAI(
+            self.openai_client = CLIENT_REGISTRY.openai_client(
                 api_key=os.environ.get("GROK_API_KEY"),
                 base_url="https://api.x.ai/v1",
             )
@@ -54,5 +32,7 @@ class LLM_Grok(LLM_GPT_OpenAI):
             "stop": None,  # the regular is already implemented
             "model": self.model_id,
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
@@ -0,0 +1,156 @@
+""" Preprocessing of the images sent to the LLMs
+
+The providers downscale large images before the model sees them, so sending them at
+full resolution only costs upload time and input tokens. Images are resized to the
+largest size useful for the model (max_image_edge in model_catalog.py), encoded as
+JPEG or PNG depending on their content, without metadata, and stored in IMAGE_STORE.
+The result is cached by the hash of the input, so an image is only processed once.
+"""
+import os
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from .image_store import IMAGE_STORE
+
+
+# longest image side used when the model does not define one
+DEFAULT_MAX_IMAGE_EDGE = 1568
+# content types: how an image is encoded
+PHOTO = "photo"
+DOCUMENT = "document"
+AUTO = "auto"
+
+
+def max_image_edge(llm):
+    """Longest image side useful for the LLM, from its spec"""
+    ans = getattr(llm, "max_image_edge", None)
+    return ans if isinstance(ans, int) else DEFAULT_MAX_IMAGE_EDGE
+
+
+class ImagePreprocessor:
+    def __init__(
+        self, image_store=None, max_cached=256, jpeg_quality=85, max_png_colors=256
+    ):
+        """Resizes and encodes images for the LLMs.
+
+        Arguments:
+            image_store: ImageStore that receives the processed images. None for IMAGE_STORE
+            max_cached: number of processed images remembered
+            jpeg_quality: quality of photos. Documents use a higher quality
+            max_png_colors: images with up to this many colors (text, charts, screenshots)
+                are encoded as PNG when content_type is AUTO
+        """
+        self.image_store = image_store if image_store is not None else IMAGE_STORE
+        self.max_cached = max_cached
+        self.jpeg_quality = jpeg_quality
+        self.max_png_colors = max_png_colors
+        # (input hash, max_edge, content_type) -> image reference
+        self.cache = OrderedDict()
+        self.metrics = {
+            "images": 0,
+            "cache_hits": 0,
+            "resized": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+        }
+        self.lock = threading.Lock()
+
+    def prepare(self, image, max_edge=DEFAULT_MAX_IMAGE_EDGE, content_type=AUTO):
+        """Returns the reference to the processed image in the image store.
+
+        Arguments:
+            image: path, bytes of an image file, PIL image or numpy array
+            max_edge: longest side of the processed image
+            content_type: PHOTO (JPEG), DOCUMENT (pages: JPEG with higher quality or PNG
+                if they have few colors) or AUTO (JPEG or PNG depending on the colors)
+        """
+        data = None
+        if isinstance(image, (str, os.PathLike)):
+            with open(image, "rb") as f:
+                data = f.read()
+        elif isinstance(image, bytes):
+            data = image
+        elif isinstance(image, np.ndarray):
+            image = Image.fromarray(np.asarray(image, dtype=np.uint8))
+
+        if data is not None:
+            digest = hashlib.sha256(data).hexdigest()
+            bytes_in = len(data)
+        else:
+            # in-memory images are compared with their uncompressed size
+            raw = image.tobytes()
+            digest = hashlib.sha256(
+                f"{image.mode}{image.size}".encode("utf-8") + raw
+            ).hexdigest()
+            bytes_in = len(raw)
+
+        key = (digest, max_edge, content_type)
+        with self.lock:
+            self.metrics["images"] += 1
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.metrics["cache_hits"] += 1
+                return self.cache[key]
+
+        if data is not None:
+            image = Image.open(BytesIO(data))
+        encoded, media_type, resized = self._encode(image, max_edge, content_type)
+        ref = self.image_store.put(encoded, media_type)
+
+        with self.lock:
+            self.metrics["resized"] += int(resized)
+            self.metrics["bytes_in"] += bytes_in
+            self.metrics["bytes_out"] += len(encoded)
+            self.cache[key] = ref
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return ref
+
+    def stats(self):
+        """Counts and bytes. bytes_in is the size of the input files, or the uncompressed
+        size of in-memory images
+        """
+        with self.lock:
+            ans = dict(self.metrics)
+        ans["bytes_saved"] = ans["bytes_in"] - ans["bytes_out"]
+        return ans
+
+    def _encode(self, image, max_edge, content_type):
+        """(encoded bytes, media type, resized?). Metadata such as EXIF is not kept"""
+        # apply the camera orientation, which is lost with the metadata
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA") or (
+            image.mode == "P" and "transparency" in image.info
+        )
+        use_png = has_alpha
+        if content_type != PHOTO and not use_png:
+            # few colors: text, charts or screenshots, which PNG keeps sharp and small.
+            # Counted before resizing, which blends colors
+            sample = image.copy()
+            sample.thumbnail((256, 256), Image.NEAREST)
+            use_png = sample.getcolors(maxcolors=self.max_png_colors) is not None
+
+        resized = max(image.size) > max_edge
+        if resized:
+            image = image.copy()
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        buffer = BytesIO()
+        if use_png:
+            if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                image = image.convert("RGBA" if has_alpha else "RGB")
+            image.save(buffer, format="PNG", optimize=True)
+            return buffer.getvalue(), "image/png", resized
+
+        quality = self.jpeg_quality if content_type != DOCUMENT else 90
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+        return buffer.getvalue(), "image/jpeg", resized
+
+
+# shared by the chat interface and the tools
+IMAGE_PREPROCESSOR = ImagePreprocessor()
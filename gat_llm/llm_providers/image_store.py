@@ -0,0 +1,158 @@
+""" Content-addressed store of the images sent to the LLMs
+
+The chat history keeps a small reference to each image ({"type": "image_ref", ...}),
+not its base64 data. The images are stored once on disk, named by the hash of their
+bytes, and turned into each provider's base64 block when a request is prepared.
+
+Files are evicted least recently used first once the store passes max_disk_mb. The
+images referenced most recently, e.g. by the chats in progress, are never evicted.
+"""
+import os
+import base64
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def is_image_ref(x):
+    return isinstance(x, dict) and x.get("type") == "image_ref"
+
+
+class ImageStore:
+    def __init__(self, root_dir=None, max_cached=32, max_disk_mb=512, keep_recent=256):
+        """Stores image bytes by their sha256.
+
+        Arguments:
+            root_dir: folder of the images. None to use a folder in the temp dir, shared by
+                the processes of the machine
+            max_cached: base64 strings of the most recently used images kept in memory
+            max_disk_mb: the least recently used images are deleted above this size
+            keep_recent: images most recently stored or read, which are not deleted
+        """
+        self.root_dir = (
+            root_dir
+            if root_dir is not None
+            else os.path.join(tempfile.gettempdir(), "gat_llm_images")
+        )
+        self.max_cached = max_cached
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self.keep_recent = keep_recent
+        # sha256 -> base64
+        self.b64_cache = OrderedDict()
+        # sha256 of the images referenced recently, most recent last
+        self.recent = OrderedDict()
+        self.metrics = {"stored": 0, "deduplicated": 0, "loaded": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        self.disk_bytes = sum(os.path.getsize(x) for x in self._files())
+
+    def put(self, data, media_type="image/jpeg"):
+        """Stores the image bytes and returns their reference"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        with self.lock:
+            self._referenced(digest)
+            if os.path.isfile(path):
+                self.metrics["deduplicated"] += 1
+                # last use time, for the LRU eviction of files
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                self.metrics["stored"] += 1
+                self.disk_bytes += len(data)
+                if self.disk_bytes > self.max_disk_bytes:
+                    self._evict()
+        return {"type": "image_ref", "sha256": digest, "media_type": media_type}
+
+    def put_b64(self, b64_data, media_type="image/jpeg"):
+        """Stores a base64 image and returns its reference"""
+        ref = self.put(base64.b64decode(b64_data), media_type)
+        self._cache(ref["sha256"], b64_data)
+        return ref
+
+    def get(self, ref):
+        """Bytes of the image"""
+        path = self._path(ref["sha256"])
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        with self.lock:
+            self._referenced(ref["sha256"])
+        return data
+
+    def get_b64(self, ref):
+        """Base64 of the image, as sent to the LLMs"""
+        digest = ref["sha256"]
+        with self.lock:
+            if digest in self.b64_cache:
+                self.b64_cache.move_to_end(digest)
+                self._referenced(digest)
+                return self.b64_cache[digest]
+        b64_data = base64.b64encode(self.get(ref)).decode("utf-8")
+        with self.lock:
+            self.metrics["loaded"] += 1
+        self._cache(digest, b64_data)
+        return b64_data
+
+    def stats(self):
+        with self.lock:
+            return {
+                "cached": len(self.b64_cache),
+                "disk_bytes": self.disk_bytes,
+                **self.metrics,
+            }
+
+    def _cache(self, digest, b64_data):
+        with self.lock:
+            self.b64_cache[digest] = b64_data
+            self.b64_cache.move_to_end(digest)
+            while len(self.b64_cache) > self.max_cached:
+                self.b64_cache.popitem(last=False)
+
+    def _referenced(self, digest):
+        self.recent[digest] = None
+        self.recent.move_to_end(digest)
+        while len(self.recent) > self.keep_recent:
+            self.recent.popitem(last=False)
+
+    def _evict(self):
+        files = []
+        for path in self._files():
+            if os.path.basename(path) in self.recent:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # removed by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        for _, size, path in sorted(files):
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            self.disk_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.b64_cache.pop(os.path.basename(path), None)
+            self.metrics["evictions"] += 1
+
+    def _files(self):
+        if not os.path.isdir(self.root_dir):
+            return
+        for folder in os.scandir(self.root_dir):
+            if folder.is_dir():
+                for x in os.scandir(folder.path):
+                    if not x.name.endswith(".tmp"):
+                        yield x.path
+
+    def _path(self, digest):
+        return os.path.join(self.root_dir, digest[:2], digest)
+
+
+# shared by all the providers in the process
+IMAGE_STORE = ImageStore()
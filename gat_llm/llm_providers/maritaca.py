@@ -1,7 +1,8 @@
 import os
 
-from openai import OpenAI
+from .client_registry import CLIENT_REGISTRY
 from .openai import LLM_GPT_OpenAI
+from .usage import UsageLog
 
 
 class LLM_Maritalk(LLM_GPT_OpenAI):
@@ -10,16 +11,10 @@ class LLM_Maritalk(LLM_GPT_OpenAI):
         Arguments:
             model_size - Maritaca model to use to make LLM calls
         """
-        if model_size == "Sabia3 Maritaca":
-            self.model_id = "sabia-3.1"
-            self.llm_description = (
-                "Sabia-3.1 (medium-sized LLM) - directly from Maritaca"
-            )
-            self.price_per_M_input_tokens = 0.95
-            self.price_per_M_output_tokens = 1.9
+        self._load_model_spec(model_size)
 
         try:
-            self.openai_client = OpenAI(
+            self.openai_client = CLIENT_REGISTRY.openai_client(
                 api_key=os.environ.get("MARITACA_API_KEY"),
                 base_url="https://chat.maritaca.ai/api",
             )
@@ -37,5 +32,7 @@ class LLM_Maritalk(LLM_GPT_OpenAI):
             "stop": None,  # the regular is already implemented
             "model": self.model_id,
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
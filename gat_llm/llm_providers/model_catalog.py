@@ -0,0 +1,823 @@
+""" Catalog of the available LLMs
+
+Describes each model (provider class, model id, prices, context window and capabilities)
+without importing the provider modules. The provider module of a model, and its SDK,
+is only imported when the model is first requested (see load_provider).
+"""
+import importlib
+
+
+# status of a model in the catalog
+CURRENT = "current"
+OUTDATED = "outdated"
+
+# defaults of the models of each provider. Keys are "<module>.<class>" in llm_providers
+PROVIDERS = {
+    "aws_bedrock.LLM_Claude_Bedrock": {
+        "bedrock_client": True,
+        "context_window": 200000,
+        "vision": True,
+        "native_tools": True,
+    },
+    "anthropic.LLM_Claude_Anthropic": {
+        "context_window": 200000,
+        "vision": True,
+        "native_tools": True,
+    },
+    "openai.LLM_GPT_OpenAI": {
+        "context_window": 400000,
+        "vision": True,
+        "max_image_edge": 2048,
+        "native_tools": True,
+        "supports_stream_usage": True,
+    },
+    "aws_bedrock_nova.LLM_Nova_Bedrock": {
+        "bedrock_client": True,
+        "context_window": 300000,
+        "vision": True,
+        "native_tools": True,
+    },
+    "aws_bedrock_cohere.LLM_Command_Cohere": {
+        "bedrock_client": True,
+        "context_window": 128000,
+        "native_tools": True,
+    },
+    "aws_bedrock_via_openai.LLM_Bedrock_OpenAI": {
+        "context_window": 128000,
+        "native_tools": True,
+        "reasoning": True,
+    },
+    "grok.LLM_Grok": {
+        "context_window": 256000,
+        "vision": True,
+        "native_tools": True,
+    },
+    "maritaca.LLM_Maritalk": {
+        "context_window": 128000,
+        "native_tools": True,
+    },
+    "deepseek.LLM_Deepseek": {
+        "context_window": 64000,
+        "native_tools": True,
+    },
+    "ollama.LLM_Ollama": {
+        "model_arg": "model",
+        "context_window": 40960,
+        "native_tools": True,
+    },
+    "vllm.LLM_VLLM": {
+        # --max_model_len of the suggested vLLM command
+        "model_arg": "model",
+        "context_window": 8192,
+        "native_tools": True,
+    },
+    "aws_bedrock.LLM_Mistral_Bedrock": {
+        "bedrock_client": True,
+        "context_window": 32000,
+    },
+    "aws_bedrock.LLM_Llama3": {
+        "bedrock_client": True,
+        "model_arg": "model",
+        "context_window": 8192,
+    },
+    "aws_bedrock.LLM_Llama13b": {"bedrock_client": True, "context_window": 4096},
+    "aws_bedrock.LLM_Llama70b": {"bedrock_client": True, "context_window": 4096},
+    "aws_bedrock.LLM_Claude2_1_Bedrock": {
+        "bedrock_client": True,
+        "context_window": 200000,
+    },
+    "aws_bedrock.LLM_Claude_Instant_1_2_Bedrock": {
+        "bedrock_client": True,
+        "context_window": 100000,
+    },
+}
+
+# defaults of every model
+MODEL_DEFAULTS = {
+    "status": CURRENT,
+    # the provider needs the boto3 bedrock-runtime client
+    "bedrock_client": False,
+    # name of the constructor argument that receives model_size
+    "model_arg": "model_size",
+    # key of the model inside its provider. None for providers with a single model
+    "model_size": None,
+    # extra constructor arguments
+    "init_kwargs": {},
+    "model_id": None,
+    "price_per_M_input_tokens": 0,
+    "price_per_M_output_tokens": 0,
+    # maximum tokens of prompt plus answer
+    "context_window": 8192,
+    # accepts images
+    "vision": False,
+    # longest side of the images worth sending. The API downscales larger images
+    "max_image_edge": 1568,
+    # uses the native tool calling of the API
+    "native_tools": False,
+    # produces reasoning (thinking) before answering
+    "reasoning": False,
+    # OpenAI-compatible APIs: accepts stream_options to report the token usage when
+    # streaming. Set only for the APIs known to accept it: others may reject the request
+    "supports_stream_usage": False,
+}
+
+# LLM name (as shown to the user) -> spec. Missing keys come from PROVIDERS and MODEL_DEFAULTS
+MODEL_CATALOG = {
+    # Local - Ollama. There would be electricity cost but for now we keep cost at 0
+    "Qwen 3 0.6b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 3 0.6b Ollama",
+        "model_id": "qwen3:0.6b",
+        "llm_description": "Qwen 3 0.6b (Tiny-size LLM) - locally from Ollama",
+        "reasoning": True,
+    },
+    "Nemotron 3 Nano 30b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Nemotron 3 Nano 30b Ollama",
+        "model_id": "nemotron-3-nano:30b",
+        "llm_description": "Nemotron 3 Nano 30b NVidia (Small-size LLM) - locally from Ollama",
+        "context_window": 1000000,
+        "reasoning": True,
+    },
+    "OpenAI GPT OSS 20b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "GPT OSS 20b Ollama",
+        "model_id": "gpt-oss:20b",
+        "llm_description": "GPT OSS 20b OpenAI (Small-size LLM) - locally from Ollama",
+        "context_window": 128000,
+        "reasoning": True,
+    },
+    "OpenAI GPT OSS 120b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "GPT OSS 120b Ollama",
+        "model_id": "gpt-oss:120b",
+        "llm_description": "GPT OSS 120b OpenAI (Small-size LLM) - locally from Ollama",
+        "context_window": 128000,
+        "reasoning": True,
+    },
+    "Qwen 3 1.7b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 3 1.7b Ollama",
+        "model_id": "qwen3:1.7b",
+        "llm_description": "Qwen 3 1.7b (Tiny-size LLM) - locally from Ollama",
+        "reasoning": True,
+    },
+    "Qwen 3 4b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 3 4b Ollama",
+        "model_id": "qwen3:4b",
+        "llm_description": "Qwen 3 4b (Small-size LLM) - locally from Ollama",
+        "reasoning": True,
+    },
+    "Qwen 3 8b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 3 8b Ollama",
+        "model_id": "qwen3:8b",
+        "llm_description": "Qwen 3 8b (Small-size LLM) - locally from Ollama",
+        "reasoning": True,
+    },
+    "Qwen 3 14b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 3 14b Ollama",
+        "model_id": "qwen3:14b",
+        "llm_description": "Qwen 3 14b (Small-size LLM) - locally from Ollama",
+        "reasoning": True,
+    },
+    "Qwen 3 Coder 30b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 3 Coder 30b Ollama",
+        "model_id": "qwen3-coder:30b",
+        "llm_description": "Qwen 3 Coder (Small-size LLM) - locally from Ollama",
+        "context_window": 256000,
+    },
+    "Llama4 16x17b - Ollama": {
+        # this model may be too big for many systems
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Llama4 16x17b Ollama",
+        "model_id": "llama4:16x17b",
+        "llm_description": "Llama 4 16x17b (Small-size LLM) - locally from Ollama",
+        "context_window": 10000000,
+        "vision": True,
+    },
+    "Qwen 3vl 8b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 3vl 8b Ollama",
+        "model_id": "qwen3-vl:8b",
+        "llm_description": "Qwen 3vl 8b (Tiny-size VLLM) - locally from Ollama",
+        "context_window": 256000,
+        "vision": True,
+    },
+    "Qwen 3vl 4b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 3vl 4b Ollama",
+        "model_id": "qwen3-vl:4b",
+        "llm_description": "Qwen 3vl 4b (Tiny-size VLLM) - locally from Ollama",
+        "context_window": 256000,
+        "vision": True,
+    },
+    "Qwen 3vl 2b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 3vl 2b Ollama",
+        "model_id": "qwen3-vl:2b",
+        "llm_description": "Qwen 3vl 2b (Tiny-size VLLM) - locally from Ollama",
+        "context_window": 256000,
+        "vision": True,
+    },
+    "DeepSeek R1 14b - Ollama": {
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "DeepSeek R1 14b Ollama",
+        "model_id": "deepseek-r1:14b",
+        "llm_description": "DeepSeek R1 14b (Tiny-size LLM) - locally from Ollama",
+        "context_window": 128000,
+        "reasoning": True,
+    },
+    # Local - vLLM
+    "Qwen 3 1.7b - VLLM": {
+        "provider": "vllm.LLM_VLLM",
+        "model_size": "Qwen 3 1.7b VLLM",
+        "model_id": "Qwen/Qwen3-1.7B",
+        "llm_description": "Qwen 3 1.7b (Tiny-size LLM) - locally from vLLM",
+        "reasoning": True,
+    },
+    # AWS Bedrock via OpenAI API
+    "OpenAI GPT OSS 20b - AWSBedrock_OpenAI": {
+        "provider": "aws_bedrock_via_openai.LLM_Bedrock_OpenAI",
+        "model_size": "GPT OSS 20b Bedrock",
+        "model_id": "openai.gpt-oss-20b-1:0",
+        "llm_description": "GPT OSS 20b (small-sized LLM) - directly from Bedrock using OpenAI API",
+        "price_per_M_input_tokens": 0.07,
+        "price_per_M_output_tokens": 0.3,
+    },
+    "OpenAI GPT OSS 120b - AWSBedrock_OpenAI": {
+        "provider": "aws_bedrock_via_openai.LLM_Bedrock_OpenAI",
+        "model_size": "GPT OSS 120b Bedrock",
+        "model_id": "openai.gpt-oss-120b-1:0",
+        "llm_description": "GPT OSS 120b (medium-sized LLM) - directly from Bedrock using OpenAI API",
+        "price_per_M_input_tokens": 0.15,
+        "price_per_M_output_tokens": 0.6,
+    },
+    # Grok
+    "Grok4 - Grok": {
+        "provider": "grok.LLM_Grok",
+        "model_size": "Grok4",
+        "model_id": "grok-4-0709",
+        "llm_description": "Grok 4 (large-sized LLM) - directly from xAI",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+        "reasoning": True,
+    },
+    "Grok4 Fast reasoning - Grok": {
+        "provider": "grok.LLM_Grok",
+        "model_size": "Grok4-fast-reasoning",
+        "model_id": "grok-4-fast-reasoning",
+        "llm_description": "Grok 4 Fast reasoning (small-sized LLM) - directly from xAI",
+        "price_per_M_input_tokens": 0.2,
+        "price_per_M_output_tokens": 0.5,
+        "context_window": 2000000,
+        "reasoning": True,
+    },
+    "Grok4 Fast nonreasoning - Grok": {
+        "provider": "grok.LLM_Grok",
+        "model_size": "Grok4-fast-non-reasoning",
+        "model_id": "grok-4-fast-non-reasoning",
+        "llm_description": "Grok 4 Fast reasoning (small-sized LLM) - directly from xAI",
+        "price_per_M_input_tokens": 0.2,
+        "price_per_M_output_tokens": 0.5,
+        "context_window": 2000000,
+    },
+    # Maritaca
+    "Sabia3 - Maritaca": {
+        "provider": "maritaca.LLM_Maritalk",
+        "model_size": "Sabia3 Maritaca",
+        "model_id": "sabia-3.1",
+        "llm_description": "Sabia-3.1 (medium-sized LLM) - directly from Maritaca",
+        "price_per_M_input_tokens": 0.95,
+        "price_per_M_output_tokens": 1.9,
+    },
+    # OpenAI
+    "GPT 5_2 - OpenAI": {
+        "provider": "openai.LLM_GPT_OpenAI",
+        "model_size": "GPT5_2 OpenAI",
+        "init_kwargs": {"reasoning_effort": "low"},
+        "model_id": "gpt-5.2",
+        "llm_description": "OpenAI GPT5.2 (Large-size LLM) - directly from OpenAI",
+        "price_per_M_input_tokens": 1.75,
+        "price_per_M_output_tokens": 14,
+        "reasoning": True,
+    },
+    "GPT 5 mini - OpenAI": {
+        "provider": "openai.LLM_GPT_OpenAI",
+        "model_size": "GPT5 mini OpenAI",
+        "init_kwargs": {"reasoning_effort": "low"},
+        "model_id": "gpt-5-mini",
+        "llm_description": "OpenAI GPT5 mini (Medium-size LLM) - directly from OpenAI",
+        "price_per_M_input_tokens": 0.25,
+        "price_per_M_output_tokens": 2,
+        "reasoning": True,
+    },
+    "GPT 5 nano - OpenAI": {
+        "provider": "openai.LLM_GPT_OpenAI",
+        "model_size": "GPT5 nano OpenAI",
+        "init_kwargs": {"reasoning_effort": "low"},
+        "model_id": "gpt-5-nano",
+        "llm_description": "OpenAI GPT5 nano (Small-size LLM) - directly from OpenAI",
+        "price_per_M_input_tokens": 0.25,
+        "price_per_M_output_tokens": 2,
+        "reasoning": True,
+    },
+    # Anthropic
+    "Claude 4.5 Sonnet - Anthropic": {
+        "provider": "anthropic.LLM_Claude_Anthropic",
+        "model_size": "Sonnet 4.5 Anthropic",
+        "model_id": "claude-sonnet-4-5-20250929",
+        "llm_description": "Anthropic Claude 4.5 Sonnet (Medium-size LLM) - directly from Anthropic",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+        "reasoning": True,
+    },
+    "Claude 4.5 Sonnet - Bedrock": {
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Sonnet 4.5",
+        "model_id": "us.anthropic.claude-sonnet-4-5-20250929-v1:0",
+        "llm_description": "Anthropic Claude 4.5 Sonnet from AWS Bedrock (Medium-size LLM)",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+        "reasoning": True,
+    },
+    "Claude 4.5 Haiku - Anthropic": {
+        "provider": "anthropic.LLM_Claude_Anthropic",
+        "model_size": "Haiku 4.5 Anthropic",
+        "model_id": "claude-haiku-4-5-20251001",
+        "llm_description": "Anthropic Claude 4.5 Haiku (Small-size LLM) - directly from Anthropic",
+        "price_per_M_input_tokens": 1,
+        "price_per_M_output_tokens": 5,
+        "reasoning": True,
+    },
+    "Claude 4.5 Haiku - Bedrock": {
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Haiku 4.5",
+        "model_id": "us.anthropic.claude-haiku-4-5-20251001-v1:0",
+        "llm_description": "Anthropic Claude 4.5 Haiku from AWS Bedrock (Small-size LLM)",
+        "price_per_M_input_tokens": 1,
+        "price_per_M_output_tokens": 5,
+        "reasoning": True,
+    },
+    "Claude 3.7 Sonnet - Bedrock": {
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Sonnet 3.7",
+        "model_id": "us.anthropic.claude-3-7-sonnet-20250219-v1:0",
+        "llm_description": "Anthropic Claude 3.7 Sonnet from AWS Bedrock (Medium-size LLM)",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+        "reasoning": True,
+    },
+    # Outdated Claude
+    "Claude 3.5 Sonnet - Anthropic": {
+        "status": OUTDATED,
+        "provider": "anthropic.LLM_Claude_Anthropic",
+        "model_size": "Sonnet 3.5 Anthropic",
+        "model_id": "claude-3-5-sonnet-20241022",
+        "llm_description": "Anthropic Claude 3.5 Sonnet (Medium-size LLM) - directly from Anthropic",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+    },
+    "Claude 3.5 Sonnet - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Sonnet 3.5",
+        "model_id": "anthropic.claude-3-5-sonnet-20241022-v2:0",
+        "llm_description": "Anthropic Claude 3.5 Sonnet from AWS Bedrock (Medium-size LLM)",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+    },
+    "Claude 3 Opus - Anthropic": {
+        "status": OUTDATED,
+        "provider": "anthropic.LLM_Claude_Anthropic",
+        "model_size": "Opus 3 Anthropic",
+        "model_id": "claude-3-opus-20240229",
+        "llm_description": "Anthropic Claude 3 Opus (Large-size LLM) - directly from Anthropic",
+        "price_per_M_input_tokens": 15,
+        "price_per_M_output_tokens": 75,
+    },
+    "Claude 3 Haiku - Anthropic": {
+        "status": OUTDATED,
+        "provider": "anthropic.LLM_Claude_Anthropic",
+        "model_size": "Haiku 3 Anthropic",
+        "model_id": "claude-3-haiku-20240307",
+        "llm_description": "Anthropic Claude 3 Haiku (Small-size LLM) - directly from Anthropic",
+        "price_per_M_input_tokens": 0.25,
+        "price_per_M_output_tokens": 1.25,
+    },
+    "Claude 3 Haiku - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Haiku",
+        "model_id": "anthropic.claude-3-haiku-20240307-v1:0",
+        "llm_description": "Anthropic Claude 3.0 Haiku from AWS Bedrock (Small-size LLM)",
+        "price_per_M_input_tokens": 0.25,
+        "price_per_M_output_tokens": 1.25,
+    },
+    "Claude 3.5 Haiku - Anthropic": {
+        "status": OUTDATED,
+        "provider": "anthropic.LLM_Claude_Anthropic",
+        "model_size": "Haiku 3.5 Anthropic",
+        "model_id": "claude-3-5-haiku-20241022",
+        "llm_description": "Anthropic Claude 3.5 Haiku (Small-size LLM) - directly from Anthropic",
+        "price_per_M_input_tokens": 1,
+        "price_per_M_output_tokens": 5,
+        "vision": False,
+    },
+    "Claude 3.5 Haiku - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Haiku 3.5",
+        "model_id": "anthropic.claude-3-5-haiku-20241022-v1:0",
+        "llm_description": "Anthropic Claude 3.5 Haiku from AWS Bedrock (Small-size LLM)",
+        "price_per_M_input_tokens": 1,
+        "price_per_M_output_tokens": 5,
+        "vision": False,
+    },
+    "Claude 3 Sonnet - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Sonnet",
+        "model_id": "anthropic.claude-3-sonnet-20240229-v1:0",
+        "llm_description": "Anthropic Claude 3.0 Sonnet from AWS Bedrock (Medium-size LLM)",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+    },
+    "Claude 3 Opus - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Opus",
+        "model_id": "anthropic.claude-3-opus-20240229-v1:0",
+        "llm_description": "Anthropic Claude 3.0 Opus from AWS Bedrock (Large LLM)",
+        "price_per_M_input_tokens": 15,
+        "price_per_M_output_tokens": 75,
+    },
+    "Claude 4 Sonnet - Anthropic": {
+        "status": OUTDATED,
+        "provider": "anthropic.LLM_Claude_Anthropic",
+        "model_size": "Sonnet 4 Anthropic",
+        "model_id": "claude-sonnet-4-20250514",
+        "llm_description": "Anthropic Claude 4 Sonnet (Medium-size LLM) - directly from Anthropic",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+        "reasoning": True,
+    },
+    "Claude 4 Sonnet - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Sonnet 4",
+        "model_id": "us.anthropic.claude-sonnet-4-20250514-v1:0",
+        "llm_description": "Anthropic Claude 4 Sonnet from AWS Bedrock (Medium-size LLM)",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+        "reasoning": True,
+    },
+    "Claude 4 Opus - Anthropic": {
+        "status": OUTDATED,
+        "provider": "anthropic.LLM_Claude_Anthropic",
+        "model_size": "Opus 4 Anthropic",
+        "model_id": "claude-opus-4-20250514",
+        "llm_description": "Anthropic Claude 4 Opus (Large-size LLM) - directly from Anthropic",
+        "price_per_M_input_tokens": 15,
+        "price_per_M_output_tokens": 75,
+        "reasoning": True,
+    },
+    "Claude 4 Opus - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Claude_Bedrock",
+        "model_size": "Opus 4",
+        "model_id": "us.anthropic.claude-opus-4-20250514-v1:0",
+        "llm_description": "Anthropic Claude 4 Opus from AWS Bedrock (Large-size LLM)",
+        "price_per_M_input_tokens": 15,
+        "price_per_M_output_tokens": 75,
+        "reasoning": True,
+    },
+    "Claude 3.7 Sonnet - Anthropic": {
+        "status": OUTDATED,
+        "provider": "anthropic.LLM_Claude_Anthropic",
+        "model_size": "Sonnet 3.7 Anthropic",
+        "model_id": "claude-3-7-sonnet-20250219",
+        "llm_description": "Anthropic Claude 3.7 Sonnet (Medium-size LLM) - directly from Anthropic",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+        "reasoning": True,
+    },
+    "Claude 2.1": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Claude2_1_Bedrock",
+        "model_id": "anthropic.claude-v2:1",
+        "llm_description": "Anthropic Claude 2.1 LLM",
+        "price_per_M_input_tokens": 8,
+        "price_per_M_output_tokens": 24,
+    },
+    "Claude Instant 1.2": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Claude_Instant_1_2_Bedrock",
+        "model_id": "anthropic.claude-instant-v1",
+        "llm_description": "Anthropic Claude Instant 1.0 LLM",
+        "price_per_M_input_tokens": 0.8,
+        "price_per_M_output_tokens": 2.4,
+    },
+    # Outdated Llama
+    "Llama2 13b": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Llama13b",
+        "model_id": "meta.llama2-13b-chat-v1",
+        "llm_description": "Llama2 13b v1 LLM",
+        "price_per_M_input_tokens": 0.75,
+        "price_per_M_output_tokens": 1,
+    },
+    "Llama2 70b": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Llama70b",
+        "model_id": "meta.llama2-70b-chat-v1",
+        "llm_description": "Llama2 70b v1 LLM",
+        "price_per_M_input_tokens": 1.95,
+        "price_per_M_output_tokens": 2.56,
+    },
+    "Llama3 8b instruct": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Llama3",
+        "model_size": "Llama3 8B Instruct - Bedrock",
+        "model_id": "meta.llama3-8b-instruct-v1:0",
+        "llm_description": "Llama3 8B Instruct LLM from Bedrock",
+        "price_per_M_input_tokens": 0.3,
+        "price_per_M_output_tokens": 0.6,
+    },
+    "Llama3 70b instruct": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Llama3",
+        "model_size": "Llama3 70B Instruct - Bedrock",
+        "model_id": "meta.llama3-70b-instruct-v1:0",
+        "llm_description": "Llama3 70B Instruct LLM from Bedrock",
+        "price_per_M_input_tokens": 2.65,
+        "price_per_M_output_tokens": 3.5,
+    },
+    # Outdated Grok
+    "Grok2Vision - Grok": {
+        "status": OUTDATED,
+        "provider": "grok.LLM_Grok",
+        "model_size": "Grok2Vision xAI",
+        "model_id": "grok-2-vision-1212",
+        "llm_description": "Grok 2 (medium-sized LLM) - directly from xAI",
+        "price_per_M_input_tokens": 2,
+        "price_per_M_output_tokens": 10,
+        "context_window": 32768,
+    },
+    # Outdated OpenAI
+    "GPT 5 - OpenAI": {
+        "status": OUTDATED,
+        "provider": "openai.LLM_GPT_OpenAI",
+        "model_size": "GPT5 OpenAI",
+        "init_kwargs": {"reasoning_effort": "low"},
+        "model_id": "gpt-5",
+        "llm_description": "OpenAI GPT5 (Large-size LLM) - directly from OpenAI",
+        "price_per_M_input_tokens": 1.25,
+        "price_per_M_output_tokens": 10,
+        "reasoning": True,
+    },
+    "GPT 5_1 - OpenAI": {
+        "status": OUTDATED,
+        "provider": "openai.LLM_GPT_OpenAI",
+        "model_size": "GPT5_1 OpenAI",
+        "init_kwargs": {"reasoning_effort": "low"},
+        "model_id": "gpt-5.1",
+        "llm_description": "OpenAI GPT5.1 (Large-size LLM) - directly from OpenAI",
+        "price_per_M_input_tokens": 1.25,
+        "price_per_M_output_tokens": 10,
+        "reasoning": True,
+    },
+    "GPT 4o - OpenAI": {
+        "status": OUTDATED,
+        "provider": "openai.LLM_GPT_OpenAI",
+        "model_size": "GPT4o OpenAI",
+        "model_id": "gpt-4o-2024-05-13",
+        "llm_description": "OpenAI GPT4o (Large-size LLM) - directly from OpenAI",
+        "price_per_M_input_tokens": 5,
+        "price_per_M_output_tokens": 15,
+        "context_window": 128000,
+    },
+    "GPT 4.1 - OpenAI": {
+        "status": OUTDATED,
+        "provider": "openai.LLM_GPT_OpenAI",
+        "model_size": "GPT4_1 OpenAI",
+        "model_id": "gpt-4.1-2025-04-14",
+        "llm_description": "OpenAI GPT4.1 (Large-size LLM) - directly from OpenAI",
+        "price_per_M_input_tokens": 2,
+        "price_per_M_output_tokens": 8,
+        "context_window": 1047576,
+    },
+    "GPT 3.5 - OpenAI": {
+        "status": OUTDATED,
+        "provider": "openai.LLM_GPT_OpenAI",
+        "model_size": "GPT3_5 OpenAI",
+        "model_id": "gpt-3.5-turbo-0125",
+        "llm_description": "OpenAI 3.5 Turbo (Medium-size LLM) - directly from OpenAI",
+        "price_per_M_input_tokens": 0.5,
+        "price_per_M_output_tokens": 1.5,
+        "context_window": 16385,
+        "vision": False,
+    },
+    "GPT 4o mini - OpenAI": {
+        "status": OUTDATED,
+        "provider": "openai.LLM_GPT_OpenAI",
+        "model_size": "GPT4o mini OpenAI",
+        "model_id": "gpt-4o-mini-2024-07-18",
+        "llm_description": "OpenAI 4o Mini (Small-size LLM) - directly from OpenAI",
+        "price_per_M_input_tokens": 0.15,
+        "price_per_M_output_tokens": 0.6,
+        "context_window": 128000,
+    },
+    # Outdated AWS
+    "Amazon Nova Micro 1.0 - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock_nova.LLM_Nova_Bedrock",
+        "model_size": "Nova_Micro",
+        "model_id": "us.amazon.nova-micro-v1:0",
+        "llm_description": "Amazon Nova Micro v1.0 from AWS Bedrock (Tiny LLM)",
+        "price_per_M_input_tokens": 0.035,
+        "price_per_M_output_tokens": 0.14,
+        "context_window": 128000,
+        "vision": False,
+    },
+    "Amazon Nova Lite 1.0 - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock_nova.LLM_Nova_Bedrock",
+        "model_size": "Nova_Lite",
+        "model_id": "us.amazon.nova-lite-v1:0",
+        "llm_description": "Amazon Nova Lite v1.0 from AWS Bedrock (Small LLM)",
+        "price_per_M_input_tokens": 0.06,
+        "price_per_M_output_tokens": 0.24,
+    },
+    "Amazon Nova Pro 1.0 - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock_nova.LLM_Nova_Bedrock",
+        "model_size": "Nova_Pro",
+        "model_id": "us.amazon.nova-pro-v1:0",
+        "llm_description": "Amazon Nova Pro v1.0 from AWS Bedrock (Large LLM)",
+        "price_per_M_input_tokens": 0.8,
+        "price_per_M_output_tokens": 3.2,
+    },
+    # Outdated misc
+    "DeepSeekV3 Chat - DeepSeek": {
+        "status": OUTDATED,
+        "provider": "deepseek.LLM_Deepseek",
+        "model_size": "Deepseek Chat",
+        "model_id": "deepseek-chat",
+        "llm_description": "Deepseek V3 (medium-sized LLM) - directly from DeepSeek",
+        "price_per_M_input_tokens": 0.27,
+        "price_per_M_output_tokens": 1.1,
+    },
+    "Command R - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock_cohere.LLM_Command_Cohere",
+        "model_size": "Command R Cohere 1",
+        "model_id": "cohere.command-r-v1:0",
+        "llm_description": "Cohere Command R 1.0 (Medium-size LLM) - from Bedrock",
+        "price_per_M_input_tokens": 0.5,
+        "price_per_M_output_tokens": 1.5,
+    },
+    "Command RPlus - Bedrock": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock_cohere.LLM_Command_Cohere",
+        "model_size": "Command RPlus Cohere 1",
+        "model_id": "cohere.command-r-plus-v1:0",
+        "llm_description": "Cohere Command R+ 1.0 (Large-size LLM) - from Bedrock",
+        "price_per_M_input_tokens": 3,
+        "price_per_M_output_tokens": 15,
+    },
+    "Mistral Mixtral 8x7B": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Mistral_Bedrock",
+        "model_size": "Mixtral 8x7B v0:1",
+        "model_id": "mistral.mixtral-8x7b-instruct-v0:1",
+        "llm_description": "Mistral Mixtral 8x7B LLM from Bedrock",
+        "price_per_M_input_tokens": 0.45,
+        "price_per_M_output_tokens": 0.7,
+    },
+    "Mistral Large v1": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Mistral_Bedrock",
+        "model_size": "Mistral Large v1",
+        "model_id": "mistral.mistral-large-2402-v1:0",
+        "llm_description": "Mistral Large LLM from Bedrock",
+        "price_per_M_input_tokens": 4,
+        "price_per_M_output_tokens": 12,
+    },
+    "Llama3_1 8b instruct": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Llama3",
+        "model_size": "Llama3_1 8B Instruct - Bedrock",
+        "model_id": "meta.llama3-1-8b-instruct-v1:0",
+        "llm_description": "Llama3.1 8B Instruct LLM from Bedrock",
+        "price_per_M_input_tokens": 0.3,
+        "price_per_M_output_tokens": 0.6,
+        "context_window": 128000,
+    },
+    "Llama3_1 70b instruct": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Llama3",
+        "model_size": "Llama3_1 70B Instruct - Bedrock",
+        "model_id": "meta.llama3-1-70b-instruct-v1:0",
+        "llm_description": "Llama3.1 70B Instruct LLM from Bedrock",
+        "price_per_M_input_tokens": 2.65,
+        "price_per_M_output_tokens": 3.5,
+        "context_window": 128000,
+    },
+    "Llama3_1 405b instruct": {
+        "status": OUTDATED,
+        "provider": "aws_bedrock.LLM_Llama3",
+        "model_size": "Llama3_1 405B Instruct - Bedrock",
+        "model_id": "meta.llama3-1-405b-instruct-v1:0",
+        "llm_description": "Llama3.1 405B Instruct LLM from Bedrock",
+        "price_per_M_input_tokens": 5.32,
+        "price_per_M_output_tokens": 16.0,
+        "context_window": 128000,
+    },
+    # Outdated Qwen
+    "Qwen 2.5vl 7b - Ollama": {
+        "status": OUTDATED,
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 2.5vl 7b Ollama",
+        "model_id": "qwen2.5vl:7b",
+        "llm_description": "Qwen 2.5vl 7b (Tiny-size VLLM) - locally from Ollama",
+        "context_window": 125000,
+        "vision": True,
+    },
+    "Qwen 2.5vl 3b - Ollama": {
+        "status": OUTDATED,
+        "provider": "ollama.LLM_Ollama",
+        "model_size": "Qwen 2.5vl 3b Ollama",
+        "model_id": "qwen2.5vl:3b",
+        "llm_description": "Qwen 2.5vl 3b (Tiny-size VLLM) - locally from Ollama",
+        "context_window": 125000,
+        "vision": True,
+    },
+}
+
+
+def get_spec(llm):
+    """Full spec of the LLM: its catalog entry with the provider and global defaults"""
+    entry = MODEL_CATALOG[llm]
+    spec = {
+        **MODEL_DEFAULTS,
+        **PROVIDERS[entry["provider"]],
+        **entry,
+        "name": llm,
+    }
+    return spec
+
+
+def list_llms(status=None, **capabilities):
+    """Names of the LLMs in catalog order.
+
+    Arguments:
+        status: CURRENT, OUTDATED or None for all
+        capabilities: e.g. vision=True keeps only the LLMs that accept images
+    """
+    ans = []
+    for llm in MODEL_CATALOG:
+        spec = get_spec(llm)
+        if status is not None and spec["status"] != status:
+            continue
+        if any(spec[k] != v for k, v in capabilities.items()):
+            continue
+        ans.append(llm)
+    return ans
+
+
+# (provider, model_size) -> LLM name, to find the spec of a provider instance
+_PROVIDER_INDEX = {
+    (entry["provider"], entry.get("model_size")): llm
+    for llm, entry in MODEL_CATALOG.items()
+}
+
+
+def provider_spec(provider_cls, model_size=None):
+    """Spec of the model model_size of a provider class (or of one of its parents)"""
+    for cls in provider_cls.__mro__:
+        provider = f"{cls.__module__.rsplit('.', 1)[-1]}.{cls.__name__}"
+        if (provider, model_size) in _PROVIDER_INDEX:
+            return get_spec(_PROVIDER_INDEX[(provider, model_size)])
+    raise ValueError(f"Unknown model for {provider_cls.__name__}: {model_size}")
+
+
+def load_provider(provider):
+    """Imports the provider module and returns the class, e.g. "ollama.LLM_Ollama" """
+    module_name, class_name = provider.rsplit(".", 1)
+    module = importlib.import_module(f".{module_name}", __package__)
+    return getattr(module, class_name)
+
+
+def create_llm(llm, bedrock_client=None):
+    """Imports the provider of the LLM and creates an instance"""
+    spec = get_spec(llm)
+    provider_cls = load_provider(spec["provider"])
+    args = [bedrock_client] if spec["bedrock_client"] else []
+    kwargs = dict(spec["init_kwargs"])
+    if spec["model_size"] is not None:
+        kwargs[spec["model_arg"]] = spec["model_size"]
+    return provider_cls(*args, **kwargs)
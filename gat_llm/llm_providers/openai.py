@@ -1,13 +1,15 @@
-import re
 import json
-import time
-import types
 
-from openai import OpenAI
 from .base_service import LLM_Service
+from .client_registry import CLIENT_REGISTRY
+from .call_session import CallSession
+from .stream_events import ReasoningDelta, StreamStop, TextDelta, ToolCallDelta
+from .usage import UsageLog, update_openai_usage
 
 
 class LLM_GPT_OpenAI(LLM_Service):
+    supports_stream_deltas = True
+
     def __init__(self, model_size, reasoning_effort=None):
         """Constructor
         Arguments:
@@ -15,67 +17,9 @@ class LLM_GPT_OpenAI(LLM_Service):
             reasoning_effort - one of [minimal, low, medium, and high].
         """
         self.openai_client = None
-        if model_size == "GPT5 OpenAI":
-            self.model_id = "gpt-5"
-            self.llm_description = "OpenAI GPT5 (Large-size LLM) - directly from OpenAI"
-            self.price_per_M_input_tokens = 1.25
-            self.price_per_M_output_tokens = 10
-        elif model_size == "GPT5_1 OpenAI":
-            self.model_id = "gpt-5.1"
-            self.llm_description = (
-                "OpenAI GPT5.1 (Large-size LLM) - directly from OpenAI"
-            )
-            self.price_per_M_input_tokens = 1.25
-            self.price_per_M_output_tokens = 10
-        elif model_size == "GPT5_2 OpenAI":
-            self.model_id = "gpt-5.2"
-            self.llm_description = (
-                "OpenAI GPT5.2 (Large-size LLM) - directly from OpenAI"
-            )
-            self.price_per_M_input_tokens = 1.75
-            self.price_per_M_output_tokens = 14
-        elif model_size == "GPT5 mini OpenAI":
-            self.model_id = "gpt-5-mini"
-            self.llm_description = (
-                "OpenAI GPT5 mini (Medium-size LLM) - directly from OpenAI"
-            )
-            self.price_per_M_input_tokens = 0.25
-            self.price_per_M_output_tokens = 2
-        elif model_size == "GPT5 nano OpenAI":
-            self.model_id = "gpt-5-nano"
-            self.llm_description = (
-                "OpenAI GPT5 nano (Small-size LLM) - directly from OpenAI"
-            )
-            self.price_per_M_input_tokens = 0.25
-            self.price_per_M_output_tokens = 2
-        elif model_size == "GPT4_1 OpenAI":
-            self.model_id = "gpt-4.1-2025-04-14"
-            self.llm_description = (
-                "OpenAI GPT4.1 (Large-size LLM) - directly from OpenAI"
-            )
-            self.price_per_M_input_tokens = 2
-            self.price_per_M_output_tokens = 8
-        elif model_size == "GPT4o OpenAI":
-            self.model_id = "gpt-4o-2024-05-13"
-            self.llm_description = (
-                "OpenAI GPT4o (Large-size LLM) - directly from OpenAI"
-            )
-            self.price_per_M_input_tokens = 5
-            self.price_per_M_output_tokens = 15
-        elif model_size == "GPT3_5 OpenAI":
-            self.model_id = "gpt-3.5-turbo-0125"
-            self.llm_description = (
-                "OpenAI 3.5 Turbo (Medium-size LLM) - directly from OpenAI"
-            )
-            self.price_per_M_input_tokens = 0.5
-            self.price_per_M_output_tokens = 1.5
-        elif model_size == "GPT4o mini OpenAI":
-            self.model_id = "gpt-4o-mini-2024-07-18"
-            self.llm_description = (
-                "OpenAI 4o Mini (Small-size LLM) - directly from OpenAI"
-            )
-            self.price_per_M_input_tokens = 0.15
-            self.price_per_M_output_tokens = 0.6
+        # None for the client of the event loop of each call, from CLIENT_REGISTRY
+        self.openai_async_client = None
+        self._load_model_spec(model_size)
 
         self.config = {
             # "messages": prompt,
@@ -92,8 +36,10 @@ class LLM_GPT_OpenAI(LLM_Service):
         if reasoning_effort is not None:
             self.config["reasoning_effort"] = reasoning_effort
 
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
 
     def _prepare_prompt_from_list(self, msg_list):
         """Receives a list of dictionaries containing keys
@@ -103,6 +49,14 @@ class LLM_GPT_OpenAI(LLM_Service):
         ans = msg_list
         return ans
 
+    def _image_block(self, b64img, media_type):
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{media_type};base64,{b64img}",
+            },
+        }
+
     def _prepare_call_list_from_history(
         self, system_prompt, msg, b64images, chat_history
     ):
@@ -122,17 +76,11 @@ class LLM_GPT_OpenAI(LLM_Service):
         else:
             if not isinstance(b64images, list):
                 b64images = [b64images]
+            # the images are kept in the history as references
             cur_content = []
             for b64img in b64images:
                 if b64img is not None:
-                    cur_content.append(
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{b64img}",
-                            },
-                        },
-                    )
+                    cur_content.append(self._image_ref(b64img))
             cur_content.append({"type": "text", "text": msg})
             history_list.append({"role": "user", "content": cur_content})
         return history_list
@@ -148,6 +96,8 @@ class LLM_GPT_OpenAI(LLM_Service):
         tool_invoker_fn=None,
         max_retries=25,
         cur_fail_sleep=60,
+        stream_deltas=False,
+        session=None,
     ):
         """
         Invokes the OpenAI model to run an inference
@@ -162,27 +112,63 @@ class LLM_GPT_OpenAI(LLM_Service):
                 function name - function to call
                 return_results_only - we set to True because we already use Claude format
                 kwargs - arguments to the tool that will be called
+        stream_deltas: if True, yields the events in stream_events instead of the
+            cumulative answer
+        session: CallSession that receives the state of the call
         :return: Inference response from the model.
         """
-        # create client if it hasn't been created already
-        if self.openai_client is None:
-            try:
-                self.openai_client = OpenAI()
-            except Exception:
-                pass
+        body = self._prepare_body(
+            prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+        )
+        yield from self._run_tool_loop(
+            session,
+            body,
+            postpend,
+            tool_invoker_fn,
+            max_retries,
+            cur_fail_sleep,
+            stream_deltas=stream_deltas,
+        )
 
-        # Messages that had to be added because of function use
-        self.tool_use_added_msgs = []
-
-        # try:
-        # The different model providers have individual request and response formats.
-        # For the format, ranges, and default values for Meta Llama 2 Chat, refer to:
-        # https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-meta.html
+    async def ainvoke_streaming(
+        self,
+        prompt,
+        b64image=None,
+        postpend="",
+        extra_stop_sequences=[],
+        tools=None,
+        tool_invoker_fn=None,
+        max_retries=25,
+        cur_fail_sleep=60,
+        stream_deltas=False,
+        session=None,
+    ):
+        """Async counterpart of invoke_streaming, using openai.AsyncOpenAI.
+        Yields the same chunks.
+        """
+        body = self._prepare_body(
+            prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+        )
+        async for x in self._arun_tool_loop(
+            session,
+            body,
+            postpend,
+            tool_invoker_fn,
+            max_retries,
+            cur_fail_sleep,
+            stream_deltas=stream_deltas,
+        ):
+            yield x
 
-        # start time
-        t0 = time.time()
+    def _prepare_body(
+        self, prompt, postpend, extra_stop_sequences, tools, tool_invoker_fn
+    ):
+        """Builds the request body sent to the OpenAI compatible API"""
         body = self.config.copy()
         body["messages"] = prompt
+        if body.get("stream") and self.model_spec["supports_stream_usage"]:
+            # the last chunk of the stream reports the token usage
+            body["stream_options"] = {"include_usage": True}
 
         if tools is None:
             body["messages"].append({"role": "assistant", "content": postpend})
@@ -203,173 +189,199 @@ class LLM_GPT_OpenAI(LLM_Service):
             assert (
                 tool_invoker_fn is not None
             ), "When using tools, a tool invoker must be provided"
+        return body
 
-        for k in range(max_retries):
+    def _invoke_model(self, body):
+        # create client if it hasn't been created already
+        if self.openai_client is None:
             try:
-                self.debug_body = body
-                llm_body_changed = True
-                while llm_body_changed:
-                    llm_body_changed = False
-                    word_count = len(re.findall(r"\w+", str(body["messages"])))
-                    print(f"Invoking {self.llm_description}. Word count: {word_count}")
-                    response = self.openai_client.chat.completions.create(**body)
-
-                    # stream responses
-                    if body["stream"]:
-                        partial_ans = self._response_gen(response, postpend)
-                        x = ""
-                        for x in partial_ans:
-                            yield x
-                        cur_ans = x
-                    else:
-                        self.cur_tool_specs = []
-                        cur_ans = response.choices[0].message.content
-                        cur_ans = cur_ans if cur_ans is not None else ""
-                        yield cur_ans
-                        self.stop_reason = response.choices[0].finish_reason
-                        if (
-                            hasattr(response.choices[0].message, "tool_calls")
-                            and response.choices[0].message.tool_calls
-                        ):
-                            for tool in response.choices[0].message.tool_calls:
-                                cur_tool_spec = {
-                                    "id": tool.id,
-                                    "tool_name": tool.function.name,
-                                    "input": tool.function.arguments,
-                                }
-                                cur_tool_spec["input"] = (
-                                    cur_tool_spec["input"]
-                                    if isinstance(cur_tool_spec["input"], dict)
-                                    else json.loads(cur_tool_spec["input"])
-                                )
-                                self.cur_tool_specs.append(cur_tool_spec)
-
-                    if len(self.cur_tool_specs) > 0:
-                        ans_to_append = cur_ans
-                        for cur_tool_spec in self.cur_tool_specs:
-                            # tool use has been required. Let's do it
-                            # TODO: update upstream to reflect the inclusion of a response
-                            # TODO: probably rework gradio UI to re-instantiate things every chat, or keep an instance per chat ID
-                            tool_ans = tool_invoker_fn(
-                                cur_tool_spec["tool_name"],
-                                return_results_only=True,
-                                **cur_tool_spec["input"],
-                            )
-                            if isinstance(tool_ans, types.GeneratorType):
-                                for partial_ans in tool_ans:
-                                    yield partial_ans
-                                tool_ans = partial_ans
-
-                            # append assistant responses
-                            assistant_msg = {
-                                "role": "assistant",
-                                "content": [
-                                    {
-                                        "type": "text",
-                                        "text": ans_to_append,
-                                    },
-                                ],
-                                "tool_calls": [
-                                    {
-                                        "id": cur_tool_spec["id"],
-                                        "type": "function",
-                                        "function": {
-                                            "name": cur_tool_spec["tool_name"],
-                                            "arguments": json.dumps(
-                                                cur_tool_spec["input"]
-                                            ),
-                                        },
-                                    }
-                                ],
-                            }
-                            # only include original message once
-                            ans_to_append = ""
-
-                            next_user_msg = {
-                                "role": "tool",
-                                "content": tool_ans,
-                                "tool_call_id": cur_tool_spec["id"],
-                            }
-                            body["messages"].append(assistant_msg)
-                            body["messages"].append(next_user_msg)
-
-                            # keep a log of messages that had to be appended due to tool use
-                            self.tool_use_added_msgs.append(assistant_msg)
-                            self.tool_use_added_msgs.append(next_user_msg)
-                        llm_body_changed = True
-
-                    # TODO: Include proper token count and pricing
-                    ans_word_count = len(
-                        re.findall(r"\w+", postpend + cur_ans + str(self.stop_reason))
-                    )
-                    self.word_counts.append(
-                        {
-                            "request_word_count": word_count,
-                            "answer_word_count": ans_word_count,
-                            "price_estimate": 0.001
-                            * (0.003 * word_count + 0.015 * ans_word_count),
-                            "exec_time_in_s": time.time() - t0,
-                        }
-                    )
-                return
-            except Exception as e:
-                yield f"Error {str(e)}. Waiting {int(cur_fail_sleep)} s. Retrying {k+1}/{max_retries}..."
-                time.sleep(int(cur_fail_sleep))
-                cur_fail_sleep *= 1.2
-        yield "Could not invoke the AI model."
-
-    def _response_gen(self, response_body, postpend=""):
-        cur_ans = ""
-        cur_reasoning = ""
-        cur_tool_specs = []
-        cur_tool_spec = None
-        for x in response_body:
-            txt = ""
-
-            if (
-                x.choices[0].delta.tool_calls is not None
-                and x.choices[0].delta.tool_calls[0].id is not None
-            ):
-                cur_tool_spec = x.choices[0].delta.tool_calls[0].__dict__.copy()
-                cur_tool_spec["arguments"] = ""
-                cur_tool_specs.append(cur_tool_spec)
+                self.openai_client = CLIENT_REGISTRY.openai_client()
+            except Exception:
+                pass
+        return self.openai_client.chat.completions.create(**body)
 
-            if (
-                hasattr(x.choices[0].delta, "reasoning")
-                and x.choices[0].delta.reasoning is not None
-            ):
-                cur_reasoning += x.choices[0].delta.reasoning
+    async def _ainvoke_model(self, body):
+        client = getattr(self, "openai_async_client", None)
+        if client is None:
+            # the async client is tied to the event loop of the call
+            if self.openai_client is None:
+                client = CLIENT_REGISTRY.async_openai_client()
+            else:
+                # same endpoint and credentials as the sync client (Ollama, vLLM, Grok, etc)
+                client = CLIENT_REGISTRY.async_openai_client(
+                    base_url=str(self.openai_client.base_url),
+                    api_key=self.openai_client.api_key,
+                )
+        return await client.chat.completions.create(**body)
 
-            txt = (
-                x.choices[0].delta.content
-                if x.choices[0].delta.content is not None
-                else ""
+    def _get_tool_calls(self, session):
+        # tool use has been required. Let's do it
+        return [
+            (cur_tool_spec["tool_name"], cur_tool_spec["input"])
+            for cur_tool_spec in session.cur_tool_specs
+        ]
+
+    def _append_tool_turn(self, session, body, cur_ans, tool_answers):
+        ans_to_append = cur_ans
+        for cur_tool_spec, tool_ans in zip(session.cur_tool_specs, tool_answers):
+            # append assistant responses
+            assistant_msg = {
+                "role": "assistant",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": ans_to_append,
+                    },
+                ],
+                "tool_calls": [
+                    {
+                        "id": cur_tool_spec["id"],
+                        "type": "function",
+                        "function": {
+                            "name": cur_tool_spec["tool_name"],
+                            "arguments": json.dumps(cur_tool_spec["input"]),
+                        },
+                    }
+                ],
+            }
+            # only include original message once
+            ans_to_append = ""
+
+            next_user_msg = {
+                "role": "tool",
+                "content": tool_ans,
+                "tool_call_id": cur_tool_spec["id"],
+            }
+            body["messages"].append(assistant_msg)
+            body["messages"].append(next_user_msg)
+
+            # keep a log of messages that had to be appended due to tool use
+            session.tool_use_added_msgs.append(assistant_msg)
+            session.tool_use_added_msgs.append(next_user_msg)
+
+    def _response_gen(
+        self, response_body, postpend="", stream_deltas=False, session=None
+    ):
+        if self.config["stream"]:
+            yield from super()._response_gen(
+                response_body, postpend, stream_deltas, session
             )
-            if (
-                x.choices[0].delta.tool_calls is not None
-                and x.choices[0].delta.tool_calls[0].function.arguments is not None
+        else:
+            yield from self._full_response_outputs(
+                response_body, stream_deltas, session
+            )
+
+    async def _aresponse_gen(
+        self, response_body, postpend="", stream_deltas=False, session=None
+    ):
+        if self.config["stream"]:
+            async for x in super()._aresponse_gen(
+                response_body, postpend, stream_deltas, session
             ):
-                cur_tool_spec["arguments"] += (
-                    x.choices[0].delta.tool_calls[0].function.arguments
-                )
+                yield x
+        else:
+            for x in self._full_response_outputs(response_body, stream_deltas, session):
+                yield x
 
-            if txt != "" or cur_reasoning != "":
-                cur_ans += txt
-                reasoning_string = (
-                    f"<think>{cur_reasoning}</think>" if cur_reasoning != "" else ""
-                )
-                yield postpend + reasoning_string + cur_ans
+    def _full_response_outputs(self, response, stream_deltas, session=None):
+        if session is None:
+            session = CallSession()
+        if not stream_deltas:
+            yield from self._full_response_gen(response, session)
+            return
+        for x in self._full_response_gen(response, session):
+            if x != "":
+                yield TextDelta(x)
+        yield StreamStop(session.stop_reason)
 
-            stop_reason = x.choices[0].finish_reason
-            if stop_reason is not None and stop_reason == "stop_sequence":
-                stop_txt = x.delta.stop_sequence
-                reasoning_string = (
-                    f"<think>{cur_reasoning}</think>" if cur_reasoning != "" else ""
+    def _full_response_gen(self, response, session):
+        """Handles answers when streaming is disabled"""
+        session.cur_tool_specs = []
+        cur_ans = response.choices[0].message.content
+        cur_ans = cur_ans if cur_ans is not None else ""
+        yield cur_ans
+        session.stop_reason = response.choices[0].finish_reason
+        if getattr(response, "usage", None) is not None:
+            session.last_usage = update_openai_usage(None, response.usage)
+        if (
+            hasattr(response.choices[0].message, "tool_calls")
+            and response.choices[0].message.tool_calls
+        ):
+            for tool in response.choices[0].message.tool_calls:
+                cur_tool_spec = {
+                    "id": tool.id,
+                    "tool_name": tool.function.name,
+                    "input": tool.function.arguments,
+                }
+                cur_tool_spec["input"] = (
+                    cur_tool_spec["input"]
+                    if isinstance(cur_tool_spec["input"], dict)
+                    else json.loads(cur_tool_spec["input"])
                 )
-                yield postpend + reasoning_string + cur_ans + stop_txt
-                break
+                session.cur_tool_specs.append(cur_tool_spec)
+
+    def _process_stream_chunk(self, state, x):
+        if getattr(x, "usage", None) is not None:
+            state["usage"] = update_openai_usage(state["usage"], x.usage)
+        # the usage chunk has no choices
+        if len(x.choices) == 0:
+            return
+
+        txt = ""
+        arguments = ""
+
+        if (
+            x.choices[0].delta.tool_calls is not None
+            and x.choices[0].delta.tool_calls[0].id is not None
+        ):
+            # plain data, so that the stream state can be stored in the response cache
+            tool_call = x.choices[0].delta.tool_calls[0]
+            state["cur_tool_spec"] = {
+                "id": tool_call.id,
+                "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": ""},
+            }
+            state["cur_tool_specs"].append(state["cur_tool_spec"])
+            yield ToolCallDelta(tool_call.id, tool_call.function.name)
+
+        if (
+            hasattr(x.choices[0].delta, "reasoning")
+            and x.choices[0].delta.reasoning is not None
+            and x.choices[0].delta.reasoning != ""
+        ):
+            yield ReasoningDelta(x.choices[0].delta.reasoning)
+
+        txt = (
+            x.choices[0].delta.content if x.choices[0].delta.content is not None else ""
+        )
+        if (
+            x.choices[0].delta.tool_calls is not None
+            and x.choices[0].delta.tool_calls[0].function.arguments is not None
+        ):
+            arguments = x.choices[0].delta.tool_calls[0].function.arguments
+            state["cur_tool_spec"]["function"]["arguments"] += arguments
+        if x.choices[0].delta.tool_calls is not None and arguments != "":
+            yield ToolCallDelta(
+                state["cur_tool_spec"]["id"],
+                state["cur_tool_spec"]["function"]["name"],
+                arguments,
+            )
+
+        if txt != "":
+            yield TextDelta(txt)
+
+        stop_reason = x.choices[0].finish_reason
+        state["stop_reason"] = stop_reason
+        if stop_reason is not None and stop_reason == "stop_sequence":
+            stop_txt = x.delta.stop_sequence
+            yield StreamStop(stop_reason, stop_txt)
+            state["finished"] = True
+
+    def _finish_stream(self, state):
+        cur_tool_specs = state["cur_tool_specs"]
         if len(cur_tool_specs) > 0:
             for cur_tool_spec in cur_tool_specs:
+                cur_tool_spec["arguments"] = cur_tool_spec["function"]["arguments"]
                 cur_tool_spec["arguments"] = cur_tool_spec["arguments"].split("{")[1:]
                 cur_tool_spec["arguments"] = "{" + "{".join(cur_tool_spec["arguments"])
 
@@ -379,11 +391,9 @@ class LLM_GPT_OpenAI(LLM_Service):
                     if isinstance(cur_tool_spec["arguments"], dict)
                     else json.loads(cur_tool_spec["arguments"])
                 )
-                cur_tool_spec["tool_name"] = cur_tool_spec["function"].name
-                cur_tool_spec.pop("index", None)
+                cur_tool_spec["tool_name"] = cur_tool_spec["function"]["name"]
                 cur_tool_spec.pop("type", None)
                 cur_tool_spec.pop("function", None)
                 cur_tool_spec.pop("arguments", None)
 
-        self.cur_tool_specs = cur_tool_specs
-        self.stop_reason = stop_reason
+        state["cur_tool_specs"] = cur_tool_specs
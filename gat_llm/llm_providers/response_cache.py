@@ -0,0 +1,269 @@
+""" Cache of model responses, so that identical requests are replayed instead of sent again
+
+Each entry is one model call: the stream events of every chunk, in the original chunking,
+plus the stream state needed to finish the answer (tool calls and stop reason).
+Tool-calling conversations are therefore cached call by call.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .stream_events import (
+    ReasoningDelta,
+    StatusMessage,
+    StreamStop,
+    TextDelta,
+    ToolCallDelta,
+    ToolResult,
+)
+
+
+EVENT_TYPES = {
+    cls.__name__: cls
+    for cls in [
+        TextDelta,
+        ReasoningDelta,
+        ToolCallDelta,
+        ToolResult,
+        StreamStop,
+        StatusMessage,
+    ]
+}
+# stream state saved with each entry. The rest of the state only matters while streaming
+CACHED_STATE_KEYS = ["cur_tool_spec", "cur_tool_specs", "stop_reason"]
+
+
+def cache_key(model_id, body, postpend=""):
+    """Canonical hash of a model call.
+    body holds the system prompt, messages, tools and stop sequences
+    """
+    canonical = json.dumps(
+        {"model_id": model_id, "body": body, "postpend": postpend},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def event_to_dict(event):
+    return {"type": type(event).__name__, **event.__dict__}
+
+
+def event_from_dict(event_dict):
+    cls = EVENT_TYPES[event_dict["type"]]
+    event = cls.__new__(cls)
+    event.__dict__.update({k: v for k, v in event_dict.items() if k != "type"})
+    return event
+
+
+class ReplayedChunk:
+    def __init__(self, events):
+        """Chunk of a cached response: the events are used as if the provider had parsed them"""
+        self.events = events
+
+
+class CachedResponse:
+    def __init__(self, entry):
+        """Replays a cached model call in place of the provider response stream"""
+        self.entry = entry
+
+    def chunks(self):
+        for events in self.entry["chunks"]:
+            yield ReplayedChunk([event_from_dict(x) for x in events])
+
+    def __iter__(self):
+        return self.chunks()
+
+    async def __aiter__(self):
+        for chunk in self.chunks():
+            yield chunk
+
+    def final_state(self):
+        return json.loads(json.dumps(self.entry["state"]))
+
+
+class RecordingResponse:
+    def __init__(self, response, response_cache, key):
+        """Wraps a provider response stream and stores it in the cache once it is complete"""
+        self.response = response
+        self.response_cache = response_cache
+        self.key = key
+        self.chunks = []
+
+    def __iter__(self):
+        return iter(self.response)
+
+    def __aiter__(self):
+        return self.response.__aiter__()
+
+    def add_chunk(self, events):
+        self.chunks.append([event_to_dict(x) for x in events])
+
+    def save(self, state):
+        """Stores the response. state is the stream state before _finish_stream"""
+        self.response_cache.put(
+            self.key,
+            {
+                "chunks": self.chunks,
+                "state": json.loads(
+                    json.dumps({k: state[k] for k in CACHED_STATE_KEYS})
+                ),
+            },
+        )
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries=256,
+        cache_dir=None,
+        max_disk_mb=512,
+        ttl_in_s=None,
+    ):
+        """LRU cache of model responses in memory, optionally persisted to disk.
+
+        Arguments:
+            max_entries: number of responses kept in memory
+            cache_dir: folder where responses are stored as json files. None to keep them in memory only
+            max_disk_mb: the least recently used files are deleted above this size
+            ttl_in_s: responses older than this are not used. None to keep them until evicted
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self.ttl_in_s = ttl_in_s
+        # key -> (creation time, entry)
+        self.memory = OrderedDict()
+        self.metrics = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+        self.lock = threading.Lock()
+
+        self.disk_bytes = 0
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.disk_bytes = sum(
+                x.stat().st_size
+                for x in os.scandir(self.cache_dir)
+                if x.name.endswith(".json")
+            )
+
+    def get(self, key):
+        """Returns the cached entry or None"""
+        with self.lock:
+            if key in self.memory:
+                created, entry = self.memory[key]
+                if not self._expired(created):
+                    self.memory.move_to_end(key)
+                    self.metrics["hits"] += 1
+                    return entry
+                # the file, if any, is as old as the entry in memory
+                del self.memory[key]
+                if self.cache_dir is not None:
+                    self._remove_file(self._path(key))
+                self.metrics["expired"] += 1
+                self.metrics["misses"] += 1
+                return None
+
+            entry = self._read_from_disk(key)
+            if entry is None:
+                self.metrics["misses"] += 1
+                return None
+            self.metrics["hits"] += 1
+            self.metrics["disk_hits"] += 1
+            return entry
+
+    def put(self, key, entry):
+        created = time.time()
+        with self.lock:
+            self._put_in_memory(key, created, entry)
+            if self.cache_dir is not None:
+                self._write_to_disk(key, created, entry)
+            self.metrics["stores"] += 1
+
+    def stats(self):
+        """Hit/miss metrics and sizes"""
+        with self.lock:
+            ans = dict(self.metrics)
+            lookups = ans["hits"] + ans["misses"]
+            ans["hit_rate"] = ans["hits"] / lookups if lookups > 0 else 0
+            ans["entries_in_memory"] = len(self.memory)
+            ans["disk_bytes"] = self.disk_bytes
+        return ans
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.cache_dir is not None:
+                for x in os.scandir(self.cache_dir):
+                    if x.name.endswith(".json"):
+                        os.remove(x.path)
+                self.disk_bytes = 0
+
+    def _expired(self, created):
+        return self.ttl_in_s is not None and time.time() - created > self.ttl_in_s
+
+    def _put_in_memory(self, key, created, entry):
+        self.memory[key] = (created, entry)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.metrics["evictions"] += 1
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_from_disk(self, key):
+        if self.cache_dir is None or not os.path.isfile(self._path(key)):
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Could not read cached response {key}: {e}")
+            self._remove_file(self._path(key))
+            return None
+        if self._expired(data["created"]):
+            self._remove_file(self._path(key))
+            self.metrics["expired"] += 1
+            return None
+        # last use time, for the LRU eviction of files
+        os.utime(self._path(key))
+        self._put_in_memory(key, data["created"], data["entry"])
+        return data["entry"]
+
+    def _write_to_disk(self, key, created, entry):
+        path = self._path(key)
+        self._remove_file(path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created": created, "entry": entry}, f)
+        os.replace(tmp_path, path)
+        self.disk_bytes += os.path.getsize(path)
+        if self.disk_bytes > self.max_disk_bytes:
+            self._evict_from_disk()
+
+    def _evict_from_disk(self):
+        files = sorted(
+            [x for x in os.scandir(self.cache_dir) if x.name.endswith(".json")],
+            key=lambda x: x.stat().st_mtime,
+        )
+        for x in files:
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            self._remove_file(x.path)
+            self.metrics["evictions"] += 1
+
+    def _remove_file(self, path):
+        if os.path.isfile(path):
+            self.disk_bytes -= os.path.getsize(path)
+            os.remove(path)
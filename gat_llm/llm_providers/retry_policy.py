@@ -0,0 +1,211 @@
+""" Retry, backoff and circuit breaking shared by the LLM providers
+"""
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+
+# error classes returned by classify_error
+THROTTLING = "throttling"
+TRANSIENT = "transient"
+FATAL = "fatal"
+UNKNOWN = "unknown"
+
+THROTTLING_CODES = [
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "RateLimitError",
+]
+TRANSIENT_CODES = [
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "ModelStreamErrorException",
+    "APIConnectionError",
+    "APITimeoutError",
+    "InternalServerError",
+    "EndpointConnectionError",
+    "ConnectTimeoutError",
+    "ReadTimeoutError",
+]
+FATAL_CODES = [
+    "ValidationException",
+    "AccessDeniedException",
+    "ResourceNotFoundException",
+    "UnrecognizedClientException",
+    "BadRequestError",
+    "AuthenticationError",
+    "PermissionDeniedError",
+    "NotFoundError",
+    "UnprocessableEntityError",
+    # raised before sending, see context_manager.py
+    "ContextWindowExceeded",
+]
+
+
+def _status_code(e):
+    """HTTP status of an openai/anthropic (status_code) or botocore (response dict) error"""
+    status_code = getattr(e, "status_code", None)
+    response = getattr(e, "response", None)
+    if status_code is None and isinstance(response, dict):
+        status_code = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return status_code
+
+
+def _error_code(e):
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code", type(e).__name__)
+    return type(e).__name__
+
+
+def classify_error(e):
+    """Returns THROTTLING, TRANSIENT, FATAL (the request itself is wrong) or UNKNOWN"""
+    error_code = _error_code(e)
+    if error_code in THROTTLING_CODES:
+        return THROTTLING
+    if error_code in TRANSIENT_CODES:
+        return TRANSIENT
+    if error_code in FATAL_CODES:
+        return FATAL
+
+    status_code = _status_code(e)
+    if status_code == 429:
+        return THROTTLING
+    if status_code in [408, 409] or (status_code is not None and status_code >= 500):
+        return TRANSIENT
+    if status_code is not None and 400 <= status_code < 500:
+        return FATAL
+
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return TRANSIENT
+    return UNKNOWN
+
+
+def retry_after(e):
+    """Seconds to wait according to the Retry-After headers of the error, if any"""
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders")
+    else:
+        headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers.get("retry-after-ms")) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP date
+            return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        """Fails fast while a backend is down.
+
+        Opens after failure_threshold consecutive throttling/transient errors.
+        Every reset_timeout seconds, one trial request is let through: success closes
+        the circuit, failure keeps it open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.n_failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at < self.reset_timeout:
+                return False
+            # half-open: let this request check the backend and block the others
+            self.opened_at = time.time()
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.n_failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.n_failures += 1
+            if self.n_failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+    def is_open(self):
+        return self.opened_at is not None
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_delay=60,
+        backoff_multiplier=2,
+        failure_threshold=5,
+        reset_timeout=60,
+    ):
+        """Decides if and when a failed LLM call is retried.
+
+        Arguments:
+            max_delay: maximum wait between attempts, in seconds
+            backoff_multiplier: the wait is multiplied by this after each attempt
+            failure_threshold: consecutive backend errors that open a circuit
+            reset_timeout: seconds before an open circuit lets a trial request through
+        """
+        self.max_delay = max_delay
+        self.backoff_multiplier = backoff_multiplier
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # one circuit breaker per provider
+        self.circuit_breakers = {}
+        self.lock = threading.Lock()
+
+    def circuit_breaker(self, key):
+        with self.lock:
+            if key not in self.circuit_breakers:
+                self.circuit_breakers[key] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self.circuit_breakers[key]
+
+    def allow_request(self, key):
+        return self.circuit_breaker(key).allow_request()
+
+    def record_success(self, key):
+        self.circuit_breaker(key).record_success()
+
+    def on_failure(self, key, e, attempt, max_retries, base_delay):
+        """Records a failed attempt (0-based) and returns how long to wait before
+        the next one, or None if the call should not be retried
+        """
+        error_class = classify_error(e)
+        if error_class in [THROTTLING, TRANSIENT]:
+            self.circuit_breaker(key).record_failure()
+        if error_class == FATAL or attempt + 1 >= max_retries:
+            return None
+        return self.delay(e, attempt, base_delay)
+
+    def delay(self, e, attempt, base_delay):
+        """Exponential backoff with jitter. Retry-After, when present, takes precedence"""
+        server_delay = retry_after(e)
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        delay = min(base_delay * self.backoff_multiplier**attempt, self.max_delay)
+        return random.uniform(delay / 2, delay)
+
+
+# used by all the providers unless an instance sets its own retry_policy
+DEFAULT_RETRY_POLICY = RetryPolicy()
@@ -0,0 +1,119 @@
+""" Typed incremental events yielded by the LLM providers in delta streaming mode
+
+In the default (cumulative) mode, providers yield the whole answer generated so far
+on every chunk. With stream_deltas=True they yield these events instead, and
+CumulativeAnswer rebuilds the cumulative string only when a consumer asks for it.
+"""
+
+
+class StreamEvent:
+    kind = "event"
+
+    def __init__(self, text=""):
+        self.text = text
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.text!r})"
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.__dict__ == other.__dict__
+
+
+class TextDelta(StreamEvent):
+    """New text generated by the model"""
+
+    kind = "text"
+
+
+class ReasoningDelta(StreamEvent):
+    """New reasoning (thinking) text generated by the model"""
+
+    kind = "reasoning"
+
+
+class ToolCallDelta(StreamEvent):
+    """Part of a tool call being generated. text holds the partial JSON input"""
+
+    kind = "tool_call"
+
+    def __init__(self, tool_id, tool_name, text=""):
+        self.tool_id = tool_id
+        self.tool_name = tool_name
+        self.text = text
+
+
+class ToolResult(StreamEvent):
+    """Output of a tool. Partial outputs of generator tools replace the previous ones"""
+
+    kind = "tool_result"
+
+    def __init__(self, tool_name, text=""):
+        self.tool_name = tool_name
+        self.text = text
+
+
+class StreamStop(StreamEvent):
+    """End of one model answer. text holds the stop sequence that was hit, if any"""
+
+    kind = "stop"
+
+    def __init__(self, stop_reason=None, text=""):
+        self.stop_reason = stop_reason
+        self.text = text
+
+
+class StatusMessage(StreamEvent):
+    """Messages that are not generated by the model, like errors and retries"""
+
+    kind = "status"
+
+
+class CumulativeAnswer:
+    def __init__(self, postpend=""):
+        """Materialises the cumulative answer from delta events.
+
+        value() returns the same string that cumulative mode would have yielded last:
+        a new model answer restarts the text, and tool outputs or status messages
+        are shown while they are the most recent event.
+
+        Arguments:
+            postpend: text that was put in the mouth of the LLM
+        """
+        self.postpend = postpend
+        self.text_parts = []
+        self.reasoning_parts = []
+        self.stop_text = ""
+        self.other_text = None
+        self.restart_on_text = False
+
+    def add(self, event):
+        if isinstance(event, (TextDelta, ReasoningDelta)):
+            if self.restart_on_text:
+                self.text_parts = []
+                self.reasoning_parts = []
+                self.stop_text = ""
+                self.restart_on_text = False
+            self.other_text = None
+            if isinstance(event, TextDelta):
+                self.text_parts.append(event.text)
+            else:
+                self.reasoning_parts.append(event.text)
+        elif isinstance(event, StreamStop):
+            self.stop_text = event.text
+            self.restart_on_text = True
+        elif isinstance(event, (ToolResult, StatusMessage)):
+            self.other_text = event.text
+            self.restart_on_text = True
+
+    def text(self):
+        """Answer of the current model turn, including postpend and reasoning"""
+        reasoning = "".join(self.reasoning_parts)
+        reasoning_string = f"<think>{reasoning}</think>" if reasoning != "" else ""
+        return (
+            self.postpend + reasoning_string + "".join(self.text_parts) + self.stop_text
+        )
+
+    def value(self):
+        if self.other_text is not None:
+            return self.other_text
+        return self.text()
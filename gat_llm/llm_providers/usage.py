@@ -0,0 +1,148 @@
+""" Token usage and cost accounting for the LLM providers
+"""
+import threading
+from collections import deque
+
+
+USAGE_KEYS = [
+    "input_tokens",
+    "output_tokens",
+    "cache_read_tokens",
+    "cache_write_tokens",
+]
+
+# maps the names of the usage fields returned by each provider to USAGE_KEYS
+ANTHROPIC_USAGE_FIELDS = {
+    "input_tokens": "input_tokens",
+    "output_tokens": "output_tokens",
+    "cache_read_input_tokens": "cache_read_tokens",
+    "cache_creation_input_tokens": "cache_write_tokens",
+}
+NOVA_USAGE_FIELDS = {
+    "inputTokens": "input_tokens",
+    "outputTokens": "output_tokens",
+    "cacheReadInputTokenCount": "cache_read_tokens",
+    "cacheWriteInputTokenCount": "cache_write_tokens",
+}
+# invocation metrics in the last chunk of the Bedrock InvokeModel streams
+BEDROCK_METRICS_FIELDS = {
+    "inputTokenCount": "input_tokens",
+    "outputTokenCount": "output_tokens",
+}
+
+
+def new_usage():
+    return {k: 0 for k in USAGE_KEYS}
+
+
+def update_usage(usage, reported, fields):
+    """Copies the token counts reported by a provider into a usage dict.
+
+    Arguments:
+        usage: dict with USAGE_KEYS. If None, a new one is created
+        reported: usage returned by the provider, either a dict or an object
+        fields: maps the provider field names to USAGE_KEYS
+    Returns the updated usage dict
+    """
+    if usage is None:
+        usage = new_usage()
+    for provider_key, key in fields.items():
+        if isinstance(reported, dict):
+            value = reported.get(provider_key)
+        else:
+            value = getattr(reported, provider_key, None)
+        if isinstance(value, int):
+            usage[key] = value
+    return usage
+
+
+def bedrock_invocation_usage(out_dict):
+    """Usage reported by Bedrock in a chunk of an InvokeModel stream. None if the chunk has none"""
+    metrics = out_dict.get("amazon-bedrock-invocationMetrics")
+    if metrics is None:
+        return None
+    return update_usage(None, metrics, BEDROCK_METRICS_FIELDS)
+
+
+def update_openai_usage(usage, reported):
+    """OpenAI includes cached tokens in prompt_tokens: keep them separate"""
+    if usage is None:
+        usage = new_usage()
+    details = getattr(reported, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    usage["input_tokens"] = (reported.prompt_tokens or 0) - cached_tokens
+    usage["output_tokens"] = reported.completion_tokens or 0
+    usage["cache_read_tokens"] = cached_tokens
+    return usage
+
+
+class UsageLog:
+    def __init__(
+        self,
+        price_per_M_input_tokens=0,
+        price_per_M_output_tokens=0,
+        cache_read_price_factor=0.1,
+        cache_write_price_factor=1.25,
+        max_records=1000,
+    ):
+        """Keeps the token usage of the last calls to an LLM and their cost.
+        Records can be read like a list, e.g. usage_log[-1]
+
+        Arguments:
+            price_per_M_input_tokens: USD per million input tokens
+            price_per_M_output_tokens: USD per million output tokens
+            cache_read_price_factor: price of cached input tokens, relative to input tokens
+            cache_write_price_factor: price of tokens written to the cache, relative to input tokens
+            max_records: how many records to keep. Totals include all the calls
+        """
+        self.price_per_M_input_tokens = price_per_M_input_tokens
+        self.price_per_M_output_tokens = price_per_M_output_tokens
+        self.cache_read_price_factor = cache_read_price_factor
+        self.cache_write_price_factor = cache_write_price_factor
+        self.records = deque(maxlen=max_records)
+        self.totals = new_usage()
+        self.totals["cost"] = 0
+        self.totals["calls"] = 0
+        # tools running in parallel may use the same LLM
+        self.lock = threading.Lock()
+
+    def add(self, usage, exec_time_in_s=0, reported=True):
+        """Records the usage of one model call.
+
+        Arguments:
+            usage: dict with (some of) USAGE_KEYS
+            exec_time_in_s: time since the call started
+            reported: False if the token counts are estimates, not returned by the provider
+        Returns the record
+        """
+        record = {k: usage.get(k, 0) for k in USAGE_KEYS}
+        record["cost"] = self.cost(record)
+        record["exec_time_in_s"] = exec_time_in_s
+        record["reported"] = reported
+        with self.lock:
+            self.records.append(record)
+            for k in USAGE_KEYS + ["cost"]:
+                self.totals[k] += record[k]
+            self.totals["calls"] += 1
+        return record
+
+    def cost(self, usage):
+        """Cost in USD of the tokens in usage"""
+        input_tokens = (
+            usage.get("input_tokens", 0)
+            + self.cache_read_price_factor * usage.get("cache_read_tokens", 0)
+            + self.cache_write_price_factor * usage.get("cache_write_tokens", 0)
+        )
+        return (
+            input_tokens * self.price_per_M_input_tokens
+            + usage.get("output_tokens", 0) * self.price_per_M_output_tokens
+        ) / 1e6
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, idx):
+        return self.records[idx]
+
+    def __iter__(self):
+        return iter(list(self.records))
@@ -6,8 +6,9 @@ docker run --gpus all -p 8000:8000 vllm/vllm-openai:latest --model Qwen/Qwen3-1.
 
 Since vLLM preallocates GPU and can't offload to CPU, this is a safe command for testing using a 8Gb RAM GPU.
 """
-from openai import OpenAI
+from .client_registry import CLIENT_REGISTRY
 from .openai import LLM_GPT_OpenAI
+from .usage import UsageLog
 
 
 class LLM_VLLM(LLM_GPT_OpenAI):
@@ -16,16 +17,11 @@ class LLM_VLLM(LLM_GPT_OpenAI):
         Arguments:
             model - Desired model
         """
-        # there would be electricity cost for running a model locally
-        # but for now we keep cost at 0
-        self.price_per_M_input_tokens = 0
-        self.price_per_M_output_tokens = 0
-        if model == "Qwen 3 1.7b VLLM":
-            self.model_id = "Qwen/Qwen3-1.7B"
-            self.llm_description = "Qwen 3 1.7b (Tiny-size LLM) - locally from vLLM"
+        # prices are 0, see model_catalog.py
+        self._load_model_spec(model)
 
         try:
-            self.openai_client = OpenAI(
+            self.openai_client = CLIENT_REGISTRY.openai_client(
                 base_url="http://localhost:8000/v1/",
                 api_key="vllm",  # required but ignored
             )
@@ -43,5 +39,7 @@ class LLM_VLLM(LLM_GPT_OpenAI):
             "stop": None,  # the regular is already implemented
             "model": self.model_id,
         }
-        # requests and answer word count
-        self.word_counts = []
+        # token usage and cost of the calls
+        self.usage_log = UsageLog(
+            self.price_per_M_input_tokens, self.price_per_M_output_tokens
+        )
@@ -1,7 +1,17 @@
 import datetime
+import functools
 import importlib.resources
 
 
+@functools.lru_cache(maxsize=None)
+def read_prompt(file_name):
+    """Contents of a prompt file of this package, read once per process"""
+    with importlib.resources.files("gat_llm.prompts").joinpath(file_name).open(
+        "r", encoding="utf-8"
+    ) as f:
+        return f.read()
+
+
 class RAGPromptGenerator:
     def __init__(self, use_native_tools=False):
         """Constructor.
@@ -14,16 +24,10 @@ class RAGPromptGenerator:
         self.prompt = ""
         self.use_native_tools = use_native_tools
         if not use_native_tools:
-            with importlib.resources.files("gat_llm.prompts").joinpath(
-                "prompt_GAT.txt"
-            ).open("r", encoding="utf-8") as f:
-                self.prompt += f.read()
+            self.prompt += read_prompt("prompt_GAT.txt")
 
         # base prompt
-        with importlib.resources.files("gat_llm.prompts").joinpath(
-            "prompt_base.txt"
-        ).open("r", encoding="utf-8") as f:
-            self.prompt += f.read()
+        self.prompt += read_prompt("prompt_base.txt")
 
         dt0 = datetime.datetime.today()
         weekday = dt0.strftime("%A")
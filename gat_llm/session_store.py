@@ -0,0 +1,161 @@
+""" Stores of chat sessions: the history of each conversation, keyed by chat id
+
+LLMInterface reads the history of a chat when a message arrives and writes it back
+once the answer is complete. The in-memory store bounds the number and age of the
+sessions kept by a process; the SQLite store keeps them on disk, where several app
+workers can share them, and only loads the sessions being used.
+"""
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class SessionStore:
+    """Interface of the session stores. Also usable like a dict of chat id -> history"""
+
+    def get(self, chat_id):
+        """Returns the history of the chat or None if it is unknown or expired"""
+        raise NotImplementedError
+
+    def put(self, chat_id, history):
+        raise NotImplementedError
+
+    def delete(self, chat_id):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    def __getitem__(self, chat_id):
+        history = self.get(chat_id)
+        if history is None:
+            raise KeyError(chat_id)
+        return history
+
+    def __setitem__(self, chat_id, history):
+        self.put(chat_id, history)
+
+    def __delitem__(self, chat_id):
+        self.delete(chat_id)
+
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
+
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self, max_sessions=1000, ttl_in_s=24 * 3600):
+        """Sessions kept in process memory, least recently used first evicted.
+
+        Arguments:
+            max_sessions: number of sessions kept
+            ttl_in_s: sessions not used for this long are dropped. None to keep them until evicted
+        """
+        self.max_sessions = max_sessions
+        self.ttl_in_s = ttl_in_s
+        # chat id -> (last use time, history)
+        self.sessions = OrderedDict()
+        self.metrics = {"evictions": 0, "expired": 0}
+        self.lock = threading.Lock()
+
+    def get(self, chat_id):
+        with self.lock:
+            if chat_id not in self.sessions:
+                return None
+            last_use, history = self.sessions[chat_id]
+            if self._expired(last_use):
+                del self.sessions[chat_id]
+                self.metrics["expired"] += 1
+                return None
+            self.sessions[chat_id] = (time.time(), history)
+            self.sessions.move_to_end(chat_id)
+            return history
+
+    def put(self, chat_id, history):
+        with self.lock:
+            self.sessions[chat_id] = (time.time(), history)
+            self.sessions.move_to_end(chat_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.metrics["evictions"] += 1
+
+    def delete(self, chat_id):
+        with self.lock:
+            self.sessions.pop(chat_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {"sessions": len(self.sessions), **self.metrics}
+
+    def _expired(self, last_use):
+        return self.ttl_in_s is not None and time.time() - last_use > self.ttl_in_s
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, db_path="chat_sessions.db", ttl_in_s=30 * 24 * 3600):
+        """Sessions stored as json in a SQLite database.
+
+        Each session is read from the database when it is used, so processes that share
+        the database file share the sessions and memory does not grow with their number.
+
+        Arguments:
+            db_path: SQLite database file
+            ttl_in_s: sessions not updated for this long are dropped. None to keep them
+        """
+        self.db_path = db_path
+        self.ttl_in_s = ttl_in_s
+        # one connection per thread: sqlite3 connections can't be shared between threads
+        self.local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(chat_id TEXT PRIMARY KEY, history TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def get(self, chat_id):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT history, updated FROM sessions WHERE chat_id = ?", (chat_id,)
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        if self._expired(row[1]):
+            self.delete(chat_id)
+            return None
+        return json.loads(row[0])
+
+    def put(self, chat_id, history):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (chat_id, history, updated) VALUES (?, ?, ?)",
+                (chat_id, json.dumps(history), time.time()),
+            )
+            if self.ttl_in_s is not None:
+                conn.execute(
+                    "DELETE FROM sessions WHERE updated < ?",
+                    (time.time() - self.ttl_in_s,),
+                )
+
+    def delete(self, chat_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+
+    def stats(self):
+        row = self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()
+        return {"sessions": row[0]}
+
+    def _expired(self, updated):
+        return self.ttl_in_s is not None and time.time() - updated > self.ttl_in_s
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            # readers don't block the writer of another process
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
@@ -1,65 +1,19 @@
 import time
 import types
+import threading
 import xml.etree.ElementTree as ET
+from collections import OrderedDict
 
-import numpy as np
-
-from .make_custom_plot import ToolMakeCustomPlot
-from .solve_symbolic import ToolSolveSymbolic
-from .solve_numeric import ToolSolveNumeric
-from .solve_python_code import ToolSolvePythonCode
-from .get_webpage_contents import ToolGetUrlContent
-from .make_qr_code import ToolMakeQRCode
-from .read_local_file import ToolReadLocalFile
-from .write_local_file import ToolWriteLocalFile
-from .read_file_names_in_local_folder import ToolReadLocalFolder
-from .do_date_math import ToolDoDateMath
-from .update_user_details import ToolUpdateUserDetails
-from .use_ffmpeg import ToolUseFFMPEG
-from .plot_with_graphviz import ToolPlotWithGraphviz
-from .text_to_speech import ToolTextToSpeech
-from .speech_to_text import ToolSpeechToText
-from .summarize_past import ToolSummarizePast
-from .text_to_image import ToolTextToImage
-from .image_edit import ToolImageEdit
-from .query_database import ToolQueryLLMDB
-from .query_database import SampleOrder_LLM_DB
-from .run_with_python import ToolRunWithPython
-from .select_video_frames import ToolSelectVideoFrames
-from .speech_transcribe_analyze import ToolSpeechAnalysis
-from .image_analyzer import ToolImageAnalyzer
-
-rng = np.random.default_rng()
+from .registry import TOOL_REGISTRY, LazyTool
 
 
 class LLMTools:
     def get_all_tools(query_llm=None):
-        """Returns a list of all tools available"""
-        return [
-            ToolDoDateMath(),
-            ToolUpdateUserDetails(),
-            ToolMakeCustomPlot(),
-            ToolSolveSymbolic(),
-            ToolSolveNumeric(),
-            ToolGetUrlContent(query_llm),
-            ToolMakeQRCode(),
-            ToolReadLocalFile(query_llm),
-            ToolImageAnalyzer(query_llm),
-            ToolWriteLocalFile(),
-            ToolReadLocalFolder(),
-            ToolUseFFMPEG(),
-            ToolSelectVideoFrames(),
-            ToolSolvePythonCode(),
-            ToolPlotWithGraphviz(),
-            ToolTextToSpeech(),
-            ToolSpeechToText(),
-            ToolSpeechAnalysis(),
-            ToolTextToImage(),
-            ToolImageEdit(),
-            ToolSummarizePast(),
-            ToolQueryLLMDB(SampleOrder_LLM_DB()),
-            ToolRunWithPython(),
-        ]
+        """Returns a list of all tools available.
+        Tools are imported and constructed when first used, see registry.py.
+        The same tools are returned for the same query_llm, see ToolCatalog
+        """
+        return TOOL_CATALOG.get_tools(query_llm)
 
     def __init__(
         self, query_llm=None, desired_tools=None, yield_partial_tool_results=True
@@ -77,31 +31,35 @@ class LLMTools:
         self.query_llm = query_llm
         self.yield_partial_tool_results = yield_partial_tool_results
         if desired_tools is None:
+            all_tools = {x.name: x for x in TOOL_CATALOG.get_tools(self.query_llm)}
             self.tools = [
-                ToolDoDateMath(),
-                ToolMakeCustomPlot(),
-                ToolSolveSymbolic(),
-                ToolSolveNumeric(),
-                ToolGetUrlContent(self.query_llm),
-                ToolMakeQRCode(),
-                ToolReadLocalFile(self.query_llm),
-                ToolImageAnalyzer(self.query_llm),
-                ToolWriteLocalFile(),
-                ToolReadLocalFolder(),
-                ToolUseFFMPEG(),
-                ToolSelectVideoFrames(),
-                ToolPlotWithGraphviz(),
-                ToolRunWithPython(),
-                # Being left out for now. Just uncomment to enable
-                # ToolSummarizePast(),
-                # ToolUpdateUserDetails(),
-                # ToolQueryLLMDB(SampleOrder_LLM_DB()),
-                # ToolSolvePythonCode(),
-                # ToolSpeechAnalysis(),
-                ToolTextToSpeech(),
-                ToolSpeechToText(),
-                ToolTextToImage(),
-                ToolImageEdit(),
+                all_tools[name]
+                for name in [
+                    "do_date_math",
+                    "make_custom_plot",
+                    "solve_symbolic",
+                    "solve_numeric",
+                    "get_url_content",
+                    "make_qr_code",
+                    "read_local_files",
+                    "analyze_images",
+                    "write_local_files",
+                    "read_file_names_in_local_folder",
+                    "use_ffmpeg",
+                    "select_video_frames",
+                    "plot_with_graphviz",
+                    "run_with_python",
+                    # Being left out for now. Just uncomment to enable
+                    # "summarize_past_on_context_switch",
+                    # "read_write_user_details",
+                    # "query_database_Sales_database",
+                    # "solve_with_python",
+                    # "speech_analysis",
+                    "text_to_speech",
+                    "speech_to_text",
+                    "text_to_image",
+                    "edit_image",
+                ]
             ]
         else:
             self.tools = desired_tools
@@ -125,6 +83,16 @@ class LLMTools:
         cmd["parameters"]["username"] = str(username)
         return self.invoke_tool(cmd["tool_name"], **cmd["parameters"])
 
+    def can_run_early(self, xml_cmd):
+        """True if the command calls a single tool without side effects (side_effect_free),
+        which can run before the LLM finishes the <function_calls> block
+        """
+        if xml_cmd.count("<invoke>") != 1:
+            return False
+        cmd = self.parse_command(xml_cmd)
+        cur_tool = self.tool_mapping.get(cmd["tool_name"])
+        return cur_tool is not None and getattr(cur_tool, "side_effect_free", False)
+
     def parse_command(self, xml_cmd):
         """Parses a XML command to retrieve arguments and tool name"""
         try:
@@ -149,8 +117,21 @@ class LLMTools:
 
     def get_tool_descriptions(self):
         """Retrieves the description of all tools available"""
+        if TOOL_CATALOG.is_cacheable(self.tools):
+            return TOOL_CATALOG.get_tool_set(self.tools, self._render_tools)["xml"]
+        return self._render_tools(self.tools)
+
+    def get_native_tools(self):
+        """Tool descriptions in the format of the LLM native tool calling.
+        The list may be shared with other calls: do not change it
+        """
+        if TOOL_CATALOG.is_cacheable(self.tools):
+            return TOOL_CATALOG.get_tool_set(self.tools, self._render_tools)["native"]
+        return [x.tool_description for x in self.tools]
+
+    def _render_tools(self, tools):
         desc_list = ["<tools>"]
-        for x in self.tools:
+        for x in tools:
             desc_list.append(self._parse_tool_description(x.tool_description))
         desc_list.append("</tools>")
         return "\n".join(desc_list)
@@ -239,3 +220,69 @@ class LLMTools:
             return str(
                 e
             )  # "Failed to invoke tool. Please try again, possibly in a different way."
+
+
+class ToolCatalog:
+    def __init__(self, max_entries=64):
+        """Keeps the tools and their rendered descriptions between messages,
+        so that setting up the tools of a message is a dictionary lookup.
+
+        Arguments:
+            max_entries: number of query LLMs and of tool sets to keep
+        """
+        self.max_entries = max_entries
+        # id(query_llm) -> (query_llm, list of LazyTool)
+        self.tools_per_llm = OrderedDict()
+        # tuple of tool names -> {"xml": <tools> block, "native": list of descriptions}
+        self.tool_sets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_tools(self, query_llm=None):
+        """All the registered tools, created once per query_llm"""
+        with self.lock:
+            key = id(query_llm)
+            if key not in self.tools_per_llm:
+                # the entry keeps query_llm alive, so its id is not reused
+                self.tools_per_llm[key] = (
+                    query_llm,
+                    [LazyTool(name, query_llm) for name in TOOL_REGISTRY],
+                )
+                self._evict(self.tools_per_llm)
+            self.tools_per_llm.move_to_end(key)
+            return list(self.tools_per_llm[key][1])
+
+    def is_cacheable(self, tools):
+        """Only the descriptions of registered tools are known to never change"""
+        return all(isinstance(x, LazyTool) for x in tools)
+
+    def get_tool_set(self, tools, render_fn):
+        """Rendered descriptions of a selection of registered tools.
+        render_fn renders the <tools> block of a list of tools
+        """
+        key = tuple(x.name for x in tools)
+        with self.lock:
+            if key in self.tool_sets:
+                self.tool_sets.move_to_end(key)
+                return self.tool_sets[key]
+        # rendering may import and construct tools: done outside the lock
+        tool_set = {
+            "xml": render_fn(tools),
+            "native": [x.tool_description for x in tools],
+        }
+        with self.lock:
+            self.tool_sets[key] = tool_set
+            self._evict(self.tool_sets)
+        return tool_set
+
+    def clear(self):
+        with self.lock:
+            self.tools_per_llm.clear()
+            self.tool_sets.clear()
+
+    def _evict(self, entries):
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+
+# shared by all the LLMTools in the process
+TOOL_CATALOG = ToolCatalog()
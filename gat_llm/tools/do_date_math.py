@@ -5,6 +5,7 @@ import dateutil
 class ToolDoDateMath:
     def __init__(self):
         self.name = "do_date_math"
+        self.side_effect_free = True
 
         self.tool_summary = f"""<tool_summary>
 <tool_name>{self.name}</tool_name>
@@ -1,43 +1,89 @@
+import os
 import re
-import requests
-from urllib.parse import urljoin
-from bs4 import BeautifulSoup, NavigableString, Tag
-
-from bs4.element import Comment
-
-
-def extract_visible_html(html):
-    soup = BeautifulSoup(html, "html.parser")
-
-    # Remove script, style, meta, head, link, hidden, aria-hidden, and other non-visible elements
-    for hidden in soup(
-        ["script", "style", "meta", "head", "link", "[hidden]", '[aria-hidden="true"]']
+import tempfile
+import threading
+from urllib.parse import urljoin, urldefrag, urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from bs4 import BeautifulSoup
+
+from ..llm_providers.context_manager import CHARS_PER_TOKEN
+from .html_extraction import HTMLExtraction
+from .read_local_file import extract_text
+from .web_crawler import CRAWL_ENGINE
+from .web_cache import WEB_CACHE
+
+
+# documents read with the extractors of read_local_files: content type -> extension
+DOCUMENT_TYPES = {
+    "application/pdf": ".pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": ".pptx",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
+}
+# other content types read as text besides text/*
+TEXT_TYPES = {
+    "application/json",
+    "application/xml",
+    "application/javascript",
+    "application/xhtml+xml",
+    "application/rss+xml",
+    "application/atom+xml",
+}
+# links to these files are not followed
+NON_HTML_EXTENSIONS = {
+    ".pdf", ".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx", ".odt", ".csv",
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".svg", ".ico", ".tif", ".tiff",
+    ".mp3", ".wav", ".ogg", ".flac", ".m4a", ".mp4", ".m4v", ".mov", ".avi", ".mkv",
+    ".webm", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".tar", ".iso",
+    ".exe", ".msi", ".dmg", ".apk", ".deb", ".rpm", ".bin", ".woff", ".woff2", ".ttf",
+    ".otf", ".eot", ".css", ".js", ".json", ".xml", ".rss",
+}  # fmt: skip
+
+
+def content_kind(content_type, url):
+    """How a response is read: "html" for pages and text, the extension of the
+    document for documents, None if it can't be read
+    """
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    if content_type in DOCUMENT_TYPES:
+        return DOCUMENT_TYPES[content_type]
+    if content_type in ["application/octet-stream", "binary/octet-stream"]:
+        # documents are often served without their type
+        return extension if extension in DOCUMENT_TYPES.values() else None
+    if (
+        content_type == ""
+        or content_type.startswith("text/")
+        or content_type in TEXT_TYPES
     ):
-        hidden.decompose()
+        return "html"
+    return None
 
-    # Remove elements with inline styles that hide them
-    for element in soup.find_all(True):
-        style = element.get("style", "")
 
-        # Check for display: none, visibility: hidden, or opacity: 0 in the style attribute
-        if (
-            "display: none" in style
-            or "visibility: hidden" in style
-            or "opacity: 0" in style
-        ):
-            element.decompose()
+def is_html_link(url):
+    """False for links that can't be web pages, like images or mailto: links"""
+    parsed = urlparse(url)
+    return (
+        parsed.scheme in ["http", "https"]
+        and os.path.splitext(parsed.path)[1].lower() not in NON_HTML_EXTENSIONS
+    )
 
-    # Remove comment nodes
-    for comment in soup.findAll(string=lambda text: isinstance(text, Comment)):
-        comment.extract()
 
-    # Loop through all elements and remove tags that are empty or hidden
-    for element in soup.find_all(True):
-        if not element.get_text(strip=True):  # Remove elements without visible text
-            element.decompose()
+def extract_document(page, extension):
+    """Text of a downloaded document, read with the extractors of read_local_files"""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, f"document{extension}")
+        with open(path, "wb") as f:
+            f.write(page.content)
+        text = extract_text(path)
+    if not text.startswith("<contents>"):
+        text = f"<contents>\n{text}\n</contents>"
+    return text
 
-    # Return the modified HTML as a string
-    return soup.prettify()
+
+def extract_visible_html(html):
+    """HTML of the visible elements of the page"""
+    return HTMLExtraction(html).visible_html()
 
 
 def get_text_and_urls(url_content):
@@ -57,64 +103,83 @@ def get_text_and_urls(url_content):
     return output
 
 
-def tag_visible(element):
-    if element.parent.name in ["a", "p"]:
-        return True
-
-    if element.parent.name in [
-        "style",
-        "script",
-        "head",
-        "title",
-        "meta",
-        # "[document]",
-    ]:
-        return False
-    if isinstance(element, Comment):
-        return False
-    return True
-
-
 def text_from_html(body):
-    soup = MyBeautifulSoup(body, "html.parser")
-    texts = soup.findAll(string=True)
-    visible_texts = filter(tag_visible, texts)
-
-    url_list = []
-    for link in soup.find_all("a"):
-        url_list.append(f"[ {link.get('href')} ] {link.text}")
-        # print(link.get('href'))
-
-    return " ".join(t.strip() for t in visible_texts), "\n".join(url_list)
-
-
-# https://stackoverflow.com/questions/52026274/beautiful-soup-get-all-text-but-preserve-link-html
-class MyBeautifulSoup(BeautifulSoup):
-    def get_text(self, separator="", strip=False, types=(NavigableString,)):
-        text_parts = []
-
-        for element in self.descendants:
-            if isinstance(element, NavigableString):
-                text_parts.append(str(element))
-            elif isinstance(element, Tag):
-                if element.name == "a" and "href" in element.attrs:
-                    text_parts.append(
-                        element.get_text(separator=separator, strip=strip)
-                    )
-                    text_parts.append("( " + element["href"] + " )")
-                elif isinstance(element, types):
-                    text_parts.append(
-                        element.get_text(separator=separator, strip=strip)
-                    )
-
-        return separator.join(text_parts)
+    """Visible text of the page and the list of its links"""
+    extraction = HTMLExtraction(body)
+    return extraction.text(), extraction.url_list()
+
+
+def split_in_chunks(text, max_chars):
+    """Splits the text in parts of up to max_chars, at line breaks or spaces if possible"""
+    chunks = []
+    while len(text) > max_chars:
+        end = text.rfind("\n", max_chars // 2, max_chars)
+        if end == -1:
+            end = text.rfind(" ", max_chars // 2, max_chars)
+        if end == -1:
+            end = max_chars
+        chunks.append(text[:end])
+        text = text[end:]
+    return chunks + [text]
+
+
+def extract_page(page, return_all_visible_html):
+    """Contents of a downloaded page and its links (not resolved), from one parse"""
+    if return_all_visible_html:
+        extraction = HTMLExtraction(page.content)
+        return {
+            "visible_html": extraction.visible_html(),
+            "links": extraction.links(),
+        }
+    extraction = HTMLExtraction(page.text)
+    return {
+        "text": extraction.text(),
+        "urls": extraction.url_list(),
+        "links": extraction.links(),
+    }
 
 
 class ToolGetUrlContent:
-    def __init__(self, query_llm, max_subpages_to_read=60):
+    def __init__(
+        self,
+        query_llm,
+        max_subpages_to_read=60,
+        crawl_engine=None,
+        deadline_s=None,
+        web_cache=None,
+        max_parallel_queries=4,
+        chunk_tokens=None,
+        max_page_bytes=5 * 1024 * 1024,
+        max_document_bytes=25 * 1024 * 1024,
+    ):
+        """Arguments:
+        query_llm: LLM that answers the prompt about each URL
+        max_subpages_to_read: maximum number of matching links followed from one page
+        crawl_engine: CrawlEngine that downloads the pages. None for the shared CRAWL_ENGINE
+        deadline_s: time limit to read each URL and its subpages. None for the engine default
+        web_cache: WebCache of the pages and their extracted contents. None for the shared WEB_CACHE
+        max_parallel_queries: queries to query_llm running at the same time
+        chunk_tokens: pages larger than this are split in parts, which are queried separately
+            and whose answers are combined. None for half the context window of query_llm
+        max_page_bytes: pages and text files larger than this are not read
+        max_document_bytes: PDF and Office documents larger than this are not read
+        """
         self.name = "get_url_content"
+        self.side_effect_free = True
         self.query_llm = query_llm
         self.max_subpages_to_read = max_subpages_to_read
+        self.crawl_engine = crawl_engine if crawl_engine is not None else CRAWL_ENGINE
+        self.deadline_s = deadline_s
+        self.web_cache = web_cache if web_cache is not None else WEB_CACHE
+        self.max_parallel_queries = max_parallel_queries
+        if chunk_tokens is None:
+            context_window = getattr(query_llm, "context_window", None)
+            chunk_tokens = (
+                context_window // 2 if isinstance(context_window, int) else 16000
+            )
+        self.chunk_tokens = chunk_tokens
+        self.max_page_bytes = max_page_bytes
+        self.max_document_bytes = max_document_bytes
 
         self.tool_description = {
             "name": self.name,
@@ -199,46 +264,191 @@ Note that the webpage URL will be checked using python's regex re package using:
         recursion_level = int(recursion_level)
         internet_urls = internet_urls.split(",")
         internet_urls = [x.strip() for x in internet_urls]
+        if prompt.strip() != "" and self.query_llm is not None:
+            yield from self._answer_prompt(
+                internet_urls,
+                prompt,
+                return_all_visible_html,
+                recursion_level,
+                recursion_regex_condition,
+            )
+            return
+
         ans = []
         for u in internet_urls:
             yield f"<scratchpad>Reading: {u}</scratchpad>"
 
             ans.append("<url_content>")
             ans.append(f"<url>{u}</url>")
-            content = self._get_url_content(
+            # pages are streamed as they are read
+            for content in self._crawl(
                 u,
                 return_all_visible_html,
                 max_recursion_level=recursion_level,
                 recursion_regex_condition=recursion_regex_condition,
-            )
+            ):
+                yield "\n".join(
+                    ans + [f"<content>{content}</content>", "</url_content>"]
+                )
             if prompt.strip() != "":
-                if self.query_llm is None:
-                    content = "Could not answer prompt because a Language Model was not provided."
-                else:
-                    sys_prompt = "Read the contents of the following webpage to answer questions:"
-                    sys_prompt = (
-                        sys_prompt + f"\n<webpage_contents>{content}<webpage_contents>"
-                    )
-                    sys_prompt = (
-                        sys_prompt + f"\nAlways include relevant links in your answers."
-                    )
-                    llm_ans = self.query_llm(
-                        prompt,
-                        system_prompt=sys_prompt,
-                    )
-                    for x in llm_ans:
-                        yield f"<scratchpad>{x}</scratchpad>"
-                    content = x
+                content = (
+                    "Could not answer prompt because a Language Model was not provided."
+                )
+
+            ans.append(f"<content>{content}</content>")
+            ans.append("</url_content>")
+        yield "\n".join(ans)
+
+    def _answer_prompt(
+        self,
+        internet_urls,
+        prompt,
+        return_all_visible_html,
+        recursion_level,
+        recursion_regex_condition,
+    ):
+        """Answers the prompt about each URL with map-reduce: the URLs are read in parallel,
+        their contents are split in parts that fit the context of query_llm, the parts are
+        queried concurrently and their answers are combined
+        """
+        progress = {"urls_read": 0, "queries": 0, "answered": 0}
+        lock = threading.Lock()
+        # the URLs wait for their queries, so they don't share the query threads
+        url_executor = ThreadPoolExecutor(max_workers=len(internet_urls))
+        query_executor = ThreadPoolExecutor(max_workers=self.max_parallel_queries)
+        try:
+            futures = [
+                url_executor.submit(
+                    self._answer_url,
+                    u,
+                    prompt,
+                    return_all_visible_html,
+                    recursion_level,
+                    recursion_regex_condition,
+                    query_executor,
+                    progress,
+                    lock,
+                )
+                for u in internet_urls
+            ]
+            status = None
+            pending = futures
+            while len(pending) > 0:
+                _, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                with lock:
+                    cur_status = f"<scratchpad>Read {progress['urls_read']} of {len(internet_urls)} URLs. Answered {progress['answered']} of {progress['queries']} queries</scratchpad>"
+                if cur_status != status:
+                    status = cur_status
+                    yield status
+        finally:
+            url_executor.shutdown(wait=False, cancel_futures=True)
+            query_executor.shutdown(wait=False, cancel_futures=True)
 
+        ans = []
+        for u, future in zip(internet_urls, futures):
+            try:
+                content = future.result()
+            except Exception as e:
+                content = f"Could not answer the prompt about URL {u}.\nError description: {str(e)}"
+            ans.append("<url_content>")
+            ans.append(f"<url>{u}</url>")
             ans.append(f"<content>{content}</content>")
             ans.append("</url_content>")
         yield "\n".join(ans)
 
+    def _answer_url(
+        self,
+        internet_url,
+        prompt,
+        return_all_visible_html,
+        recursion_level,
+        recursion_regex_condition,
+        query_executor,
+        progress,
+        lock,
+    ):
+        """Answer about one URL: map over the parts of its contents, then reduce"""
+        content = self._get_url_content(
+            internet_url,
+            return_all_visible_html,
+            max_recursion_level=recursion_level,
+            recursion_regex_condition=recursion_regex_condition,
+        )
+        chunks = split_in_chunks(content, self.chunk_tokens * CHARS_PER_TOKEN)
+        with lock:
+            progress["urls_read"] += 1
+            progress["queries"] += len(chunks)
+
+        def query(sys_prompt):
+            ans = self._query(prompt, sys_prompt)
+            with lock:
+                progress["answered"] += 1
+            return ans
+
+        futures = []
+        for k, chunk in enumerate(chunks):
+            if len(chunks) == 1:
+                sys_prompt = (
+                    "Read the contents of the following webpage to answer questions:"
+                )
+            else:
+                sys_prompt = f"Read the contents of the following part ({k + 1} of {len(chunks)}) of a webpage to answer questions. If this part has nothing relevant, say so briefly:"
+            sys_prompt = sys_prompt + f"\n<webpage_contents>{chunk}<webpage_contents>"
+            sys_prompt = (
+                sys_prompt + f"\nAlways include relevant links in your answers."
+            )
+            futures.append(query_executor.submit(query, sys_prompt))
+        answers = [x.result() for x in futures]
+
+        # combine the answers, in groups that fit the context of query_llm
+        while len(answers) > 1:
+            groups = [[]]
+            group_chars = 0
+            for answer in answers:
+                if (
+                    len(groups[-1]) > 0
+                    and group_chars + len(answer) > self.chunk_tokens * CHARS_PER_TOKEN
+                ):
+                    groups.append([])
+                    group_chars = 0
+                groups[-1].append(answer)
+                group_chars += len(answer)
+            if len(groups) == len(answers):
+                # each answer fills a group: combine them in pairs
+                groups = [answers[k : k + 2] for k in range(0, len(answers), 2)]
+            with lock:
+                progress["queries"] += len(groups)
+            futures = []
+            for group in groups:
+                if len(group) == 1:
+                    futures.append(None)
+                    continue
+                partial_answers = "\n".join(
+                    f"<partial_answer>{x}</partial_answer>" for x in group
+                )
+                sys_prompt = f"""The following answers to the same question were written from different parts of one webpage. Combine them into a single answer to the question, without repeating information. Ignore the parts that had nothing relevant.
+<partial_answers>{partial_answers}</partial_answers>
+Always include relevant links in your answers."""
+                futures.append(query_executor.submit(query, sys_prompt))
+            answers = [
+                group[0] if future is None else future.result()
+                for group, future in zip(groups, futures)
+            ]
+            with lock:
+                progress["answered"] += sum(x is None for x in futures)
+        return answers[0]
+
+    def _query(self, prompt, sys_prompt):
+        """Answer of query_llm"""
+        x = ""
+        for x in self.query_llm(prompt, system_prompt=sys_prompt):
+            pass
+        return x
+
     def _get_url_content(
         self,
         internet_url,
         return_all_visible_html,
-        cur_recursion_level=0,
         max_recursion_level=0,
         recursion_regex_condition="",
     ):
@@ -247,39 +457,127 @@ Note that the webpage URL will be checked using python's regex re package using:
         Arguments:
             internet_url: URL to read
             return_all_visible_html: whether to return all HTML that renders visible elements or just the text
-            cur_recursion_level: current recursion level, for cases when subpages need to be retrieved
             max_recursion_level: maximum recursion level to go to
+            recursion_regex_condition: links followed have to match it
         """
-        # keep track of pages already visited to avoid looping
-        if cur_recursion_level == 0:
-            self.retrieved_pages = {internet_url: True}
+        for ans in self._crawl(
+            internet_url,
+            return_all_visible_html,
+            max_recursion_level,
+            recursion_regex_condition,
+        ):
+            pass
+        return ans
 
+    def _crawl(
+        self,
+        internet_url,
+        return_all_visible_html,
+        max_recursion_level=0,
+        recursion_regex_condition="",
+    ):
+        """Reads the URL and its subpages concurrently. Yields the contents of the pages
+        read so far, as they complete. The last yield has all pages, each subpage after
+        the page that links to it
+        """
+        contents = {}
+        children = {}
+        read_so_far = []
+
+        def read_page(url, depth):
+            return self._read_page(
+                url,
+                return_all_visible_html,
+                max_recursion_level,
+                recursion_regex_condition,
+                depth < max_recursion_level,
+                subpage=depth > 0,
+            )
+
+        for page in self.crawl_engine.crawl(
+            internet_url, read_page, max_recursion_level, self.deadline_s
+        ):
+            if page["error"] is not None:
+                page["content"] = (
+                    f"Could not retrieve page from URL {page['url']}.\n"
+                    f"Error description: {page['error']}"
+                )
+            contents[page["url"]] = page["content"]
+            children[page["url"]] = page["links"]
+            read_so_far.append(page["content"])
+            yield "\n".join(read_so_far)
+
+        ordered = []
+        pending = [internet_url]
+        while len(pending) > 0:
+            url = pending.pop(0)
+            if url in contents:
+                ordered.append(contents[url])
+            pending = children.get(url, []) + pending
+        yield "\n".join(ordered)
+
+    def _read_page(
+        self,
+        internet_url,
+        return_all_visible_html,
+        max_recursion_level,
+        recursion_regex_condition,
+        read_links,
+        subpage=False,
+    ):
+        """Reads one page. Returns its contents and the links to read next.
+        Subpages are only read if they are web pages
+        """
         try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
-            }
-            c = requests.get(internet_url, headers=headers)
+            # pages and their extracted contents are reused while they don't change
+            c = self.web_cache.fetch(
+                lambda url, **kwargs: self.crawl_engine.get(
+                    url, check=lambda r: self._check_download(r, subpage), **kwargs
+                ),
+                internet_url,
+            )
+            kind = content_kind(c.headers.get("Content-Type"), c.url)
+            if kind != "html":
+                # pages from the cache were not checked when downloaded
+                self._check_kind(kind, c.headers.get("Content-Type"), subpage)
+                text = self.web_cache.extract(
+                    c, "document", lambda page: extract_document(page, kind)
+                )
+                ans = f"<source_url>{c.url}</source_url><status_code>{c.status_code}</status_code>\n{text}"
+                return ans, []
+
+            visible_html = str(return_all_visible_html).lower().strip() == "true"
+            # contents and links come from a single parse of the page
+            extracted = self.web_cache.extract(
+                c,
+                "page_visible_html" if visible_html else "page_text",
+                lambda page: extract_page(page, visible_html),
+            )
 
-            if str(return_all_visible_html).lower().strip() == "true":
+            if visible_html:
                 # return all visible HTML (remove only scripts and hidden elements)
-                visible_html = extract_visible_html(c.content)
+                visible_html = extracted["visible_html"]
                 ans = f"<source_url>{c.url}</source_url><status_code>{c.status_code}</status_code>\n<contents>{visible_html}</contents>"
             else:
                 # only extract texts and URLs
-                texts, urls = text_from_html(c.text)
+                texts, urls = extracted["text"], extracted["urls"]
                 # don't return URLs if navigating sub-URLs
                 if max_recursion_level == 0:
                     ans = f"<source_url>{c.url}</source_url><status_code>{c.status_code}</status_code>\n<contents>{texts}</contents><urls>{urls}</urls>"
                 else:
                     ans = f"<source_url>{c.url}</source_url><status_code>{c.status_code}</status_code>\n<contents>{texts}</contents>"
 
+            sub_links = []
             # if the user requested sublinks:
-            if cur_recursion_level < max_recursion_level:
-                sub_links = self._extract_links(c.content)
+            if read_links:
+                # links to parts of the same page are read once
+                sub_links = [urljoin(c.url, x) for x in extracted["links"]]
+                sub_links = dict.fromkeys(urldefrag(x).url for x in sub_links)
                 sub_links = [
                     x
                     for x in sub_links
-                    if (
+                    if is_html_link(x)
+                    and (
                         re.match(recursion_regex_condition, x)
                         or recursion_regex_condition in x
                     )
@@ -292,24 +590,32 @@ Please narrow down the number of webpages using a recursion_regex_condition.
 Tried to read the following pages:
 {sub_links}
 """
-                sub_contents = []
-                for sub_link in sub_links:
-                    if not self.retrieved_pages.get(sub_link, False):
-                        sub_content = self._get_url_content(
-                            sub_link,
-                            return_all_visible_html,
-                            cur_recursion_level + 1,
-                            max_recursion_level,
-                        )
-                        self.retrieved_pages[sub_link] = True
-                        sub_contents.append(sub_content)
-                ans = ans + "\n" + "\n".join(sub_contents)
-
-            return ans
+            return ans, sub_links
         except Exception as e:
-            return f"Could not retrieve page from URL {internet_url}.\nError description: {str(e)}"
+            return (
+                f"Could not retrieve page from URL {internet_url}.\nError description: {str(e)}",
+                [],
+            )
 
-        return str(ans)
+    def _check_download(self, response, subpage):
+        """Byte limit of the body of the response, from its headers. Raises if it
+        should not be downloaded
+        """
+        if response.status_code != 200:
+            # error pages, redirects without body, not modified...
+            return self.max_page_bytes
+        content_type = response.headers.get("Content-Type")
+        kind = content_kind(content_type, response.url)
+        self._check_kind(kind, content_type, subpage)
+        return self.max_page_bytes if kind == "html" else self.max_document_bytes
+
+    def _check_kind(self, kind, content_type, subpage):
+        if kind is None:
+            raise ValueError(f"Can't read contents of type {content_type}")
+        if kind != "html" and subpage:
+            raise ValueError(
+                f"Skipped link to a document of type {content_type}, which is not a web page"
+            )
 
     def _extract_links(self, html_text, base_url=None):
         """
@@ -322,15 +628,4 @@ Tried to read the following pages:
         Returns:
             list: A list of all extracted URLs.
         """
-        soup = BeautifulSoup(html_text, "html.parser")
-        links = []
-
-        # Find all 'a' tags with an 'href' attribute
-        for a_tag in soup.find_all("a", href=True):
-            href = a_tag["href"]
-            if base_url:
-                # Resolve relative links against the base URL
-                href = urljoin(base_url, href)
-            links.append(href)
-
-        return [x.strip() for x in links]
+        return HTMLExtraction(html_text).links(base_url)
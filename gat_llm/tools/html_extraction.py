@@ -0,0 +1,132 @@
+""" Extraction of the contents of web pages, from a single parse
+
+get_url_content needs the visible text of a page, its links and, in raw HTML mode, the
+HTML of its visible elements. HTMLExtraction parses the page once and produces all of
+them: the text and links in one walk over the tree, the visible HTML in a few linear
+passes over the same tree. The lxml parser is used when it is installed, which is
+several times faster than Python's html.parser on large pages.
+"""
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import Doctype, PreformattedString
+
+try:
+    import lxml  # noqa: F401
+
+    DEFAULT_PARSER = "lxml"
+except ImportError:
+    DEFAULT_PARSER = "html.parser"
+
+
+# the text of these tags is not visible
+HIDDEN_TEXT_PARENTS = {"style", "script", "head", "title", "meta"}
+# removed from the visible HTML
+NON_VISIBLE_TAGS = ["script", "style", "meta", "head", "link", "noscript", "template"]
+HIDDEN_STYLE = re.compile(
+    r"display\s*:\s*none|visibility\s*:\s*hidden|opacity\s*:\s*0(?:\.0*)?\s*(?:;|!|$)",
+    re.IGNORECASE,
+)
+
+
+class HTMLExtraction:
+    def __init__(self, html, parser=None):
+        """Parses the page and extracts its text and links.
+
+        Arguments:
+            html: page contents, str or bytes
+            parser: BeautifulSoup parser. None to use lxml if installed, else html.parser
+        """
+        self.parser = parser if parser is not None else DEFAULT_PARSER
+        self.soup = BeautifulSoup(html, self.parser)
+        self.texts = []
+        # (href or None, text) of the <a> tags
+        self.anchors = []
+        self._visible_html = None
+
+        for element in self.soup.descendants:
+            if isinstance(element, Tag):
+                if element.name == "a":
+                    self.anchors.append((element.get("href"), element.get_text()))
+            elif isinstance(element, PreformattedString):
+                # comments, doctype, CDATA...
+                continue
+            elif isinstance(element, NavigableString):
+                if element.parent.name in HIDDEN_TEXT_PARENTS:
+                    continue
+                text = element.strip()
+                if text != "":
+                    self.texts.append(text)
+
+    def text(self):
+        """Visible text of the page"""
+        return " ".join(self.texts)
+
+    def url_list(self):
+        """One line per link: [ href ] text"""
+        return "\n".join(f"[ {href} ] {text}" for href, text in self.anchors)
+
+    def links(self, base_url=None):
+        """URLs of the links, resolved against base_url if given"""
+        ans = []
+        for href, _ in self.anchors:
+            if href is None:
+                continue
+            href = href.strip()
+            ans.append(urljoin(base_url, href) if base_url else href)
+        return ans
+
+    def visible_html(self):
+        """HTML of the elements that render visible text, without scripts, styles,
+        comments and hidden elements. Modifies the parsed tree, so it is computed once
+        """
+        if self._visible_html is not None:
+            return self._visible_html
+        soup = self.soup
+
+        # the elements are removed after the walk, outermost first
+        removed = set()
+        to_remove = []
+        for element in soup.find_all(True):
+            if id(element.parent) in removed:
+                removed.add(id(element))
+            elif (
+                element.name in NON_VISIBLE_TAGS
+                or element.has_attr("hidden")
+                or element.get("aria-hidden") == "true"
+                or HIDDEN_STYLE.search(element.get("style", "") or "") is not None
+            ):
+                removed.add(id(element))
+                to_remove.append(element)
+        for element in to_remove:
+            element.decompose()
+
+        # comments, CDATA...
+        for string in soup.find_all(
+            string=lambda x: isinstance(x, PreformattedString)
+            and not isinstance(x, Doctype)
+        ):
+            string.extract()
+
+        # mark the elements that contain text, going up from each string
+        with_text = {id(soup)}
+        for string in soup.find_all(string=True):
+            if string.strip() == "":
+                continue
+            parent = string.parent
+            while parent is not None and id(parent) not in with_text:
+                with_text.add(id(parent))
+                parent = parent.parent
+
+        # remove the outermost elements without text
+        to_remove = [
+            x
+            for x in soup.find_all(True)
+            if id(x) not in with_text and id(x.parent) in with_text
+        ]
+        for element in to_remove:
+            element.decompose()
+
+        self._visible_html = soup.prettify()
+        return self._visible_html
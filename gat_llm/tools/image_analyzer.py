@@ -1,9 +1,9 @@
 import os
-import base64
 import numpy as np
 
 from PIL import Image
-from io import BytesIO
+
+from ..llm_providers.image_preprocessing import IMAGE_PREPROCESSOR, max_image_edge
 
 
 rng = np.random.default_rng()
@@ -14,6 +14,7 @@ class ToolImageAnalyzer:
 
     def __init__(self, query_llm=None):
         self.name = "analyze_images"
+        self.side_effect_free = True
         self.query_llm = query_llm
         self.tool_description = {
             "name": self.name,
@@ -68,11 +69,9 @@ Do not invent any information. Only use information that can be found in the ima
         except Exception as e:
             raise ValueError(f"Failed to load image: {str(e)}")
 
-    def _encode_image_to_base64(self, image: Image.Image) -> str:
-        """Convert PIL Image to base64 string."""
-        buffer = BytesIO()
-        image.save(buffer, format="PNG")
-        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    def _prepare_image(self, path_to_image: str):
+        """Image resized for the LLM, as a reference in the image store."""
+        return IMAGE_PREPROCESSOR.prepare(path_to_image, max_image_edge(self.query_llm))
 
     def _analyze_with_llm(
         self,
@@ -81,9 +80,9 @@ Do not invent any information. Only use information that can be found in the ima
         items_to_identify: str,
     ) -> str:
         """Analyze image using LLM model."""
-        # Load and encode image for API
-        image = self._load_image(path_to_image)
-        base64_image = self._encode_image_to_base64(image)
+        # Check and prepare image for API
+        self._load_image(path_to_image)
+        image_ref = self._prepare_image(path_to_image)
 
         # replace strings
         system_prompt = self.system_prompt.replace("[[ITEMS]]", items_to_identify)
@@ -92,7 +91,7 @@ Do not invent any information. Only use information that can be found in the ima
         llm_ans = self.query_llm(
             prompt,
             system_prompt=system_prompt,
-            b64images=[base64_image],
+            b64images=[image_ref],
         )
 
         for x in llm_ans:
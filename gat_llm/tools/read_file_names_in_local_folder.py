@@ -4,6 +4,7 @@ import os
 class ToolReadLocalFolder:
     def __init__(self):
         self.name = "read_file_names_in_local_folder"
+        self.side_effect_free = True
 
         self.tool_description = {
             "name": self.name,
@@ -1,14 +1,19 @@
 import os
 import re
 import pypdf
-import base64
 from pathlib import Path
-from io import BytesIO
 
 import pandas as pd
 from markitdown import MarkItDown
 from pdf2image import convert_from_path
 
+from ..llm_providers.image_preprocessing import (
+    DEFAULT_MAX_IMAGE_EDGE,
+    DOCUMENT,
+    IMAGE_PREPROCESSOR,
+    max_image_edge,
+)
+
 
 def extract_text(file) -> str:
     file = Path(file)
@@ -56,28 +61,23 @@ def pdf_to_xml(pdf_path):
     return "\n".join(xml_content)
 
 
-def pdf_pages_to_base64_images(pdf_path, dpi=200, fmt="JPEG", jpeg_quality=95):
+def pdf_pages_to_images(pdf_path, max_edge=DEFAULT_MAX_IMAGE_EDGE, dpi=200):
     """
-    Convert each page of a PDF into a Base64-encoded image.
+    Convert each page of a PDF into an image for the LLM.
 
     Args:
         pdf_path (str): Path to the PDF file.
-        dpi (int): Resolution of output images (higher dpi = better quality).
-        fmt (str): Image format, e.g., 'PNG', 'JPEG'.
+        max_edge (int): Longest side of the images sent to the LLM.
+        dpi (int): Resolution used to render the pages, before they are resized.
 
     Returns:
-        List[str]: Base64-encoded strings of each page image.
+        List[dict]: References to the page images in the image store.
     """
     images = convert_from_path(pdf_path, dpi=dpi)
-    base64_images = []
-
-    for img in images:
-        buffered = BytesIO()
-        img.save(buffered, format=fmt, quality=jpeg_quality)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        base64_images.append(img_base64)
-
-    return base64_images
+    return [
+        IMAGE_PREPROCESSOR.prepare(img, max_edge, content_type=DOCUMENT)
+        for img in images
+    ]
 
 
 def sanitize_column_name(name):
@@ -135,6 +135,7 @@ def normalize_xml_content(xml_content):
 class ToolReadLocalFile:
     def __init__(self, query_llm=None):
         self.name = "read_local_files"
+        self.side_effect_free = True
         self.query_llm = query_llm
 
         self.tool_description = {
@@ -232,7 +233,9 @@ subfolder/file2.pdf
                     if path_to_file in pdfs_to_read_as_images:
                         if b64_images is None:
                             b64_images = []
-                        b64_images += pdf_pages_to_base64_images(path_to_file)
+                        b64_images += pdf_pages_to_images(
+                            path_to_file, max_image_edge(self.query_llm)
+                        )
                 except Exception as e:
                     ans = (
                         f"Error: Failed to process the file `{path_to_file}`: {str(e)}"
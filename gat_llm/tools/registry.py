@@ -0,0 +1,196 @@
+""" Registry of the available tools
+
+Tool modules import heavy libraries (matplotlib, pandas, duckdb, openai, ...).
+The registry knows the name of each tool and where it is implemented, so tools can be
+listed and selected without importing them. A tool is imported and constructed
+the first time it is invoked, or when its description is needed and no previous
+process saved it on disk.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import importlib
+import threading
+
+
+def _make_query_database_tool(query_llm):
+    from .query_database import ToolQueryLLMDB, SampleOrder_LLM_DB
+
+    return ToolQueryLLMDB(SampleOrder_LLM_DB())
+
+
+# tool name -> where the tool is implemented. In the order of LLMTools.get_all_tools
+TOOL_REGISTRY = {
+    "do_date_math": {"module": "do_date_math", "class": "ToolDoDateMath"},
+    "read_write_user_details": {
+        "module": "update_user_details",
+        "class": "ToolUpdateUserDetails",
+    },
+    "make_custom_plot": {"module": "make_custom_plot", "class": "ToolMakeCustomPlot"},
+    "solve_symbolic": {"module": "solve_symbolic", "class": "ToolSolveSymbolic"},
+    "solve_numeric": {"module": "solve_numeric", "class": "ToolSolveNumeric"},
+    "get_url_content": {
+        "module": "get_webpage_contents",
+        "class": "ToolGetUrlContent",
+        "query_llm": True,
+    },
+    "make_qr_code": {"module": "make_qr_code", "class": "ToolMakeQRCode"},
+    "read_local_files": {
+        "module": "read_local_file",
+        "class": "ToolReadLocalFile",
+        "query_llm": True,
+    },
+    "analyze_images": {
+        "module": "image_analyzer",
+        "class": "ToolImageAnalyzer",
+        "query_llm": True,
+    },
+    "write_local_files": {"module": "write_local_file", "class": "ToolWriteLocalFile"},
+    "read_file_names_in_local_folder": {
+        "module": "read_file_names_in_local_folder",
+        "class": "ToolReadLocalFolder",
+    },
+    "use_ffmpeg": {"module": "use_ffmpeg", "class": "ToolUseFFMPEG"},
+    "select_video_frames": {
+        "module": "select_video_frames",
+        "class": "ToolSelectVideoFrames",
+    },
+    "solve_with_python": {
+        "module": "solve_python_code",
+        "class": "ToolSolvePythonCode",
+    },
+    "plot_with_graphviz": {
+        "module": "plot_with_graphviz",
+        "class": "ToolPlotWithGraphviz",
+    },
+    "text_to_speech": {"module": "text_to_speech", "class": "ToolTextToSpeech"},
+    "speech_to_text": {"module": "speech_to_text", "class": "ToolSpeechToText"},
+    "speech_analysis": {
+        "module": "speech_transcribe_analyze",
+        "class": "ToolSpeechAnalysis",
+    },
+    "text_to_image": {"module": "text_to_image", "class": "ToolTextToImage"},
+    "edit_image": {"module": "image_edit", "class": "ToolImageEdit"},
+    "summarize_past_on_context_switch": {
+        "module": "summarize_past",
+        "class": "ToolSummarizePast",
+    },
+    # the description includes a sample of the tables, read when it is constructed
+    "query_database_Sales_database": {
+        "module": "query_database",
+        "factory": _make_query_database_tool,
+        "data_files": ["query_database_sales_data_sample.csv"],
+    },
+    "run_with_python": {"module": "run_with_python", "class": "ToolRunWithPython"},
+}
+
+# tool name -> tool_description. Descriptions don't depend on query_llm
+_descriptions = {}
+_lock = threading.Lock()
+# descriptions saved by previous processes, by the contents of the tool module
+DESCRIPTION_CACHE_DIR = os.path.join(tempfile.gettempdir(), "gat_llm_tool_descriptions")
+
+
+def _description_path(name):
+    """File of the saved description. It changes with the tool module and its data files"""
+    spec = TOOL_REGISTRY[name]
+    digest = hashlib.sha256(name.encode("utf-8"))
+    for file_name in [f"{spec['module']}.py"] + spec.get("data_files", []):
+        with open(os.path.join(os.path.dirname(__file__), file_name), "rb") as f:
+            digest.update(f.read())
+    return os.path.join(DESCRIPTION_CACHE_DIR, f"{name}-{digest.hexdigest()[:16]}.json")
+
+
+def _read_description(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Could not read the saved tool description {path}: {e}")
+        return None
+
+
+def _write_description(path, description):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(description, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Could not save the tool description {path}: {e}")
+
+
+def create_tool(name, query_llm=None):
+    """Imports and constructs the tool"""
+    spec = TOOL_REGISTRY[name]
+    if "factory" in spec:
+        return spec["factory"](query_llm)
+    module = importlib.import_module(f".{spec['module']}", __package__)
+    tool_cls = getattr(module, spec["class"])
+    if spec.get("query_llm", False):
+        return tool_cls(query_llm)
+    return tool_cls()
+
+
+class LazyTool:
+    def __init__(self, name, query_llm=None):
+        """Stands for a registered tool until it is used.
+
+        The tool is constructed on the first call or attribute access other than name
+        and tool_description. tool_description is shared by all the LazyTools of the
+        same tool and saved in DESCRIPTION_CACHE_DIR, so the tool is only constructed
+        to describe it when its module changes
+
+        Arguments:
+            name: key of the tool in TOOL_REGISTRY
+            query_llm: LLM to use when the tool requires LLM for further processing
+        """
+        assert name in TOOL_REGISTRY, f"Unknown tool: {name}"
+        self.name = name
+        self.query_llm = query_llm
+        self._tool = None
+        self._tool_lock = threading.Lock()
+
+    @property
+    def tool(self):
+        """The actual tool, constructed on first use"""
+        if self._tool is None:
+            with self._tool_lock:
+                if self._tool is None:
+                    self._tool = create_tool(self.name, self.query_llm)
+                    with _lock:
+                        _descriptions.setdefault(self.name, self._tool.tool_description)
+        return self._tool
+
+    @property
+    def is_loaded(self):
+        return self._tool is not None
+
+    @property
+    def tool_description(self):
+        with _lock:
+            if self.name in _descriptions:
+                return _descriptions[self.name]
+        path = _description_path(self.name)
+        description = _read_description(path)
+        if description is None:
+            description = self.tool.tool_description
+            _write_description(path, description)
+        with _lock:
+            return _descriptions.setdefault(self.name, description)
+
+    def __call__(self, *args, **kwargs):
+        return self.tool(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        # only called for attributes not found on the LazyTool, e.g. requires_username
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.tool, attr)
+
+    def __repr__(self):
+        return f"LazyTool({self.name})"
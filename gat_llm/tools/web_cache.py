@@ -0,0 +1,339 @@
+""" Disk cache of the web pages read by get_url_content
+
+Agents read the same front pages and documentation over and over. Pages are stored on
+disk with their validators (ETag, Last-Modified) and used while fresh according to
+Cache-Control or Expires; stale pages are revalidated with a conditional GET, so an
+unchanged page costs a 304 instead of a download. Pages without cache headers are
+considered fresh for min_fresh_s. The text extracted from a page is cached by the hash
+of its content, so an unchanged page is not parsed again either.
+
+Files are evicted least recently used first once the cache passes max_disk_mb.
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from email.utils import parsedate_to_datetime
+
+from requests.structures import CaseInsensitiveDict
+
+
+def _cache_control(headers):
+    """Cache-Control directives: name -> value (None for directives without one)"""
+    ans = {}
+    for x in headers.get("Cache-Control", "").split(","):
+        name, _, value = x.strip().partition("=")
+        if name != "":
+            ans[name.lower()] = value.strip('"') if value != "" else None
+    return ans
+
+
+def _int(x, default=0):
+    try:
+        return int(x)
+    except (TypeError, ValueError):
+        return default
+
+
+class CachedPage:
+    def __init__(
+        self,
+        url,
+        status_code,
+        content,
+        encoding,
+        headers,
+        sha256,
+        from_cache=False,
+        storable=True,
+    ):
+        """Page read through the cache, with the attributes of requests responses used
+        by the tools
+        """
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+        self.headers = headers
+        self.sha256 = sha256
+        # True if the content was not downloaded (fresh or revalidated)
+        self.from_cache = from_cache
+        # False if the server does not allow caching it, e.g. no-store
+        self.storable = storable
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+class WebCache:
+    # response headers stored with the pages
+    STORED_HEADERS = [
+        "Content-Type",
+        "ETag",
+        "Last-Modified",
+        "Cache-Control",
+        "Expires",
+    ]
+
+    def __init__(self, cache_dir=None, max_disk_mb=256, min_fresh_s=300):
+        """HTTP cache of pages and of their extracted contents.
+
+        Arguments:
+            cache_dir: folder of the cache. None to use a folder in the temp dir, shared by
+                the processes of the machine
+            max_disk_mb: the least recently used files are deleted above this size
+            min_fresh_s: time a page without Cache-Control or Expires headers is used
+                without revalidating it
+        """
+        self.cache_dir = (
+            cache_dir
+            if cache_dir is not None
+            else os.path.join(tempfile.gettempdir(), "gat_llm_web_cache")
+        )
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self.min_fresh_s = min_fresh_s
+        self.metrics = {
+            "hits": 0,
+            "revalidated": 0,
+            "misses": 0,
+            "stores": 0,
+            "not_stored": 0,
+            "extract_hits": 0,
+            "extract_misses": 0,
+            "evictions": 0,
+        }
+        self.lock = threading.Lock()
+        for folder in ["pages", "bodies", "extracted"]:
+            os.makedirs(os.path.join(self.cache_dir, folder), exist_ok=True)
+        self.disk_bytes = sum(os.path.getsize(x) for x in self._files())
+
+    def fetch(self, get_fn, url):
+        """Returns the CachedPage of the URL, downloaded only if needed.
+
+        Arguments:
+            get_fn: function (url, headers=...) -> requests response, e.g. CrawlEngine.get
+            url: page to read
+        """
+        meta = self._read_json(self._page_path(url))
+        body = None
+        if meta is not None:
+            body = self._read_body(meta["sha256"])
+            if body is None:
+                meta = None
+
+        if meta is not None and time.time() < meta["fresh_until"]:
+            with self.lock:
+                self.metrics["hits"] += 1
+            return self._page(meta, body)
+
+        headers = {}
+        if meta is not None:
+            if meta["headers"].get("ETag"):
+                headers["If-None-Match"] = meta["headers"]["ETag"]
+            if meta["headers"].get("Last-Modified"):
+                headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+        response = get_fn(url, headers=headers)
+
+        if meta is not None and response.status_code == 304:
+            # the headers of the 304 update the stored ones
+            meta["headers"].update(
+                {
+                    k: response.headers[k]
+                    for k in self.STORED_HEADERS
+                    if k in response.headers
+                }
+            )
+            headers = CaseInsensitiveDict(meta["headers"])
+            headers.update(response.headers)
+            meta["fresh_until"] = self._fresh_until(headers)
+            self._write_json(self._page_path(url), meta)
+            with self.lock:
+                self.metrics["revalidated"] += 1
+            return self._page(meta, body)
+
+        with self.lock:
+            self.metrics["misses"] += 1
+        sha256 = hashlib.sha256(response.content).hexdigest()
+        meta = {
+            "url": response.url,
+            "status_code": response.status_code,
+            "encoding": response.encoding or response.apparent_encoding,
+            "headers": {
+                k: response.headers[k]
+                for k in self.STORED_HEADERS
+                if k in response.headers
+            },
+            "sha256": sha256,
+            "fresh_until": self._fresh_until(response.headers),
+        }
+        page = CachedPage(
+            meta["url"],
+            meta["status_code"],
+            response.content,
+            meta["encoding"],
+            meta["headers"],
+            sha256,
+            storable=self._storable(response),
+        )
+        if page.storable:
+            self._write_body(sha256, response.content)
+            self._write_json(self._page_path(url), meta)
+            with self.lock:
+                self.metrics["stores"] += 1
+        else:
+            with self.lock:
+                self.metrics["not_stored"] += 1
+        return page
+
+    def extract(self, page, kind, extract_fn):
+        """Result of extract_fn(page), cached by the content of the page.
+        kind names the extraction, e.g. "text". The result has to be json serializable
+        """
+        if not page.storable:
+            return json.loads(json.dumps(extract_fn(page)))
+        path = os.path.join(self.cache_dir, "extracted", f"{page.sha256}-{kind}.json")
+        ans = self._read_json(path)
+        if ans is not None:
+            with self.lock:
+                self.metrics["extract_hits"] += 1
+            return ans["result"]
+        with self.lock:
+            self.metrics["extract_misses"] += 1
+        result = extract_fn(page)
+        self._write_json(path, {"result": result})
+        # same types whether the result is cached or not, e.g. lists for tuples
+        return json.loads(json.dumps(result))
+
+    def stats(self):
+        with self.lock:
+            ans = dict(self.metrics)
+            ans["disk_bytes"] = self.disk_bytes
+        return ans
+
+    def clear(self):
+        with self.lock:
+            for path in self._files():
+                os.remove(path)
+            self.disk_bytes = 0
+
+    def _storable(self, response):
+        directives = _cache_control(response.headers)
+        return (
+            response.status_code == 200
+            and "no-store" not in directives
+            and response.headers.get("Vary", "").strip() != "*"
+        )
+
+    def _fresh_until(self, headers):
+        """Time until which a response can be used without revalidation"""
+        now = time.time()
+        directives = _cache_control(headers)
+        if "no-cache" in directives:
+            return now
+        if "max-age" in directives:
+            return now + _int(directives["max-age"]) - _int(headers.get("Age"))
+        if "Expires" in headers:
+            try:
+                return parsedate_to_datetime(headers["Expires"]).timestamp()
+            except (TypeError, ValueError):
+                # invalid dates, like 0, mean already expired
+                return now
+        return now + self.min_fresh_s
+
+    def _page(self, meta, body):
+        return CachedPage(
+            meta["url"],
+            meta["status_code"],
+            body,
+            meta["encoding"],
+            meta["headers"],
+            meta["sha256"],
+            from_cache=True,
+        )
+
+    def _page_path(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "pages", f"{key}.json")
+
+    def _body_path(self, sha256):
+        return os.path.join(self.cache_dir, "bodies", sha256)
+
+    def _read_body(self, sha256):
+        path = self._body_path(sha256)
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError:
+            return None
+        # last use time, for the LRU eviction of files
+        os.utime(path)
+        return body
+
+    def _write_body(self, sha256, content):
+        if not os.path.isfile(self._body_path(sha256)):
+            self._write_file(self._body_path(sha256), content)
+
+    def _read_json(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Could not read cached file {path}: {e}")
+            self._remove_file(path)
+            return None
+        os.utime(path)
+        return data
+
+    def _write_json(self, path, data):
+        self._write_file(path, json.dumps(data).encode("utf-8"))
+
+    def _write_file(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self.lock:
+            old_size = os.path.getsize(path) if os.path.isfile(path) else 0
+            os.replace(tmp_path, path)
+            self.disk_bytes += len(data) - old_size
+            if self.disk_bytes > self.max_disk_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # removed by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        for _, size, path in sorted(files):
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            self.disk_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.metrics["evictions"] += 1
+
+    def _remove_file(self, path):
+        with self.lock:
+            if os.path.isfile(path):
+                self.disk_bytes -= os.path.getsize(path)
+                os.remove(path)
+
+    def _files(self):
+        for folder in ["pages", "bodies", "extracted"]:
+            for x in os.scandir(os.path.join(self.cache_dir, folder)):
+                if not x.name.endswith(".tmp"):
+                    yield x.path
+
+
+# shared by the get_url_content tools of the process
+WEB_CACHE = WebCache()
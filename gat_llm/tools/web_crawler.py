@@ -0,0 +1,201 @@
+""" Concurrent crawler used by get_url_content
+
+Pages are downloaded with one pooled requests.Session, so connections to a host are
+reused, and read in parallel by a shared thread pool. Each crawl limits how many of
+its pages are downloaded at once in total and per host, every request has a timeout,
+and the crawl stops at an overall deadline. Pages are yielded as they complete, so the
+tool can stream partial results.
+
+Bodies are streamed: the headers of a response are checked before its body is
+downloaded, and the download stops once the body passes a byte limit, so a link to a
+video or a huge file does not fill the memory of the workers.
+"""
+import time
+import threading
+import http.cookiejar
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
+}
+
+
+class ResponseTooLarge(ValueError):
+    pass
+
+
+class CrawlEngine:
+    def __init__(
+        self,
+        max_workers=8,
+        max_per_host=4,
+        timeout=(10, 30),
+        deadline_s=120,
+        headers=DEFAULT_HEADERS,
+        max_bytes=10 * 1024 * 1024,
+    ):
+        """Downloads and reads pages concurrently.
+
+        Arguments:
+            max_workers: pages read at the same time, by each crawl and by the shared pool
+            max_per_host: pages of the same host downloaded at the same time by a crawl
+            timeout: requests timeout of each download, (connect, read) in s
+            deadline_s: default time limit of a crawl, in s
+            headers: headers sent with every request
+            max_bytes: default limit of the size of a downloaded body
+        """
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.deadline_s = deadline_s
+        self.max_bytes = max_bytes
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(headers)
+        # the session is shared by the crawls of all users: cookies set by a page (consent,
+        # login...) are not kept, so they are not sent with the requests of others
+        self.session.cookies.set_policy(
+            http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="crawler"
+        )
+        self.metrics = {
+            "pages": 0,
+            "errors": 0,
+            "deadline_exceeded": 0,
+            "too_large": 0,
+        }
+        self.lock = threading.Lock()
+
+    def get(self, url, check=None, **kwargs):
+        """GET with the pooled session and the default timeout. The body is streamed and
+        the download stops with ResponseTooLarge above the byte limit.
+
+        Arguments:
+            url: page to download
+            check: function (response) -> byte limit of the body, None for the default.
+                Called with the headers, before the body is downloaded. It raises to
+                not download the body, e.g. because of its content type
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.get(url, stream=True, **kwargs)
+        try:
+            max_bytes = check(response) if check is not None else None
+            max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+            content_length = response.headers.get("Content-Length", "")
+            if content_length.isdigit() and int(content_length) > max_bytes:
+                self._too_large(url, max_bytes)
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > max_bytes:
+                    self._too_large(url, max_bytes)
+                chunks.append(chunk)
+            # same as a response downloaded without stream
+            response._content = b"".join(chunks)
+        except Exception:
+            response.close()
+            raise
+        return response
+
+    def _too_large(self, url, max_bytes):
+        with self.lock:
+            self.metrics["too_large"] += 1
+        raise ResponseTooLarge(
+            f"The contents of {url} are larger than the limit of {max_bytes} bytes"
+        )
+
+    def crawl(self, root_url, read_page, max_depth=0, deadline_s=None):
+        """Reads root_url and, breadth first up to max_depth, the links of its pages.
+
+        Arguments:
+            root_url: first page
+            read_page: function (url, depth) -> (content, links), run in the pool. links
+                are the pages to read next, ignored at max_depth. Pages are read once
+            max_depth: levels of links followed
+            deadline_s: time limit of the crawl. None for the default
+
+        Yields one dict per page as pages complete: url, depth, parent (url of the page
+        that linked it), content, links (new pages queued from it) and error (None if
+        read). Pages not read before the deadline are yielded last, with an error.
+        """
+        deadline_s = deadline_s if deadline_s is not None else self.deadline_s
+        deadline = time.time() + deadline_s
+        visited = {root_url}
+        queue = deque([(root_url, 0, None)])
+        # future -> (url, depth, parent, host)
+        in_flight = {}
+        host_counts = Counter()
+
+        while len(queue) > 0 or len(in_flight) > 0:
+            # start the pages allowed by the limits, keeping the others in order
+            waiting = deque()
+            while len(queue) > 0 and len(in_flight) < self.max_workers:
+                url, depth, parent = queue.popleft()
+                host = urlparse(url).netloc
+                if host_counts[host] >= self.max_per_host:
+                    waiting.append((url, depth, parent))
+                    continue
+                host_counts[host] += 1
+                future = self.executor.submit(read_page, url, depth)
+                in_flight[future] = (url, depth, parent, host)
+            queue.extendleft(reversed(waiting))
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            done, _ = wait(in_flight, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, depth, parent, host = in_flight.pop(future)
+                host_counts[host] -= 1
+                page = {"url": url, "depth": depth, "parent": parent, "links": []}
+                try:
+                    page["content"], links = future.result()
+                    page["error"] = None
+                except Exception as e:
+                    page["content"], links = None, []
+                    page["error"] = str(e)
+                if depth < max_depth:
+                    for link in links:
+                        if link not in visited:
+                            visited.add(link)
+                            page["links"].append(link)
+                            queue.append((link, depth + 1, url))
+                with self.lock:
+                    self.metrics["pages"] += 1
+                    self.metrics["errors"] += int(page["error"] is not None)
+                yield page
+
+        # deadline exceeded: the downloads in progress end with their timeout
+        unread = [x[:3] for x in in_flight.values()] + list(queue)
+        for future in in_flight:
+            future.cancel()
+        with self.lock:
+            self.metrics["deadline_exceeded"] += len(unread)
+        for url, depth, parent in unread:
+            yield {
+                "url": url,
+                "depth": depth,
+                "parent": parent,
+                "links": [],
+                "content": None,
+                "error": f"Not read within the deadline of {deadline_s} s",
+            }
+
+    def stats(self):
+        with self.lock:
+            return dict(self.metrics)
+
+
+# shared by the get_url_content tools of the process
+CRAWL_ENGINE = CrawlEngine()
@@ -1,17 +1,19 @@
 import os
 import json
 import asyncio
+import threading
 import requests
 
-import boto3
-import botocore
 import gradio as gr
 
 
 import gat_llm.llm_invoker as inv
+from gat_llm.llm_providers.client_registry import CLIENT_REGISTRY
 from gat_llm.tools.base import LLMTools
 from gat_llm.connector_mcp import MCPConnector
 from gat_llm.llm_interface import LLMInterface
+from gat_llm.session_store import InMemorySessionStore
+from gat_llm.history_compactor import HistoryCompactor
 from gat_llm.tools.speech_to_text import ToolSpeechToText
 from gat_llm.tools.speech_transcribe_analyze import ToolSpeechAnalysis
 from gat_llm.prompts.prompt_generator import RAGPromptGenerator
@@ -47,6 +49,7 @@ description = """- Before running this demo, set the API key of the LLM you want
 - Note that some tools require non-LLM OpenAI models: text_to_image, text_to_speech, speech_to_text
 - Select the tools allowed for the LLM
 - If a model is unavailable, you need to set the proper API key in the environment before running this interface
+- To summarize the older turns of long chats, set HISTORY_COMPACTION_LLM to the name of the LLM that writes the summaries, or to "chat" to use the LLM of each chat. Off by default
 """
 
 default_mcps = """{
@@ -62,8 +65,32 @@ default_mcps = """{
     }
 }"""
 
-# Keep track of previous conversations
-history_log = {}
+# Keep track of previous conversations. Use SQLiteSessionStore to share them between workers
+history_log = InMemorySessionStore(max_sessions=1000, ttl_in_s=24 * 3600)
+# Summarize the older turns of long chats between messages. Opt-in: the chats are sent
+# to the summarizer LLM. Name of an LLM, or "chat" for the LLM of each chat
+history_compaction_llm = os.environ.get("HISTORY_COMPACTION_LLM")
+# summarizer LLM name -> HistoryCompactor, created with the first chat that uses it
+history_compactors = {}
+history_compactors_lock = threading.Lock()
+
+
+def get_history_compactor(bedrock_client, llm_name):
+    """HistoryCompactor of the chats with llm_name, None if compaction is disabled"""
+    if history_compaction_llm is None or history_compaction_llm.strip() == "":
+        return None
+    summarizer_name = (
+        llm_name
+        if history_compaction_llm.strip().lower() == "chat"
+        else history_compaction_llm.strip()
+    )
+    with history_compactors_lock:
+        if summarizer_name not in history_compactors:
+            history_compactors[summarizer_name] = HistoryCompactor(
+                inv.LLM_Provider.get_llm(bedrock_client, summarizer_name),
+                threshold_tokens=32000,
+            )
+        return history_compactors[summarizer_name]
 
 
 def process_audio_func(
@@ -79,6 +106,7 @@ def process_audio_func(
     mcp_servers,
     mcp_enable,
     use_speech_parameters,
+    send_raw_history,
     request: gr.Request,
 ):
     if use_speech_parameters:
@@ -105,6 +133,7 @@ def process_audio_func(
         allowed_tools,
         mcp_servers,
         mcp_enable,
+        send_raw_history,
         request,
     )
     for x in ans_gen:
@@ -123,15 +152,16 @@ def msg_forward_func(
     allowed_tools,
     mcp_servers,
     mcp_enable,
+    send_raw_history,
     request: gr.Request,
 ):
     if "unavailable" in selected_llm.lower():
         return
 
-    config = botocore.client.Config(
-        connect_timeout=9000, read_timeout=9000, region_name="us-west-2"
+    # shared client and LLM instances: no new connections per message
+    bedrock_client = CLIENT_REGISTRY.bedrock_client(
+        region_name="us-west-2", connect_timeout=9000, read_timeout=9000
     )  # us-east-1  us-west-2
-    bedrock_client = boto3.client(service_name="bedrock-runtime", config=config)
 
     llm_name = selected_llm
     llm = inv.LLM_Provider.get_llm(bedrock_client, llm_name)
@@ -139,9 +169,7 @@ def msg_forward_func(
 
     # Initialize LLM
     allowed_tool_list = [
-        x
-        for x in LLMTools.get_all_tools(query_llm)
-        if x.tool_description["name"] in allowed_tools
+        x for x in LLMTools.get_all_tools(query_llm) if x.name in allowed_tools
     ]
 
     # Handle MCP Servers
@@ -169,8 +197,14 @@ def msg_forward_func(
         tool_descriptions = lt.get_tool_descriptions()
         system_prompt = rpg.prompt.replace("{{TOOLS}}", tool_descriptions)
 
-    li = LLMInterface(system_prompt=system_prompt, llm=llm, llm_tools=lt, rpg=rpg)
-    li.history_log = history_log
+    li = LLMInterface(
+        system_prompt=system_prompt,
+        llm=llm,
+        llm_tools=lt,
+        rpg=rpg,
+        session_store=history_log,
+        compactor=get_history_compactor(bedrock_client, llm_name),
+    )
 
     # Call LLM
     li.system_prompt = system_prompt + "\n" + system_prompt_prepend
@@ -194,15 +228,17 @@ def msg_forward_func(
             username=request.username,
         )
 
+    # the raw history is only sent once, at the end, if requested
     for x in ans_gen:
         txtbox, scratchpad_info, img_input_1, cur_history = x
-        yield txtbox, scratchpad_info, None, None, None, cur_history, []
+        yield txtbox, scratchpad_info, None, None, None, cur_history, gr.skip()
 
-    chat_id = cur_history[0]["content"][0]["text"]
-    raw_history = li.history_log[chat_id]
-    yield txtbox, scratchpad_info, None, None, None, cur_history, {
-        "raw_history": raw_history
-    }
+    if send_raw_history:
+        chat_id = cur_history[0]["content"][0]["text"]
+        raw_history = li.history_log[chat_id]
+        yield txtbox, scratchpad_info, None, None, None, cur_history, {
+            "raw_history": raw_history
+        }
 
 
 def is_server_active(url="http://localhost:11434/"):
@@ -269,7 +305,7 @@ def main(max_audio_duration=120):
 
     with gr.Blocks(title="Self-testing GAT Tools demo") as demo:
         gr.Markdown(f"# {demo_title}")
-        all_tools = [x.tool_description["name"] for x in LLMTools.get_all_tools()]
+        all_tools = [x.name for x in LLMTools.get_all_tools()]
         with gr.Sidebar(width=500):
             gr.Markdown("# Tools")
             chk_tools = gr.CheckboxGroup(
@@ -343,6 +379,11 @@ def main(max_audio_duration=120):
             )
             scratchpad = gr.Textbox(label="Scratchpad", visible=False)
             sys_prompt_txt = gr.Text(label="System prompt prepend", value="")
+        chk_raw_history = gr.Checkbox(
+            label="Send raw history",
+            value=False,
+            info="Send the raw history of the chat after each answer",
+        )
         raw_history = gr.JSON(label="Raw history", open=False)
 
         send_txt_event = gr.on(
@@ -360,6 +401,7 @@ def main(max_audio_duration=120):
                 chk_tools,
                 mcp_servers,
                 mcp_enable,
+                chk_raw_history,
             ],
             outputs=[
                 msg2,
@@ -388,6 +430,7 @@ def main(max_audio_duration=120):
                 mcp_servers,
                 mcp_enable,
                 chk_speechparams,
+                chk_raw_history,
             ],
             outputs=[
                 audio_msg,
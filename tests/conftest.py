@@ -4,3 +4,23 @@ import pytest
 @pytest.fixture
 def unexpected_param_msg():
     return "Error: Unexpected parameter(s): "
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breakers():
+    # the default retry policy is shared by all the LLMs: don't leak open circuits between tests
+    from gat_llm.llm_providers.retry_policy import DEFAULT_RETRY_POLICY
+
+    DEFAULT_RETRY_POLICY.circuit_breakers.clear()
+    yield
+    DEFAULT_RETRY_POLICY.circuit_breakers.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_client_registry():
+    # tests change the LLM instances (mocked clients): don't share them between tests
+    from gat_llm.llm_providers.client_registry import CLIENT_REGISTRY
+
+    CLIENT_REGISTRY.clear()
+    yield
+    CLIENT_REGISTRY.clear()
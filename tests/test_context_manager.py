@@ -0,0 +1,158 @@
+from unittest.mock import Mock
+
+import pytest
+
+from gat_llm.llm_invoker import LLM_Provider
+from gat_llm.llm_providers.call_session import CallSession
+from gat_llm.llm_providers import context_manager as cm
+from gat_llm.llm_providers.context_manager import ContextManager
+from gat_llm.llm_providers.context_manager import ContextWindowExceeded
+
+
+def user(text):
+    return {"role": "user", "content": text}
+
+
+def assistant(text):
+    return {"role": "assistant", "content": text}
+
+
+def tool_result(text):
+    return {
+        "role": "user",
+        "content": [{"type": "tool_result", "tool_use_id": "t1", "content": text}],
+    }
+
+
+def make_call_list(n_turns, chars=4000):
+    call_list = [{"role": "system", "content": "System"}]
+    for k in range(n_turns):
+        call_list += [user(f"q{k} " + "x" * chars), assistant(f"a{k} " + "y" * chars)]
+    return call_list + [user("last question")]
+
+
+def test_small_history_is_unchanged():
+    manager = ContextManager(100000)
+    call_list = make_call_list(3)
+    assert manager.fit(call_list) is call_list
+    assert manager.stats()["fitted"] == 0
+
+
+def test_drop_oldest_keeps_last_turns():
+    # each turn is about 2000 tokens
+    manager = ContextManager(8000, reserved_output_tokens=2000)
+    call_list = make_call_list(10)
+
+    fitted = manager.fit(call_list)
+    assert fitted[0] == call_list[0]
+    assert fitted[-1] == user("last question")
+    assert fitted[1]["content"].startswith("q8 ")
+    assert len(fitted) == 6
+    assert manager.stats() == {
+        "budget": 6000,
+        "fitted": 1,
+        "dropped_messages": 16,
+        "elided_results": 0,
+    }
+
+
+def test_last_turn_is_always_kept():
+    manager = ContextManager(1000)
+    call_list = [{"role": "system", "content": "System"}, user("x" * 20000)]
+    assert manager.fit(call_list) == call_list
+
+
+def test_elide_tool_results():
+    manager = ContextManager(
+        4000, policy=cm.ELIDE_TOOL_RESULTS, reserved_output_tokens=1000
+    )
+    call_list = [
+        {"role": "system", "content": "System"},
+        user("get the page"),
+        assistant("calling the tool"),
+        tool_result("page " * 4000),
+        assistant("the page says hi"),
+        user("thanks"),
+    ]
+
+    fitted = manager.fit(call_list)
+    assert len(fitted) == len(call_list), "Eliding is enough: no turn is dropped"
+    assert fitted[3]["content"][0]["content"] == cm.ELIDED_TOOL_RESULT
+    assert call_list[3]["content"][0]["content"].startswith("page "), "Not modified"
+    assert manager.stats()["elided_results"] == 1
+
+
+def test_summarize_dropped_turns():
+    summarizer = Mock(return_value="We talked about q0 to q7")
+    manager = ContextManager(
+        8000,
+        policy=cm.SUMMARIZE,
+        reserved_output_tokens=2000,
+        summarizer=summarizer,
+    )
+    call_list = make_call_list(10)
+
+    fitted = manager.fit(call_list)
+    dropped = summarizer.call_args[0][0]
+    assert dropped == call_list[1:17]
+    assert fitted[1]["content"].startswith(
+        "[|[PAST_FORGOTTEN]|]\n<past_conversation_summary>\nWe talked about q0 to q7\n"
+    )
+    assert call_list[17]["content"].startswith("q8 "), "The history is not modified"
+
+
+def test_summarize_needs_summarizer():
+    with pytest.raises(AssertionError):
+        ContextManager(8000, policy=cm.SUMMARIZE)
+
+
+def test_estimates_are_cached():
+    manager = ContextManager(100000)
+    # "user" + 396 characters
+    msg = user("x" * 396)
+    assert manager.estimate_tokens(msg) == 100 + cm.MESSAGE_OVERHEAD_TOKENS
+    # a message with the same content is found in the cache
+    assert manager.estimate_tokens(user("x" * 396)) == 100 + cm.MESSAGE_OVERHEAD_TOKENS
+    assert len(manager.token_cache) == 1
+    msg["content"] = "changed"
+    # "user" + 7 characters
+    assert manager.estimate_tokens(msg) == 2 + cm.MESSAGE_OVERHEAD_TOKENS
+
+    image = {"type": "image_ref", "sha256": "abc", "media_type": "image/jpeg"}
+    msg = {"role": "user", "content": [image, {"type": "text", "text": "x" * 32}]}
+    # "user" + "text" + 32 characters
+    assert manager.estimate_tokens(msg) == cm.IMAGE_TOKENS + 10 + 4
+
+
+def test_check_raises():
+    manager = ContextManager(1000)
+    assert manager.check({"messages": [user("hi")]}) < 100
+    # the request bodies, with their images, are not kept
+    assert len(manager.token_cache) == 0
+    with pytest.raises(ContextWindowExceeded):
+        manager.check({"messages": [user("hi")], "system": "x" * 10000})
+
+
+def test_history_is_fitted_before_sending():
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    llm.context_manager = ContextManager(8000, reserved_output_tokens=2000)
+    call_list = make_call_list(10)
+    history = call_list[1:-1]
+
+    session = CallSession()
+    prompt = llm._prepare_invocation(
+        session, "last question", None, "System", history, "", []
+    )
+    assert len(prompt["messages"]) == 5
+    assert session.last_message == user("last question")
+
+
+def test_oversized_request_is_not_sent():
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    llm.context_manager = ContextManager(1000)
+    llm.bedrock_client = Mock()
+
+    ans = list(llm("x" * 20000, max_retries=5, cur_fail_sleep=0))
+    assert llm.bedrock_client.invoke_model_with_response_stream.call_count == 0
+    assert ans[0].startswith("Error The request has about")
+    assert ans[-1] == "Could not invoke the AI model."
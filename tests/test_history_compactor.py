@@ -0,0 +1,117 @@
+from unittest.mock import Mock
+
+from gat_llm.llm_invoker import LLM_Provider
+from gat_llm.llm_interface import LLMInterface
+from gat_llm.history_compactor import HistoryCompactor, summary_messages
+from tests.test_llm_interface import mock_llm
+
+
+def summarizer_llm(answer="Talked about q0 and q1"):
+    """Mock of the small LLM: streams the summary"""
+    llm = Mock(side_effect=lambda msg, **kwargs: iter([answer[:5], answer]))
+    llm.llm_description = "Summarizer"
+    return llm
+
+
+def long_history(n_turns, chars=400):
+    history = []
+    for k in range(n_turns):
+        history += [
+            {"role": "user", "content": f"q{k} " + "x" * chars},
+            {"role": "assistant", "content": f"a{k} " + "y" * chars},
+        ]
+    return history
+
+
+def test_short_history_is_not_compacted():
+    llm = summarizer_llm()
+    compactor = HistoryCompactor(llm, threshold_tokens=1000)
+    assert not compactor.submit("chat", long_history(2))
+    assert compactor.apply("chat", long_history(2)) == long_history(2)
+    assert llm.call_count == 0
+
+
+def test_older_turns_are_summarized():
+    llm = summarizer_llm()
+    # each turn is about 200 tokens
+    compactor = HistoryCompactor(llm, threshold_tokens=500, keep_recent_tokens=300)
+    history = long_history(4)
+
+    assert compactor.submit("chat", history)
+    compactor.wait("chat", timeout=5)
+    compacted = compactor.apply("chat", history)
+
+    assert compacted == summary_messages("Talked about q0 and q1") + history[6:]
+    prompt = llm.call_args.args[0]
+    assert "q0 " in prompt and "a2 " in prompt and "q3 " not in prompt
+    assert compactor.stats() == {
+        "pending": 0,
+        "submitted": 1,
+        "compacted": 1,
+        "failed": 0,
+        "stale": 0,
+    }
+
+    # a summary is summarized again with the next turns
+    assert compactor.submit("chat", compacted + long_history(3))
+    compactor.wait("chat", timeout=5)
+    assert "Talked about q0 and q1" in llm.call_args.args[0]
+
+
+def test_summary_is_not_applied_to_changed_history():
+    compactor = HistoryCompactor(
+        summarizer_llm(), threshold_tokens=500, keep_recent_tokens=300
+    )
+    history = long_history(4)
+    compactor.submit("chat", history)
+    compactor.wait("chat", timeout=5)
+
+    changed = [{"role": "user", "content": "edited"}] + history[1:]
+    assert compactor.apply("chat", changed) == changed
+    assert compactor.stats()["stale"] == 1
+
+
+def test_failed_summary_keeps_history():
+    compactor = HistoryCompactor(
+        summarizer_llm("Could not invoke the AI model."),
+        threshold_tokens=500,
+        keep_recent_tokens=300,
+    )
+    history = long_history(4)
+    compactor.submit("chat", history)
+    compactor.wait("chat", timeout=5)
+    assert compactor.apply("chat", history) == history
+    assert compactor.stats()["failed"] == 1
+
+
+def test_chat_is_compacted_between_messages():
+    answers = [[f"a{k} " + "y" * 400] for k in range(4)]
+    llm = mock_llm(answers)
+    compactor = HistoryCompactor(
+        summarizer_llm(), threshold_tokens=500, keep_recent_tokens=300
+    )
+    li = LLMInterface(
+        "You are a helpful assistant", llm, None, None, compactor=compactor
+    )
+
+    ui_history = []
+    for k in range(4):
+        for x in li.chat_with_function_caller(
+            f"q{k} " + "x" * 400, None, ui_history=ui_history
+        ):
+            pass
+        ui_history = x[-1]
+        compactor.wait(ui_history[0]["content"][0]["text"], timeout=5)
+
+    chat_history = llm.call_args.kwargs["chat_history"]
+    assert chat_history[:2] == summary_messages("Talked about q0 and q1")
+    assert chat_history[2]["content"].startswith("q2 ")
+
+
+def test_summary_replaces_past_in_prompt():
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    history = long_history(2) + summary_messages("Summary") + long_history(1)
+    call_list = llm._prepare_call_list_from_history("System", "Next", None, history)
+
+    assert call_list[1:3] == summary_messages("Summary")
+    assert [x["content"][:3] for x in call_list[3:]] == ["q0 ", "a0 ", "Nex"]
@@ -0,0 +1,111 @@
+import time
+from io import BytesIO
+
+import pytest
+import numpy as np
+from PIL import Image
+
+from gat_llm.llm_invoker import LLM_Provider
+from gat_llm.llm_providers.image_store import ImageStore
+from gat_llm.llm_providers.image_preprocessing import (
+    DEFAULT_MAX_IMAGE_EDGE,
+    PHOTO,
+    ImagePreprocessor,
+    max_image_edge,
+)
+
+
+def photo(width=3000, height=2000):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+
+
+def jpeg_with_exif():
+    exif = Image.Exif()
+    exif[0x010F] = "Camera maker"
+    buffer = BytesIO()
+    Image.fromarray(photo()).save(buffer, format="JPEG", exif=exif, quality=95)
+    return buffer.getvalue()
+
+
+def test_photo_is_resized_without_metadata(tmp_path):
+    image_store = ImageStore(str(tmp_path))
+    preprocessor = ImagePreprocessor(image_store=image_store)
+    data = jpeg_with_exif()
+    ref = preprocessor.prepare(data, max_edge=1000)
+
+    assert ref["media_type"] == "image/jpeg"
+    image = Image.open(BytesIO(image_store.get(ref)))
+    assert image.size == (1000, 667)
+    assert len(image.getexif()) == 0, "Metadata has to be removed"
+
+    stats = preprocessor.stats()
+    assert stats["resized"] == 1
+    assert stats["bytes_in"] == len(data)
+    assert stats["bytes_saved"] == len(data) - len(image_store.get(ref))
+    assert stats["bytes_saved"] > 0
+
+
+def test_few_colors_are_encoded_as_png(tmp_path):
+    preprocessor = ImagePreprocessor(image_store=ImageStore(str(tmp_path)))
+    chart = np.full((400, 600, 3), 255, dtype=np.uint8)
+    chart[100:300, 200:250] = [0, 0, 255]
+    assert preprocessor.prepare(chart)["media_type"] == "image/png"
+    # unless it is a photo
+    assert preprocessor.prepare(chart, content_type=PHOTO)["media_type"] == (
+        "image/jpeg"
+    )
+    transparent = Image.fromarray(photo(100, 100)).convert("RGBA")
+    assert preprocessor.prepare(transparent)["media_type"] == "image/png"
+
+
+def test_processed_images_are_cached(tmp_path):
+    image_store = ImageStore(str(tmp_path))
+    preprocessor = ImagePreprocessor(image_store=image_store)
+    image = photo(800, 600)
+    ref = preprocessor.prepare(image)
+    assert preprocessor.prepare(image.copy()) == ref
+    assert preprocessor.prepare(image, max_edge=400) != ref
+
+    stats = preprocessor.stats()
+    assert stats["images"] == 3
+    assert stats["cache_hits"] == 1
+    assert image_store.stats()["stored"] == 2
+
+
+def test_max_image_edge_of_llm(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    claude = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    assert max_image_edge(claude) == 1568
+    assert max_image_edge(LLM_Provider.get_llm(None, "GPT 5_2 - OpenAI")) == 2048
+    assert max_image_edge(None) == DEFAULT_MAX_IMAGE_EDGE
+
+
+def test_image_store_is_bounded(tmp_path):
+    # room for two images of 400 bytes
+    image_store = ImageStore(str(tmp_path), max_disk_mb=1000 / 1024 / 1024)
+    image_store.keep_recent = 1
+    refs = []
+    for k in range(2):
+        refs.append(image_store.put(bytes([k]) * 400))
+        time.sleep(0.01)
+    # the first image is read: the second is the least recently used
+    image_store.get(refs[0])
+    refs.append(image_store.put(bytes([2]) * 400))
+
+    assert image_store.get(refs[0]) == bytes([0]) * 400
+    with pytest.raises(FileNotFoundError):
+        image_store.get(refs[1])
+    assert image_store.stats()["evictions"] == 1
+    assert image_store.stats()["disk_bytes"] == 800
+    # a new store of the folder knows its size
+    assert ImageStore(str(tmp_path)).disk_bytes == 800
+
+
+def test_recent_images_are_not_evicted(tmp_path):
+    image_store = ImageStore(
+        str(tmp_path), max_disk_mb=500 / 1024 / 1024, keep_recent=3
+    )
+    refs = [image_store.put(bytes([k]) * 400) for k in range(3)]
+    assert all(image_store.get(x) == bytes([k]) * 400 for k, x in enumerate(refs))
+    assert image_store.stats()["evictions"] == 0
@@ -1,13 +1,34 @@
+import os
+import time
 import types
+import threading
 from unittest.mock import Mock
 
-from gat_llm.llm_interface import LLMInterface
+import pytest
+
+from gat_llm.llm_interface import (
+    LLMInterface,
+    UIMessageFormatter,
+    _adjust_msg_for_gradio_ui,
+)
+from gat_llm.tools.base import LLMTools
+
+
+def mock_llm(answers):
+    """Mock of a LLM that uses messages: each call fills its session like the providers"""
+
+    def llm_call(msg, session=None, **kwargs):
+        session.last_message = {"role": "user", "content": msg}
+        session.tool_use_added_msgs = []
+        return answers.pop(0)
+
+    llm = Mock(side_effect=llm_call)
+    llm.usage_log = [{}]
+    return llm
 
 
 def test_return_any_answer():
-    llm = Mock(return_value=["<scratchpad>Thoughts</scratchpad>Bot response"])
-    llm.tool_use_added_msgs = []
-    llm.word_counts = [2]
+    llm = mock_llm([["<scratchpad>Thoughts</scratchpad>Bot response"]])
     rpg = None
     llm_tools = None
 
@@ -29,3 +50,179 @@ def test_return_any_answer():
         "role": "assistant",
         "content": "Bot response\n",
     }, "Unexpected bot response"
+
+
+def test_manual_tool_early_dispatch():
+    # The manual tool call starts as soon as </invoke> is generated
+    tool_started = threading.Event()
+    call = "<function_calls><invoke><tool_name>dummy</tool_name></invoke>"
+
+    def first_answer():
+        yield call
+        assert tool_started.wait(5), "Tool was not dispatched early"
+        yield call + "</function_calls>"
+
+    def invoke_from_cmd(xml_cmd, username=None):
+        tool_started.set()
+        return "<function_results>ok</function_results>"
+
+    llm = mock_llm([first_answer(), ["<answer>Done</answer>"]])
+    rpg = Mock()
+    rpg.use_native_tools = False
+    rpg.post_anti_hallucination = ""
+    llm_tools = Mock()
+    llm_tools.invoke_from_cmd = Mock(side_effect=invoke_from_cmd)
+    llm_tools.can_run_early = Mock(return_value=True)
+    llm_tools.invoke_log = []
+
+    li = LLMInterface("You are a helpful assistant", llm, llm_tools, rpg)
+    for x in li.chat_with_function_caller("Hello", None, ui_history=[]):
+        pass
+
+    llm_tools.invoke_from_cmd.assert_called_once()
+    assert "Done" in x[-1][-1]["content"]
+
+
+def test_tools_with_side_effects_wait_for_the_call_block():
+    call = "<function_calls><invoke><tool_name>dummy</tool_name></invoke>"
+    invoked = []
+
+    def first_answer():
+        yield call
+        time.sleep(0.1)
+        assert invoked == [], "Tool with side effects was dispatched early"
+        yield call + "</function_calls>"
+
+    def invoke_from_cmd(xml_cmd, username=None):
+        invoked.append(xml_cmd)
+        return "<function_results>ok</function_results>"
+
+    llm = mock_llm([first_answer(), ["<answer>Done</answer>"]])
+    rpg = Mock()
+    rpg.use_native_tools = False
+    rpg.post_anti_hallucination = ""
+    llm_tools = Mock()
+    llm_tools.invoke_from_cmd = Mock(side_effect=invoke_from_cmd)
+    llm_tools.can_run_early = Mock(return_value=False)
+    llm_tools.invoke_log = []
+
+    li = LLMInterface("You are a helpful assistant", llm, llm_tools, rpg)
+    for x in li.chat_with_function_caller("Hello", None, ui_history=[]):
+        pass
+
+    assert len(invoked) == 1
+    assert "Done" in x[-1][-1]["content"]
+
+
+def test_only_single_side_effect_free_calls_run_early():
+    read_tool = Mock(side_effect_free=True)
+    read_tool.name = "read"
+    write_tool = Mock(spec=["name", "__call__"])
+    write_tool.name = "write"
+    llm_tools = LLMTools(desired_tools=[read_tool, write_tool])
+
+    def invoke(name):
+        return (
+            f"<invoke><tool_name>{name}</tool_name><parameters></parameters></invoke>"
+        )
+
+    assert llm_tools.can_run_early(invoke("read"))
+    assert not llm_tools.can_run_early(invoke("write"))
+    assert not llm_tools.can_run_early(invoke("unknown"))
+    assert not llm_tools.can_run_early(invoke("read") + invoke("read"))
+
+
+STREAMED_ANSWERS = [
+    "<scratchpad>Let me think</scratchpad>\n\nHi <answer>The answer</answer>",
+    "<think>a < b</think> <function_calls><invoke>x</invoke></function_calls>"
+    "<function_results>ok</function_results>\nDone <scratchpad>open",
+    "<function_results><scratchpad>x</function_results>y</scratchpad> z <answ",
+]
+
+
+@pytest.mark.parametrize("answer", STREAMED_ANSWERS)
+@pytest.mark.parametrize("show_scratchpad,show_calls", [(False, False), (True, True)])
+def test_incremental_formatter_matches_full_formatting(
+    answer, show_scratchpad, show_calls
+):
+    formatter = UIMessageFormatter(show_scratchpad, show_calls)
+    for k in range(1, len(answer) + 1):
+        assert formatter.update(answer[:k]) == _adjust_msg_for_gradio_ui(
+            answer[:k], show_scratchpad, show_calls
+        ), f"Mismatch after {k} characters"
+    # a chunk that doesn't extend the previous one is formatted from scratch
+    assert formatter.update("<answer>New</answer>") == "<answer><b>New</answer></b>"
+
+
+def test_incremental_formatter_checks_media_once(tmp_path, monkeypatch):
+    image = str(tmp_path / "image.png")
+    open(image, "w").close()
+    answer = f"See <path_to_image>{image}</path_to_image> and <path_to_image>missing.png</path_to_image>"
+
+    checked = []
+    isfile = os.path.isfile
+    monkeypatch.setattr(os.path, "isfile", lambda x: checked.append(x) or isfile(x))
+
+    li = LLMInterface("You are a helpful assistant", None, None, None)
+    formatter = UIMessageFormatter()
+    for k in range(1, len(answer) + 1):
+        _, _, _, cur_history = li._format_msg(
+            answer[:k], "Hello", [], formatter=formatter
+        )
+
+    assert cur_history[-1] == {
+        "role": "assistant",
+        "content": {"path": image, "alt_text": "media"},
+    }
+    # a path is also checked while its closing tag is being generated
+    assert checked.count(image) < 5, "Finished paths have to be checked only once"
+    assert checked.count("missing.png") <= 2
+
+
+def test_streamed_frames_are_coalesced():
+    chunks = ["a" * k for k in range(1, 201)]
+    llm = mock_llm([list(chunks)])
+    li = LLMInterface("You are a helpful assistant", llm, None, None)
+    frames = list(li.chat_with_function_caller("Hello", None, ui_history=[]))
+
+    assert len(frames) < 10, "Chunks arriving together have to be coalesced"
+    assert frames[-1][-1][-1]["content"] == chunks[-1] + "\n"
+
+    llm = mock_llm([list(chunks)])
+    li = LLMInterface("You are a helpful assistant", llm, None, None, ui_frame_chars=50)
+    frames = list(li.chat_with_function_caller("Hello", None, ui_history=[]))
+    # chunks 1, 51, 101 and 151, then the final answer
+    assert len(frames) == 4 + 1, "A frame has to be sent every 50 new characters"
+
+    llm = mock_llm([list(chunks)])
+    li = LLMInterface(
+        "You are a helpful assistant", llm, None, None, ui_frame_interval_ms=0
+    )
+    frames = list(li.chat_with_function_caller("Hello", None, ui_history=[]))
+    assert len(frames) == len(chunks) + 1
+
+
+def test_manual_tool_call_is_shown_before_it_runs():
+    call = (
+        "<function_calls><invoke><tool_name>dummy</tool_name></invoke></function_calls>"
+    )
+
+    llm = mock_llm([[call[:10], call[:20], call], ["<answer>Done</answer>"]])
+    rpg = Mock()
+    rpg.use_native_tools = False
+    rpg.post_anti_hallucination = ""
+    llm_tools = Mock()
+    llm_tools.invoke_from_cmd = Mock(
+        return_value="<function_results>ok</function_results>"
+    )
+    llm_tools.invoke_log = []
+
+    li = LLMInterface(
+        "You are a helpful assistant", llm, llm_tools, rpg, ui_frame_interval_ms=10000
+    )
+    frames = list(li.chat_with_function_caller("Hello", None, ui_history=[]))
+
+    # first chunk, tool call, final answer
+    assert len(frames) == 3
+    assert "Function call" in frames[1][1] and "</invoke>" in frames[1][1]
+    assert "Done" in frames[-1][-1][-1]["content"]
@@ -1,11 +1,38 @@
+import copy
+import sys
 import json
+import base64
+import hashlib
+import time
+import types
+import asyncio
+import threading
+import subprocess
 
+from unittest.mock import AsyncMock
 from unittest.mock import MagicMock
 from unittest.mock import Mock
 
 import pytest
+from openai.types.chat import ChatCompletionChunk
 
 from gat_llm.llm_invoker import LLM_Provider
+from gat_llm.llm_providers.stream_events import CumulativeAnswer
+from gat_llm.llm_providers.stream_events import StreamStop
+from gat_llm.llm_providers.stream_events import TextDelta
+from gat_llm.llm_providers.stream_events import ToolCallDelta
+from gat_llm.llm_providers.stream_events import ToolResult
+from gat_llm.llm_providers.usage import UsageLog
+from gat_llm.llm_providers import retry_policy
+from gat_llm.llm_providers.retry_policy import RetryPolicy
+from gat_llm.llm_providers.response_cache import ResponseCache
+from gat_llm.llm_providers.call_session import CallSession
+from gat_llm.llm_providers.client_registry import CLIENT_REGISTRY
+from gat_llm.llm_providers.client_registry import ClientRegistry
+from gat_llm.llm_providers import model_catalog
+from gat_llm.llm_providers import base_service
+from gat_llm.llm_providers.image_store import ImageStore
+from gat_llm.llm_providers.context_manager import IMAGE_TOKENS
 
 
 @pytest.mark.parametrize(
@@ -45,7 +72,7 @@ def test_model_creation(llm):
 
 
 def dummy_response_gen(ret_val):
-    def resp_gen_func(text, postpend=""):
+    def resp_gen_func(text, postpend="", session=None):
         # just mocks the yield part of the response
         if isinstance(text, str):
             yield text
@@ -109,6 +136,91 @@ def test_if_llm_responds(llm_name, ret_val):
     assert x == ret_val
 
 
+def dummy_aresponse_gen(ret_val):
+    async def resp_gen_func(text, postpend="", session=None):
+        # just mocks the yield part of the async response
+        yield ret_val
+
+    return resp_gen_func
+
+
+async def _collect_async(ans):
+    x = None
+    async for x in ans:
+        pass
+    return x
+
+
+@pytest.mark.parametrize(
+    "llm_name", LLM_Provider.allowed_llms + LLM_Provider.outdated_llms
+)
+@pytest.mark.parametrize(
+    "ret_val",
+    [
+        "Dummy LLM generation",
+        "",
+    ],
+)
+def test_if_llm_responds_async(llm_name, ret_val):
+    # Checks if acall yields the same answer as the blocking call
+    bedrock_client = None
+    llm = LLM_Provider.get_llm(bedrock_client, llm_name)
+
+    # mocks the clients
+    llm.anthropic_client = MagicMock()
+    llm.anthropic_async_client = MagicMock()
+    llm.bedrock_client = MagicMock()
+    llm.openai_client = MagicMock()
+    llm.openai_async_client = MagicMock()
+
+    # mocks the invoke methods
+    llm.anthropic_client.messages.create = Mock(return_value=ret_val)
+    llm.anthropic_async_client.messages.create = AsyncMock(return_value=ret_val)
+    llm.openai_client.chat.completions.create = Mock(return_value=ret_val)
+    llm.openai_async_client.chat.completions.create = AsyncMock(return_value=ret_val)
+    llm.bedrock_client.invoke_model_with_response_stream = Mock(
+        return_value={
+            "body": [
+                {
+                    "chunk": {
+                        "bytes": json.dumps(
+                            {
+                                "generation": ret_val,
+                                "outputs": [{"text": ret_val}],
+                                "completion": ret_val,
+                                "stop": "",
+                            }
+                        )
+                    }
+                }
+            ]
+        }
+    )
+
+    llm.cur_tool_specs = []
+    llm.cur_tool_spec = None
+    llm.stop_reason = None
+    llm._response_gen = dummy_response_gen(ret_val)
+    llm._aresponse_gen = dummy_aresponse_gen(ret_val)
+    x = asyncio.run(_collect_async(llm.acall("Dummy message")))
+
+    assert x == ret_val
+
+
+@pytest.mark.parametrize(
+    "llm_name", LLM_Provider.allowed_llms + LLM_Provider.outdated_llms
+)
+def test_if_llm_exits_gracefully_async(llm_name):
+    # Checks if the async path also exits gracefully without a valid token
+    bedrock_client = None
+    llm = LLM_Provider.get_llm(bedrock_client, llm_name)
+
+    ans = llm.acall("Dummy message", max_retries=1, cur_fail_sleep=0)
+    x = asyncio.run(_collect_async(ans))
+
+    assert x == "Could not invoke the AI model."
+
+
 @pytest.mark.parametrize(
     "llm_name", LLM_Provider.allowed_llms + LLM_Provider.outdated_llms
 )
@@ -123,3 +235,854 @@ def test_if_llm_exits_gracefully(llm_name):
         pass
 
     assert x == "Could not invoke the AI model."
+
+
+def bedrock_chunk(out_dict):
+    return {"chunk": {"bytes": json.dumps(out_dict)}}
+
+
+def bedrock_tool_use_turns():
+    # first answer calls a tool, second answer uses its result
+    turn1 = [
+        bedrock_chunk({"content_block": {"type": "text", "text": "Let me"}}),
+        bedrock_chunk({"delta": {"text": " check."}}),
+        bedrock_chunk(
+            {"content_block": {"type": "tool_use", "id": "t1", "name": "dummy_tool"}}
+        ),
+        bedrock_chunk({"delta": {"partial_json": '{"a": '}}),
+        bedrock_chunk({"delta": {"partial_json": "1}"}}),
+        bedrock_chunk({"delta": {"stop_reason": "tool_use"}}),
+    ]
+    turn2 = [
+        bedrock_chunk({"content_block": {"type": "text", "text": "Done"}}),
+        bedrock_chunk({"delta": {"stop_reason": "end_turn"}}),
+    ]
+    turns = iter([turn1, turn2])
+    return lambda **kwargs: {"body": next(turns)}
+
+
+def dummy_tool_invoker(tool_name, return_results_only=True, **kwargs):
+    def tool_gen():
+        yield "partial"
+        yield f"{tool_name}:{kwargs}"
+
+    return tool_gen()
+
+
+def test_stream_deltas_bedrock_tool_use():
+    # Delta events rebuild exactly the answers of the cumulative mode
+    tools = [{"name": "dummy_tool", "description": "d", "input_schema": {}}]
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    llm.bedrock_client = Mock()
+
+    llm.bedrock_client.invoke_model_with_response_stream = bedrock_tool_use_turns()
+    cumulative = list(llm("hi", tools=tools, tool_invoker_fn=dummy_tool_invoker))
+    cumulative_msgs = llm.last_session.tool_use_added_msgs
+
+    llm.bedrock_client.invoke_model_with_response_stream = bedrock_tool_use_turns()
+    events = list(
+        llm("hi", tools=tools, tool_invoker_fn=dummy_tool_invoker, stream_deltas=True)
+    )
+
+    assert events == [
+        TextDelta("Let me"),
+        TextDelta(" check."),
+        ToolCallDelta("t1", "dummy_tool"),
+        ToolCallDelta("t1", "dummy_tool", '{"a": '),
+        ToolCallDelta("t1", "dummy_tool", "1}"),
+        StreamStop("tool_use"),
+        ToolResult("dummy_tool", "partial"),
+        ToolResult("dummy_tool", "dummy_tool:{'a': 1}"),
+        TextDelta("Done"),
+        StreamStop("end_turn"),
+    ]
+    assert llm.last_session.tool_use_added_msgs == cumulative_msgs
+
+    answer = CumulativeAnswer()
+    rebuilt = []
+    for event in events:
+        answer.add(event)
+        if event.kind in ["text", "tool_result"]:
+            rebuilt.append(answer.value())
+    assert rebuilt == cumulative
+
+
+def test_stream_deltas_bedrock_stop_sequence_async():
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    chunks = [
+        bedrock_chunk({"content_block": {"type": "text", "text": "Answer"}}),
+        bedrock_chunk(
+            {"delta": {"stop_reason": "stop_sequence", "stop_sequence": "</a>"}}
+        ),
+        bedrock_chunk({"delta": {"text": "never streamed"}}),
+    ]
+    llm.bedrock_client = Mock()
+    llm.bedrock_client.invoke_model_with_response_stream = Mock(
+        return_value={"body": chunks}
+    )
+
+    async def collect():
+        return [x async for x in llm.acall("hi", stream_deltas=True)]
+
+    events = asyncio.run(collect())
+    assert events == [TextDelta("Answer"), StreamStop("stop_sequence", "</a>")]
+
+
+def test_stream_deltas_not_supported():
+    llm = LLM_Provider.get_llm(None, "Llama2 13b")
+    with pytest.raises(AssertionError):
+        llm("hi", stream_deltas=True)
+
+
+def bedrock_parallel_tool_turns():
+    # first answer calls the same tool three times
+    turn1 = [bedrock_chunk({"content_block": {"type": "text", "text": "Checking"}})]
+    for k in range(3):
+        turn1 += [
+            bedrock_chunk(
+                {
+                    "content_block": {
+                        "type": "tool_use",
+                        "id": f"t{k}",
+                        "name": "slow_tool",
+                    }
+                }
+            ),
+            bedrock_chunk({"delta": {"partial_json": json.dumps({"k": k})}}),
+        ]
+    turn1.append(bedrock_chunk({"delta": {"stop_reason": "tool_use"}}))
+    turn2 = [
+        bedrock_chunk({"content_block": {"type": "text", "text": "Done"}}),
+        bedrock_chunk({"delta": {"stop_reason": "end_turn"}}),
+    ]
+    turns = iter([turn1, turn2])
+    return lambda **kwargs: {"body": next(turns)}
+
+
+class SlowToolInvoker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, tool_name, return_results_only=True, k=0):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        # first calls finish last
+        time.sleep(0.05 * (3 - k))
+        with self.lock:
+            self.running -= 1
+        return f"result {k}"
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+@pytest.mark.parametrize("max_parallel_tools", [1, 2, 4])
+def test_parallel_tool_calls(use_async, max_parallel_tools):
+    # All tool calls of a turn run, at most max_parallel_tools at a time,
+    # and the results are sent back in the original order
+    tools = [{"name": "slow_tool", "description": "d", "input_schema": {}}]
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    llm.max_parallel_tools = max_parallel_tools
+    llm.bedrock_client = Mock()
+    llm.bedrock_client.invoke_model_with_response_stream = bedrock_parallel_tool_turns()
+    tool_invoker = SlowToolInvoker()
+
+    if use_async:
+        ans = llm.acall("hi", tools=tools, tool_invoker_fn=tool_invoker, max_retries=1)
+        x = asyncio.run(_collect_async(ans))
+    else:
+        ans = llm("hi", tools=tools, tool_invoker_fn=tool_invoker, max_retries=1)
+        for x in ans:
+            pass
+
+    assert x == "Done"
+    assert tool_invoker.max_running == min(max_parallel_tools, 3)
+    assistant_msg, tool_results_msg = llm.last_session.tool_use_added_msgs
+    assert [c["id"] for c in assistant_msg["content"][1:]] == ["t0", "t1", "t2"]
+    assert tool_results_msg["content"] == [
+        {"type": "tool_result", "tool_use_id": f"t{k}", "content": f"result {k}"}
+        for k in range(3)
+    ]
+
+
+def test_early_tool_dispatch():
+    # The tool starts when its content block stops, before the answer ends
+    tool_started = threading.Event()
+
+    def turn1():
+        yield bedrock_chunk(
+            {"content_block": {"type": "tool_use", "id": "t1", "name": "dummy_tool"}}
+        )
+        yield bedrock_chunk({"delta": {"partial_json": '{"a": 1}'}})
+        yield bedrock_chunk({"type": "content_block_stop", "index": 0})
+        assert tool_started.wait(5), "Tool was not dispatched early"
+        yield bedrock_chunk({"delta": {"stop_reason": "tool_use"}})
+
+    turn2 = [
+        bedrock_chunk({"content_block": {"type": "text", "text": "Done"}}),
+        bedrock_chunk({"delta": {"stop_reason": "end_turn"}}),
+    ]
+    turns = iter([turn1(), turn2])
+
+    def tool_invoker(tool_name, return_results_only=True, **kwargs):
+        tool_started.set()
+        return "tool result"
+
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    llm.bedrock_client = Mock()
+    llm.bedrock_client.invoke_model_with_response_stream = lambda **kwargs: {
+        "body": next(turns)
+    }
+    tools = [{"name": "dummy_tool", "description": "d", "input_schema": {}}]
+    for x in llm("hi", tools=tools, tool_invoker_fn=tool_invoker, max_retries=1):
+        pass
+
+    assert x == "Done"
+    assert (
+        llm.last_session.tool_use_added_msgs[-1]["content"][0]["content"]
+        == "tool result"
+    )
+
+
+def bedrock_two_tools_turn(id_prefix):
+    turn = []
+    for k, name in enumerate(["expensive_tool", "flaky_tool"]):
+        turn += [
+            bedrock_chunk(
+                {
+                    "content_block": {
+                        "type": "tool_use",
+                        "id": f"{id_prefix}{k}",
+                        "name": name,
+                    }
+                }
+            ),
+            bedrock_chunk({"delta": {"partial_json": '{"a": 1}'}}),
+        ]
+    turn.append(bedrock_chunk({"delta": {"stop_reason": "tool_use"}}))
+    return turn
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_retry_reuses_tool_results(use_async):
+    # A failed tool turn is retried without running the tools that had finished
+    turns = iter(
+        [
+            bedrock_two_tools_turn("first"),
+            bedrock_two_tools_turn("second"),
+            [
+                bedrock_chunk({"content_block": {"type": "text", "text": "Done"}}),
+                bedrock_chunk({"delta": {"stop_reason": "end_turn"}}),
+            ],
+        ]
+    )
+    calls = []
+
+    def tool_invoker(tool_name, return_results_only=True, **kwargs):
+        calls.append(tool_name)
+        if tool_name == "flaky_tool" and calls.count("flaky_tool") == 1:
+            raise ConnectionError("flaky")
+        return f"{tool_name} result"
+
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    llm.bedrock_client = Mock()
+    llm.bedrock_client.invoke_model_with_response_stream = lambda **kwargs: {
+        "body": next(turns)
+    }
+    tools = [{"name": "expensive_tool", "description": "d", "input_schema": {}}]
+    if use_async:
+        ans = llm.acall(
+            "hi", tools=tools, tool_invoker_fn=tool_invoker, cur_fail_sleep=0
+        )
+        x = asyncio.run(_collect_async(ans))
+    else:
+        ans = llm("hi", tools=tools, tool_invoker_fn=tool_invoker, cur_fail_sleep=0)
+        for x in ans:
+            pass
+
+    assert x == "Done"
+    assert sorted(calls) == ["expensive_tool", "flaky_tool", "flaky_tool"]
+    assistant_msg, tool_results_msg = llm.last_session.tool_use_added_msgs
+    assert [c["id"] for c in assistant_msg["content"]] == ["second0", "second1"]
+    assert [c["content"] for c in tool_results_msg["content"]] == [
+        "expensive_tool result",
+        "flaky_tool result",
+    ]
+
+
+def test_concurrent_calls_share_one_llm():
+    # Each call keeps its own tool calls and messages, even on the same instance
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    both_streaming = threading.Barrier(2, timeout=5)
+
+    def turns(user):
+        def turn1():
+            yield bedrock_chunk(
+                {
+                    "content_block": {
+                        "type": "tool_use",
+                        "id": f"id_{user}",
+                        "name": "dummy_tool",
+                    }
+                }
+            )
+            yield bedrock_chunk({"delta": {"partial_json": json.dumps({"a": user})}})
+            # both answers are being streamed at the same time
+            both_streaming.wait()
+            yield bedrock_chunk({"delta": {"stop_reason": "tool_use"}})
+
+        turn2 = [
+            bedrock_chunk({"content_block": {"type": "text", "text": f"Done {user}"}}),
+            bedrock_chunk({"delta": {"stop_reason": "end_turn"}}),
+        ]
+        return iter([turn1(), turn2])
+
+    user_turns = {"ann": turns("ann"), "bob": turns("bob")}
+
+    def invoke(modelId, body):
+        user = json.loads(body)["messages"][0]["content"]
+        return {"body": next(user_turns[user])}
+
+    llm.bedrock_client = Mock()
+    llm.bedrock_client.invoke_model_with_response_stream = invoke
+    tools = [{"name": "dummy_tool", "description": "d", "input_schema": {}}]
+    results = {}
+
+    def chat(user):
+        session = CallSession()
+        ans = llm(
+            user, tools=tools, tool_invoker_fn=dummy_tool_invoker, session=session
+        )
+        results[user] = (list(ans)[-1], session)
+
+    threads = [threading.Thread(target=chat, args=(user,)) for user in user_turns]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for user in ["ann", "bob"]:
+        ans, session = results[user]
+        assert ans == f"Done {user}"
+        assert session.last_message == {"role": "user", "content": user}
+        assistant_msg, tool_results_msg = session.tool_use_added_msgs
+        assert assistant_msg["content"][0]["id"] == f"id_{user}"
+        assert tool_results_msg["content"][0]["content"] == (
+            f"dummy_tool:{{'a': '{user}'}}"
+        )
+
+
+def test_usage_from_bedrock_stream():
+    # Token counts come from the stream and the cost from the model prices
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    chunks = [
+        bedrock_chunk(
+            {
+                "type": "message_start",
+                "message": {
+                    "usage": {
+                        "input_tokens": 1000,
+                        "output_tokens": 1,
+                        "cache_read_input_tokens": 2000,
+                        "cache_creation_input_tokens": 0,
+                    }
+                },
+            }
+        ),
+        bedrock_chunk({"content_block": {"type": "text", "text": "Answer"}}),
+        bedrock_chunk(
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn"},
+                "usage": {"output_tokens": 500},
+            }
+        ),
+    ]
+    llm.bedrock_client = Mock()
+    llm.bedrock_client.invoke_model_with_response_stream = Mock(
+        return_value={"body": chunks}
+    )
+    for x in llm("hi"):
+        pass
+
+    usage = llm.usage_log[-1]
+    assert usage["input_tokens"] == 1000
+    assert usage["output_tokens"] == 500
+    assert usage["cache_read_tokens"] == 2000
+    assert usage["reported"]
+    expected_cost = (
+        (1000 + 0.1 * 2000) * llm.price_per_M_input_tokens
+        + 500 * llm.price_per_M_output_tokens
+    ) / 1e6
+    assert usage["cost"] == pytest.approx(expected_cost)
+
+
+@pytest.mark.parametrize(
+    "llm_name, stream_usage",
+    [
+        ("GPT 5 nano - OpenAI", True),
+        ("Qwen 3 0.6b - Ollama", False),
+        ("Sabia3 - Maritaca", False),
+    ],
+)
+def test_stream_usage_is_requested_if_supported(llm_name, stream_usage):
+    llm = LLM_Provider.get_llm(None, llm_name)
+    body = llm._prepare_body([{"role": "user", "content": "Hi"}], "", [], None, None)
+    assert ("stream_options" in body) == stream_usage
+
+
+def test_usage_is_estimated_if_not_reported():
+    llm = LLM_Provider.get_llm(None, "Qwen 3 0.6b - Ollama", cached=False)
+    delta = types.SimpleNamespace(content="One two three", tool_calls=None)
+    chunk = types.SimpleNamespace(
+        choices=[types.SimpleNamespace(delta=delta, finish_reason="stop")]
+    )
+    llm.openai_client = Mock()
+    llm.openai_client.chat.completions.create = Mock(return_value=[chunk])
+    b64_image = base64.b64encode(bytes(range(256)) * 1000).decode("utf-8")
+    for x in llm("Four five", b64images=[b64_image], system_prompt="Six"):
+        pass
+
+    assert x == "One two three"
+    usage = llm.usage_log[-1]
+    assert not usage["reported"]
+    assert usage["output_tokens"] == 3
+    # the image counts as an image, not as the characters of its base64
+    assert IMAGE_TOKENS < usage["input_tokens"] < IMAGE_TOKENS + 100
+
+
+@pytest.mark.parametrize(
+    "llm_name, out_dict",
+    [
+        ("Llama3_1 8b instruct", {"generation": "One two three"}),
+        ("Mistral Large v1", {"outputs": [{"text": "One two three"}]}),
+        (
+            "Command R - Bedrock",
+            {
+                "event_type": "stream-end",
+                "text": "One two three",
+                "is_finished": True,
+                "response": {"generation_id": "g", "chat_history": []},
+            },
+        ),
+    ],
+)
+def test_bedrock_invocation_metrics_are_logged(llm_name, out_dict):
+    # The token counts of the last chunk are used instead of an estimate
+    llm = LLM_Provider.get_llm(None, llm_name, cached=False)
+    metrics = {"inputTokenCount": 12, "outputTokenCount": 34}
+    llm.bedrock_client = Mock()
+    llm.bedrock_client.invoke_model_with_response_stream = Mock(
+        return_value={
+            "body": [
+                bedrock_chunk({**out_dict, "amazon-bedrock-invocationMetrics": metrics})
+            ]
+        }
+    )
+    for x in llm("Hi"):
+        pass
+
+    assert x == "One two three"
+    usage = llm.usage_log[-1]
+    assert usage["reported"]
+    assert usage["input_tokens"] == 12
+    assert usage["output_tokens"] == 34
+
+
+def test_usage_log_is_bounded():
+    usage_log = UsageLog(1, 2, max_records=3)
+    for k in range(5):
+        usage_log.add({"input_tokens": 1000000, "output_tokens": k})
+
+    assert len(usage_log) == 3
+    assert [x["output_tokens"] for x in usage_log] == [2, 3, 4]
+    assert usage_log.totals["calls"] == 5
+    assert usage_log.totals["input_tokens"] == 5000000
+    assert usage_log.totals["cost"] == pytest.approx(5 + 2 * 10 / 1e6)
+
+
+class BotoLikeError(Exception):
+    def __init__(self, code, status_code, headers=None):
+        super().__init__(code)
+        self.response = {
+            "Error": {"Code": code},
+            "ResponseMetadata": {
+                "HTTPStatusCode": status_code,
+                "HTTPHeaders": headers or {},
+            },
+        }
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (BotoLikeError("ThrottlingException", 400), retry_policy.THROTTLING),
+        (BotoLikeError("ServiceUnavailableException", 503), retry_policy.TRANSIENT),
+        (BotoLikeError("ValidationException", 400), retry_policy.FATAL),
+        (BotoLikeError("SomethingNew", 502), retry_policy.TRANSIENT),
+        (StatusError(429), retry_policy.THROTTLING),
+        (StatusError(401), retry_policy.FATAL),
+        (ConnectionError("reset"), retry_policy.TRANSIENT),
+        (ValueError("?"), retry_policy.UNKNOWN),
+    ],
+)
+def test_classify_error(error, expected):
+    assert retry_policy.classify_error(error) == expected
+
+
+def test_retry_delay():
+    policy = RetryPolicy(max_delay=10)
+    error = BotoLikeError("ThrottlingException", 429, {"retry-after": "3"})
+    assert policy.delay(error, 0, 1) == 3
+    error = BotoLikeError("ThrottlingException", 429, {"retry-after": "300"})
+    assert policy.delay(error, 0, 1) == 10
+    error = BotoLikeError("ThrottlingException", 429)
+    for attempt in range(6):
+        delay = policy.delay(error, attempt, 1)
+        expected = min(2**attempt, 10)
+        assert expected / 2 <= delay <= expected
+
+
+def failing_bedrock_llm(error):
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    llm.bedrock_client = Mock()
+    llm.bedrock_client.invoke_model_with_response_stream = Mock(side_effect=error)
+    return llm
+
+
+def test_fatal_error_is_not_retried():
+    llm = failing_bedrock_llm(BotoLikeError("ValidationException", 400))
+    ans = list(llm("hi", max_retries=5, cur_fail_sleep=0))
+
+    assert llm.bedrock_client.invoke_model_with_response_stream.call_count == 1
+    assert ans[-1] == "Could not invoke the AI model."
+
+
+def test_retry_after_is_honoured(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", lambda s: sleeps.append(s))
+    error = BotoLikeError("ThrottlingException", 429, {"retry-after-ms": "1500"})
+    llm = failing_bedrock_llm(error)
+    ans = list(llm("hi", max_retries=3, cur_fail_sleep=0))
+
+    assert sleeps == [1.5, 1.5]
+    assert "Waiting 1 s. Retrying 1/3..." in ans[0]
+    assert ans[-1] == "Could not invoke the AI model."
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_circuit_breaker_fails_fast(use_async):
+    llm = failing_bedrock_llm(BotoLikeError("ServiceUnavailableException", 503))
+    llm.retry_policy = RetryPolicy(failure_threshold=2, reset_timeout=60)
+    invoke = llm.bedrock_client.invoke_model_with_response_stream
+
+    def call():
+        if use_async:
+            return asyncio.run(_collect_async(llm.acall("hi", max_retries=1)))
+        return list(llm("hi", max_retries=1))[-1]
+
+    call()
+    call()
+    assert invoke.call_count == 2
+    assert llm.retry_policy.circuit_breaker(llm._retry_key()).is_open()
+
+    # open circuit: the model is not called
+    assert call() == "Could not invoke the AI model."
+    assert invoke.call_count == 2
+
+    # after reset_timeout, one trial call closes the circuit if it succeeds
+    llm.retry_policy.circuit_breaker(llm._retry_key()).opened_at -= 61
+    invoke.side_effect = None
+    invoke.return_value = {
+        "body": [
+            bedrock_chunk({"content_block": {"type": "text", "text": "Back"}}),
+            bedrock_chunk({"delta": {"stop_reason": "end_turn"}}),
+        ]
+    }
+    assert call() == "Back"
+    assert not llm.retry_policy.circuit_breaker(llm._retry_key()).is_open()
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_response_cache_replays_tool_turns(use_async, tmp_path):
+    # The second identical request is replayed call by call, with the same chunks
+    # and the same tool calls, without invoking the model
+    tools = [{"name": "dummy_tool", "description": "d", "input_schema": {}}]
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    llm.response_cache = ResponseCache(cache_dir=str(tmp_path))
+    llm.bedrock_client = Mock()
+    invoke = Mock(side_effect=bedrock_tool_use_turns())
+    llm.bedrock_client.invoke_model_with_response_stream = invoke
+
+    def run():
+        if use_async:
+            ans = llm.acall("hi", tools=tools, tool_invoker_fn=dummy_tool_invoker)
+            return asyncio.run(_collect_all_async(ans))
+        return list(llm("hi", tools=tools, tool_invoker_fn=dummy_tool_invoker))
+
+    first = run()
+    assert invoke.call_count == 2
+    second = run()
+    assert invoke.call_count == 2
+    assert second == first
+    assert second[-1] == "Done"
+    assert llm.usage_log[-1]["input_tokens"] == 0
+    stats = llm.response_cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+
+    # a new cache on the same folder reads the responses from disk
+    llm.response_cache = ResponseCache(cache_dir=str(tmp_path))
+    assert run() == first
+    assert invoke.call_count == 2
+    assert llm.response_cache.stats()["disk_hits"] == 2
+
+
+def openai_chunk(delta, finish_reason=None):
+    return ChatCompletionChunk.model_validate(
+        {
+            "id": "c1",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "m",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+    )
+
+
+def openai_tool_use_turns():
+    # first answer calls a tool, second answer uses its result
+    def tool_call(**kwargs):
+        return {"tool_calls": [{"index": 0, **kwargs}]}
+
+    turn1 = [
+        openai_chunk({"content": "Let me check."}),
+        openai_chunk(
+            tool_call(id="t1", type="function", function={"name": "dummy_tool"})
+        ),
+        openai_chunk(tool_call(function={"arguments": '{"a": '})),
+        openai_chunk(tool_call(function={"arguments": "1}"}), "tool_calls"),
+    ]
+    turn2 = [openai_chunk({"content": "Done"}, "stop")]
+    turns = iter([turn1, turn2])
+    return lambda **kwargs: next(turns)
+
+
+def test_response_cache_replays_openai_tool_turns(tmp_path):
+    # The tool calls of OpenAI stream chunks are stored as plain data
+    tools = [{"name": "dummy_tool", "description": "d", "input_schema": {}}]
+    llm = LLM_Provider.get_llm(None, "GPT 5 nano - OpenAI", cached=False)
+    llm.response_cache = ResponseCache(cache_dir=str(tmp_path))
+    llm.openai_client = Mock()
+    create = Mock(side_effect=openai_tool_use_turns())
+    llm.openai_client.chat.completions.create = create
+
+    def run():
+        return list(llm("hi", tools=tools, tool_invoker_fn=dummy_tool_invoker))
+
+    first = run()
+    assert create.call_count == 2
+    assert first[-1] == "Done"
+    assert "dummy_tool:{'a': 1}" in str(create.call_args.kwargs["messages"])
+
+    llm.response_cache = ResponseCache(cache_dir=str(tmp_path))
+    assert run() == first
+    assert create.call_count == 2
+    assert llm.response_cache.stats()["disk_hits"] == 2
+
+
+async def _collect_all_async(ans):
+    return [x async for x in ans]
+
+
+def test_response_cache_eviction_and_ttl(tmp_path):
+    cache = ResponseCache(max_entries=2, cache_dir=None)
+    for k in range(3):
+        cache.put(f"key{k}", {"chunks": [], "state": {}})
+    assert cache.get("key0") is None
+    assert cache.get("key2") is not None
+    assert cache.stats()["evictions"] == 1
+
+    cache = ResponseCache(cache_dir=str(tmp_path), ttl_in_s=0.05)
+    cache.put("key", {"chunks": [], "state": {}})
+    assert cache.get("key") is not None
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    assert ResponseCache(cache_dir=str(tmp_path), ttl_in_s=0.05).get("key") is None
+    assert cache.stats()["expired"] == 1
+
+    big_entry = {"chunks": [["x" * 1000]], "state": {}}
+    cache = ResponseCache(cache_dir=str(tmp_path / "small"), max_disk_mb=0.003)
+    for k in range(5):
+        cache.put(f"key{k}", big_entry)
+        time.sleep(0.01)
+    assert cache.stats()["disk_bytes"] <= 0.003 * 1024 * 1024
+    # the least recently used files are deleted first
+    assert sorted(x.name for x in (tmp_path / "small").iterdir()) == [
+        "key3.json",
+        "key4.json",
+    ]
+
+
+def test_get_llm_is_cached():
+    bedrock_client = Mock()
+    llm = LLM_Provider.get_llm(bedrock_client, "Claude 4.5 Haiku - Bedrock")
+    assert LLM_Provider.get_llm(bedrock_client, "Claude 4.5 Haiku - Bedrock") is llm
+    assert LLM_Provider.get_llm(Mock(), "Claude 4.5 Haiku - Bedrock") is not llm
+    assert (
+        LLM_Provider.get_llm(bedrock_client, "Claude 4.5 Haiku - Bedrock", cached=False)
+        is not llm
+    )
+    stats = CLIENT_REGISTRY.stats()["llms"]
+    assert stats == {"cached": 2, "hits": 1, "misses": 2}
+
+
+@pytest.mark.parametrize(
+    "llm_name",
+    [
+        "Amazon Nova Lite 1.0 - Bedrock",
+        "Claude 4.5 Haiku - Bedrock",
+        "Claude 4.5 Haiku - Anthropic",
+    ],
+)
+def test_prepare_body_does_not_change_shared_config(llm_name):
+    llm = LLM_Provider.get_llm(Mock(), llm_name)
+    config = copy.deepcopy(llm.config)
+    system = [{"type": "text", "text": "System"}]
+    for _ in range(2):
+        prompt = {"system": system, "messages": [{"role": "user", "content": "Hi"}]}
+        body = llm._prepare_body(prompt, "", ["</function_calls>"], None, None)
+    assert llm.config == config
+    assert system == [{"type": "text", "text": "System"}]
+    stop_sequences = (
+        body.get("stop_sequences") or body["inferenceConfig"]["stopSequences"]
+    )
+    assert stop_sequences.count("</function_calls>") == 1
+
+
+def test_client_registry_reuses_clients(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    registry = ClientRegistry(max_pool_connections=8)
+    client = registry.openai_client()
+    assert registry.openai_client() is client
+    local_client = registry.openai_client(base_url="http://localhost:11434/v1")
+    assert local_client is not client
+    assert registry.openai_client(base_url="http://localhost:11434/v1") is local_client
+    keyed_client = registry.openai_client(api_key="secret-key")
+    assert keyed_client is not client
+    assert registry.openai_client(api_key="secret-key") is keyed_client
+
+    bedrock_client = registry.bedrock_client(region_name="us-east-1")
+    assert registry.bedrock_client(region_name="us-east-1") is bedrock_client
+    assert bedrock_client.meta.config.max_pool_connections == 8
+
+    stats = registry.stats()
+    assert stats["max_pool_connections"] == 8
+    assert len(stats["clients"]) == 4
+    assert [x["handed_out"] for x in stats["clients"].values()] == [2, 2, 2, 2]
+    # API keys are not shown
+    assert "secret-key" not in str(stats) and "secret-key" not in str(registry.clients)
+
+
+def test_async_clients_belong_to_their_event_loop(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    registry = ClientRegistry()
+
+    async def get_clients():
+        clients = [registry.async_openai_client(), registry.async_anthropic_client()]
+        assert registry.async_openai_client() is clients[0]
+        assert registry.async_anthropic_client() is clients[1]
+        return clients
+
+    first_loop_clients = asyncio.run(get_clients())
+    second_loop_clients = asyncio.run(get_clients())
+    assert all(x is not y for x, y in zip(first_loop_clients, second_loop_clients))
+    # the clients of the closed loops are dropped
+    asyncio.run(get_clients())
+    assert len(registry.async_clients) == 1
+    assert [x["handed_out"] for x in registry.stats()["clients"].values()] == [6, 6]
+
+
+def test_provider_modules_are_imported_lazily():
+    code = (
+        "import sys\n"
+        "from gat_llm.llm_invoker import LLM_Provider\n"
+        "loaded = lambda: sorted(m for m in ['boto3', 'openai', 'anthropic'] if m in sys.modules)\n"
+        "print(loaded())\n"
+        "LLM_Provider.get_llm(None, 'Qwen 3 0.6b - Ollama')\n"
+        "print(loaded())\n"
+    )
+    ans = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert ans.stdout.split("\n")[:2] == ["[]", "['openai']"]
+
+
+@pytest.mark.parametrize(
+    "llm_name", LLM_Provider.allowed_llms + LLM_Provider.outdated_llms
+)
+def test_model_spec(llm_name):
+    spec = LLM_Provider.get_model_spec(llm_name)
+    llm = LLM_Provider.get_llm(None, llm_name)
+    assert llm.model_spec == spec
+    assert llm.model_id == spec["model_id"]
+    assert llm.llm_description == spec["llm_description"]
+    assert llm.usage_log.price_per_M_input_tokens == spec["price_per_M_input_tokens"]
+    assert llm.context_window > 0
+
+
+def test_list_llms_by_capability():
+    vision_llms = model_catalog.list_llms(
+        status=model_catalog.CURRENT, vision=True, native_tools=True
+    )
+    assert "Claude 4.5 Haiku - Bedrock" in vision_llms
+    assert "Qwen 3vl 2b - Ollama" in vision_llms
+    assert "Qwen 3 0.6b - Ollama" not in vision_llms
+    assert set(vision_llms) <= set(LLM_Provider.allowed_llms)
+
+
+@pytest.mark.parametrize(
+    "llm_name", ["Claude 4.5 Haiku - Bedrock", "Qwen 3vl 2b - Ollama"]
+)
+def test_history_keeps_image_references(llm_name, tmp_path, monkeypatch):
+    image_store = ImageStore(str(tmp_path))
+    monkeypatch.setattr(base_service, "IMAGE_STORE", image_store)
+    llm = LLM_Provider.get_llm(None, llm_name)
+    b64_image = base64.b64encode(b"image bytes").decode("utf-8")
+
+    session = CallSession()
+    prompt = llm._prepare_invocation(
+        session, "What is this?", [b64_image], "System", [], "", []
+    )
+    ref = session.last_message["content"][0]
+    assert ref == {
+        "type": "image_ref",
+        "sha256": hashlib.sha256(b"image bytes").hexdigest(),
+        "media_type": "image/jpeg",
+    }
+    assert b64_image in json.dumps(prompt), "The request has to include the image"
+
+    # next turn: the image is read from the store
+    image_store.b64_cache.clear()
+    history = [session.last_message, {"role": "assistant", "content": "A test"}]
+    prompt = llm._prepare_invocation(
+        CallSession(), "And this?", None, "System", history, "", []
+    )
+    assert b64_image in json.dumps(prompt)
+    assert b64_image not in json.dumps(history)
+    assert image_store.stats() == {
+        "cached": 1,
+        "stored": 1,
+        "deduplicated": 0,
+        "loaded": 1,
+        "evictions": 0,
+        "disk_bytes": len(base64.b64decode(b64_image)),
+    }
@@ -0,0 +1,100 @@
+import time
+
+from gat_llm.llm_interface import LLMInterface
+from gat_llm.session_store import InMemorySessionStore, SQLiteSessionStore
+from tests.test_llm_interface import mock_llm
+
+
+HISTORY = [
+    {"role": "user", "content": [{"text": "Hello"}]},
+    {"role": "assistant", "content": "Hi"},
+]
+
+
+def test_in_memory_store_evicts_least_recently_used():
+    store = InMemorySessionStore(max_sessions=2)
+    store["a"] = HISTORY
+    store["b"] = HISTORY
+    assert store.get("a") == HISTORY
+    store["c"] = HISTORY
+
+    assert "b" not in store, "The least recently used session has to be evicted"
+    assert "a" in store and "c" in store
+    assert store.stats() == {"sessions": 2, "evictions": 1, "expired": 0}
+
+
+def test_in_memory_store_expires_sessions():
+    store = InMemorySessionStore(ttl_in_s=0.05)
+    store["a"] = HISTORY
+    time.sleep(0.1)
+    assert store.get("a") is None
+    assert store.stats()["expired"] == 1
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(db_path)
+    store["a"] = HISTORY
+
+    # eg. another worker process
+    other_store = SQLiteSessionStore(db_path)
+    assert other_store["a"] == HISTORY
+    assert other_store.get("unknown") is None
+
+    other_store["a"] = HISTORY + HISTORY
+    assert store["a"] == HISTORY + HISTORY
+    del store["a"]
+    assert other_store.stats() == {"sessions": 0}
+
+
+def test_sqlite_store_expires_sessions(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl_in_s=0.05)
+    store["a"] = HISTORY
+    time.sleep(0.1)
+    assert store.get("a") is None
+
+
+def test_chat_continues_from_store(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    llm = mock_llm([["First answer"], ["Second answer"]])
+    li = LLMInterface(
+        "You are a helpful assistant", llm, None, None, session_store=store
+    )
+    for x in li.chat_with_function_caller("Hello", None, ui_history=[]):
+        pass
+    ui_history = x[-1]
+
+    # a new interface, eg. in another worker
+    li = LLMInterface(
+        "You are a helpful assistant", llm, None, None, session_store=store
+    )
+    for x in li.chat_with_function_caller("Again", None, ui_history=ui_history):
+        pass
+
+    chat_id = ui_history[0]["content"][0]["text"]
+    first_turn = [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "First answer"},
+    ]
+    assert llm.call_args.kwargs["chat_history"] == first_turn
+    assert store[chat_id] == first_turn + [
+        {"role": "user", "content": "Again"},
+        {"role": "assistant", "content": "Second answer"},
+    ]
+
+
+def test_cancelled_answer_is_stored():
+    llm = mock_llm([["Partial", "Partial answer", "Partial answer that"]])
+    li = LLMInterface(
+        "You are a helpful assistant", llm, None, None, ui_frame_interval_ms=0
+    )
+    frames = li.chat_with_function_caller("Hello", None, ui_history=[])
+    x = next(frames)
+    x = next(frames)
+    frames.close()
+
+    chat_id = x[-1][0]["content"][0]["text"]
+    assert li.history_log[chat_id][-1] == {
+        "role": "assistant",
+        "content": "Partial answer",
+    }
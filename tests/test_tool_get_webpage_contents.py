@@ -1,16 +1,35 @@
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
 import pytest
 from unittest.mock import patch, Mock
-from gat_llm.tools.get_webpage_contents import ToolGetUrlContent
+from gat_llm.tools import get_webpage_contents
+from gat_llm.tools.get_webpage_contents import ToolGetUrlContent, text_from_html
+from gat_llm.tools.html_extraction import HTMLExtraction
+from gat_llm.tools.web_crawler import CrawlEngine
+from gat_llm.tools.web_cache import WebCache
+
+
+@pytest.fixture(autouse=True)
+def web_cache(tmp_path, monkeypatch):
+    # pages cached by a test are not read by the next one
+    web_cache = WebCache(str(tmp_path / "web_cache"))
+    monkeypatch.setattr(get_webpage_contents, "WEB_CACHE", web_cache)
+    return web_cache
 
 
 @pytest.fixture
 def mock_requests_get():
-    with patch("requests.get") as mock_get:
+    with patch("requests.Session.get") as mock_get:
         mock_response = Mock()
         mock_response.content = (
-            "<html><body><p><div>Test content</div></p></body></html>"
+            b"<html><body><p><div>Test content</div></p></body></html>"
         )
+        mock_response.iter_content = lambda chunk_size: iter([mock_response.content])
         mock_response.text = "Test content"
+        mock_response.encoding = "utf-8"
+        mock_response.headers = {}
         mock_response.url = "http://example.com"
         mock_response.status_code = 200
         mock_get.return_value = mock_response
@@ -46,7 +65,7 @@ def test_get_url_content_text_and_urls(mock_requests_get):
     assert "<urls>" in result
 
 
-@patch("requests.get", side_effect=Exception("Connection error"))
+@patch("requests.Session.get", side_effect=Exception("Connection error"))
 def test_get_url_content_error(mock_requests_get):
     tguc = ToolGetUrlContent(None)
     result_gen = tguc("http://example.com")
@@ -56,4 +75,428 @@ def test_get_url_content_error(mock_requests_get):
     assert "Connection error" in result
 
 
-# Add more tests for different scenarios and edge cases
+class PageServer(ThreadingHTTPServer):
+    """Local server of test pages: path -> (html or bytes, delay in s)"""
+
+    daemon_threads = True
+
+    def __init__(self, pages, headers=None):
+        self.pages = pages
+        # path -> extra response headers
+        self.headers = headers if headers is not None else {}
+        self.requests = []
+        # Cookie header of each request
+        self.cookies = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), PageHandler)
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.cookies.append(self.headers["Cookie"])
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            html, delay = server.pages.get(self.path, ("Not found", 0))
+            time.sleep(delay)
+            headers = server.headers.get(self.path, {})
+            if "ETag" in headers and self.headers["If-None-Match"] == headers["ETag"]:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = html if isinstance(html, bytes) else html.encode("utf-8")
+            self.send_response(200 if self.path in server.pages else 404)
+            if "Content-Type" not in headers:
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def page_server():
+    servers = []
+
+    def start(pages, headers=None):
+        server = PageServer(pages, headers)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def news_pages(n_articles, delay=0):
+    links = "".join(
+        f'<a href="/news/{k}">Article {k}</a> <a href="/about">About</a>'
+        for k in range(n_articles)
+    )
+    pages = {"/": (f"<html><body><p>Front page</p>{links}</body></html>", 0)}
+    for k in range(n_articles):
+        pages[f"/news/{k}"] = (
+            f'<html><body><p>Article text {k}</p><a href="/">Home</a>'
+            f'<a href="/news/{k}#comments">Comments</a></body></html>',
+            delay,
+        )
+    return pages
+
+
+def test_recursion_reads_each_page_once(page_server):
+    server, base_url = page_server(news_pages(5))
+    tguc = ToolGetUrlContent(None, crawl_engine=CrawlEngine())
+    for result in tguc(
+        f"{base_url}/", recursion_level=2, recursion_regex_condition="/news/"
+    ):
+        pass
+
+    assert sorted(server.requests) == ["/"] + [f"/news/{k}" for k in range(5)]
+    # subpages follow the page that links to them, in the order of the links
+    positions = [result.index(f"Article text {k}") for k in range(5)]
+    assert result.index("Front page") < positions[0]
+    assert positions == sorted(positions)
+    assert "/about" not in result
+
+
+def test_pages_are_read_concurrently(page_server):
+    server, base_url = page_server(news_pages(8, delay=0.3))
+    tguc = ToolGetUrlContent(
+        None, crawl_engine=CrawlEngine(max_workers=8, max_per_host=4)
+    )
+    t0 = time.time()
+    partial_results = list(
+        tguc(f"{base_url}/", recursion_level=1, recursion_regex_condition="/news/")
+    )
+    elapsed = time.time() - t0
+
+    assert server.max_in_flight == 4, "Per host limit"
+    assert elapsed < 8 * 0.3 / 2
+    assert "Article text 7" in partial_results[-1]
+    # the pages are streamed as they are read
+    article_counts = [x.count("Article text") for x in partial_results]
+    assert article_counts[-1] == 8
+    assert set(range(1, 8)).issubset(article_counts)
+    assert all(x.endswith("</url_content>") for x in partial_results[1:])
+
+
+def test_crawl_deadline(page_server):
+    pages = news_pages(2)
+    pages["/news/1"] = (pages["/news/1"][0], 2)
+    server, base_url = page_server(pages)
+    tguc = ToolGetUrlContent(None, crawl_engine=CrawlEngine(), deadline_s=0.5)
+
+    t0 = time.time()
+    for result in tguc(
+        f"{base_url}/", recursion_level=1, recursion_regex_condition="/news/"
+    ):
+        pass
+
+    assert time.time() - t0 < 1.5
+    assert "Article text 0" in result
+    assert f"Could not retrieve page from URL {base_url}/news/1" in result
+    assert "Not read within the deadline of 0.5 s" in result
+
+
+def test_cookies_are_not_shared(page_server):
+    pages = news_pages(0)
+    pages["/login"] = ("<html><body><p>Logged in</p></body></html>", 0)
+    server, base_url = page_server(
+        pages, {"/login": {"Set-Cookie": "session=user1; Path=/"}}
+    )
+    crawl_engine = CrawlEngine()
+    crawl_engine.get(f"{base_url}/login")
+    crawl_engine.get(f"{base_url}/")
+    assert len(crawl_engine.session.cookies) == 0
+    assert server.cookies == [None, None]
+
+
+def test_too_many_sublinks(page_server):
+    server, base_url = page_server(news_pages(5))
+    tguc = ToolGetUrlContent(None, max_subpages_to_read=3, crawl_engine=CrawlEngine())
+    for result in tguc(
+        f"{base_url}/", recursion_level=1, recursion_regex_condition="/news/"
+    ):
+        pass
+    assert "Error: tried to read too many sublinks: 5" in result
+    assert server.requests == ["/"]
+
+
+class SlowLLM:
+    """Mock of query_llm: answers after delay s, tracking the concurrent queries"""
+
+    def __init__(self, delay=0.3):
+        self.delay = delay
+        self.system_prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, system_prompt=""):
+        with self.lock:
+            self.system_prompts.append(system_prompt)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        if "<partial_answers>" in system_prompt:
+            yield "Combined"
+        else:
+            yield "Answer"
+            yield f"Answer {system_prompt.count('Article text')} articles"
+
+
+def test_prompt_about_several_urls_is_answered_concurrently(page_server):
+    pages = news_pages(0)
+    pages["/slow"] = ("<html><body><p>Article text slow</p></body></html>", 0.5)
+    server, base_url = page_server(pages)
+    llm = SlowLLM()
+    tguc = ToolGetUrlContent(llm, crawl_engine=CrawlEngine())
+
+    t0 = time.time()
+    partial_results = list(
+        tguc(f"{base_url}/,{base_url}/slow,{base_url}/", prompt="Any news?")
+    )
+    elapsed = time.time() - t0
+
+    # as long as the slowest page and its query
+    assert elapsed < 0.5 + 0.3 + 0.4
+    assert len(llm.system_prompts) == 3
+    result = partial_results[-1]
+    assert result.count("<content>Answer 0 articles</content>") == 2
+    assert "<content>Answer 1 articles</content>" in result
+    assert result.index(f"<url>{base_url}/slow</url>") < result.rindex(
+        f"<url>{base_url}/</url>"
+    )
+    assert all(x.startswith("<scratchpad>") for x in partial_results[:-1])
+
+
+def test_large_page_is_answered_by_parts(page_server):
+    pages = {"/": ("<html><body>" + "<p>News</p>" * 300 + "</body></html>", 0)}
+    server, base_url = page_server(pages)
+    llm = SlowLLM(delay=0.1)
+    tguc = ToolGetUrlContent(
+        llm, crawl_engine=CrawlEngine(), max_parallel_queries=3, chunk_tokens=100
+    )
+
+    for result in tguc(f"{base_url}/", prompt="Any news?"):
+        pass
+
+    map_prompts = [x for x in llm.system_prompts if "<webpage_contents>" in x]
+    reduce_prompts = [x for x in llm.system_prompts if "<partial_answers>" in x]
+    assert len(map_prompts) > 3
+    assert "part (1 of" in map_prompts[0]
+    assert all(len(x) < 100 * 4 + 500 for x in map_prompts)
+    # every part is read once
+    assert sum(x.count("News") for x in map_prompts) == 300
+    assert len(reduce_prompts) > 0
+    assert llm.max_in_flight == 3
+    assert "<content>Combined</content>" in result
+
+
+def test_prompt_without_llm(mock_requests_get):
+    tguc = ToolGetUrlContent(None)
+    for result in tguc("http://example.com", prompt="Any news?"):
+        pass
+    assert "a Language Model was not provided" in result
+
+
+def text_pdf(text):
+    """PDF of one page with the text"""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for k, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % k + obj + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % x for x in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\n" % (len(objects) + 1)
+    return pdf + b"startxref\n%d\n%%%%EOF\n" % xref
+
+
+def read(tguc, url):
+    for result in tguc(url):
+        pass
+    return result
+
+
+def test_pdf_is_read_as_document(page_server):
+    server, base_url = page_server(
+        {"/download": (text_pdf("Quarterly results"), 0)},
+        {"/download": {"Content-Type": "application/pdf"}},
+    )
+    tguc = ToolGetUrlContent(None, crawl_engine=CrawlEngine())
+    result = read(tguc, f"{base_url}/download")
+    assert "<page_1>Quarterly results</page_1>" in result
+    assert "<status_code>200</status_code>" in result
+
+
+def test_download_is_limited(page_server):
+    server, base_url = page_server(
+        {
+            "/": ("<html><body><p>" + "x" * 2000 + "</p></body></html>", 0),
+            "/video": (b"0" * 100, 0),
+        },
+        {"/video": {"Content-Type": "video/mp4"}},
+    )
+    tguc = ToolGetUrlContent(None, crawl_engine=CrawlEngine(), max_page_bytes=1000)
+    result = read(tguc, f"{base_url}/")
+    assert "larger than the limit of 1000 bytes" in result
+    assert "xxx" not in result
+    result = read(tguc, f"{base_url}/video")
+    assert "Can't read contents of type video/mp4" in result
+
+
+def test_non_html_links_are_not_followed(page_server):
+    links = "".join(
+        f'<a href="{x}">{x}</a>'
+        for x in ["/photo.jpg", "/paper.pdf", "mailto:a@b.com", "/download", "/news"]
+    )
+    server, base_url = page_server(
+        {
+            "/": (f"<html><body>{links}</body></html>", 0),
+            "/download": (text_pdf("Report"), 0),
+            "/news": ("<html><body><p>Article text</p></body></html>", 0),
+        },
+        {"/download": {"Content-Type": "application/pdf"}},
+    )
+    tguc = ToolGetUrlContent(None, crawl_engine=CrawlEngine())
+    for result in tguc(f"{base_url}/", recursion_level=1):
+        pass
+
+    assert sorted(server.requests) == ["/", "/download", "/news"]
+    assert "Article text" in result
+    assert "Skipped link to a document of type application/pdf" in result
+    assert "Report" not in result
+
+
+def test_cache_honours_cache_control(page_server, web_cache):
+    pages = {
+        "/fresh": ("<p>Fresh page</p>", 0),
+        "/no-store": ("<p>Private page</p>", 0),
+        "/no-headers": ("<p>Plain page</p>", 0),
+    }
+    headers = {
+        "/fresh": {"Cache-Control": "public, max-age=600"},
+        "/no-store": {"Cache-Control": "no-store"},
+    }
+    server, base_url = page_server(pages, headers)
+    tguc = ToolGetUrlContent(None, crawl_engine=CrawlEngine())
+
+    for _ in range(2):
+        for path in pages:
+            assert "page" in read(tguc, f"{base_url}{path}")
+
+    # pages without cache headers are fresh for min_fresh_s
+    assert sorted(server.requests) == [
+        "/fresh",
+        "/no-headers",
+        "/no-store",
+        "/no-store",
+    ]
+    stats = web_cache.stats()
+    assert stats["hits"] == 2
+    assert stats["not_stored"] == 2
+    assert stats["extract_hits"] == 2
+
+
+def test_cache_revalidates_with_etag(page_server, web_cache):
+    pages = {"/doc": ("<p>Documentation</p>", 0)}
+    headers = {"/doc": {"Cache-Control": "no-cache", "ETag": '"v1"'}}
+    server, base_url = page_server(pages, headers)
+    tguc = ToolGetUrlContent(None, crawl_engine=CrawlEngine())
+
+    first = read(tguc, f"{base_url}/doc")
+    second = read(tguc, f"{base_url}/doc")
+    assert first == second
+    assert "Documentation" in second
+    assert server.requests == ["/doc", "/doc"]
+    stats = web_cache.stats()
+    assert stats["revalidated"] == 1
+    assert stats["extract_hits"] == 1, "The page is not parsed again"
+
+    # a changed page is downloaded
+    pages["/doc"] = ("<p>New documentation</p>", 0)
+    headers["/doc"]["ETag"] = '"v2"'
+    assert "New documentation" in read(tguc, f"{base_url}/doc")
+
+
+def test_cache_is_bounded(tmp_path):
+    web_cache = WebCache(str(tmp_path / "small_cache"), max_disk_mb=0.01)
+
+    def get_fn(url, headers=None):
+        response = Mock()
+        response.url = url
+        response.status_code = 200
+        response.content = url.encode("utf-8") * 200
+        response.encoding = "utf-8"
+        response.headers = {"Cache-Control": "max-age=600"}
+        return response
+
+    for k in range(20):
+        page = web_cache.fetch(get_fn, f"http://example.com/{k}")
+        assert not page.from_cache
+    assert web_cache.stats()["evictions"] > 0
+    assert web_cache.stats()["disk_bytes"] <= 0.01 * 1024 * 1024
+    # the most recent pages are kept
+    assert web_cache.fetch(get_fn, "http://example.com/19").from_cache
+    assert not web_cache.fetch(get_fn, "http://example.com/0").from_cache
+
+
+PAGE = """<!DOCTYPE html><html><head><title>Title</title><script>var x = 1;</script>
+<style>p {color: red}</style></head><body><!-- comment -->
+<p>Hello <b>bold</b> world</p><a href=" /news/1 ">First <span>news</span></a>
+<a>No link</a><div style="display:none">Hidden style</div><div hidden>Hidden attr</div>
+<div aria-hidden="true">Hidden aria</div><div style="opacity: 0.5">Half visible</div>
+<div><img src="a.png"></div><p><div>Test content</div></p></body></html>"""
+
+
+@pytest.mark.parametrize("parser", ["lxml", "html.parser"])
+def test_single_pass_extraction(parser):
+    extraction = HTMLExtraction(PAGE, parser)
+    assert extraction.text() == (
+        "Hello bold world First news No link Hidden style Hidden attr Hidden aria "
+        "Half visible Test content"
+    )
+    assert extraction.url_list() == "[  /news/1  ] First news\n[ None ] No link"
+    assert extraction.links("http://example.com/a/") == ["http://example.com/news/1"]
+
+    visible_html = extraction.visible_html()
+    for text in ["Hello", "First", "Half visible", "Test content"]:
+        assert text in visible_html
+    for text in ["var x", "color", "comment", "Hidden", "img", "Title"]:
+        assert text not in visible_html
+    assert extraction.visible_html() is visible_html
+
+
+def test_parsers_extract_the_same_contents():
+    fast = HTMLExtraction(PAGE, "lxml")
+    default = HTMLExtraction(PAGE, "html.parser")
+    assert fast.text() == default.text()
+    assert fast.url_list() == default.url_list()
+    assert text_from_html(PAGE) == (fast.text(), fast.url_list())
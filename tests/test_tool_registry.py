@@ -0,0 +1,121 @@
+import sys
+import subprocess
+from unittest.mock import Mock
+
+from gat_llm.llm_invoker import LLM_Provider
+from gat_llm.tools.base import LLMTools
+from gat_llm.tools.registry import TOOL_REGISTRY, LazyTool, create_tool
+
+
+def test_listing_tools_does_not_import_them():
+    code = (
+        "import sys\n"
+        "from gat_llm.tools.base import LLMTools\n"
+        "heavy = ['matplotlib', 'pandas', 'duckdb', 'openai', 'boto3']\n"
+        "tools = LLMTools.get_all_tools()\n"
+        "print([m for m in heavy if m in sys.modules])\n"
+        "lt = LLMTools(desired_tools=[x for x in tools if x.name == 'do_date_math'])\n"
+        "lt.invoke_tool('do_date_math', base_date='2024-01-01', deltas='1', delta_type='day')\n"
+        "print([m for m in heavy if m in sys.modules])\n"
+    )
+    ans = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert ans.stdout.split("\n")[:2] == ["[]", "[]"]
+
+
+def test_saved_descriptions_are_used_by_new_processes(tmp_path):
+    code = (
+        "import sys\n"
+        "from gat_llm.tools import registry\n"
+        f"registry.DESCRIPTION_CACHE_DIR = {str(tmp_path)!r}\n"
+        "from gat_llm.tools.base import LLMTools\n"
+        "lt = LLMTools(desired_tools=LLMTools.get_all_tools())\n"
+        "assert '<tool_name>\\nmake_custom_plot\\n</tool_name>' in lt.get_tool_descriptions()\n"
+        "print([m for m in sys.modules if m.startswith('gat_llm.tools.')])\n"
+    )
+    ans = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert "gat_llm.tools.make_custom_plot" in ans.stdout
+    assert len(list(tmp_path.iterdir())) == len(TOOL_REGISTRY)
+
+    # the next process reads the descriptions instead of importing the tools
+    ans = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert (
+        ans.stdout.split("\n")[-2] == "['gat_llm.tools.registry', 'gat_llm.tools.base']"
+    )
+
+
+def test_registry_names_match_the_tools():
+    for name in TOOL_REGISTRY:
+        assert create_tool(name).name == name
+
+
+def test_lazy_tool_is_constructed_on_first_use():
+    tool = LazyTool("do_date_math")
+    assert not tool.is_loaded
+    lt = LLMTools(desired_tools=[tool])
+    assert list(lt.tool_mapping) == ["do_date_math"]
+    assert not tool.is_loaded
+
+    ans = lt.invoke_tool(
+        "do_date_math",
+        return_results_only=True,
+        base_date="2024-01-01",
+        deltas="1",
+        delta_type="day",
+    )
+    assert tool.is_loaded
+    assert "2024-01-02" in ans
+
+    # the description is built once and shared with the other instances
+    other_tool = LazyTool("do_date_math")
+    assert other_tool.tool_description is tool.tool_description
+    assert not other_tool.is_loaded
+    assert "<tool_name>\ndo_date_math\n</tool_name>" in lt.get_tool_descriptions()
+
+
+def test_tool_catalog_reuses_tools_and_descriptions():
+    query_llm = object()
+    tools = LLMTools.get_all_tools(query_llm)
+    assert [id(x) for x in LLMTools.get_all_tools(query_llm)] == [id(x) for x in tools]
+    assert LLMTools.get_all_tools()[0] is not tools[0]
+
+    selected = [x for x in tools if x.name in ["do_date_math", "run_with_python"]]
+    lt = LLMTools(query_llm=query_llm, desired_tools=selected)
+    other_lt = LLMTools(query_llm=query_llm, desired_tools=list(selected))
+    assert other_lt.get_tool_descriptions() is lt.get_tool_descriptions()
+    assert other_lt.get_native_tools() is lt.get_native_tools()
+    assert [x["name"] for x in lt.get_native_tools()] == [
+        "do_date_math",
+        "run_with_python",
+    ]
+    assert lt.get_tool_descriptions() == lt._render_tools(selected)
+
+
+def test_tool_catalog_does_not_cache_other_tools():
+    mcp_tool = Mock()
+    mcp_tool.name = "mcp_tool"
+    mcp_tool.tool_description = {
+        "name": "mcp_tool",
+        "description": "first",
+        "input_schema": {"properties": {}, "required": []},
+    }
+    lt = LLMTools(desired_tools=[mcp_tool])
+    assert "first" in lt.get_tool_descriptions()
+    mcp_tool.tool_description["description"] = "second"
+    assert "second" in lt.get_tool_descriptions()
+
+
+def test_caching_does_not_change_shared_tool_descriptions():
+    tools = [LazyTool("do_date_math")]
+    native_tools = LLMTools(desired_tools=tools).get_native_tools()
+    llm = LLM_Provider.get_llm(None, "Claude 4.5 Haiku - Bedrock")
+    body = llm._prepare_body(
+        {"system": "sys", "messages": []}, "", [], native_tools, lambda: None
+    )
+    assert body["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in native_tools[-1]